@@ -0,0 +1,173 @@
+"""
+Benchmark of the JSON API (race/api.py).
+
+Seeds `--events` upcoming events, each with three race types, a schedule and
+`--registrations` active registrations, then sends the same requests through
+the whole WSGI stack (middleware included, no network) and reports requests per
+second of one worker and the queries per request:
+
+    cold         - the cache is cleared before every request
+    cached       - the response comes from the cache
+    304          - the client sends the ETag it got
+    after signup - a registration bumps the registrations topic before each
+                   request (only responses showing free slots are rebuilt)
+
+The list is requested with its default fields and with free slots, schedules
+and race types. Seeded rows are removed afterwards. Run from the backend
+directory with DEBUG off:
+
+    python -m benchmarks.api --events 500 --seconds 3
+"""
+import argparse
+import io
+import os
+import time
+from datetime import time as day_time, timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'race_project.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from loadtest.stats import format_table  # noqa: E402
+from race import api  # noqa: E402
+from race.models import Event, EventRegistration, EventSchedule, Location, RaceType  # noqa: E402
+
+SLUG_PREFIX = 'bench-api-'
+USER_PREFIX = 'bench-api-'
+QUERIES = {
+    'default fields': '',
+    'slots+schedule': 'fields=slug,title,start,free_slots,schedules,race_types',
+}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def seed(events, registrations):
+    location = Location.objects.create(country='Россия', city='Бенчмарк', street='Тестовая', house_number='1',
+                                       postal_code='000000', latitude=55.75, longitude=37.62)
+    races = [RaceType.objects.create(distance=distance, gender='M', min_age=18, registration_fee=1000)
+             for distance in (5, 10, 21)]
+    now = timezone.now()
+    created = Event.objects.bulk_create([
+        Event(title=f'Бенчмарк API {n}', slug=f'{SLUG_PREFIX}{n}', description='-', event_rules='-',
+              event_type='road', start_datetime=now + timedelta(days=1, hours=n), location=location,
+              total_slots=registrations * 2, image='bench.jpg')
+        for n in range(events)
+    ])
+    Event.race_types.through.objects.bulk_create([
+        Event.race_types.through(event=event, racetype=race) for event in created for race in races
+    ])
+    EventSchedule.objects.bulk_create([
+        EventSchedule(event=event, start_time=day_time(hour, 0), description=f'Старт {hour}')
+        for event in created for hour in (9, 11)
+    ])
+    User = get_user_model()
+    users = User.objects.bulk_create([User(username=f'{USER_PREFIX}{n}', email=f'{USER_PREFIX}{n}@example.com')
+                                     for n in range(registrations)])
+    EventRegistration.objects.bulk_create([
+        EventRegistration(user=user, event=event, race=races[0], payment_document='bench.pdf', city='Москва',
+                          tshirt_size='M')
+        for event in created for user in users
+    ], batch_size=5000)
+    with connection.cursor() as cursor:
+        # Статистика, которую autovacuum собрал бы сам
+        cursor.execute('ANALYZE race_eventregistration')
+    return location, races
+
+
+def environ(query, etag=None):
+    env = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/v1/events/', 'QUERY_STRING': query,
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_ACCEPT_ENCODING': 'gzip', 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(),
+    }
+    if etag:
+        env['HTTP_IF_NONE_MATCH'] = etag
+    return env
+
+
+def current_etag(handler, query):
+    headers = {}
+
+    def start_response(status, response_headers):
+        headers.update(response_headers)
+
+    b''.join(handler(environ(query), start_response))
+    return headers['ETag']
+
+
+def measure(handler, query, seconds, before=None, etag=None):
+    counter, statuses, requests = QueryCounter(), {}, 0
+
+    def start_response(status, headers):
+        statuses[status] = statuses.get(status, 0) + 1
+
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        while time.perf_counter() < deadline:
+            if before:
+                before()
+            response = handler(environ(query, etag), start_response)
+            b''.join(response)
+            response.close()
+            requests += 1
+    elapsed = time.perf_counter() - started
+    return requests / elapsed, counter.count / requests, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--registrations', type=int, default=20, help="Active registrations per event.")
+    parser.add_argument('--seconds', type=float, default=3.0, help="Seconds spent on each measurement.")
+    args = parser.parse_args()
+
+    location, races = seed(args.events, args.registrations)
+    handler = WSGIHandler()
+    try:
+        rows = []
+        for label, query in QUERIES.items():
+            steps = [
+                ('cold', {'before': cache.clear}),
+                ('cached', {}),
+                ('304', {'etag': True}),
+                ('after signup', {'before': lambda: api.bump(api.REGISTRATIONS)}),
+            ]
+            for step, options in steps:
+                if options.get('etag'):
+                    options['etag'] = current_etag(handler, query)
+                rps, queries, statuses = measure(handler, query, args.seconds, **options)
+                rows.append({'request': label, 'step': step, 'req/s': rps, 'queries': queries,
+                             'statuses': ' '.join(f'{status[:3]}x{n}' for status, n in statuses.items())})
+        print(format_table(rows, ['request', 'step', 'req/s', 'queries', 'statuses']))
+        print(f'{args.events} events, {args.registrations} registrations each, one process, no network.')
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM race_eventregistration WHERE user_id IN '
+                           '(SELECT id FROM users_user WHERE username LIKE %s)', [f'{USER_PREFIX}%'])
+            cursor.execute('DELETE FROM users_user WHERE username LIKE %s', [f'{USER_PREFIX}%'])
+        Event.objects.filter(slug__startswith=SLUG_PREFIX).delete()
+        location.delete()
+        for race in races:
+            race.delete()
+        cache.clear()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark of bib-number allocation at event scale.
+
+Seeds an event with `--runners` paid registrations over four race types (5 km
+men and women sharing one range, 10 km men and women sharing another) using
+bulk inserts, then times:
+
+    first allocation   - every runner gets a number
+    repeat             - nothing left to assign (what a cron run costs)
+    late registrations - `--late` new paid registrations get numbers
+
+Seeded rows are removed afterwards. Run from the backend directory:
+
+    python -m benchmarks.bibs --runners 100000
+"""
+import argparse
+import os
+import random
+import time
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'race_project.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from loadtest.stats import format_table  # noqa: E402
+from race import bibs  # noqa: E402
+from race.models import Event, EventRegistration, Location, RaceType  # noqa: E402
+
+SLUG = 'bench-bibs'
+USER_PREFIX = 'bench-bibs-'
+
+
+def add_registrations(event, races, start, count, rng):
+    User = get_user_model()
+    users = User.objects.bulk_create([
+        User(username=f'{USER_PREFIX}{n}', email=f'{USER_PREFIX}{n}@example.com')
+        for n in range(start, start + count)
+    ], batch_size=5000)
+    EventRegistration.objects.bulk_create([
+        EventRegistration(user=user, event=event, race=rng.choice(races), payment_confirmation=True,
+                          payment_document='bench.pdf', city='Москва', tshirt_size='M')
+        for user in users
+    ], batch_size=5000)
+
+
+def timed(func):
+    started = time.perf_counter()
+    value = func()
+    return time.perf_counter() - started, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runners', type=int, default=100000)
+    parser.add_argument('--late', type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    range_size = args.runners + args.late
+    location = Location.objects.create(country='Россия', city='Бенчмарк', street='Тестовая', house_number='1',
+                                       postal_code='000000', latitude=55.75, longitude=37.62)
+    event = Event.objects.create(title='Бенчмарк номеров', slug=SLUG, description='-', event_rules='-',
+                                 event_type='road', start_datetime=timezone.now() + timedelta(days=30),
+                                 location=location, total_slots=args.runners + args.late, image='bench.jpg')
+    races = [RaceType.objects.create(distance=distance, gender=gender, min_age=18, registration_fee=1000,
+                                     bib_range_start=first, bib_range_end=first + range_size - 1)
+             for distance, first in ((5, 1), (10, range_size + 1)) for gender in ('M', 'F')]
+    event.race_types.set(races)
+    try:
+        add_registrations(event, races, 0, args.runners, rng)
+        rows = []
+        for label, prepare in (('first allocation', None), ('repeat', None),
+                               ('late registrations', lambda: add_registrations(event, races, args.runners,
+                                                                                args.late, rng))):
+            if prepare:
+                prepare()
+            seconds, allocations = timed(lambda: bibs.allocate(event))
+            rows.append({'step': label, 'seconds': seconds,
+                         'assigned': sum(allocation.assigned for allocation in allocations),
+                         'waiting': sum(allocation.waiting for allocation in allocations)})
+        print(format_table(rows, ['step', 'seconds', 'assigned', 'waiting']))
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM race_eventregistration WHERE event_id = %s', [event.pk])
+            cursor.execute('DELETE FROM users_user WHERE username LIKE %s', [f'{USER_PREFIX}%'])
+        event.delete()
+        location.delete()
+        for race in races:
+            race.delete()
+
+
+if __name__ == '__main__':
+    main()
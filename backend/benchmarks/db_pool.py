@@ -0,0 +1,98 @@
+"""
+Benchmark of per-request latency with and without database connection reuse.
+
+Each variant runs in a fresh process against the database from the environment
+(the docker-compose Postgres by default), serving pages through the Django test
+client and closing connections after each request as the real handler does:
+
+    no reuse   - stock backend, CONN_MAX_AGE=0: connect + auth (+ TLS) per request
+    persistent - stock backend, CONN_MAX_AGE=60 with health checks
+    pool       - race_project.db_pool with a bounded per-process pool
+
+Run from the backend directory:
+
+    python -m benchmarks.db_pool --requests 500 --threads 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+VARIANTS = [
+    ('no reuse', {'DB_POOL': 'False', 'DB_CONN_MAX_AGE': '0'}),
+    ('persistent', {'DB_POOL': 'False', 'DB_CONN_MAX_AGE': '60'}),
+    ('pool', {'DB_POOL': 'True'}),
+]
+
+
+def run_variant(path, requests, threads):
+    """Serve `path` `requests` times from `threads` threads and return latencies."""
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'race_project.settings')
+    django.setup()
+    from django.db import close_old_connections
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    latencies = []
+    lock = threading.Lock()
+
+    def client_loop(count):
+        client = Client()
+        local = []
+        for _ in range(count):
+            started = time.perf_counter()
+            client.get(path)
+            # Тестовый клиент отключает этот обработчик request_finished, вызываем его сами
+            close_old_connections()
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    client_loop(10)  # прогрев
+    latencies.clear()
+    started = time.perf_counter()
+    workers = [threading.Thread(target=client_loop, args=(requests // threads,)) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--path', default='/events/')
+    parser.add_argument('--variant-worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant_worker:
+        latencies, elapsed = run_variant(args.path, args.requests, args.threads)
+        print(json.dumps({'latencies': latencies, 'elapsed': elapsed}))
+        return
+
+    from loadtest.stats import format_table, summarize
+
+    rows = []
+    for label, env in VARIANTS:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.db_pool', '--variant-worker', '--path', args.path,
+             '--requests', str(args.requests), '--threads', str(args.threads)],
+            env={**os.environ, **env}, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        row = summarize(result['latencies'], 0, result['elapsed'])
+        row['variant'] = label
+        rows.append(row)
+    print(format_table(rows, ['variant', 'requests', 'rps', 'p50', 'p95', 'p99']))
+
+
+if __name__ == '__main__':
+    main()
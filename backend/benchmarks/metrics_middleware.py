@@ -0,0 +1,65 @@
+"""
+Benchmark of RequestMetricsMiddleware overhead.
+
+Serves the same pages through the Django test client with the middleware removed,
+enabled at the configured sample rate and enabled for every request, and prints
+the mean time per request. Run from the backend directory:
+
+    python -m benchmarks.metrics_middleware --requests 2000
+"""
+import argparse
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'race_project.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from loadtest.stats import format_table  # noqa: E402
+
+METRICS_MIDDLEWARE = 'race_project.middleware.RequestMetricsMiddleware'
+
+
+def time_requests(path, count):
+    client = Client()
+    client.get(path)
+    started = time.perf_counter()
+    for _ in range(count):
+        client.get(path)
+    return (time.perf_counter() - started) / count * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--path', dest='paths', action='append')
+    args = parser.parse_args()
+    setup_test_environment()
+
+    without = [m for m in settings.MIDDLEWARE if m != METRICS_MIDDLEWARE and 'debug_toolbar' not in m]
+    with_metrics = [METRICS_MIDDLEWARE] + without
+    variants = [
+        ('off', without, 0.0),
+        (f'sampled ({settings.METRICS_SAMPLE_RATE:g})', with_metrics, settings.METRICS_SAMPLE_RATE),
+        ('every request', with_metrics, 1.0),
+    ]
+
+    rows = []
+    for path in args.paths or ['/contact/', '/', '/events/']:
+        baseline = None
+        for label, middleware, rate in variants:
+            with override_settings(MIDDLEWARE=middleware, METRICS_SAMPLE_RATE=rate, METRICS_DIR='', DEBUG=False):
+                mean_us = time_requests(path, args.requests)
+            baseline = baseline or mean_us
+            rows.append({'path': path, 'middleware': label, 'us/request': mean_us,
+                         'overhead us': mean_us - baseline})
+    print(format_table(rows, ['path', 'middleware', 'us/request', 'overhead us']))
+
+
+if __name__ == '__main__':
+    main()
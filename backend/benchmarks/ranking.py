@@ -0,0 +1,140 @@
+"""
+Benchmark of the ranking engine at event scale.
+
+Seeds an event with `--finishers` results over eight race types (5 and 10 km,
+men and women, two minimum ages) using bulk inserts, then times:
+
+    compute only       - the NumPy pass over columns already in memory
+    full recompute     - load + compute + write every row (first ranking)
+    no-op recompute    - load + compute when nothing changed (nothing written)
+    corrected time     - one finish time corrected, re-ranking only its distance
+    per-runner ORM     - the spreadsheet-style approach: COUNT queries per runner
+                         and category, measured on a sample and extrapolated
+
+Seeded rows are removed afterwards. Run from the backend directory:
+
+    python -m benchmarks.ranking --finishers 20000
+"""
+import argparse
+import os
+import random
+import time
+from datetime import date, timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'race_project.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from loadtest.stats import format_table  # noqa: E402
+from race import ranking  # noqa: E402
+from race.models import Event, EventRegistration, Location, RaceResult, RaceType  # noqa: E402
+
+SLUG = 'bench-ranking'
+USER_PREFIX = 'bench-ranking-'
+
+
+def seed(finishers, rng):
+    location = Location.objects.create(country='Россия', city='Бенчмарк', street='Тестовая', house_number='1',
+                                       postal_code='000000', latitude=55.75, longitude=37.62)
+    event = Event.objects.create(title='Бенчмарк протокола', slug=SLUG, description='-', event_rules='-',
+                                 event_type='road', start_datetime=timezone.now() - timedelta(days=1),
+                                 location=location, total_slots=finishers, image='bench.jpg')
+    races = [RaceType.objects.create(distance=distance, gender=gender, min_age=min_age, registration_fee=1000)
+             for distance in (5, 10) for gender in ('M', 'F') for min_age in (18, 40)]
+    event.race_types.set(races)
+
+    User = get_user_model()
+    users = User.objects.bulk_create([
+        User(username=f'{USER_PREFIX}{n}', email=f'{USER_PREFIX}{n}@example.com', first_name='Бегун',
+             last_name=str(n), date_birth=date(1950, 1, 1) + timedelta(days=rng.randrange(50 * 365)))
+        for n in range(finishers)
+    ], batch_size=5000)
+    registrations = EventRegistration.objects.bulk_create([
+        EventRegistration(user=user, event=event, race=rng.choice(races), payment_document='bench.pdf',
+                          city='Москва', tshirt_size='M')
+        for user in users
+    ], batch_size=5000)
+    results = []
+    for registration in registrations:
+        race = registration.race
+        seconds = rng.gauss(race.distance * 330, race.distance * 50)
+        status = 'dnf' if rng.random() < 0.02 else 'finished'
+        results.append(RaceResult(registration=registration, event=event, race=race, distance=race.distance,
+                                  status=status, finish_time=timedelta(seconds=round(max(seconds, 600)))))
+    RaceResult.objects.bulk_create(results, batch_size=5000)
+    return event, location, races
+
+
+def cleanup(event, location, races):
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM race_raceresult WHERE event_id = %s', [event.pk])
+        cursor.execute('DELETE FROM race_eventregistration WHERE event_id = %s', [event.pk])
+        cursor.execute('DELETE FROM users_user WHERE username LIKE %s', [f'{USER_PREFIX}%'])
+    event.delete()
+    location.delete()
+    for race in races:
+        race.delete()
+
+
+def per_runner_orm(results):
+    """Places as a spreadsheet port would compute them: one COUNT per runner and category."""
+    for result in results:
+        faster = RaceResult.objects.filter(event=result.event_id, status='finished',
+                                           finish_time__lt=result.finish_time)
+        faster.filter(distance=result.distance).count()
+        faster.filter(distance=result.distance, race__gender=result.race.gender).count()
+        faster.filter(race=result.race_id).count()
+        faster.filter(distance=result.distance, race__gender=result.race.gender,
+                      age_group=result.age_group).count()
+
+
+def timed(func):
+    started = time.perf_counter()
+    value = func()
+    return time.perf_counter() - started, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--finishers', type=int, default=20000)
+    parser.add_argument('--orm-sample', type=int, default=200, help='Runners timed for the per-runner baseline')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    event, location, races = seed(args.finishers, rng)
+    try:
+        columns, _ = ranking.load(event)
+        event_day = timezone.localtime(event.start_datetime).date()
+        rows = []
+        seconds, _ = timed(lambda: ranking.compute(columns, event_day))
+        rows.append({'operation': 'compute only', 'seconds': seconds, 'rows written': 0})
+        seconds, changed = timed(lambda: ranking.recompute(event))
+        rows.append({'operation': 'full recompute', 'seconds': seconds, 'rows written': changed})
+        seconds, changed = timed(lambda: ranking.recompute(event))
+        rows.append({'operation': 'no-op recompute', 'seconds': seconds, 'rows written': changed})
+
+        # Исправление времени бегуна из середины протокола 5 км
+        result = RaceResult.objects.filter(event=event, distance=5, place_overall__isnull=False) \
+            .order_by('place_overall')[args.finishers // 4]
+        # update() не отправляет сигналов, поэтому пересчёт замеряется отдельно
+        RaceResult.objects.filter(pk=result.pk).update(finish_time=result.finish_time - timedelta(minutes=3))
+        seconds, changed = timed(lambda: ranking.recompute(event, {5}))
+        rows.append({'operation': 'corrected time (5 km)', 'seconds': seconds, 'rows written': changed})
+
+        sample = list(RaceResult.objects.filter(event=event, status='finished').select_related('race')
+                      [:args.orm_sample])
+        seconds, _ = timed(lambda: per_runner_orm(sample))
+        rows.append({'operation': f'per-runner ORM (x{args.finishers // len(sample)} of sample)',
+                     'seconds': seconds * args.finishers / len(sample), 'rows written': 0})
+        print(format_table(rows, ['operation', 'seconds', 'rows written']))
+    finally:
+        cleanup(event, location, races)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark of bank-statement reconciliation.
+
+Builds `--registrations` synthetic unpaid registrations and a CSV statement with
+`--lines` payments (most identify the payer by phone in the purpose field, some
+only by name, some match nothing), then times parsing the CSV and matching it
+in memory (race.reconciliation.read_statement / match_statement). No database
+is needed. Run from the backend directory:
+
+    python -m benchmarks.reconciliation --registrations 50000 --lines 40000
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import time
+from collections import Counter
+from decimal import Decimal
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'race_project.settings')
+django.setup()
+
+from loadtest.stats import format_table  # noqa: E402
+from race import reconciliation  # noqa: E402
+
+FEES = [Decimal('1000.00'), Decimal('1500.00'), Decimal('2000.00'), Decimal('2500.00')]
+LAST_NAMES = ['Иванов', 'Петров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов', 'Новиков']
+FIRST_NAMES = ['Иван', 'Пётр', 'Алексей', 'Дмитрий', 'Сергей', 'Андрей', 'Михаил', 'Никита']
+
+
+def unique_suffix(n):
+    letters = 'абвгдежзиклмнопрстуфхцчшэюя'
+    suffix = ''
+    while n:
+        n, digit = divmod(n, len(letters))
+        suffix += letters[digit]
+    return suffix
+
+
+def make_registrations(count, rng):
+    return [
+        (n, rng.choice(FEES), f'8 (912) {n // 10000 % 1000:03d}-{n // 100 % 100:02d}-{n % 100:02d}',
+         f'{rng.choice(LAST_NAMES)}-{unique_suffix(n)}', rng.choice(FIRST_NAMES))
+        for n in range(1, count + 1)
+    ]
+
+
+def make_statement(registrations, count, rng):
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter=';')
+    writer.writerow(['Дата', 'Сумма', 'Плательщик', 'Назначение платежа'])
+    for registration_id, fee, phone, last_name, first_name in rng.sample(registrations, count):
+        kind = rng.random()
+        amount = f'{fee:,.2f}'.replace(',', ' ').replace('.', ',')
+        if kind < 0.7:
+            writer.writerow(['01.06.2024', amount, f'{last_name} {first_name} Петрович', f'Взнос, тел. {phone}'])
+        elif kind < 0.95:
+            writer.writerow(['01.06.2024', amount, f'{first_name} {last_name}', 'Оплата участия'])
+        else:
+            writer.writerow(['01.06.2024', '999,00', 'ООО Ромашка', 'Спонсорский взнос'])
+    out.seek(0)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--registrations', type=int, default=50000)
+    parser.add_argument('--lines', type=int, default=40000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    registrations = make_registrations(args.registrations, rng)
+    statement = make_statement(registrations, min(args.lines, len(registrations)), rng)
+
+    started = time.perf_counter()
+    lines = reconciliation.read_statement(statement, 'Сумма', name_column='Плательщик',
+                                          purpose_column='Назначение платежа')
+    parsed = time.perf_counter()
+    matches = reconciliation.match_statement(lines, registrations)
+    matched = time.perf_counter()
+
+    rows = [
+        {'step': 'parse CSV', 'seconds': parsed - started},
+        {'step': 'match', 'seconds': matched - parsed},
+        {'step': 'total', 'seconds': matched - started},
+    ]
+    print(format_table(rows, ['step', 'seconds']))
+    print(', '.join(f'{status}: {count}' for status, count in sorted(Counter(m.status for m in matches).items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Benchmark of the registration search in the admin (race/search.py) on a large
+registration table.
+
+Seeds `--registrations` registrations, each with its own user, with plain SQL
+(INSERT ... SELECT generate_series), then times searches by last name, email
+fragment, phone number in two formats, club, city and a misspelled last name,
+each returning the first changelist page. Every search is timed through
+race.search and, with --compare, through the standard admin search
+(ModelAdmin.get_search_results: one WHERE with OR over a JOIN with users) for
+reference; the plans of our queries are printed to show they are index scans.
+Seeded rows are removed afterwards unless --keep is given. Run from the
+backend directory against a scratch database, with pg_trgm available:
+
+    python -m benchmarks.registration_search --registrations 1000000 --compare
+"""
+import argparse
+import os
+import time
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'race_project.settings')
+django.setup()
+
+from django.contrib import admin  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from loadtest.stats import format_table  # noqa: E402
+from race import search  # noqa: E402
+from race.models import Event, EventRegistration, Location, RaceType  # noqa: E402
+
+SLUG_PREFIX = 'bench-search-'
+USER_PREFIX = 'bench-search-'
+LAST_NAMES = ['Иванов', 'Петров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов', 'Новиков']
+FIRST_NAMES = ['Иван', 'Пётр', 'Алексей', 'Дмитрий', 'Сергей', 'Андрей', 'Михаил', 'Никита']
+CITIES = ['Москва', 'Санкт-Петербург', 'Казань', 'Екатеринбург', 'Новосибирск', 'Тверь', 'Сочи']
+CLUBS = ['', '', 'Бегущий город', 'Марафонец', 'Лига бега', 'Сильные люди']
+# Один редкий бегун, которого ищут по фамилии, email и телефону
+TARGET_LAST_NAME = 'Бенчмарков'
+TARGET_CLUB = 'Ночные совы'
+PAGE_SIZE = 100
+
+
+def seed(registrations, events):
+    location = Location.objects.create(country='Россия', city='Бенчмарк', street='Тестовая', house_number='1',
+                                       postal_code='000000', latitude=55.75, longitude=37.62)
+    race = RaceType.objects.create(distance=10, gender='M', min_age=18, registration_fee=1000)
+    # По одному, а не bulk_create: сигнал сохранения создаёт секцию сезона
+    created = [Event.objects.create(title=f'Бенчмарк {n}', slug=f'{SLUG_PREFIX}{n}', description='-',
+                                    event_rules='-', event_type='road', location=location, total_slots=registrations,
+                                    start_datetime=timezone.now() + timedelta(days=30), image='bench.jpg')
+               for n in range(events)]
+    target = registrations // 2
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO users_user (password, is_superuser, username, first_name, last_name, email, is_staff,
+                                    is_active, date_joined)
+            SELECT '!', false, %(prefix)s || n, (%(first)s::text[])[1 + n %% 8],
+                   CASE WHEN n = %(target)s THEN %(target_name)s
+                        ELSE (%(last)s::text[])[1 + n %% 9] || '-' || to_hex(n * 2654435761 %% 4294967291) END,
+                   'runner' || n || '@' || (ARRAY['mail.ru', 'yandex.ru', 'gmail.com'])[1 + n %% 3],
+                   false, true, now()
+            FROM generate_series(1, %(count)s) AS n
+        """, {'prefix': USER_PREFIX, 'first': FIRST_NAMES, 'last': LAST_NAMES, 'target': target,
+              'target_name': TARGET_LAST_NAME, 'count': registrations})
+        cursor.execute("""
+            INSERT INTO race_eventregistration (event_id, race_id, user_id, phone_number, phone_e164, city, club,
+                                                tshirt_size, payment_document, payment_confirmation, registered_at,
+                                                is_active, updated_at, season)
+            SELECT (%(events)s::bigint[])[1 + number %% %(event_count)s], %(race)s, users.id,
+                   format('8 (916) %%s-%%s-%%s', substr(digits, 1, 3), substr(digits, 4, 2), substr(digits, 6, 2)),
+                   '+7916' || digits, (%(cities)s::text[])[1 + number %% 7],
+                   CASE WHEN number = %(target)s THEN %(target_club)s ELSE (%(clubs)s::text[])[1 + number %% 6] END,
+                   'M', 'payments/bench.pdf', false, now(), true, now(), %(season)s
+            FROM (SELECT id, substr(username, length(%(prefix)s) + 1)::int AS number FROM users_user
+                  WHERE username LIKE %(prefix)s || '%%') AS users,
+                 LATERAL (SELECT lpad(number::text, 7, '0') AS digits) AS phone
+        """, {'events': [event.pk for event in created], 'event_count': events, 'race': race.pk,
+              'cities': CITIES, 'clubs': CLUBS, 'target': target, 'target_club': TARGET_CLUB,
+              'season': created[0].season, 'prefix': USER_PREFIX})
+        cursor.execute('ANALYZE users_user')
+        cursor.execute('ANALYZE race_eventregistration')
+    return location, race, target
+
+
+def cleanup(location, race):
+    # Без ORM: миллион удалений через сигналы и журнал изменений заняли бы часы
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM race_eventregistration WHERE event_id IN '
+                       '(SELECT id FROM race_event WHERE slug LIKE %s)', [f'{SLUG_PREFIX}%'])
+        cursor.execute('DELETE FROM users_user WHERE username LIKE %s', [f'{USER_PREFIX}%'])
+    Event.objects.filter(slug__startswith=SLUG_PREFIX).delete()
+    race.delete()
+    location.delete()
+
+
+def standard_search(term):
+    model_admin = admin.site._registry[EventRegistration]
+    queryset, _ = admin.ModelAdmin.get_search_results(model_admin, None, EventRegistration.objects.all(), term)
+    return queryset
+
+
+def first_page(queryset):
+    return list(queryset.select_related('user').order_by('-pk')[:PAGE_SIZE])
+
+
+def timed(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - started) / repeat * 1000, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--registrations', type=int, default=1_000_000)
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--compare', action='store_true', help='Also time the standard admin search')
+    parser.add_argument('--explain', action='store_true', help='Print the plans of the searches')
+    parser.add_argument('--keep', action='store_true', help='Keep the seeded rows')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    location, race, target = seed(args.registrations, args.events)
+    print(f'Seeded {args.registrations} registrations and users in {time.perf_counter() - started:.1f}s')
+    digits = f'{target:07d}'
+    terms = [
+        ('last name', TARGET_LAST_NAME),
+        ('last name fragment', TARGET_LAST_NAME[3:8]),
+        ('email fragment', f'runner{target}@'),
+        ('phone, E.164', f'+7916{digits}'),
+        ('phone, as typed', f'8 (916) {digits[:3]}-{digits[3:5]}-{digits[5:]}'),
+        ('phone fragment', digits[1:]),
+        ('rare club', TARGET_CLUB),
+        ('city (many rows)', 'Тверь'),
+        ('misspelled last name', 'Бенчмарков'.replace('мар', 'мр')),
+    ]
+    try:
+        rows = []
+        for name, term in terms:
+            queryset = search.search_registrations(EventRegistration.objects.all(), term)
+            if args.explain:
+                print(f'-- {name}: {term}')
+                print(queryset.order_by('-pk')[:PAGE_SIZE].explain())
+            ms, found = timed(lambda: first_page(search.search_registrations(EventRegistration.objects.all(), term)),
+                              args.repeat)
+            row = {'search': name, 'term': term, 'rows': found, 'ms': ms}
+            if args.compare:
+                row['standard_ms'], row['standard_rows'] = timed(lambda: first_page(standard_search(term)), 1)
+            rows.append(row)
+        columns = ['search', 'term', 'rows', 'ms'] + (['standard_rows', 'standard_ms'] if args.compare else [])
+        print(format_table(rows, columns))
+        print(f'First page of up to {PAGE_SIZE} rows, ms per search.')
+    finally:
+        if not args.keep:
+            cleanup(location, race)
+
+
+if __name__ == '__main__':
+    main()
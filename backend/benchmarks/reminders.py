@@ -0,0 +1,116 @@
+"""
+Benchmark of pre-race reminders at event scale.
+
+Seeds an event starting in 7 days with `--runners` active registrations using
+bulk inserts and sends its reminders to an in-process SMTP sink
+(loadtest/smtp_sink.py) that spends `--latency` ms on each message, then times:
+
+    first run  - every registrant is claimed, rendered and emailed
+    rerun      - nothing is left to send (what a repeated cron run costs)
+
+and reports the messages per second and the database queries issued. Seeded
+rows and their reminder records are removed afterwards. Run from the backend
+directory:
+
+    python -m benchmarks.reminders --runners 10000 --connections 4 --rate 1000/s
+"""
+import argparse
+import os
+import random
+import time
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'race_project.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from loadtest.smtp_sink import SmtpSink  # noqa: E402
+from loadtest.stats import format_table  # noqa: E402
+from race import reminders  # noqa: E402
+from race.models import Event, EventRegistration, Location, RaceType  # noqa: E402
+
+SLUG = 'bench-reminders'
+USER_PREFIX = 'bench-remind-'
+FIRST_NAMES = ['Александр', 'Дмитрий', 'Мария', 'Анна', 'Сергей', 'Елена', 'Иван', 'Ольга']
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def seed(event, races, count, rng):
+    User = get_user_model()
+    users = User.objects.bulk_create([
+        User(username=f'{USER_PREFIX}{n}', email=f'{USER_PREFIX}{n}@example.com', first_name=rng.choice(FIRST_NAMES))
+        for n in range(count)
+    ], batch_size=5000)
+    EventRegistration.objects.bulk_create([
+        EventRegistration(user=user, event=event, race=rng.choice(races), payment_confirmation=True,
+                          bib_number=n + 1 if n % 3 else None, payment_document='bench.pdf', city='Москва',
+                          tshirt_size='M')
+        for n, user in enumerate(users)
+    ], batch_size=5000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runners', type=int, default=10000)
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--rate', default='1000/s')
+    parser.add_argument('--latency', type=float, default=2, help="Milliseconds the sink spends on each message.")
+    args = parser.parse_args()
+
+    sink = SmtpSink(latency=args.latency / 1000).start()
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    settings.EMAIL_HOST, settings.EMAIL_PORT = '127.0.0.1', sink.port
+    settings.EMAIL_USE_TLS, settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD = False, '', ''
+
+    rng = random.Random(1)
+    location = Location.objects.create(country='Россия', city='Бенчмарк', street='Тестовая', house_number='1',
+                                       postal_code='000000', latitude=55.75, longitude=37.62)
+    event = Event.objects.create(title='Бенчмарк напоминаний', slug=SLUG, description='-', event_rules='-',
+                                 event_type='road', start_datetime=timezone.now() + timedelta(days=7),
+                                 location=location, total_slots=args.runners, image='bench.jpg')
+    races = [RaceType.objects.create(distance=distance, gender='M', min_age=18, registration_fee=1000)
+             for distance in (5, 10, 21)]
+    try:
+        seed(event, races, args.runners, rng)
+        rows = []
+        for label in ('first run', 'rerun'):
+            counter = QueryCounter()
+            pool = reminders.SmtpPool(args.connections, args.rate)
+            started = time.perf_counter()
+            with connection.execute_wrapper(counter):
+                result = reminders.send(event, 7, pool, deadline=float('inf'))
+                pool.close()
+            seconds = time.perf_counter() - started
+            rows.append({'step': label, 'seconds': seconds, 'sent': result.sent, 'failed': result.failed,
+                         'msg/s': result.sent / seconds, 'queries': counter.count})
+        print(format_table(rows, ['step', 'seconds', 'sent', 'failed', 'msg/s', 'queries']))
+        print(f'The sink received {sink.messages} message(s) over {args.connections} connection(s), '
+              f'{args.latency:g} ms each, rate limit {args.rate}.')
+    finally:
+        sink.stop()
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM race_reminderdelivery WHERE event_id = %s', [event.pk])
+            cursor.execute('DELETE FROM race_eventregistration WHERE event_id = %s', [event.pk])
+            cursor.execute('DELETE FROM users_user WHERE username LIKE %s', [f'{USER_PREFIX}%'])
+        event.delete()
+        location.delete()
+        for race in races:
+            race.delete()
+
+
+if __name__ == '__main__':
+    main()
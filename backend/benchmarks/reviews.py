@@ -0,0 +1,122 @@
+"""
+Benchmark of the review pages with a large review table.
+
+Seeds `--reviews` reviews spread over `--events` past events with plain SQL (one
+INSERT ... SELECT generate_series), then times the latest-reviews feed with a
+cold and a warm cache, the main page, and the first and a deep page of one
+event's reviews. The plan of the feed query is printed to show it is an index
+scan. Seeded rows are removed afterwards unless --keep is given. Run from the
+backend directory against a scratch database:
+
+    python -m benchmarks.reviews --reviews 1000000
+"""
+import argparse
+import os
+import time
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'race_project.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from loadtest.stats import format_table  # noqa: E402
+from race.models import Event, Location, Review  # noqa: E402
+from race.reviews import invalidate_latest_reviews, latest_reviews  # noqa: E402
+
+SLUG_PREFIX = 'bench-reviews-'
+
+
+def seed(reviews, events):
+    location = Location.objects.create(country='Россия', city='Бенчмарк', street='Тестовая', house_number='1',
+                                       postal_code='000000', latitude=55.75, longitude=37.62)
+    start = timezone.now() - timedelta(days=30)
+    created = Event.objects.bulk_create([
+        Event(title=f'Бенчмарк {n}', slug=f'{SLUG_PREFIX}{n}', description='-', event_rules='-', event_type='road',
+              start_datetime=start, location=location, total_slots=100, image='bench.jpg')
+        for n in range(events)
+    ])
+    author, _ = get_user_model().objects.get_or_create(
+        username='bench-reviews', defaults={'first_name': 'Бенч', 'last_name': 'Марк', 'email': 'bench@example.com'})
+    event_ids = [event.pk for event in created]
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO race_review (event_id, author_id, text, created_at, updated_at)
+            SELECT (%s::bigint[])[1 + n %% %s], %s, 'Отличный старт, спасибо организаторам!',
+                   now() - n * interval '1 second', now()
+            FROM generate_series(1, %s) AS n
+        """, [event_ids, len(event_ids), author.pk, reviews])
+        cursor.execute("""
+            UPDATE race_event SET review_count = (SELECT count(*) FROM race_review WHERE event_id = race_event.id)
+            WHERE id = ANY(%s)
+        """, [event_ids])
+        # Как после прохода autovacuum: карта видимости позволяет index-only scan
+        cursor.execute('VACUUM ANALYZE race_review')
+    return created[0], location, author
+
+
+def cleanup(location, author):
+    # Без ORM: каскадное удаление миллиона отзывов через сигналы заняло бы часы
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM race_review WHERE author_id = %s', [author.pk])
+    Event.objects.filter(slug__startswith=SLUG_PREFIX).delete()
+    location.delete()
+    author.delete()
+    invalidate_latest_reviews()
+
+
+def timed(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reviews', type=int, default=1_000_000)
+    parser.add_argument('--events', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--keep', action='store_true', help='Keep the seeded rows')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    started = time.perf_counter()
+    event, location, author = seed(args.reviews, args.events)
+    print(f'Seeded {args.reviews} reviews in {time.perf_counter() - started:.1f}s')
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + str(Review.objects.order_by('-created_at', '-id')[:5].query))
+            print('\n'.join(row[0] for row in cursor.fetchall()))
+
+        def cold_feed():
+            invalidate_latest_reviews()
+            latest_reviews()
+
+        client = Client()
+        event.refresh_from_db()
+        last_page = (event.review_count - 1) // settings.REVIEWS_PER_PAGE + 1
+        rows = [
+            {'operation': 'latest feed, cold cache', 'ms': timed(cold_feed, args.repeat)},
+            {'operation': 'latest feed, cached', 'ms': timed(latest_reviews, args.repeat)},
+            {'operation': 'main page', 'ms': timed(lambda: client.get('/'), args.repeat)},
+            {'operation': 'event reviews, page 1',
+             'ms': timed(lambda: client.get(event.get_reviews_url()), args.repeat)},
+            {'operation': f'event reviews, page {last_page}',
+             'ms': timed(lambda: client.get(f'{event.get_reviews_url()}?page={last_page}'), args.repeat)},
+        ]
+        print(format_table(rows, ['operation', 'ms']))
+    finally:
+        if not args.keep:
+            cleanup(location, author)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark of start-list generation at event scale.
+
+Seeds an event with `--runners` paid registrations with bib numbers over four
+race types using bulk inserts, then times:
+
+    first build   - the start list and bib sheets are rendered and written
+    unchanged     - registrations did not change, only the version is checked
+                    (what a `build_start_lists --watch` cycle costs)
+    one change    - one registration changed, the documents are rebuilt
+
+Documents go to a temporary START_LIST_ROOT; seeded rows are removed
+afterwards. Run from the backend directory:
+
+    python -m benchmarks.start_lists --runners 10000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'race_project.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from loadtest.stats import format_table  # noqa: E402
+from race import start_lists  # noqa: E402
+from race.models import Event, EventRegistration, Location, RaceType  # noqa: E402
+
+SLUG = 'bench-start-lists'
+USER_PREFIX = 'bench-start-'
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов']
+FIRST_NAMES = ['Александр', 'Дмитрий', 'Максим', 'Сергей', 'Андрей', 'Алексей', 'Иван', 'Никита']
+
+
+def seed(event, races, count, rng):
+    User = get_user_model()
+    users = User.objects.bulk_create([
+        User(username=f'{USER_PREFIX}{n}', email=f'{USER_PREFIX}{n}@example.com',
+             last_name=rng.choice(LAST_NAMES), first_name=rng.choice(FIRST_NAMES))
+        for n in range(count)
+    ], batch_size=5000)
+    EventRegistration.objects.bulk_create([
+        EventRegistration(user=user, event=event, race=rng.choice(races), payment_confirmation=True, bib_number=n + 1,
+                          payment_document='bench.pdf', city='Москва', club=rng.choice(['', 'Бегущий город']),
+                          tshirt_size='M')
+        for n, user in enumerate(users)
+    ], batch_size=5000)
+
+
+def timed(func):
+    started = time.perf_counter()
+    value = func()
+    return time.perf_counter() - started, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runners', type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    settings.START_LIST_ROOT = tempfile.mkdtemp()
+    location = Location.objects.create(country='Россия', city='Бенчмарк', street='Тестовая', house_number='1',
+                                       postal_code='000000', latitude=55.75, longitude=37.62)
+    event = Event.objects.create(title='Бенчмарк протоколов', slug=SLUG, description='-', event_rules='-',
+                                 event_type='road', start_datetime=timezone.now() + timedelta(days=30),
+                                 location=location, total_slots=args.runners, image='bench.jpg')
+    races = [RaceType.objects.create(distance=distance, gender=gender, min_age=18, registration_fee=1000)
+             for distance in (5, 10) for gender in ('M', 'F')]
+    event.race_types.set(races)
+    try:
+        seed(event, races, args.runners, rng)
+        steps = (
+            ('first build', None),
+            ('unchanged', None),
+            ('one change', lambda: EventRegistration.objects.filter(event=event, bib_number=1)
+             .update(club='Новый клуб', updated_at=timezone.now())),
+        )
+        rows = []
+        for label, prepare in steps:
+            if prepare:
+                prepare()
+            seconds, rebuilt = timed(lambda: start_lists.build([event]))
+            rows.append({'step': label, 'seconds': seconds, 'rebuilt': len(rebuilt)})
+        directory = start_lists.event_dir(event)
+        sizes = {name: os.path.getsize(os.path.join(directory, name)) // 1024
+                 for name in (start_lists.START_LIST_FILE, start_lists.BIB_SHEETS_FILE)}
+        print(format_table(rows, ['step', 'seconds', 'rebuilt']))
+        print(', '.join(f'{name}: {size} KiB' for name, size in sizes.items()))
+    finally:
+        shutil.rmtree(settings.START_LIST_ROOT)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM race_eventregistration WHERE event_id = %s', [event.pk])
+            cursor.execute('DELETE FROM users_user WHERE username LIKE %s', [f'{USER_PREFIX}%'])
+        event.delete()
+        location.delete()
+        for race in races:
+            race.delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark of the per-request cost of throttling.
+
+Calls a trivial view wrapped with the throttle decorator through RequestFactory
+and reports the mean time per call for: no throttle, the per-process bucket
+store, the Redis store (when REDIS_URL is set) and the local "already denied"
+fast path. Run from the backend directory:
+
+    python -m benchmarks.throttling --calls 20000
+"""
+import argparse
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'race_project.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import AnonymousUser  # noqa: E402
+from django.http import HttpResponse  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+
+from loadtest.stats import format_table  # noqa: E402
+from race_project import throttling  # noqa: E402
+
+
+def view(request):
+    return HttpResponse('ok')
+
+
+def time_calls(func, requests):
+    started = time.perf_counter()
+    for request in requests:
+        func(request)
+    return (time.perf_counter() - started) / len(requests) * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=5000, help='Distinct client IPs')
+    args = parser.parse_args()
+
+    factory = RequestFactory()
+    requests = []
+    for n in range(args.calls):
+        request = factory.post('/', REMOTE_ADDR=f'10.{n % args.clients // 65536}.{n % args.clients // 256 % 256}.'
+                                                f'{n % args.clients % 256}')
+        request.user = AnonymousUser()
+        requests.append(request)
+
+    rows = [{'variant': 'no throttle', 'us/call': time_calls(view, requests)}]
+    stores = [('local store', '')]
+    if settings.REDIS_URL:
+        stores.append(('redis store', settings.REDIS_URL))
+    for label, url in stores:
+        # Ёмкость больше числа вызовов — все запросы проходят и доходят до хранилища
+        rates = {'bench': f'{args.calls * 2}/s'}
+        with override_settings(REDIS_URL=url, THROTTLE_RATES=rates, THROTTLE_TRUST_X_FORWARDED_FOR=False):
+            throttling.throttle_checker = throttling.Throttle()
+            rows.append({'variant': label, 'us/call': time_calls(throttling.throttle('bench')(view), requests)})
+
+    # Все клиенты уже получили 429 — проверки отвечают из памяти процесса
+    with override_settings(REDIS_URL=settings.REDIS_URL, THROTTLE_RATES={'bench': '1/h'},
+                           THROTTLE_TRUST_X_FORWARDED_FOR=False):
+        throttling.throttle_checker = throttling.Throttle()
+        throttled_view = throttling.throttle('bench')(view)
+        time_calls(throttled_view, requests[:args.clients * 2])
+        rows.append({'variant': 'denied fast path', 'us/call': time_calls(throttled_view, requests)})
+
+    print(format_table(rows, ['variant', 'us/call']))
+
+
+if __name__ == '__main__':
+    main()
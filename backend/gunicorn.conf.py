@@ -0,0 +1,88 @@
+"""
+Gunicorn configuration for race_project.
+
+Every value can be overridden from the environment (GUNICORN_*), so the same
+file serves a laptop and a production host. Defaults are tuned for our
+I/O-bound workload: the geocoder, SMTP and media uploads spend most of their
+time waiting, so threaded workers keep a few slow clients from starving the site.
+"""
+import multiprocessing
+import os
+import shutil
+
+
+def _env_int(name, default):
+    """Read an integer setting from the environment, falling back to the default."""
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_bool(name, default):
+    """Read a boolean setting from the environment, falling back to the default."""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Потоковые воркеры: процесс на ядро (+1), несколько потоков на процесс для I/O-ожиданий.
+# Сервис трансляции результатов (SSE) запускается с uvicorn.workers.UvicornWorker и race_project.asgi
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = _env_int('GUNICORN_WORKERS', cpu_count + 1)
+threads = _env_int('GUNICORN_THREADS', 4)
+backlog = _env_int('GUNICORN_BACKLOG', 2048)
+
+# Перезапуск воркеров с разбросом, чтобы утечки памяти не копились и воркеры не падали разом
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+
+# nginx buffers request bodies, but a payment document on a slow link can still
+# take a while to spool and save, so the worker timeout is generous.
+timeout = _env_int('GUNICORN_TIMEOUT', 60)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+
+# Load Django once in the master so workers fork with the code already imported.
+preload_app = _env_bool('GUNICORN_PRELOAD', True)
+
+# Heartbeat files on tmpfs: an overlay filesystem in Docker can stall workers.
+worker_tmp_dir = os.environ.get('GUNICORN_WORKER_TMP_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+errorlog = os.environ.get('GUNICORN_ERRORLOG', '-')
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+# Workers dump their request metrics here; /metrics merges the files.
+metrics_dir = os.environ.setdefault('METRICS_DIR', '/tmp/race_metrics')
+
+
+def on_starting(server):
+    """Start every master with an empty metrics directory."""
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_fork(server, worker):
+    """Drop any database connections inherited from the preloaded master."""
+    from django.db import connections
+
+    for conn in connections.all(initialized_only=True):
+        conn.close()
+
+
+def worker_exit(server, worker):
+    """Write the final metrics of a worker that is shutting down."""
+    from race_project.metrics import registry
+
+    registry.maybe_flush(force=True)
+
+
+def child_exit(server, worker):
+    """Fold the metrics of an exited worker into the archive (runs in the master)."""
+    from race_project.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid, metrics_dir)
@@ -0,0 +1,95 @@
+"""
+Stand-in for the Nominatim search endpoint used by Location.geocode_address,
+so load tests neither wait on nor hammer the public OpenStreetMap service. It
+answers GET /search with one result whose coordinates are derived from the
+query (the same address always lands in the same spot near Moscow) and can add
+a delay per request to look like the real service.
+
+Standalone (point GEOCODER_URL at http://<host>:8080/search):
+
+    python -m loadtest.geocoder_stub --port 8080 --latency 50
+
+In a script: `stub = GeocoderStub(latency=0.05).start()`, then `stub.url` and
+`stub.requests`.
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+def coordinates(query):
+    digest = hashlib.md5(query.encode()).digest()
+    return 55.5 + digest[0] / 255 * 0.5, 37.3 + digest[1] / 255 * 0.6
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        stub = self.server.stub
+        parts = urlsplit(self.path)
+        if stub.latency:
+            time.sleep(stub.latency)
+        with stub.lock:
+            stub.requests += 1
+        if parts.path.rstrip('/') != '/search':
+            body, status = b'[]', 404
+        else:
+            params = dict(parse_qsl(parts.query))
+            query = ', '.join(params.get(key, '') for key in ('street', 'city', 'postalcode', 'country'))
+            lat, lon = coordinates(query)
+            body, status = json.dumps([{'lat': f'{lat:.6f}', 'lon': f'{lon:.6f}', 'display_name': query}]).encode(), 200
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class GeocoderStub:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = _Server((host, port), _Handler)
+        self.server.stub = self
+        self.port = self.server.server_address[1]
+        self.url = f'http://{host}:{self.port}/search'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help="Milliseconds spent on each request.")
+    args = parser.parse_args()
+    stub = GeocoderStub(args.host, args.port, args.latency / 1000)
+    print(f'Geocoder stub listening on {args.host}:{stub.port}')
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        print(f'{stub.requests} request(s) answered')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Load test for live results: timing stations posting readings while many
+spectators hold Server-Sent Events streams open.
+
+`--stations` simulated stations post `--rate` readings per second each, in
+batches of `--batch`, to the ingestion endpoint. `--subscribers` clients
+follow /live/<event>/ and measure how long each reading takes from the POST
+to their stream. Clients reconnect with Last-Event-ID when a stream ends,
+like a browser would. The event must exist; bibs need not be allocated
+(readings of unknown bibs are stored and streamed too).
+
+As in docker-compose, readings go to the WSGI workers and streams to the ASGI
+ones (run from the backend directory, TIMING_API_TOKENS=secret exported):
+
+    gunicorn race_project.wsgi:application -c gunicorn.conf.py --bind 127.0.0.1:8000
+    gunicorn race_project.asgi:application -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker \\
+        --bind 127.0.0.1:8001 --workers 2
+    python -m loadtest.live_results --event my-race --token secret \\
+        --base-url http://127.0.0.1:8000 --live-url http://127.0.0.1:8001 \\
+        --subscribers 2000 --stations 4 --rate 5 --batch 5 --metrics-url http://127.0.0.1:8001/metrics
+
+With --metrics-url the report includes how many times the workers read the
+timing log, which does not grow with the number of subscribers.
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+from loadtest.stats import format_table, summarize
+
+
+class Run:
+    """Shared state of one load-test run."""
+
+    def __init__(self):
+        self.sent_at = {}
+        self.post_latencies = []
+        self.post_errors = 0
+        self.delivery_latencies = []
+        self.connected = 0
+        self.reconnects = 0
+        self.stream_errors = 0
+        self.stopping = False
+
+
+async def open_connection(url):
+    parts = urlsplit(url)
+    return await asyncio.open_connection(parts.hostname, parts.port or 80, limit=2 ** 20)
+
+
+async def read_head(reader):
+    """Status code and headers of an HTTP/1.1 response."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return int(status_line.split()[1]), headers
+
+
+async def post_batch(base_url, path, token, payload):
+    reader, writer = await open_connection(base_url)
+    try:
+        body = json.dumps(payload).encode()
+        writer.write(
+            f'POST {path} HTTP/1.1\r\nHost: {urlsplit(base_url).netloc}\r\nAuthorization: Bearer {token}\r\n'
+            f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode()
+            + body)
+        await writer.drain()
+        status, headers = await read_head(reader)
+        await reader.read()
+        return status
+    finally:
+        writer.close()
+
+
+async def station(run, args, number, deadline):
+    """Post readings for this station's bib range at the configured rate."""
+    path = f'/api/timing/{args.event}/'
+    name = f'loadtest-{number}'
+    # Номера записей уникальны между запусками, иначе повторный прогон отбросится как дубликаты
+    sequence = int(time.time() * 1000) * 100
+    first_bib = args.first_bib + number * args.bibs_per_station
+    interval = args.batch / args.rate
+    reading = 0
+    next_post = time.monotonic()
+    while time.monotonic() < deadline:
+        records = []
+        for _ in range(args.batch):
+            bib = first_bib + reading % args.bibs_per_station
+            point = f'split-{reading // args.bibs_per_station}'
+            sequence += 1
+            reading += 1
+            records.append({'seq': sequence, 'bib': bib, 'point': point, 'time': round(reading * 0.7, 1)})
+            run.sent_at[bib, point] = time.monotonic()
+        started = time.perf_counter()
+        try:
+            status = await post_batch(args.base_url, path, args.token, {'station': name, 'records': records})
+        except OSError:
+            status = 0
+        if 200 <= status < 300:
+            run.post_latencies.append(time.perf_counter() - started)
+        else:
+            run.post_errors += 1
+        next_post += interval
+        await asyncio.sleep(max(0.0, next_post - time.monotonic()))
+
+
+async def subscriber(run, args):
+    """Follow the stream, reconnecting with Last-Event-ID like EventSource does."""
+    path = f'/live/{args.event}/' + (f'?race={args.race}' if args.race else '')
+    last_event_id = None
+    first = True
+    while not run.stopping:
+        try:
+            reader, writer = await open_connection(args.live_url)
+        except OSError:
+            run.stream_errors += 1
+            await asyncio.sleep(1)
+            continue
+        try:
+            resume = f'Last-Event-ID: {last_event_id}\r\n' if last_event_id else ''
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {urlsplit(args.live_url).netloc}\r\n'
+                         f'Accept: text/event-stream\r\n{resume}\r\n'.encode())
+            await writer.drain()
+            status, headers = await read_head(reader)
+            if status != 200:
+                run.stream_errors += 1
+                await asyncio.sleep(1)
+                continue
+            if first:
+                run.connected += 1
+                first = False
+            else:
+                run.reconnects += 1
+            async for line in iter_lines(reader, headers.get('transfer-encoding') == 'chunked'):
+                if line.startswith('id: '):
+                    last_event_id = line[4:]
+                elif line.startswith('data: '):
+                    record = json.loads(line[6:])
+                    sent_at = run.sent_at.get((record['bib'], record['point']))
+                    if sent_at is not None:
+                        run.delivery_latencies.append(time.monotonic() - sent_at)
+        except (OSError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            if not run.stopping:
+                run.stream_errors += 1
+        finally:
+            writer.close()
+
+
+async def iter_lines(reader, chunked):
+    """Text lines of a (possibly chunked) streaming body."""
+    buffer = b''
+    while True:
+        if chunked:
+            size_line = await reader.readline()
+            if not size_line:
+                return
+            size = int(size_line.strip() or b'0', 16)
+            if size == 0:
+                return
+            data = await reader.readexactly(size + 2)
+            buffer += data[:-2]
+        else:
+            data = await reader.read(65536)
+            if not data:
+                return
+            buffer += data
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line.decode()
+
+
+async def read_polls(metrics_url):
+    """Sum of live_polls_total reported by /metrics (None without --metrics-url)."""
+    if not metrics_url:
+        return None
+    parts = urlsplit(metrics_url)
+    reader, writer = await open_connection(metrics_url)
+    try:
+        writer.write(f'GET {parts.path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        await read_head(reader)
+        body = (await reader.read()).decode()
+    finally:
+        writer.close()
+    return sum(float(line.rsplit(' ', 1)[1]) for line in body.splitlines() if line.startswith('live_polls_total'))
+
+
+async def main_async(args):
+    run = Run()
+    subscribers = []
+    for n in range(args.subscribers):
+        subscribers.append(asyncio.create_task(subscriber(run, args)))
+        if n % 100 == 99:
+            # Подключаемся волнами, чтобы не упереться в очередь accept сервера
+            await asyncio.sleep(0.05)
+    await asyncio.sleep(args.warmup)
+    polls_before = await read_polls(args.metrics_url)
+
+    started = time.monotonic()
+    deadline = started + args.duration
+    await asyncio.gather(*(station(run, args, n, deadline) for n in range(args.stations)))
+    # Даём последним отметкам дойти до подписчиков
+    await asyncio.sleep(args.drain)
+    elapsed = time.monotonic() - started
+    polls_after = await read_polls(args.metrics_url)
+
+    run.stopping = True
+    for task in subscribers:
+        task.cancel()
+    await asyncio.gather(*subscribers, return_exceptions=True)
+
+    readings = len(run.sent_at)
+    ingest = summarize(run.post_latencies, run.post_errors, elapsed)
+    ingest.update(step='ingest POST', items=readings)
+    delivery = summarize(run.delivery_latencies, 0, elapsed)
+    delivery.update(step='POST -> stream', items=len(run.delivery_latencies))
+    print(format_table([ingest, delivery], ['step', 'requests', 'errors', 'items', 'p50', 'p95', 'p99']))
+    expected = readings * run.connected if not args.race else None
+    print(f'subscribers connected: {run.connected}/{args.subscribers}, reconnects: {run.reconnects}, '
+          f'stream errors: {run.stream_errors}')
+    if expected:
+        print(f'deliveries: {len(run.delivery_latencies)} of {expected} '
+              f'({len(run.delivery_latencies) / expected:.1%})')
+    if polls_before is not None and polls_after is not None:
+        print(f'timing-log reads by the workers during the run: {polls_after - polls_before:.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--event', required=True, help='Slug of an existing event')
+    parser.add_argument('--token', required=True, help='One of TIMING_API_TOKENS')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Server receiving the readings')
+    parser.add_argument('--live-url', help='Server streaming /live/ (defaults to --base-url)')
+    parser.add_argument('--race', type=int, help='Subscribe to one race type only')
+    parser.add_argument('--subscribers', type=int, default=1000)
+    parser.add_argument('--stations', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=50.0, help='Readings per second per station')
+    parser.add_argument('--batch', type=int, default=25, help='Readings per POST')
+    parser.add_argument('--first-bib', type=int, default=1)
+    parser.add_argument('--bibs-per-station', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of posting')
+    parser.add_argument('--warmup', type=float, default=3.0, help='Seconds for the subscribers to connect')
+    parser.add_argument('--drain', type=float, default=3.0, help='Seconds to wait for the last deliveries')
+    parser.add_argument('--metrics-url', help='/metrics of the streaming server, to count timing-log reads')
+    args = parser.parse_args()
+    args.live_url = args.live_url or args.base_url
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
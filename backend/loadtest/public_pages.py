@@ -0,0 +1,164 @@
+"""
+Load test for the public pages (main page, events, pricing, contact, event detail).
+
+Runs a fixed number of concurrent keep-alive clients for a fixed duration and reports
+throughput and latency percentiles. Optional "slow clients" trickle their requests
+byte by byte, which is what starves sync workers on a real network.
+
+Against an already running server:
+
+    python -m loadtest.public_pages --base-url http://127.0.0.1:8000
+
+Comparing the old default command with the shipped gunicorn config (each server is
+started, measured and stopped in turn; run from the backend directory):
+
+    python -m loadtest.public_pages --slow-clients 8 \\
+        --server "default=gunicorn race_project.wsgi:application --bind 127.0.0.1:8000" \\
+        --server "tuned=gunicorn race_project.wsgi:application -c gunicorn.conf.py --bind 127.0.0.1:8000"
+
+Comparing pre-rendered snapshots served by nginx with the same pages rendered by
+Django (docker-compose stack, after `manage.py build_snapshots --all`):
+
+    python -m loadtest.public_pages --path /pricing/ --path /contact/ --path "/events/?filter=past" \
+        --target nginx=http://127.0.0.1 --target django=http://127.0.0.1:8000
+"""
+import argparse
+import http.client
+import shlex
+import socket
+import subprocess
+import threading
+import time
+from urllib.parse import urlsplit
+
+from loadtest.stats import format_table, summarize
+
+DEFAULT_PATHS = ['/', '/events/', '/events/?filter=upcoming', '/pricing/', '/contact/']
+
+
+def run_clients(base_url, paths, concurrency, duration):
+    """Hammer the given paths from `concurrency` threads and return a summary dict."""
+    parts = urlsplit(base_url)
+    deadline = time.monotonic() + duration
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client(offset):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        local_latencies, local_errors, i = [], 0, offset
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path, headers={'Host': parts.netloc})
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 400:
+                    local_errors += 1
+                else:
+                    local_latencies.append(time.perf_counter() - started)
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.monotonic() - started)
+
+
+def start_slow_clients(base_url, count, stop):
+    """Open `count` connections that send their request one byte per second."""
+    parts = urlsplit(base_url)
+    request = f'GET / HTTP/1.1\r\nHost: {parts.netloc}\r\n\r\n'.encode()
+
+    def slow_client():
+        while not stop.is_set():
+            try:
+                with socket.create_connection((parts.hostname, parts.port or 80), timeout=60) as sock:
+                    for byte in request:
+                        if stop.wait(1):
+                            return
+                        sock.send(bytes([byte]))
+                    sock.recv(65536)
+            except OSError:
+                stop.wait(1)
+
+    threads = [threading.Thread(target=slow_client, daemon=True) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def wait_for_port(base_url, timeout=30):
+    """Block until the server accepts TCP connections."""
+    parts = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((parts.hostname, parts.port or 80), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server at {base_url} did not come up in {timeout}s')
+
+
+def measure(label, base_url, args):
+    stop = threading.Event()
+    start_slow_clients(base_url, args.slow_clients, stop)
+    try:
+        if args.warmup:
+            run_clients(base_url, args.paths, args.concurrency, args.warmup)
+        result = run_clients(base_url, args.paths, args.concurrency, args.duration)
+    finally:
+        stop.set()
+    result['server'] = label
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--path', dest='paths', action='append', help='Path to request (repeatable)')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds of measured load')
+    parser.add_argument('--warmup', type=float, default=3.0, help='Seconds of unmeasured load first')
+    parser.add_argument('--slow-clients', type=int, default=0, help='Connections that trickle their request')
+    parser.add_argument('--server', action='append', default=[], metavar='LABEL=COMMAND',
+                        help='Start this server, measure it and stop it (repeatable)')
+    parser.add_argument('--target', action='append', default=[], metavar='LABEL=URL',
+                        help='Measure an already running server at URL instead of --base-url (repeatable)')
+    args = parser.parse_args()
+    args.paths = args.paths or DEFAULT_PATHS
+
+    rows = []
+    for spec in args.target:
+        label, _, base_url = spec.partition('=')
+        rows.append(measure(label, base_url, args))
+    if not args.server and not args.target:
+        rows.append(measure(args.base_url, args.base_url, args))
+    for spec in args.server:
+        label, _, command = spec.partition('=')
+        process = subprocess.Popen(shlex.split(command))
+        try:
+            wait_for_port(args.base_url)
+            rows.append(measure(label, args.base_url, args))
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    print(format_table(rows, ['server', 'requests', 'errors', 'rps', 'p50', 'p95', 'p99']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""
+Rehearsal of the moment a big event opens for registration.
+
+Each virtual user walks the path of a real runner with its own session:
+
+    main           GET  /
+    event_detail   GET  /event-detail/<slug>/
+    races          GET  /get-races-for-event/<id>/
+    login_form     GET  /users/login/
+    login          POST /users/login/                (302 expected)
+    register_form  GET  /register-for-event/
+    register       POST /register-for-event/         (multipart with a payment document, 302 expected)
+    registrations  GET  /users/registrations-list/   (must list the event)
+
+and leaves; new users arrive as long as the ramp profile asks for more
+concurrent users than are active. A profile is a list of `second:users` points
+joined by straight lines, or one of the presets (PROFILES, scaled by --peak).
+Accounts come from loadtest/rush_fixtures.py, one per virtual user.
+
+The report has, per step, the number of requests, errors and the error rate,
+p50/p95/p99 latency, and the database queries of the request as counted by the
+server (X-DB-Queries, sent when METRICS_QUERY_HEADER is on).
+
+The whole stand - the docker-compose stack plus an SMTP sink and a stub
+geocoder (docker-compose.loadtest.yml), the fixtures, the run and the clean-up
+- from the repository root:
+
+    python backend/loadtest/registration_rush.py --compose --users 2000 --profile opening --peak 300
+
+Against a server that is already running, with the fixtures already created:
+
+    python -m loadtest.registration_rush --base-url http://127.0.0.1:8000 --profile "0:0,30:50,90:50"
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+if __package__ in (None, ''):
+    # Запуск файлом из корня репозитория: python backend/loadtest/registration_rush.py
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loadtest.stats import format_table, summarize  # noqa: E402
+
+EVENT_SLUG = 'rush-event'
+USER_PREFIX = 'rush-'
+PASSWORD = 'rush-password'
+
+STEPS = ['main', 'event_detail', 'races', 'login_form', 'login', 'register_form', 'register', 'registrations']
+
+# Точки "секунда:пользователей" в долях от --peak
+PROFILES = {
+    # Регистрация открылась: все приходят за несколько секунд
+    'opening': [(0, 0), (5, 1), (65, 1), (75, 0)],
+    # Плавный рост, плато и спад
+    'ramp': [(0, 0), (60, 1), (120, 1), (150, 0)],
+    'steady': [(0, 1), (60, 1)],
+}
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+COMPOSE = ['docker', 'compose', '-f', 'docker-compose.yml', '-f', 'docker-compose.loadtest.yml']
+
+# Минимальный PDF вместо квитанции об оплате
+PAYMENT_DOCUMENT = (b'%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n'
+                    b'2 0 obj<</Type/Pages/Kids[]/Count 0>>endobj\ntrailer<</Root 1 0 R>>\n%%EOF\n')
+
+
+def parse_profile(value, peak):
+    """[(second, users), ...] from a preset name or 'second:users,...' points."""
+    if value in PROFILES:
+        return [(second, round(share * peak)) for second, share in PROFILES[value]]
+    try:
+        points = [tuple(float(part) for part in point.split(':')) for point in value.split(',')]
+        points = [(second, int(users)) for second, users in points]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Bad profile {value!r}: use a preset or 'second:users,...'.")
+    if any(later[0] <= earlier[0] for earlier, later in zip(points, points[1:])):
+        raise argparse.ArgumentTypeError("Profile seconds must increase.")
+    return points
+
+
+def target_users(profile, elapsed):
+    """Concurrent users the profile asks for `elapsed` seconds in."""
+    if elapsed <= profile[0][0]:
+        return profile[0][1]
+    for (start, first), (end, last) in zip(profile, profile[1:]):
+        if elapsed <= end:
+            return round(first + (last - first) * (elapsed - start) / (end - start))
+    return profile[-1][1]
+
+
+class Recorder:
+    """Latencies, errors and server-side query counts per step, shared by all virtual users."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+        self.queries = {step: [] for step in STEPS}
+        self.reasons = {}
+        self.flows = 0
+        self.failed_flows = 0
+
+    def record(self, step, seconds, error, queries):
+        with self.lock:
+            if error:
+                self.errors[step] += 1
+                self.reasons[(step, error)] = self.reasons.get((step, error), 0) + 1
+            else:
+                self.latencies[step].append(seconds)
+            if queries is not None:
+                self.queries[step].append(queries)
+
+    def rows(self, elapsed):
+        rows = []
+        for step in STEPS:
+            row = summarize(self.latencies[step], self.errors[step], elapsed)
+            queries = self.queries[step]
+            row.update(step=step, error_rate=row['error_rate'] * 100,
+                       queries=sum(queries) / len(queries) if queries else '-',
+                       max_queries=max(queries) if queries else '-')
+            rows.append(row)
+        return rows
+
+
+class FlowError(Exception):
+    pass
+
+
+class VirtualUser:
+    def __init__(self, base_url, username, recorder, think):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.recorder = recorder
+        self.think = think
+        self.session = requests.Session()
+
+    def request(self, step, method, path, expect=200, check=None, **kwargs):
+        started = time.perf_counter()
+        error, response = None, None
+        try:
+            response = self.session.request(method, self.base_url + path, allow_redirects=False, timeout=60,
+                                            **kwargs)
+            if response.status_code != expect:
+                error = f'HTTP {response.status_code}'
+            elif check and not check(response):
+                error = 'unexpected content'
+        except (requests.RequestException, ValueError) as exc:
+            error = type(exc).__name__
+        seconds = time.perf_counter() - started
+        queries = response.headers.get('X-DB-Queries') if response is not None else None
+        self.recorder.record(step, seconds, error, int(queries) if queries else None)
+        if error:
+            raise FlowError(error)
+        if self.think:
+            time.sleep(random.uniform(0, 2 * self.think))
+        return response
+
+    def csrf(self):
+        return self.session.cookies.get('csrftoken', '')
+
+    def run(self, event):
+        self.request('main', 'GET', '/')
+        self.request('event_detail', 'GET', f'/event-detail/{event["slug"]}/')
+        races = self.request('races', 'GET', f'/get-races-for-event/{event["id"]}/',
+                             check=lambda response: response.json()['races']).json()['races']
+        self.request('login_form', 'GET', '/users/login/')
+        self.request('login', 'POST', '/users/login/', expect=302, data={
+            'csrfmiddlewaretoken': self.csrf(), 'username': self.username, 'password': PASSWORD,
+        })
+        self.request('register_form', 'GET', '/register-for-event/')
+        number = re.sub(r'\D', '', self.username)[-7:].rjust(7, '0')
+        self.request('register', 'POST', '/register-for-event/', expect=302, data={
+            'csrfmiddlewaretoken': self.csrf(), 'phone_number': f'+7916{number}', 'event': event['id'],
+            'race': random.choice(races)['id'], 'tshirt_size': random.choice('SML'), 'city': 'Москва',
+            'club': random.choice(['', 'Бегущий город', 'Марафонец']),
+        }, files={'payment_document': ('payment.pdf', PAYMENT_DOCUMENT, 'application/pdf')})
+        self.request('registrations', 'GET', '/users/registrations-list/',
+                     check=lambda response: event['title'] in response.text)
+
+
+def find_event(base_url):
+    response = requests.get(f'{base_url.rstrip("/")}/api/v1/events/{EVENT_SLUG}/',
+                            params={'fields': 'id,slug,title'}, timeout=30)
+    if response.status_code != 200:
+        sys.exit(f'Event {EVENT_SLUG} not found at {base_url}; create it with loadtest/rush_fixtures.py first.')
+    return response.json()
+
+
+def run(base_url, profile, users, think):
+    """
+    Drive virtual users along the profile. Returns the recorder, the elapsed
+    seconds and whether the accounts ran out before the profile ended.
+    """
+    event = find_event(base_url)
+    recorder = Recorder()
+    accounts = iter(f'{USER_PREFIX}{n}' for n in range(users))
+    active = set()
+    lock = threading.Lock()
+
+    def flow(username):
+        try:
+            VirtualUser(base_url, username, recorder, think).run(event)
+            with recorder.lock:
+                recorder.flows += 1
+        except FlowError:
+            with recorder.lock:
+                recorder.failed_flows += 1
+        finally:
+            with lock:
+                active.discard(threading.current_thread())
+
+    started = time.monotonic()
+    duration = profile[-1][0]
+    exhausted = False
+    while (elapsed := time.monotonic() - started) < duration:
+        with lock:
+            missing = target_users(profile, elapsed) - len(active)
+        for _ in range(missing):
+            username = next(accounts, None)
+            if username is None:
+                exhausted = True
+                break
+            thread = threading.Thread(target=flow, args=(username,), daemon=True)
+            with lock:
+                active.add(thread)
+            thread.start()
+        time.sleep(0.1)
+    for thread in list(active):
+        thread.join(timeout=120)
+    return recorder, time.monotonic() - started, exhausted
+
+
+def compose(*args, check=True):
+    return subprocess.run(COMPOSE + list(args), cwd=REPO_ROOT, check=check)
+
+
+def wait_until_up(base_url, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url, timeout=5).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(2)
+    sys.exit(f'{base_url} did not come up in {timeout} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--profile', default='opening',
+                        help=f"Preset ({', '.join(PROFILES)}) or 'second:users,...' points.")
+    parser.add_argument('--peak', type=int, default=100, help="Concurrent users at the top of a preset profile.")
+    parser.add_argument('--users', type=int, default=1000, help="Accounts available (one per virtual user).")
+    parser.add_argument('--think', type=float, default=0.5, help="Mean pause in seconds between a user's steps.")
+    parser.add_argument('--compose', action='store_true',
+                        help="Start the docker-compose stand, create the fixtures, and delete them afterwards.")
+    parser.add_argument('--down', action='store_true', help="With --compose: stop the stand at the end.")
+    parser.add_argument('--json', metavar='FILE', help="Also write the report as JSON.")
+    args = parser.parse_args()
+    try:
+        profile = parse_profile(args.profile, args.peak)
+    except argparse.ArgumentTypeError as exc:
+        parser.error(str(exc))
+
+    if args.compose:
+        compose('up', '-d', '--build')
+        wait_until_up(args.base_url)
+        compose('exec', '-T', 'backend', 'python', '-m', 'loadtest.rush_fixtures', 'create',
+                '--users', str(args.users), '--slots', str(args.users))
+    try:
+        recorder, elapsed, exhausted = run(args.base_url, profile, args.users, args.think)
+    finally:
+        if args.compose:
+            compose('exec', '-T', 'backend', 'python', '-m', 'loadtest.rush_fixtures', 'delete', check=False)
+            if args.down:
+                compose('down', check=False)
+
+    rows = recorder.rows(elapsed)
+    print(format_table(rows, ['step', 'requests', 'errors', 'error_rate', 'p50', 'p95', 'p99', 'queries',
+                              'max_queries']))
+    print(f'{recorder.flows} registration(s) completed, {recorder.failed_flows} flow(s) failed, '
+          f'{elapsed:.1f} s, profile {", ".join(f"{second:g}s:{users}" for second, users in profile)}. '
+          f'Latency in ms, error rate in %.')
+    if exhausted:
+        print(f'All {args.users} accounts were used before the profile ended; create more with --users.')
+    for (step, reason), count in sorted(recorder.reasons.items(), key=lambda item: -item[1]):
+        print(f'  {step}: {reason} x{count}')
+    if not any(recorder.queries[step] for step in STEPS):
+        print('No X-DB-Queries headers: start the server with METRICS_QUERY_HEADER=True to count queries.')
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump({'profile': profile, 'elapsed': elapsed, 'flows': recorder.flows,
+                       'failed_flows': recorder.failed_flows, 'steps': rows}, fh, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Data for the registration-rush load test (loadtest/registration_rush.py).
+
+`create` adds an upcoming event with free slots and three race types, a
+location (geocoded through GEOCODER_URL, the stub on the load-test stand) and
+`--users` active accounts rush-0 ... rush-N sharing one password. The password
+is hashed once and the users are bulk-inserted, so thousands of accounts take
+seconds. `delete` removes all of it, registrations and their uploaded payment
+documents included. Run where the application runs, e.g. on the docker-compose
+stand:
+
+    docker compose -f docker-compose.yml -f docker-compose.loadtest.yml exec -T backend \\
+        python -m loadtest.rush_fixtures create --users 2000 --slots 1500
+"""
+import argparse
+import os
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'race_project.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.contrib.auth.hashers import make_password  # noqa: E402
+from django.core.files.storage import default_storage  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from race.models import Event, EventRegistration, Location, RaceType  # noqa: E402
+
+EVENT_SLUG = 'rush-event'
+USER_PREFIX = 'rush-'
+PASSWORD = 'rush-password'
+LOCATION_CITY = 'Нагрузочный тест'
+
+
+def create(users, slots, days):
+    with transaction.atomic():
+        location = Location.objects.create(country='Россия', city=LOCATION_CITY, street='Беговая',
+                                           house_number='1', postal_code='125284')
+        event = Event.objects.create(title='Нагрузочный забег', slug=EVENT_SLUG, description='Открытие регистрации',
+                                     event_rules='-', event_type='road', location=location, total_slots=slots,
+                                     start_datetime=timezone.now() + timedelta(days=days), image='rush.jpg')
+        event.race_types.set([RaceType.objects.create(distance=distance, gender='M', min_age=18, registration_fee=1500)
+                              for distance in (5, 10, 21)])
+        password = make_password(PASSWORD)
+        User = get_user_model()
+        User.objects.bulk_create([
+            User(username=f'{USER_PREFIX}{n}', email=f'{USER_PREFIX}{n}@example.com', password=password,
+                 first_name='Бегун', last_name=str(n))
+            for n in range(users)
+        ], batch_size=5000)
+    return event
+
+
+def delete():
+    event = Event.objects.filter(slug=EVENT_SLUG).first()
+    documents = list(EventRegistration.objects.filter(user__username__startswith=USER_PREFIX)
+                     .values_list('payment_document', flat=True))
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM race_eventregistration WHERE user_id IN '
+                       '(SELECT id FROM users_user WHERE username LIKE %s)', [f'{USER_PREFIX}%'])
+        cursor.execute('DELETE FROM race_registrationauditentry WHERE actor_id IN '
+                       '(SELECT id FROM users_user WHERE username LIKE %s)', [f'{USER_PREFIX}%'])
+        cursor.execute('DELETE FROM users_user WHERE username LIKE %s', [f'{USER_PREFIX}%'])
+    if event is not None:
+        races = list(event.race_types.all())
+        event.delete()
+        for race in races:
+            race.delete()
+    Location.objects.filter(city=LOCATION_CITY).delete()
+    for name in documents:
+        default_storage.delete(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('action', choices=['create', 'delete'])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--slots', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=30, help="The event starts this many days from now.")
+    args = parser.parse_args()
+    if args.action == 'create':
+        delete()
+        event = create(args.users, args.slots, args.days)
+        print(f'Created event {event.slug} (id {event.pk}, {args.slots} slots) and {args.users} users '
+              f'{USER_PREFIX}0..{USER_PREFIX}{args.users - 1} with password {PASSWORD!r}.')
+    else:
+        delete()
+        print('Load-test data deleted.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+SMTP server that accepts every message and throws it away, for load tests and
+benchmarks of outgoing mail. It answers just enough of the protocol for
+smtplib (EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT) and can add a delay
+per message to look like a real relay.
+
+Standalone:
+
+    python -m loadtest.smtp_sink --port 2525 --latency 20
+
+In a script: `sink = SmtpSink(latency=0.02).start()`, then `sink.port` and
+`sink.messages`.
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        sink = self.server.sink
+        self.reply('220 sink ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.wfile.write(b'250-sink\r\n250 8BITMIME\r\n')
+            elif command == b'DATA':
+                self.reply('354 go ahead')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                if sink.latency:
+                    time.sleep(sink.latency)
+                with sink.lock:
+                    sink.messages += 1
+                self.reply('250 queued')
+            elif command == b'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SmtpSink:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.messages = 0
+        self.lock = threading.Lock()
+        self.server = _Server((host, port), _Handler)
+        self.server.sink = self
+        self.port = self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--latency', type=float, default=0, help="Milliseconds spent on each message.")
+    args = parser.parse_args()
+    sink = SmtpSink(args.host, args.port, args.latency / 1000)
+    print(f'SMTP sink listening on {args.host}:{sink.port}')
+    try:
+        sink.server.serve_forever()
+    except KeyboardInterrupt:
+        print(f'{sink.messages} message(s) received')
+
+
+if __name__ == '__main__':
+    main()
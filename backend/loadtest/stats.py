@@ -0,0 +1,42 @@
+"""
+Helpers shared by the load-test scripts: latency percentiles and report formatting.
+"""
+
+
+def percentile(sorted_values, pct):
+    """Return the pct-th percentile of an already sorted list (nearest-rank)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, errors, elapsed):
+    """Build a summary dict from per-request latencies (seconds) and an error count."""
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        'requests': total,
+        'errors': errors,
+        'error_rate': errors / total if total else 0.0,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+    }
+
+
+def format_table(rows, columns):
+    """Render a list of dicts as a fixed-width text table."""
+    widths = {col: max(len(col), *(len(_fmt(row[col])) for row in rows)) for col in columns}
+    lines = ['  '.join(col.ljust(widths[col]) for col in columns)]
+    lines.append('  '.join('-' * widths[col] for col in columns))
+    for row in rows:
+        lines.append('  '.join(_fmt(row[col]).ljust(widths[col]) for col in columns))
+    return '\n'.join(lines)
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        return f'{value:.2f}'
+    return str(value)
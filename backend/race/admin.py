@@ -2,7 +2,8 @@ import csv
 from django.http import HttpResponse
 from django.utils.encoding import smart_str
 
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.utils import timezone
 from .models import (RaceType,
                      EventRegistration,
                      Location,
@@ -11,13 +12,23 @@ from .models import (RaceType,
                      Organizer,
                      EventSummary,
                      GalleryPhoto,
-                     Review)
+                     RaceResult,
+                     Review,
+                     RegistrationAuditEntry,
+                     ReminderDelivery,
+                     CanonicalName,
+                     ImageUpload,
+                     TimingRecord)
 from django.utils.html import format_html
+from .paginators import EstimatedCountPaginator
+from django.db import transaction
+from django.urls import reverse
+from . import audit, bibs, names, search, start_lists
 
 
 class RaceTypeAdmin(admin.ModelAdmin):
     """Class for displaying the RaceType model in the admin panel"""
-    list_display = ['distance', 'gender', 'min_age', 'registration_fee']
+    list_display = ['distance', 'gender', 'min_age', 'registration_fee', 'bib_range_start', 'bib_range_end']
     list_filter = ['distance']
     search_fields = ['distance']
 
@@ -38,13 +49,75 @@ class RaceTypeAdmin(admin.ModelAdmin):
 
 
 class EventRegistrationAdmin(admin.ModelAdmin):
-    list_display = ['event', 'race', 'get_user_name', 'get_user_date_birth', 'phone_number', 'city',
+    list_display = ['event', 'race', 'bib_number', 'get_user_name', 'get_user_date_birth', 'phone_number', 'city',
                     'club', 'tshirt_size', 'payment_document_link',
                     'payment_confirmation', 'registered_at', 'is_active']
 
-    list_filter = ['event', 'payment_confirmation', 'registered_at', 'is_active']
+    # Фильтр по сезону читает одну секцию таблицы
+    list_filter = ['season', 'event', 'payment_confirmation', 'registered_at', 'is_active']
 
-    actions = ['export_active_to_csv']
+    # Пользователь, мероприятие и забег читаются одним JOIN, а не отдельным запросом на строку
+    list_select_related = ['user', 'event', 'race']
+    autocomplete_fields = ['user', 'event', 'race']
+    date_hierarchy = 'registered_at'
+    # Без фильтров число строк берётся из статистики PostgreSQL, а не из COUNT(*) по всей таблице
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # Поиск идёт по индексам каждого поля (race/search.py), а не стандартным OR по JOIN с пользователями
+    search_fields = ['user__last_name', 'user__first_name', 'user__email', 'phone_e164', 'club', 'city']
+    search_help_text = "Фамилия, имя, email, телефон в любом формате, клуб или город"
+
+    readonly_fields = ['audit_link']
+
+    actions = ['export_active_to_csv', 'confirm_payment']
+
+    @admin.action(description="Подтвердить оплату", permissions=['change'])
+    def confirm_payment(self, request, queryset):
+        # Один UPDATE на все выбранные регистрации, без загрузки объектов; журналу нужны только их id
+        with transaction.atomic():
+            rows = list(queryset.filter(payment_confirmation=False).select_for_update()
+                        .values_list('pk', 'event_id'))
+            updated = EventRegistration.objects.filter(pk__in=[pk for pk, _ in rows]).update(
+                payment_confirmation=True, updated_at=timezone.now())
+            audit.record_many(rows, RegistrationAuditEntry.PAYMENT_CONFIRMED, actor=request.user,
+                              source=RegistrationAuditEntry.ADMIN, changes={'payment_confirmation': [False, True]})
+        self.message_user(request, f"Оплата подтверждена для регистраций: {updated}.", messages.SUCCESS)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return search.search_registrations(queryset, search_term), False
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            audit.record_created(obj, actor=request.user, source=RegistrationAuditEntry.ADMIN)
+            return
+        changes = {
+            name: [audit.logged_value(form.initial.get(name)),
+                   audit.logged_value(obj._meta.get_field(name).value_from_object(obj))]
+            for name in form.changed_data
+        }
+        if changes:
+            audit.record(obj, RegistrationAuditEntry.CHANGED, actor=request.user,
+                         source=RegistrationAuditEntry.ADMIN, changes=changes)
+
+    def delete_model(self, request, obj):
+        audit.record(obj, RegistrationAuditEntry.DELETED, actor=request.user, source=RegistrationAuditEntry.ADMIN)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        audit.record_many(queryset.values_list('pk', 'event_id'), RegistrationAuditEntry.DELETED,
+                          actor=request.user, source=RegistrationAuditEntry.ADMIN)
+        super().delete_queryset(request, queryset)
+
+    @admin.display(description='Журнал изменений')
+    def audit_link(self, obj):
+        if obj.pk is None:
+            return '—'
+        url = reverse('admin:race_registrationauditentry_changelist')
+        return format_html('<a href="{}?registration_id={}">История регистрации</a>', url, obj.pk)
 
     def export_active_to_csv(self, request, queryset):
         response = HttpResponse(content_type='text/csv')
@@ -57,6 +130,7 @@ class EventRegistrationAdmin(admin.ModelAdmin):
         writer.writerow([
             smart_str(u"Event"),
             smart_str(u"Race"),
+            smart_str(u"Bib"),
             smart_str(u"User"),
             smart_str(u"Date of Birth"),
             smart_str(u"Phone Number"),
@@ -76,6 +150,7 @@ class EventRegistrationAdmin(admin.ModelAdmin):
             writer.writerow([
                 smart_str(registration.event.title),
                 smart_str(registration.race),
+                smart_str(registration.bib_number or ''),
                 smart_str(full_name),
                 smart_str(date_of_birth),
                 smart_str(registration.phone_number),
@@ -117,6 +192,168 @@ class EventRegistrationAdmin(admin.ModelAdmin):
 
 class EventAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("title",)}
+    search_fields = ['title']
+    list_display = ['title', 'start_datetime', 'start_list_links']
+    actions = ['allocate_bibs', 'build_start_lists']
+
+    @admin.action(description="Выдать стартовые номера", permissions=['change'])
+    def allocate_bibs(self, request, queryset):
+        for event in queryset:
+            allocations = bibs.allocate(event)
+            assigned = sum(allocation.assigned for allocation in allocations)
+            waiting = sum(allocation.waiting for allocation in allocations)
+            level = messages.WARNING if waiting else messages.SUCCESS
+            self.message_user(request, f"{event}: выдано номеров {assigned}, остались без номера {waiting}.", level)
+
+    @admin.action(description="Собрать стартовые протоколы", permissions=['change'])
+    def build_start_lists(self, request, queryset):
+        built = start_lists.build(queryset, rebuild_all=True)
+        self.message_user(request, f"Собрано стартовых протоколов: {len(built)}.", messages.SUCCESS)
+
+    @admin.display(description='Стартовый протокол')
+    def start_list_links(self, obj):
+        # Документы собирает build_start_lists; пока их нет, ссылок тоже нет
+        if start_lists.built_version(obj) is None:
+            return '—'
+        return format_html('<a href="{}" target="_blank">Протокол</a> · <a href="{}" target="_blank">Номера</a>',
+                           start_lists.document_url(obj), start_lists.document_url(obj, start_lists.BIB_SHEETS_FILE))
+
+
+class RaceResultAdmin(admin.ModelAdmin):
+    """Results: only the status and the time are edited, places are recalculated by race/ranking.py."""
+    list_display = ['event', 'race', 'get_runner', 'status', 'finish_time', 'place_overall', 'place_gender',
+                    'place_race', 'age_group', 'place_age_group', 'pace', 'gap_to_leader']
+    list_filter = ['event', 'distance', 'status']
+    list_select_related = ['event', 'race', 'registration__user']
+    raw_id_fields = ['registration']
+    readonly_fields = ['event', 'race', 'distance', 'age_group', 'place_overall', 'place_gender', 'place_race',
+                       'place_age_group', 'pace', 'gap_to_leader', 'gap_in_race']
+    ordering = ['event', 'distance', 'place_overall']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @admin.display(description='Участник', ordering='registration__user__last_name')
+    def get_runner(self, obj):
+        user = obj.registration.user
+        return f"{user.last_name} {user.first_name}".strip() or user.username
+
+
+class TimingRecordAdmin(admin.ModelAdmin):
+    """The timing log is append-only: records are viewed here, corrections are sent as new readings."""
+    list_display = ['event', 'bib_number', 'registration', 'point', 'elapsed', 'station', 'sequence', 'received_at']
+    list_filter = ['event', 'point', 'station']
+    list_select_related = ['event', 'registration__user', 'registration__event', 'registration__race']
+    search_fields = ['=bib_number']
+    ordering = ['-id']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class RegistrationAuditEntryAdmin(admin.ModelAdmin):
+    """The registration audit log is append-only: entries are only viewed here (see race/audit.py)."""
+    list_display = ['created_at', 'registration_id', 'event_id', 'action', 'source', 'actor', 'changes']
+    list_filter = ['action', 'source']
+    list_select_related = ['actor']
+    search_fields = ['=registration_id', '=event_id']
+    ordering = ['-created_at']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class ReminderDeliveryAdmin(admin.ModelAdmin):
+    """Pre-race reminders written by send_reminders; failed ones are retried by its next run."""
+    list_display = ['email', 'event', 'days_before', 'start_date', 'status', 'sent_at', 'error']
+    list_filter = ['status', 'days_before', 'event']
+    list_select_related = ['event']
+    search_fields = ['email', '=registration_id']
+    ordering = ['-id']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class CanonicalNameAdmin(admin.ModelAdmin):
+    """
+    The club and city dictionary built by name_dictionary. Only the name is
+    edited here; the actions rewrite the spellings in all registrations.
+    """
+    list_display = ['name', 'kind', 'registrations', 'spellings', 'updated_at']
+    list_filter = ['kind']
+    search_fields = ['name', '^key']
+    ordering = ['-registrations']
+    fields = ['kind', 'name', 'key', 'spellings', 'registrations', 'updated_at']
+    readonly_fields = ['kind', 'key', 'spellings', 'registrations', 'updated_at']
+
+    actions = ['merge_names', 'canonicalize_names']
+
+    def has_add_permission(self, request):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        names.warm(obj.kind)
+
+    @admin.action(description="Объединить в самое частое название", permissions=['change'])
+    def merge_names(self, request, queryset):
+        entries = list(queryset)
+        if len({entry.kind for entry in entries}) > 1:
+            self.message_user(request, "Клубы и города объединяются отдельно.", messages.ERROR)
+            return
+        into = max(entries, key=lambda entry: entry.registrations)
+        spellings = {spelling for entry in entries if entry.pk != into.pk
+                     for spelling in [entry.name, *entry.spellings]}
+        updated = names.merge(into.kind, spellings, into.name)
+        self.message_user(request, f"Объединено в «{into.name}», изменено регистраций: {updated}.", messages.SUCCESS)
+
+    @admin.action(description="Привести написания к названию", permissions=['change'])
+    def canonicalize_names(self, request, queryset):
+        updated = 0
+        for kind in {entry.kind for entry in queryset}:
+            updated += names.canonicalize(kind, queryset.filter(kind=kind))
+        self.message_user(request, f"Изменено регистраций: {updated}.", messages.SUCCESS)
+
+
+class ImageUploadAdmin(admin.ModelAdmin):
+    """Uploaded images and what process_images made of them; failed ones can be queued again."""
+    list_display = ['original_name', 'model', 'object_id', 'field', 'size', 'status', 'created_at',
+                    'processed_at', 'error']
+    list_filter = ['status', 'model', 'field']
+    search_fields = ['original_name', '=object_id']
+    readonly_fields = [field.name for field in ImageUpload._meta.fields]
+    ordering = ['-id']
+    actions = ['retry']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Проверить заново", permissions=['change'])
+    def retry(self, request, queryset):
+        # Файл неудачной загрузки остаётся в карантине до следующей попытки
+        updated = queryset.filter(status=ImageUpload.FAILED).update(status=ImageUpload.PENDING, attempts=0)
+        self.message_user(request, f"Поставлено в очередь повторно: {updated}.", messages.SUCCESS)
 
 
 # Регистрация моделей в админ-панели
@@ -129,3 +366,9 @@ admin.site.register(Organizer)
 admin.site.register(EventSummary)
 admin.site.register(GalleryPhoto)
 admin.site.register(Review)
+admin.site.register(RaceResult, RaceResultAdmin)
+admin.site.register(TimingRecord, TimingRecordAdmin)
+admin.site.register(RegistrationAuditEntry, RegistrationAuditEntryAdmin)
+admin.site.register(ReminderDelivery, ReminderDeliveryAdmin)
+admin.site.register(CanonicalName, CanonicalNameAdmin)
+admin.site.register(ImageUpload, ImageUploadAdmin)
@@ -0,0 +1,428 @@
+"""
+Read-only JSON API, version 1.
+
+    /api/v1/events/                  events, upcoming by default (?filter=past|all)
+    /api/v1/events/<slug>/           one event
+    /api/v1/race-types/              race types
+    /api/v1/locations/               locations
+
+Every resource is a table of fields (EVENT_FIELDS and the others below). A field knows how to read
+its value from an object and what it needs from the database: columns for
+.only(), select_related joins, prefetches and annotations. `?fields=a,b` picks
+the fields of the response, and the queryset is put together from what those
+fields need, so the schedule is only prefetched when it is asked for and the
+free-slot count only runs when `free_slots` is requested.
+
+Lists are paginated by cursor: `next` is an opaque token holding the sort key
+of the last row, and the following page is read with a keyset condition, which
+costs the same on page 1 and page 1000. `?limit=` sets the page size
+(API_PAGE_SIZE, at most API_MAX_PAGE_SIZE).
+
+Responses are cached whole, gzipped, in the Django cache:
+- each field also names the topics its value depends on (events, locations,
+  race types, schedules, registrations); race/signals.py bumps a version
+  counter in the cache when a topic changes;
+- the cache key and the ETag are a hash of the request and the versions of
+  the topics the requested fields depend on, so a registration only drops the
+  responses that show free slots;
+- the event lists also depend on the clock: the next event start is part of
+  the key, so pages change the moment an event moves from upcoming to past;
+- a cached request reads a few cache keys and touches no database; one with a
+  matching If-None-Match gets 304 without the body being read at all.
+Bulk updates that send no signals are covered by API_CACHE_TIMEOUT.
+"""
+import base64
+import binascii
+import gzip
+import hashlib
+import json
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (Count, Min, OuterRef, PositiveSmallIntegerField, Prefetch, Q, Subquery,
+                              prefetch_related_objects)
+from django.db.models.functions import Cast, Coalesce, ExtractYear
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
+
+from .models import Event, EventRegistration, EventSchedule, Location, RaceType
+
+VERSION_KEY = 'race:api:version:{}'
+RESPONSE_KEY = 'race:api:response:{}'
+NEXT_START_KEY = 'race:api:next_start:{}'
+
+EVENTS, LOCATIONS, RACE_TYPES, SCHEDULES, REGISTRATIONS = 'events', 'locations', 'race_types', 'schedules', \
+    'registrations'
+
+
+class ApiError(Exception):
+    """A bad query parameter; answered with 400 and the message."""
+
+
+class NotFound(Exception):
+    pass
+
+
+class Field:
+    __slots__ = ('getter', 'only', 'select', 'prefetch', 'annotate', 'topics')
+
+    def __init__(self, getter, only=(), select=(), prefetch=(), annotate=None, topics=()):
+        self.getter = getter
+        self.only = only
+        self.select = select
+        self.prefetch = prefetch
+        self.annotate = annotate or {}
+        self.topics = topics
+
+
+def column(name, topic):
+    return Field(lambda obj: getattr(obj, name), only=(name,), topics=(topic,))
+
+
+def local_iso(value):
+    return timezone.localtime(value).isoformat() if value else None
+
+
+# Вложенные представления: одни и те же поля в списках и внутри мероприятия
+
+LOCATION_COLUMNS = ('city', 'country', 'street', 'house_number', 'postal_code', 'latitude', 'longitude')
+RACE_TYPE_COLUMNS = ('distance', 'gender', 'min_age', 'registration_fee')
+
+
+def location_data(location):
+    return {'id': location.pk, **{name: getattr(location, name) for name in LOCATION_COLUMNS}}
+
+
+def race_type_data(race):
+    return {'id': race.pk, 'distance': race.distance, 'gender': race.gender, 'min_age': race.min_age,
+            'registration_fee': str(race.registration_fee)}
+
+
+def schedule_data(item):
+    return {'start_time': item.start_time.strftime('%H:%M'), 'description': item.description}
+
+
+def registered_count():
+    """Active registrations of the outer event; the season condition keeps the count to one partition."""
+    return Coalesce(Subquery(
+        # EXTRACT возвращает numeric; без приведения к smallint не работают ни отсечение секций, ни индекс
+        EventRegistration.objects.filter(event=OuterRef('pk'), is_active=True,
+                                         season=Cast(ExtractYear(OuterRef('start_datetime')),
+                                                     PositiveSmallIntegerField()))
+        .order_by().values('event').annotate(count=Count('pk')).values('count')[:1]
+    ), 0)
+
+
+EVENT_FIELDS = {
+    'id': column('id', EVENTS),
+    'slug': column('slug', EVENTS),
+    'title': column('title', EVENTS),
+    'event_type': column('event_type', EVENTS),
+    'start': Field(lambda event: local_iso(event.start_datetime), only=('start_datetime',), topics=(EVENTS,)),
+    'url': Field(lambda event: event.get_absolute_url(), only=('slug',), topics=(EVENTS,)),
+    'description': column('description', EVENTS),
+    'rules': Field(lambda event: event.event_rules, only=('event_rules',), topics=(EVENTS,)),
+    'total_slots': column('total_slots', EVENTS),
+    'free_slots': Field(lambda event: max(event.total_slots - event.registered, 0),
+                        only=('total_slots', 'start_datetime'), annotate={'registered': registered_count},
+                        topics=(EVENTS, REGISTRATIONS)),
+    'review_count': column('review_count', EVENTS),
+    'updated_at': Field(lambda event: local_iso(event.updated_at), only=('updated_at',), topics=(EVENTS,)),
+    'location': Field(lambda event: location_data(event.location),
+                      only=('location',) + tuple(f'location__{name}' for name in LOCATION_COLUMNS),
+                      select=('location',), topics=(LOCATIONS,)),
+    'race_types': Field(lambda event: [race_type_data(race) for race in event.race_types.all()],
+                        prefetch=(lambda: Prefetch('race_types', RaceType.objects.only(*RACE_TYPE_COLUMNS)
+                                                   .order_by('distance', 'gender', 'pk')),),
+                        topics=(RACE_TYPES,)),
+    'schedules': Field(lambda event: [schedule_data(item) for item in event.schedules.all()],
+                       prefetch=(lambda: Prefetch('schedules', EventSchedule.objects
+                                                  .only('event', 'start_time', 'description')
+                                                  .order_by('start_time', 'pk')),),
+                       topics=(SCHEDULES,)),
+}
+
+LOCATION_FIELDS = {
+    'id': column('id', LOCATIONS),
+    **{name: column(name, LOCATIONS) for name in LOCATION_COLUMNS},
+}
+
+RACE_TYPE_FIELDS = {
+    'id': column('id', RACE_TYPES),
+    'distance': column('distance', RACE_TYPES),
+    'gender': column('gender', RACE_TYPES),
+    'min_age': column('min_age', RACE_TYPES),
+    'registration_fee': Field(lambda race: str(race.registration_fee), only=('registration_fee',),
+                              topics=(RACE_TYPES,)),
+}
+
+
+class Resource:
+    """A collection of the API: its model, fields, the default fields of lists and details, its topic."""
+
+    def __init__(self, model, fields, list_fields, detail_fields, topic):
+        self.model = model
+        self.fields = fields
+        self.list_fields = list_fields
+        self.detail_fields = detail_fields
+        self.topic = topic
+
+    def requested_fields(self, request, detail=False):
+        value = request.GET.get('fields')
+        if not value:
+            return self.detail_fields if detail else self.list_fields
+        names = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+        unknown = [name for name in names if name not in self.fields]
+        if unknown or not names:
+            raise ApiError(f"Unknown fields: {', '.join(unknown) or value}. "
+                           f"Available: {', '.join(self.fields)}.")
+        return names
+
+    def topics(self, names):
+        topics = {self.topic}
+        for name in names:
+            topics.update(self.fields[name].topics)
+        return sorted(topics)
+
+    def queryset(self, queryset, names):
+        """Narrow the queryset to the columns, joins and annotations the requested fields read."""
+        only, select, annotate = {'id'}, [], {}
+        for name in names:
+            field = self.fields[name]
+            only.update(field.only)
+            select.extend(field.select)
+            annotate.update({alias: factory() for alias, factory in field.annotate.items()})
+        if select:
+            queryset = queryset.select_related(*select)
+        if annotate:
+            queryset = queryset.annotate(**annotate)
+        return queryset.only(*only)
+
+    def data(self, rows, names):
+        """Serialize the rows; prefetches run here, on the page without its lookahead row."""
+        lookups = [factory() for name in names for factory in self.fields[name].prefetch]
+        if lookups:
+            prefetch_related_objects(rows, *lookups)
+        return [{name: self.fields[name].getter(row) for name in names} for row in rows]
+
+
+EVENT_RESOURCE = Resource(Event, EVENT_FIELDS, topic=EVENTS,
+                          list_fields=['id', 'slug', 'title', 'event_type', 'start', 'url', 'location',
+                                       'total_slots'],
+                          detail_fields=list(EVENT_FIELDS))
+LOCATION_RESOURCE = Resource(Location, LOCATION_FIELDS, topic=LOCATIONS,
+                             list_fields=list(LOCATION_FIELDS), detail_fields=list(LOCATION_FIELDS))
+RACE_TYPE_RESOURCE = Resource(RaceType, RACE_TYPE_FIELDS, topic=RACE_TYPES,
+                              list_fields=list(RACE_TYPE_FIELDS), detail_fields=list(RACE_TYPE_FIELDS))
+
+
+# Версии тем в кэше
+
+def bump(*topics):
+    """Drop the cached responses depending on the topics once the transaction commits."""
+    def run():
+        for topic in topics:
+            key = VERSION_KEY.format(topic)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), None)
+
+    transaction.on_commit(run)
+
+
+def versions(topics):
+    """Current versions of the topics, read in one round trip."""
+    keys = [VERSION_KEY.format(topic) for topic in topics]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # Версия вытеснена из кэша: новое значение не совпадёт ни с одним прежним
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return found
+
+
+def next_start(events_version):
+    """The next event start after now (or None): upcoming and past lists change at that moment."""
+    key = NEXT_START_KEY.format(events_version)
+    value = cache.get(key, 0)
+    if value == 0 or (value is not None and value <= time.time()):
+        start = Event.objects.filter(start_datetime__gt=timezone.now()).aggregate(start=Min('start_datetime'))
+        value = start['start'].timestamp() if start['start'] else None
+        timeout = settings.API_CACHE_TIMEOUT if value is None else max(1, min(value - time.time(), 86400))
+        cache.set(key, value, timeout)
+    return value
+
+
+# Курсор
+
+def encode_cursor(values):
+    data = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, kinds):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if not isinstance(values, list) or len(values) != len(kinds):
+            raise ValueError
+        decoded = []
+        for value, kind in zip(values, kinds):
+            if kind is datetime:
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError
+            elif not isinstance(value, kind) or isinstance(value, bool):
+                raise ValueError
+            decoded.append(value)
+        return decoded
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        raise ApiError("Invalid cursor.")
+
+
+def after(key_fields, values, descending):
+    """Keyset condition: rows strictly after `values` in the (key_fields) order."""
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for i, name in enumerate(key_fields):
+        step = Q(**{f'{name}__{lookup}': values[i]}, **dict(zip(key_fields[:i], values[:i])))
+        condition |= step
+    return condition
+
+
+def page_size(request):
+    value = request.GET.get('limit')
+    if value is None:
+        return settings.API_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ApiError("limit must be an integer.")
+    if not 1 <= limit <= settings.API_MAX_PAGE_SIZE:
+        raise ApiError(f"limit must be between 1 and {settings.API_MAX_PAGE_SIZE}.")
+    return limit
+
+
+def paginate(request, queryset, key_fields, kinds, descending=False):
+    """One page of the queryset ordered by key_fields, and the `next` URL or None."""
+    limit = page_size(request)
+    token = request.GET.get('cursor')
+    if token:
+        queryset = queryset.filter(after(key_fields, decode_cursor(token, kinds), descending))
+    order = [f'-{name}' if descending else name for name in key_fields]
+    rows = list(queryset.order_by(*order)[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    params = request.GET.copy()
+    params['cursor'] = encode_cursor([getattr(last, name) for name in key_fields])
+    return rows, f'{request.path}?{params.urlencode()}'
+
+
+# Ответы
+
+def cache_key(request, topic_versions):
+    params = sorted((key, value) for key, values in request.GET.lists() for value in values)
+    data = repr((request.path, urlencode(params), sorted(topic_versions.items())))
+    return hashlib.md5(data.encode()).hexdigest()
+
+
+def cached_body(key, build):
+    """Gzipped JSON of the response under `key`, built by `build()` on a miss."""
+    body = cache.get(RESPONSE_KEY.format(key))
+    if body is None:
+        data = build()
+        # mtime=0: одинаковое содержимое даёт одинаковые байты
+        body = gzip.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode(),
+                             compresslevel=6, mtime=0)
+        cache.set(RESPONSE_KEY.format(key), body, settings.API_CACHE_TIMEOUT)
+    return body
+
+
+def accepts_gzip(request):
+    return 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '').lower()
+
+
+def finish(response, request, etag, body=None):
+    """Set the caching headers; with a body, send it gzipped if the client accepts it."""
+    if body is not None:
+        if accepts_gzip(request):
+            response['Content-Encoding'] = 'gzip'
+        else:
+            body = gzip.decompress(body)
+        response.content = body
+    response['ETag'] = f'"{etag}"'
+    response['Cache-Control'] = f'public, max-age={settings.API_MAX_AGE}'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+def not_modified(request, etag):
+    tags = request.META.get('HTTP_IF_NONE_MATCH', '')
+    return etag in (tag.strip().removeprefix('W/').strip('"') for tag in tags.split(','))
+
+
+def respond(request, resource, build, *args, detail=False, clock=False):
+    """
+    The cached response of `build(*args, names)`; it returns the JSON data, or
+    None for a missing object. Bad parameters are answered with 400.
+    """
+    try:
+        names = resource.requested_fields(request, detail)
+        topic_versions = versions(resource.topics(names))
+        if clock:
+            topic_versions['next_start'] = next_start(topic_versions[VERSION_KEY.format(EVENTS)])
+        etag = cache_key(request, topic_versions)
+        if not_modified(request, etag):
+            return finish(HttpResponse(status=304), request, etag)
+
+        def data():
+            result = build(*args, names)
+            if result is None:
+                raise NotFound
+            return result
+
+        body = cached_body(etag, data)
+    except ApiError as exc:
+        return JsonResponse({'errors': [str(exc)]}, status=400)
+    except NotFound:
+        return JsonResponse({'errors': ["Not found."]}, status=404)
+    return finish(HttpResponse(content_type='application/json'), request, etag, body)
+
+
+def events_queryset(filter_option):
+    now = timezone.now()
+    if filter_option == 'upcoming':
+        return Event.objects.filter(start_datetime__gte=now), False
+    if filter_option == 'past':
+        return Event.objects.filter(start_datetime__lt=now), True
+    if filter_option == 'all':
+        return Event.objects.all(), True
+    raise ApiError("filter must be one of upcoming, past, all.")
+
+
+def event_list(request, names):
+    queryset, descending = events_queryset(request.GET.get('filter', 'upcoming'))
+    rows, next_url = paginate(request, EVENT_RESOURCE.queryset(queryset, names), ('start_datetime', 'id'),
+                              (datetime, int), descending)
+    return {'results': EVENT_RESOURCE.data(rows, names), 'next': next_url}
+
+
+def event_detail(slug, names):
+    event = EVENT_RESOURCE.queryset(Event.objects.filter(slug=slug), names).first()
+    return EVENT_RESOURCE.data([event], names)[0] if event else None
+
+
+def simple_list(resource):
+    def build(request, names):
+        rows, next_url = paginate(request, resource.queryset(resource.model.objects.all(), names), ('id',), (int,))
+        return {'results': resource.data(rows, names), 'next': next_url}
+    return build
@@ -0,0 +1,184 @@
+"""
+Audit log of registration changes.
+
+The changes that matter in a dispute are appended to RegistrationAuditEntry
+with who made them and the old and new values:
+- a registration is created;
+- its runner cancels or restores it;
+- a payment is confirmed, in the admin or by reconcile_payments;
+- it is edited or deleted in the admin.
+
+record() writes nothing itself and stays off the hot path:
+1. The entry is collected once the surrounding transaction commits, so a
+   rolled-back change leaves no trace.
+2. AuditMiddleware writes everything a request collected with one INSERT after
+   the view has returned.
+3. Outside a request (management commands, the shell) entries are written at
+   commit, or with one INSERT per `with audit.buffered():` block.
+
+Entries are never updated. `audit_log --keep-days` deletes old entries, and
+`--compact-after` folds runs of cancellations and restorations into one entry.
+"""
+import datetime
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.db import connection, models, transaction
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+
+from .models import RegistrationAuditEntry
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = 1000
+PRUNE_BATCH_SIZE = 5000
+COMPACT_BATCH_SIZE = 10000
+
+# Записи, собранные текущим запросом или блоком buffered()
+current_buffer = ContextVar('registration_audit_buffer', default=None)
+
+# Состояние новой регистрации, которое попадает в журнал
+CREATED_FIELDS = ('race_id', 'bib_number', 'is_active', 'payment_confirmation')
+TOGGLES = (RegistrationAuditEntry.DEACTIVATED, RegistrationAuditEntry.REACTIVATED)
+
+COMPACT_SQL = """
+    WITH runs AS (
+        SELECT registration_id, min(event_id) AS event_id, count(*) AS toggles,
+               CASE WHEN count(DISTINCT actor_id) = 1 THEN min(actor_id) END AS actor_id,
+               CASE WHEN count(DISTINCT source) = 1 THEN min(source) END AS source,
+               (array_agg(changes -> 'is_active' -> 0 ORDER BY created_at, id))[1] AS first_state,
+               (array_agg(changes -> 'is_active' -> 1 ORDER BY created_at DESC, id DESC))[1] AS last_state,
+               min(created_at) AS first_at, max(created_at) AS last_at, array_agg(id) AS ids
+        FROM race_registrationauditentry
+        WHERE action IN %(toggles)s AND created_at < %(before)s
+              AND registration_id BETWEEN %(first)s AND %(last)s
+        GROUP BY registration_id
+        HAVING count(*) > 1
+    ), summary AS (
+        INSERT INTO race_registrationauditentry
+            (registration_id, event_id, actor_id, action, source, changes, created_at)
+        SELECT registration_id, event_id, actor_id, %(action)s, coalesce(source, %(system)s),
+               jsonb_build_object('is_active', jsonb_build_array(first_state, last_state), 'toggles', toggles,
+                                  'from', first_at, 'to', last_at),
+               last_at
+        FROM runs
+    ), removed AS (
+        DELETE FROM race_registrationauditentry WHERE id IN (SELECT unnest(ids) FROM runs) RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM removed) - (SELECT count(*) FROM runs)
+"""
+
+
+def logged_value(value):
+    """A field value as it is stored in `changes`."""
+    if isinstance(value, models.Model):
+        return value.pk
+    if isinstance(value, FieldFile):
+        return value.name or None
+    if value is None or isinstance(value, (bool, int, float, str, datetime.date, datetime.time)):
+        return value
+    # Номер телефона, Decimal и прочее — строкой
+    return str(value)
+
+
+def record_created(registration, *, actor=None, source=RegistrationAuditEntry.SITE):
+    changes = {name: [None, logged_value(getattr(registration, name))] for name in CREATED_FIELDS}
+    record(registration, RegistrationAuditEntry.CREATED, actor=actor, source=source, changes=changes)
+
+
+def record(registration, action, *, actor=None, source=RegistrationAuditEntry.SITE, changes=None):
+    """Log a change of one registration once the current transaction commits."""
+    record_many([(registration.pk, registration.event_id)], action, actor=actor, source=source, changes=changes)
+
+
+def record_many(rows, action, *, actor=None, source=RegistrationAuditEntry.SITE, changes=None):
+    """Log the same change of several registrations, given as (registration id, event id) pairs."""
+    now = timezone.now()
+    actor_id = getattr(actor, 'pk', None)
+    entries = [
+        RegistrationAuditEntry(registration_id=registration_id, event_id=event_id, actor_id=actor_id,
+                               action=action, source=source, changes=changes or {}, created_at=now)
+        for registration_id, event_id in rows
+    ]
+    if entries:
+        transaction.on_commit(partial(collect, entries))
+
+
+def collect(entries):
+    buffer = current_buffer.get()
+    if buffer is None:
+        write(entries)
+    else:
+        buffer.extend(entries)
+
+
+def write(entries):
+    try:
+        RegistrationAuditEntry.objects.bulk_create(entries, batch_size=WRITE_BATCH_SIZE)
+    except Exception:
+        # Изменения уже зафиксированы; ошибка журнала не должна превращаться в ошибку для пользователя
+        logger.exception('Could not write %d registration audit entries', len(entries))
+
+
+@contextmanager
+def buffered():
+    """Collect the entries recorded inside the block and write them with one INSERT at its end."""
+    entries = []
+    token = current_buffer.set(entries)
+    try:
+        yield entries
+    finally:
+        current_buffer.reset(token)
+        if entries:
+            write(entries)
+
+
+class AuditMiddleware:
+    """Writes the audit entries of a request after its view has returned."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with buffered():
+            return self.get_response(request)
+
+
+def prune(before):
+    """Delete entries older than `before` in batches; returns the number deleted."""
+    deleted = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM race_registrationauditentry WHERE id IN ('
+                           'SELECT id FROM race_registrationauditentry WHERE created_at < %s LIMIT %s)',
+                           [before, PRUNE_BATCH_SIZE])
+            if not cursor.rowcount:
+                return deleted
+            deleted += cursor.rowcount
+
+
+def compact(before):
+    """
+    Replace each registration's cancellations and restorations older than
+    `before` with one entry holding the first and last state and the number of
+    toggles. Works through ranges of registration ids, one transaction each;
+    returns by how many entries the log shrank.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT min(registration_id), max(registration_id) FROM race_registrationauditentry '
+                       'WHERE action IN %s AND created_at < %s', [TOGGLES, before])
+        first, last = cursor.fetchone()
+    if first is None:
+        return 0
+    removed = 0
+    for start in range(first, last + 1, COMPACT_BATCH_SIZE):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(COMPACT_SQL, {
+                'toggles': TOGGLES, 'before': before, 'first': start, 'last': start + COMPACT_BATCH_SIZE - 1,
+                'action': RegistrationAuditEntry.TOGGLES_COMPACTED, 'system': RegistrationAuditEntry.SYSTEM,
+            })
+            removed += cursor.fetchone()[0]
+    return removed
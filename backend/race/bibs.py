@@ -0,0 +1,105 @@
+"""
+Allocation of bib numbers.
+
+Each race type may have a range of bib numbers (RaceType.bib_range_start/end).
+Race types with the same range share it: 5 km men and 5 km women both draw from
+1–999, for example. Allocation gives every active, paid registration without a
+number the lowest free number of its range, in order of registration.
+
+Each range is filled with a single UPDATE that numbers the waiting
+registrations and the free numbers with row_number() and joins the two lists,
+so the cost does not depend on the number of runners in Python. All ranges of
+an event are filled in one transaction under a per-event advisory lock, so two
+allocations never hand out the same number. Numbers already given are never
+changed, and the UPDATE only touches rows that still have no number. A number
+set by hand in the admin in the meantime trips the unique index, and the
+allocation is then retried with fresh data.
+"""
+import logging
+from collections import defaultdict
+
+from django.db import IntegrityError, connection, transaction
+
+from .models import EventRegistration
+
+logger = logging.getLogger(__name__)
+
+# Ключ рекомендательной блокировки PostgreSQL для выдачи номеров (второй ключ — id мероприятия)
+LOCK_NAMESPACE = 3801
+ATTEMPTS = 3
+
+ALLOCATE_SQL = """
+    WITH waiting AS (
+        SELECT id, row_number() OVER (ORDER BY registered_at, id) AS position
+        FROM race_eventregistration
+        WHERE event_id = %(event)s AND season = %(season)s AND race_id = ANY(%(races)s) AND is_active
+              AND payment_confirmation AND bib_number IS NULL
+    ),
+    free AS (
+        SELECT number, row_number() OVER (ORDER BY number) AS position
+        FROM generate_series(%(start)s::integer, %(end)s::integer) AS number
+        WHERE NOT EXISTS (
+            SELECT 1 FROM race_eventregistration AS taken
+            WHERE taken.event_id = %(event)s AND taken.season = %(season)s AND taken.bib_number = number
+        )
+    )
+    UPDATE race_eventregistration AS registration
+    SET bib_number = free.number, updated_at = now()
+    FROM waiting JOIN free USING (position)
+    WHERE registration.id = waiting.id AND registration.season = %(season)s AND registration.bib_number IS NULL
+"""
+
+
+class RangeAllocation:
+    """Outcome for one range of bib numbers (or for the race types without a range)."""
+    __slots__ = ('start', 'end', 'races', 'assigned', 'waiting')
+
+    def __init__(self, start, end, races, assigned=0, waiting=0):
+        self.start = start
+        self.end = end
+        self.races = races
+        self.assigned = assigned
+        self.waiting = waiting
+
+    def __str__(self):
+        bounds = f'{self.start}–{self.end}' if self.start is not None else 'no range'
+        return f'{bounds}: assigned {self.assigned}, still without a number {self.waiting}'
+
+
+def waiting_count(event, races):
+    return EventRegistration.objects.for_event(event).filter(
+        race__in=races, is_active=True, payment_confirmation=True, bib_number__isnull=True,
+    ).count()
+
+
+def _allocate_once(event, dry_run):
+    ranges = defaultdict(list)
+    for race in event.race_types.order_by('bib_range_start', 'id'):
+        ranges[race.bib_range_start, race.bib_range_end].append(race)
+
+    allocations = []
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [LOCK_NAMESPACE, event.pk])
+            for (start, end), races in ranges.items():
+                if start is None or end is None:
+                    allocations.append(RangeAllocation(None, None, races, waiting=waiting_count(event, races)))
+                    continue
+                cursor.execute(ALLOCATE_SQL, {'event': event.pk, 'season': event.season,
+                                              'races': [race.pk for race in races], 'start': start, 'end': end})
+                allocations.append(RangeAllocation(start, end, races, cursor.rowcount, waiting_count(event, races)))
+        if dry_run:
+            transaction.set_rollback(True)
+    return allocations
+
+
+def allocate(event, dry_run=False):
+    """Give bib numbers to the event's paid registrations that have none; returns a RangeAllocation per range."""
+    for attempt in range(1, ATTEMPTS + 1):
+        try:
+            return _allocate_once(event, dry_run)
+        except IntegrityError:
+            # Номер из диапазона заняли вручную после начала выдачи — повторяем с актуальными данными
+            if attempt == ATTEMPTS:
+                raise
+            logger.warning('Bib allocation for event %s collided with a concurrent change, retrying', event.pk)
@@ -0,0 +1,115 @@
+"""
+Conditional GET support (ETag / Last-Modified) for the public event pages.
+
+Each page has a validator function returning the values its content depends on,
+computed with a single aggregate query over Event and its dependents. The ETag
+is a hash of those values plus what the template adds per request (the user's
+name and photo, today's date for "days left"); Last-Modified is the newest
+timestamp, sent to anonymous users only since a profile edit does not move it.
+Deletions leave no timestamp behind, so race/signals.py bumps Event.updated_at
+for them.
+"""
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from race_project.metrics import registry
+
+from .models import Event, EventRegistration, EventSchedule, GalleryPhoto, RaceType, Review
+
+registry.describe('http_conditional_requests_total', 'counter',
+                  'Conditional-GET capable requests by view and result (hit = 304 Not Modified).')
+
+
+def _latest(queryset):
+    """Subquery with MAX(updated_at) of the queryset rows related to the outer event."""
+    return Subquery(
+        queryset.filter(event=OuterRef('pk')).order_by().values('event').annotate(latest=Max('updated_at'))
+        .values('latest')[:1]
+    )
+
+
+def event_detail_validator(event_slug):
+    """Newest change of an event and everything shown on its page."""
+    row = Event.objects.filter(slug=event_slug).annotate(
+        latest=Greatest(
+            'updated_at',
+            'location__updated_at',
+            'summary__updated_at',
+            _latest(EventSchedule.objects.all()),
+            _latest(RaceType.objects.all()),
+            _latest(GalleryPhoto.objects.all()),
+            _latest(Review.objects.all()),
+            _latest(EventRegistration.objects.all()),
+        )
+    ).values_list('latest', flat=True).first()
+    return (row, ()) if row else None
+
+
+def events_list_validator():
+    """Newest change among all events and their locations, and the upcoming/past split."""
+    now = timezone.now()
+    values = Event.objects.aggregate(
+        latest=Greatest(Max('updated_at'), Max('location__updated_at')),
+        total=Count('id'),
+        upcoming=Count('id', filter=Q(start_datetime__gte=now)),
+    )
+    return values['latest'], (values['total'], values['upcoming'])
+
+
+def pricing_validator():
+    """Newest change among upcoming events, their race types and organizers."""
+    values = Event.objects.filter(start_datetime__gte=timezone.now()).aggregate(
+        latest=Greatest(Max('updated_at'), Max('race_types__updated_at'), Max('organizers__updated_at')),
+        ids=Count('id', distinct=True),
+    )
+    return values['latest'], (values['ids'],)
+
+
+class ConditionalGetMixin:
+    """
+    Answer GET/HEAD with 304 Not Modified when the client's copy is current,
+    without running the view. Subclasses implement `get_validator()` returning
+    `(last_modified, extra_values)` or None to skip conditional handling.
+    """
+
+    def get_validator(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        view = request.resolver_match.view_name if request.resolver_match else self.__class__.__name__
+        validator = None if get_messages(request) else self.get_validator()
+        if validator is None:
+            return super().get(request, *args, **kwargs)
+
+        last_modified, extra = validator
+        etag = self._make_etag(request, last_modified, extra)
+        # Смена имени или фото пользователя не двигает Last-Modified: вошедшим проверяется только ETag
+        last_modified_ts = (int(last_modified.timestamp())
+                            if last_modified and not request.user.is_authenticated else None)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified_ts)
+        if response is not None:
+            registry.inc('http_conditional_requests_total', {'view': view, 'result': 'hit'})
+        else:
+            registry.inc('http_conditional_requests_total', {'view': view, 'result': 'miss'})
+            response = super().get(request, *args, **kwargs)
+        response['ETag'] = etag
+        if last_modified_ts:
+            response['Last-Modified'] = http_date(last_modified_ts)
+        patch_vary_headers(response, ('Cookie',))
+        # Клиент и CDN обязаны перепроверять копию при каждом обращении
+        patch_cache_control(response, no_cache=True, private=request.user.is_authenticated)
+        return response
+
+    def _make_etag(self, request, last_modified, extra):
+        user = request.user
+        # Шапка страницы показывает имя и фото вошедшего пользователя
+        user_key = ((user.pk, user.username, user.first_name, user.last_name, str(user.photo or ''))
+                    if user.is_authenticated else 'anon')
+        source = repr((last_modified, extra, user_key, timezone.localdate()))
+        return quote_etag(hashlib.md5(source.encode()).hexdigest())
@@ -0,0 +1,211 @@
+"""
+Calendar (iCalendar) and RSS/Atom feeds of events.
+
+The public feeds of upcoming events are
+/events/feed.ics, /events/feed.rss and /events/feed.atom.
+They are snapshot pages (race/snapshots.py):
+- build_snapshots renders them to files whenever an event changes and again
+  when the next event starts;
+- nginx serves those files with its own ETag, so calendar apps and partner
+  sites polling them never reach Django;
+- the views below answer with an ETag from feeds_validator() when nginx falls
+  through.
+
+Each runner also gets a calendar of their own registrations at
+/calendar/<token>.ics:
+- the token is the user id signed with SECRET_KEY, so the URL works from a
+  calendar app without a session, and checking it needs no lookup;
+- the rendered calendar is cached under the ETag of the user's registrations,
+  so a poll costs one aggregate query, and nothing is rendered unless
+  something changed.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.contrib.syndication.views import Feed
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.db.models.functions import Greatest
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+
+from .models import Event, EventRegistration
+
+CALENDAR_SALT = 'race.feeds.calendar'
+# Длительность в модели не хранится; календарям нужен конец события
+EVENT_DURATION = timedelta(hours=3)
+DESCRIPTION_WORDS = 60
+USER_CALENDAR_TIMEOUT = 24 * 60 * 60
+
+
+def upcoming_events():
+    return (Event.objects.filter(start_datetime__gte=timezone.now()).select_related('location')
+            .prefetch_related('race_types').order_by('start_datetime'))
+
+
+def feeds_validator():
+    """ETag of the public feeds: the newest change among upcoming events and what they show."""
+    values = Event.objects.filter(start_datetime__gte=timezone.now()).aggregate(
+        latest=Greatest(Max('updated_at'), Max('location__updated_at'), Max('race_types__updated_at')),
+        ids=Count('id', distinct=True),
+    )
+    return hashlib.md5(repr((values['latest'], values['ids'])).encode()).hexdigest()
+
+
+def summary_of(event):
+    distances = sorted({race.distance for race in event.race_types.all()})
+    distances = ', '.join(f'{distance} км' for distance in distances)
+    start = timezone.localtime(event.start_datetime)
+    text = Truncator(strip_tags(event.description)).words(DESCRIPTION_WORDS)
+    return f"{start:%d.%m.%Y %H:%M}, {event.location.city}. {distances}\n\n{text}".strip()
+
+
+class UpcomingEventsFeed(Feed):
+    title = "Предстоящие забеги"
+    description = "Мероприятия, на которые открыта регистрация"
+
+    def link(self):
+        return reverse('events') + '?filter=upcoming'
+
+    def items(self):
+        return upcoming_events()
+
+    def item_title(self, event):
+        return event.title
+
+    def item_description(self, event):
+        return summary_of(event)
+
+    def item_link(self, event):
+        return event.get_absolute_url()
+
+    def item_pubdate(self, event):
+        return event.updated_at
+
+    def item_updateddate(self, event):
+        return event.updated_at
+
+
+class UpcomingEventsAtomFeed(UpcomingEventsFeed):
+    feed_type = Atom1Feed
+    subtitle = UpcomingEventsFeed.description
+
+
+# iCalendar (RFC 5545)
+
+def ical_text(value):
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def ical_time(value):
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def fold(line):
+    """Split a content line into 75-octet pieces without breaking UTF-8 characters."""
+    data = line.encode()
+    if len(data) <= 75:
+        return line
+    pieces, start, limit = [], 0, 75
+    while start < len(data):
+        end = min(start + limit, len(data))
+        # Не разрываем многобайтовый символ
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        pieces.append(data[start:end].decode())
+        start, limit = end, 74
+    return '\r\n '.join(pieces)
+
+
+def vevent(uid, event, url, summary, description, stamp, status='CONFIRMED'):
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:{uid}',
+        f'DTSTAMP:{ical_time(stamp)}',
+        f'LAST-MODIFIED:{ical_time(stamp)}',
+        f'DTSTART:{ical_time(event.start_datetime)}',
+        f'DTEND:{ical_time(event.start_datetime + EVENT_DURATION)}',
+        f'SUMMARY:{ical_text(summary)}',
+        f'LOCATION:{ical_text(event.location)}',
+        f'URL:{url}',
+        f'DESCRIPTION:{ical_text(description)}',
+        f'STATUS:{status}',
+    ]
+    if event.location.latitude is not None and event.location.longitude is not None:
+        lines.append(f'GEO:{event.location.latitude};{event.location.longitude}')
+    lines.append('END:VEVENT')
+    return lines
+
+
+def calendar(name, events):
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//rase//events//RU', 'CALSCALE:GREGORIAN',
+             'METHOD:PUBLISH', f'X-WR-CALNAME:{ical_text(name)}',
+             f'X-WR-TIMEZONE:{timezone.get_current_timezone_name()}']
+    for event_lines in events:
+        lines.extend(event_lines)
+    lines.append('END:VCALENDAR')
+    return ('\r\n'.join(fold(line) for line in lines) + '\r\n').encode()
+
+
+def events_calendar(request):
+    domain = request.get_host().split(':')[0]
+    return calendar("Предстоящие забеги", (
+        vevent(f'event-{event.pk}@{domain}', event, request.build_absolute_uri(event.get_absolute_url()),
+               event.title, summary_of(event), event.updated_at)
+        for event in upcoming_events()
+    ))
+
+
+# Личный календарь
+
+def calendar_token(user):
+    return signing.Signer(salt=CALENDAR_SALT).sign(str(user.pk))
+
+
+def user_id_from_token(token):
+    """The user id a token was issued for, or None for a forged or mangled token."""
+    try:
+        return int(signing.Signer(salt=CALENDAR_SALT).unsign(token))
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+def user_calendar_etag(user_id):
+    """ETag of a user's calendar: one aggregate query over their registrations and events."""
+    values = EventRegistration.objects.filter(user_id=user_id).aggregate(
+        latest=Greatest(Max('updated_at'), Max('race__updated_at'), Max('event__updated_at'),
+                        Max('event__location__updated_at')),
+        count=Count('id'),
+    )
+    return hashlib.md5(repr((user_id, values['latest'], values['count'])).encode()).hexdigest()
+
+
+def user_calendar(request, user_id, etag):
+    """The user's calendar, from the cache while the ETag is unchanged."""
+    key = f'race:calendar:{user_id}:{etag}'
+    content = cache.get(key)
+    if content is None:
+        registrations = (EventRegistration.objects.filter(user_id=user_id, is_active=True)
+                         .select_related('event__location', 'race').order_by('event__start_datetime'))
+        domain = request.get_host().split(':')[0]
+        content = calendar("Мои старты", (
+            vevent(f'registration-{registration.pk}@{domain}', registration.event,
+                   request.build_absolute_uri(registration.event.get_absolute_url()),
+                   f'{registration.event.title} — {registration.race.distance} км',
+                   registration_description(registration),
+                   max(registration.updated_at, registration.event.updated_at))
+            for registration in registrations
+        ))
+        cache.set(key, content, USER_CALENDAR_TIMEOUT)
+    return content
+
+
+def registration_description(registration):
+    bib = registration.bib_number or 'будет выдан перед стартом'
+    payment = 'подтверждена' if registration.payment_confirmation else 'ожидает подтверждения'
+    return f"Дистанция: {registration.race}\nСтартовый номер: {bib}\nОплата: {payment}"
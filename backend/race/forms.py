@@ -1,9 +1,12 @@
 from django import forms
-from .models import Review, EventRegistration, Event, RaceType
+from .models import CanonicalName, Review, EventRegistration, Event, RaceType
+from django.urls import reverse
 from django.utils import timezone
 from phonenumber_field.formfields import PhoneNumberField
 from phonenumber_field.widgets import PhoneNumberPrefixWidget
 
+from . import names
+
 
 class ReviewForm(forms.ModelForm):
     class Meta:
@@ -42,6 +45,7 @@ class EventRegistrationForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         self.initialize_field_classes()
         self.initialize_dynamic_fields()
+        self.initialize_autocomplete()
 
     def initialize_field_classes(self):
         # Установка CSS классов для каждого поля формы
@@ -49,6 +53,19 @@ class EventRegistrationForm(forms.ModelForm):
             css_class = 'form-control' if not isinstance(field.widget, forms.widgets.Select) else 'form-select'
             field.widget.attrs.update({'class': css_class})
 
+    def initialize_autocomplete(self):
+        # Подсказки клубов и городов из словаря (event_register.js)
+        for kind, name in names.FIELDS.items():
+            self.fields[name].widget.attrs.update({'data-autocomplete': reverse('autocomplete', args=[kind]),
+                                                   'autocomplete': 'off'})
+
+    def clean_city(self):
+        # Известный город записывается так, как в словаре
+        return names.canonical(CanonicalName.CITY, self.cleaned_data['city'])
+
+    def clean_club(self):
+        return names.canonical(CanonicalName.CLUB, self.cleaned_data['club'])
+
     def initialize_dynamic_fields(self):
         # Инициализация динамических полей, в частности, настройка queryset для поля 'race'
         event_id = self.data.get('event') if 'event' in self.data else None
@@ -81,5 +98,5 @@ class EventRegistrationForm(forms.ModelForm):
         user = self.initial.get("user")
         event = cleaned_data.get("event")
         race = cleaned_data.get("race")
-        if EventRegistration.objects.filter(user=user, event=event, race=race).exists():
+        if event and EventRegistration.objects.for_event(event).filter(user=user, race=race).exists():
             raise forms.ValidationError("Вы уже зарегистрированы на это мероприятие в данной группе.")
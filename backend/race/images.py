@@ -0,0 +1,212 @@
+"""
+Publishing uploaded images (the request side is race/uploads.py).
+
+Event images, gallery photos and profile photos used to be decoded by Pillow
+in the request that uploaded them, with no limit on their pixel count: a small
+PNG claiming 50000 x 50000 pixels took the worker's memory and time, and the
+published files kept their EXIF, GPS coordinates included.
+
+Now the request only stores the upload in quarantine and queues an
+ImageUpload. process_images takes the pending uploads and checks them in a
+pool of IMAGE_WORKERS processes (race/imaging.py): each process has a memory
+limit and each image a time limit. A clean image is saved to the field's
+storage under the usual upload_to name and the object is saved with it, so
+signals update snapshots and caches as for any edit; the quarantined file is
+then deleted. A rejected upload keeps its reason for the form, and its file is
+deleted.
+
+A worker that dies breaks the whole pool, and every unfinished task of the
+round fails with it. Those uploads are not charged: each is checked again
+alone in its own pool, and only a death there counts as an attempt of that
+upload; MAX_ATTEMPTS deaths reject it.
+
+A session-level advisory lock per upload keeps two runs from publishing the
+same upload; an upload replaced by a newer one while it was being checked is
+dropped when its result comes back. A save whose transaction rolls back leaves
+its quarantined file behind with no row; sweep_quarantine() deletes such files.
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import imaging
+from .models import ImageUpload
+from .uploads import quarantine_storage
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAMESPACE = 4201
+# Столько раз подряд процесс проверки может упасть на загрузке, прежде чем она будет отклонена
+MAX_ATTEMPTS = 3
+# Процесс пула заменяется новым после стольких изображений: память Pillow не копится
+TASKS_PER_WORKER = 50
+# Файлы карантина моложе этого (в секундах) не считаются брошенными: их строка может быть ещё не записана
+ORPHAN_MIN_AGE = 3600
+
+
+def pool(workers):
+    # spawn, а не fork: процессам проверки не нужны ни Django, ни соединения с базой
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=imaging.limit_resources, initargs=(settings.IMAGE_WORKER_MEMORY_MB * 1024 * 1024,),
+        max_tasks_per_child=TASKS_PER_WORKER)
+
+
+def lock(upload):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [LOCK_NAMESPACE, upload.pk])
+        return cursor.fetchone()[0]
+
+
+def unlock(upload):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [LOCK_NAMESPACE, upload.pk])
+
+
+def output_name(upload):
+    return f'{upload.quarantine_name}.out'
+
+
+def remove_quarantined(upload):
+    storage = quarantine_storage()
+    storage.delete(upload.quarantine_name)
+    storage.delete(output_name(upload))
+
+
+def publish(upload, result):
+    """Save the cleaned image to the field of its object; False if the upload is no longer wanted."""
+    model = apps.get_model(upload.model)
+    field = model._meta.get_field(upload.field)
+    with transaction.atomic():
+        current = ImageUpload.objects.select_for_update().filter(pk=upload.pk, status=ImageUpload.PENDING).first()
+        instance = model._base_manager.select_for_update().filter(pk=upload.object_id).first()
+        if current is None or instance is None:
+            # Заменена более новой загрузкой или объект удалён
+            ImageUpload.objects.filter(pk=upload.pk, status=ImageUpload.PENDING).delete()
+            return False
+        stem = os.path.splitext(upload.original_name)[0] or 'image'
+        with quarantine_storage().open(output_name(upload)) as cleaned:
+            name = field.storage.save(field.generate_filename(instance, f'{stem}{result["extension"]}'),
+                                      File(cleaned))
+        setattr(instance, field.attname, name)
+        update_fields = [field.name] + [f.name for f in model._meta.concrete_fields if getattr(f, 'auto_now', False)]
+        instance.save(update_fields=update_fields)
+        ImageUpload.objects.filter(pk=upload.pk).update(status=ImageUpload.DONE, result=name, error='',
+                                                        processed_at=timezone.now())
+    # Прежний файл поля остаётся в хранилище, пока его не уберёт sweep_media, как при любой замене
+    return True
+
+
+def worker_died(upload):
+    """Count a worker death that happened while this upload was checked alone."""
+    logger.warning('Image worker died while checking upload %s', upload.pk)
+    attempts = upload.attempts + 1
+    if attempts < MAX_ATTEMPTS:
+        ImageUpload.objects.filter(pk=upload.pk).update(attempts=attempts)
+        return
+    ImageUpload.objects.filter(pk=upload.pk, status=ImageUpload.PENDING).update(
+        status=ImageUpload.REJECTED, attempts=attempts, processed_at=timezone.now(),
+        error="Изображение не удалось обработать.")
+    remove_quarantined(upload)
+
+
+def finish(upload, future):
+    """Record the outcome of one checked upload."""
+    try:
+        result = future.result()
+    except imaging.Rejected as exc:
+        ImageUpload.objects.filter(pk=upload.pk, status=ImageUpload.PENDING).update(
+            status=ImageUpload.REJECTED, error=str(exc), processed_at=timezone.now())
+    except Exception as exc:
+        logger.exception('Checking upload %s failed', upload.pk)
+        ImageUpload.objects.filter(pk=upload.pk).update(status=ImageUpload.FAILED, attempts=F('attempts') + 1,
+                                                        error=repr(exc))
+        return
+    else:
+        try:
+            publish(upload, result)
+        except Exception as exc:
+            logger.exception('Publishing upload %s failed', upload.pk)
+            ImageUpload.objects.filter(pk=upload.pk).update(status=ImageUpload.FAILED,
+                                                            attempts=F('attempts') + 1, error=repr(exc))
+            return
+    remove_quarantined(upload)
+
+
+def check(uploads, workers):
+    """
+    Check the uploads in a fresh pool and record their outcomes. Returns the
+    uploads whose results were lost because a worker of the pool died.
+    """
+    storage = quarantine_storage()
+    limits = {'max_pixels': settings.IMAGE_MAX_PIXELS, 'max_side': settings.IMAGE_MAX_SIDE,
+              'quality': settings.IMAGE_JPEG_QUALITY, 'timeout': settings.IMAGE_TASK_TIMEOUT}
+    lost = []
+    with pool(workers) as executor:
+        futures = {
+            executor.submit(imaging.sanitize, storage.path(upload.quarantine_name),
+                            storage.path(output_name(upload)), **limits): upload
+            for upload in uploads
+        }
+        for future in concurrent.futures.as_completed(futures):
+            if isinstance(future.exception(), BrokenProcessPool):
+                lost.append(futures[future])
+            else:
+                finish(futures[future], future)
+    return lost
+
+
+def process_pending(workers=None, limit=None):
+    """Check and publish the pending uploads, oldest first; returns the processed ones."""
+    uploads = ImageUpload.objects.filter(status=ImageUpload.PENDING).order_by('pk')
+    if limit:
+        uploads = uploads[:limit]
+    uploads = [upload for upload in uploads if lock(upload)]
+    if not uploads:
+        return []
+    try:
+        lost = check(uploads, workers or settings.IMAGE_WORKERS)
+        # Умерший процесс роняет весь пул, и неизвестно, на каком изображении: потерянные
+        # проверяются по одному, и попытка засчитывается только тому, на котором процесс умер снова
+        for upload in lost:
+            for dead in check([upload], 1):
+                worker_died(dead)
+    finally:
+        for upload in uploads:
+            unlock(upload)
+    return uploads
+
+
+def sweep_quarantine(min_age=ORPHAN_MIN_AGE):
+    """
+    Delete quarantined files no upload refers to: those of a save whose
+    transaction was rolled back after the file was written. Returns their number.
+    """
+    storage = quarantine_storage()
+    if not os.path.isdir(storage.location):
+        return 0
+    threshold = time.time() - min_age
+    old = {}
+    with os.scandir(storage.location) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < threshold:
+                old[entry.name.removesuffix('.out')] = entry.name
+    if not old:
+        return 0
+    referenced = set(ImageUpload.objects.filter(quarantine_name__in=list(old), status__in=[
+        ImageUpload.PENDING, ImageUpload.FAILED]).values_list('quarantine_name', flat=True))
+    orphans = [name for name in old if name not in referenced]
+    for name in orphans:
+        storage.delete(name)
+        storage.delete(f'{name}.out')
+    return len(orphans)
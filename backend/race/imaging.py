@@ -0,0 +1,114 @@
+"""
+Checking and cleaning uploaded images, run in the worker processes of
+race/images.py. Nothing here touches Django or the database: a task gets the
+path of a quarantined file and the limits and writes the cleaned image next
+to it, so a crash or a runaway decode only costs a pool process.
+
+sanitize():
+1. reads the header only and rejects a format other than JPEG, PNG or WebP
+   and a picture over the pixel limit, before a single pixel is decoded;
+2. decodes the first frame, for JPEG already scaled down by the decoder
+   (draft), and turns it upright by its EXIF orientation;
+3. fits it into max_side x max_side and saves it in the same format with no
+   EXIF (GPS coordinates, camera, time), no XMP and no text chunks; only the
+   colour profile is kept.
+
+limit_resources() is the pool initializer: an address-space limit and an
+alarm per task bound the memory and the time one image may take.
+"""
+import resource
+import signal
+
+from PIL import Image, ImageOps
+
+FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+# Сигнатуры форматов в начале файла; проверяются в запросе без декодирования
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+]
+
+
+class Rejected(Exception):
+    """The file is not an acceptable image; the message is shown to the uploader."""
+
+
+class TimedOut(Exception):
+    pass
+
+
+def sniff(head):
+    """Format of the image by its first bytes (at least 12), or None."""
+    for signature, name in SIGNATURES:
+        if head.startswith(signature):
+            return name
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def _alarm(signum, frame):
+    raise TimedOut
+
+
+def limit_resources(memory_bytes):
+    """Pool initializer: cap the address space of the worker process."""
+    if memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    signal.signal(signal.SIGALRM, _alarm)
+
+
+def sanitize(source, target, max_pixels, max_side, quality=85, timeout=0):
+    """
+    Check the image at `source` and write the cleaned copy to `target`.
+    Returns {'format', 'extension', 'width', 'height'}; raises Rejected.
+    """
+    # Собственная проверка ниже; предел Pillow — на случай, если до неё не дойдёт
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    if timeout:
+        signal.alarm(timeout)
+    try:
+        return _sanitize(source, target, max_pixels, max_side, quality)
+    except TimedOut:
+        raise Rejected("Изображение обрабатывается слишком долго.")
+    except MemoryError:
+        raise Rejected("Изображению нужно слишком много памяти.")
+    except Image.DecompressionBombError:
+        raise Rejected("Слишком большое изображение.")
+    except (OSError, SyntaxError, ValueError) as exc:
+        # Pillow сообщает о повреждённых и неподдерживаемых файлах этими исключениями
+        raise Rejected(f"Файл не удалось прочитать как изображение ({exc.__class__.__name__}).")
+    finally:
+        if timeout:
+            signal.alarm(0)
+
+
+def _sanitize(source, target, max_pixels, max_side, quality):
+    with Image.open(source, formats=list(FORMATS)) as image:
+        width, height = image.size
+        if width * height > max_pixels:
+            raise Rejected(f"Слишком большое изображение: {width}×{height}, допускается не больше "
+                           f"{max_pixels // 1_000_000} млн точек.")
+        image_format = image.format
+        icc_profile = image.info.get('icc_profile')
+        if image_format == 'JPEG':
+            # Декодер JPEG сразу уменьшает в 2, 4 или 8 раз: меньше памяти и времени
+            image.draft('RGB', (max_side, max_side))
+        image.seek(0)
+        upright = ImageOps.exif_transpose(image)
+
+    if image_format == 'JPEG' and upright.mode not in ('RGB', 'L'):
+        upright = upright.convert('RGB')
+    upright.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    options = {'icc_profile': icc_profile} if icc_profile else {}
+    if image_format == 'JPEG':
+        options.update(quality=quality, optimize=True, progressive=True)
+    elif image_format == 'WEBP':
+        options.update(quality=quality)
+    else:
+        options.update(optimize=True)
+    # Метаданные не передаются: без exif= и pnginfo= Pillow их не записывает
+    upright.save(target, format=image_format, **options)
+    return {'format': image_format, 'extension': FORMATS[image_format], 'width': upright.width,
+            'height': upright.height}
@@ -0,0 +1,245 @@
+"""
+Live results over Server-Sent Events.
+
+Every ASGI worker process runs a single Broadcaster task. For each event that
+has at least one connected spectator it reads the new timing records once per
+LIVE_POLL_INTERVAL: one query per event and worker, however many clients are
+connected. It encodes every record once and puts the same chunk of bytes into
+the queue of each subscriber whose race type matches, so a client gets one
+write per poll rather than one per record. Ingestion commits an event's records
+in id order (race/timing.py), so following the log with an id cursor skips
+nothing.
+
+A reconnecting EventSource sends Last-Event-ID, and the records it missed are
+replayed from the log before the live ones. A client that falls LIVE_QUEUE_SIZE
+polls behind is disconnected and catches up the same way.
+
+Streams end after LIVE_STREAM_MAX_SECONDS and the browser reconnects on its
+own. Django 4.2 does not notice a client that went away in the middle of a
+streaming response, so this limit bounds how long a dead subscription lives.
+
+The stream must be served by an ASGI server (the `live` service in
+docker-compose.yml); a WSGI worker would try to buffer the endless response.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import Max
+
+from race_project.metrics import registry
+
+from .models import Event, TimingRecord
+
+logger = logging.getLogger(__name__)
+
+registry.describe('live_subscribers', 'gauge', 'Connected live-results streams per worker.')
+registry.describe('live_polls_total', 'counter', 'Timing-log reads of the live-results broadcaster.')
+registry.describe('live_messages_total', 'counter', 'Timing records delivered to live-results streams.')
+
+RECORD_FIELDS = ('id', 'bib_number', 'point', 'elapsed', 'registration__race_id', 'registration__user__last_name',
+                 'registration__user__first_name')
+HEARTBEAT = b': ping\n\n'
+
+# Все запросы трансляции выполняются в одном потоке: воркер держит одно подключение к БД,
+# а не по подключению на каждый открытый поток (под ASGI у каждого запроса свой sync-поток)
+database_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='live-db')
+
+
+def in_database_thread(func):
+    return sync_to_async(func, thread_sensitive=False, executor=database_executor)
+
+
+def format_elapsed(elapsed):
+    """timedelta -> 'H:MM:SS.f'."""
+    hours, rest = divmod(elapsed.days * 86400 + elapsed.seconds, 3600)
+    return f'{hours}:{rest // 60:02d}:{rest % 60:02d}.{elapsed.microseconds // 100000}'
+
+
+def encode(row):
+    """A log row -> (race id, SSE message bytes)."""
+    record_id, bib_number, point, elapsed, race_id, last_name, first_name = row
+    data = json.dumps({
+        'bib': bib_number,
+        'point': point,
+        'time': format_elapsed(elapsed),
+        'race': race_id,
+        'name': f'{last_name} {first_name}'.strip() if race_id else '',
+    }, ensure_ascii=False)
+    return race_id, f'id: {record_id}\nevent: timing\ndata: {data}\n\n'.encode()
+
+
+def read_log(event_id, after_id, limit, race_id=None):
+    """Records of the event after `after_id`, oldest first."""
+    close_old_connections()
+    records = TimingRecord.objects.filter(event_id=event_id, id__gt=after_id)
+    if race_id is not None:
+        records = records.filter(registration__race_id=race_id)
+    return list(records.order_by('id').values_list(*RECORD_FIELDS)[:limit])
+
+
+def read_recent(event_id, after_id, limit, race_id=None):
+    """The newest `limit` records after `after_id`, oldest first (replay for a reconnecting client)."""
+    close_old_connections()
+    records = TimingRecord.objects.filter(event_id=event_id, id__gt=after_id)
+    if race_id is not None:
+        records = records.filter(registration__race_id=race_id)
+    return list(reversed(records.order_by('-id').values_list(*RECORD_FIELDS)[:limit]))
+
+
+def last_record_id(event_id):
+    close_old_connections()
+    return TimingRecord.objects.filter(event_id=event_id).aggregate(last=Max('id'))['last'] or 0
+
+
+def event_id_for(slug):
+    close_old_connections()
+    return Event.objects.filter(slug=slug).values_list('id', flat=True).first()
+
+
+class Batch:
+    """The new records of one poll for one race type (or all of them), encoded once and shared by the subscribers."""
+    __slots__ = ('messages', 'payload', 'first_id', 'last_id')
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.payload = b''.join(message for _, message in messages)
+        self.first_id = messages[0][0]
+        self.last_id = messages[-1][0]
+
+    def after(self, record_id):
+        """Payload without the records up to `record_id` (already sent as a replay)."""
+        if self.first_id > record_id:
+            return self.payload
+        return b''.join(message for message_id, message in self.messages if message_id > record_id)
+
+
+class Subscription:
+    """One connected stream: the records of an event, optionally of one race type."""
+    __slots__ = ('event_id', 'race_id', 'queue', 'overflowed')
+
+    def __init__(self, event_id, race_id):
+        self.event_id = event_id
+        self.race_id = race_id
+        self.queue = asyncio.Queue(maxsize=settings.LIVE_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, batch):
+        try:
+            self.queue.put_nowait(batch)
+        except asyncio.QueueFull:
+            # Медленный клиент: поток закрывается, при переподключении он догонит по Last-Event-ID
+            self.overflowed = True
+            return False
+        return True
+
+
+class Broadcaster:
+    """Follows the timing log of the watched events and fans new records out to the subscribers."""
+
+    def __init__(self):
+        self.subscriptions = defaultdict(set)
+        self.cursors = {}
+        self.task = None
+
+    async def subscribe(self, event_id, race_id=None):
+        if event_id not in self.cursors:
+            cursor = await in_database_thread(last_record_id)(event_id)
+            # Пока шёл запрос, курсор мог установить другой подписчик — он уже не сдвигается назад
+            self.cursors.setdefault(event_id, cursor)
+        subscription = Subscription(event_id, race_id)
+        self.subscriptions[event_id].add(subscription)
+        self._ensure_running()
+        registry.set_gauge('live_subscribers', self.count())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscribers = self.subscriptions.get(subscription.event_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscriptions[subscription.event_id]
+                self.cursors.pop(subscription.event_id, None)
+        registry.set_gauge('live_subscribers', self.count())
+
+    def count(self):
+        return sum(len(subscribers) for subscribers in self.subscriptions.values())
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            # Собственный контекст: задача не должна наследовать состояние запроса, который её запустил
+            self.task = loop.create_task(self.run(), context=contextvars.Context())
+
+    async def run(self):
+        while self.subscriptions:
+            await asyncio.sleep(settings.LIVE_POLL_INTERVAL)
+            for event_id in list(self.subscriptions):
+                try:
+                    await self.poll(event_id)
+                except DatabaseError:
+                    logger.warning('Cannot read the timing log of event %s', event_id, exc_info=True)
+
+    async def poll(self, event_id):
+        cursor = self.cursors.get(event_id)
+        if cursor is None:
+            return
+        rows = await in_database_thread(read_log)(event_id, cursor, settings.LIVE_POLL_BATCH)
+        registry.inc('live_polls_total')
+        if not rows or event_id not in self.cursors:
+            return
+        self.cursors[event_id] = rows[-1][0]
+
+        # Каждая запись кодируется один раз; подписчик получает одну порцию на опрос, а не по сообщению на запись
+        encoded = [(row[0], *encode(row)) for row in rows]
+        batches = {}
+        delivered = 0
+        for subscription in list(self.subscriptions.get(event_id, ())):
+            if subscription.race_id not in batches:
+                messages = [(record_id, message) for record_id, race_id, message in encoded
+                            if subscription.race_id in (None, race_id)]
+                batches[subscription.race_id] = Batch(messages) if messages else None
+            batch = batches[subscription.race_id]
+            if batch is not None and subscription.offer(batch):
+                delivered += len(batch.messages)
+        registry.inc('live_messages_total', amount=delivered)
+
+
+broadcaster = Broadcaster()
+
+
+async def stream(event_id, race_id=None, last_event_id=None):
+    """Body of the SSE response: missed records (if reconnecting), then live ones with heartbeats."""
+    subscription = await broadcaster.subscribe(event_id, race_id)
+    try:
+        yield f'retry: {settings.LIVE_RETRY_MS}\n\n'.encode()
+        last_sent = 0
+        if last_event_id is not None:
+            missed = await in_database_thread(read_recent)(event_id, last_event_id, settings.LIVE_REPLAY_LIMIT, race_id)
+            if missed:
+                yield b''.join(encode(row)[1] for row in missed)
+                last_sent = missed[-1][0]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.LIVE_STREAM_MAX_SECONDS
+        while not subscription.overflowed:
+            timeout = min(settings.LIVE_HEARTBEAT_SECONDS, deadline - loop.time())
+            if timeout <= 0:
+                break
+            try:
+                batch = await asyncio.wait_for(subscription.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT
+                continue
+            # Записи, уже отправленные при повторе, из очереди пропускаются
+            if batch.last_id > last_sent:
+                yield batch.after(last_sent)
+                last_sent = batch.last_id
+    finally:
+        broadcaster.unsubscribe(subscription)
@@ -0,0 +1,24 @@
+"""
+Field lookups, registered when the app is ready (race/apps.py).
+"""
+from django.db.models import CharField, TextField
+from django.db.models.lookups import IContains
+
+
+@CharField.register_lookup
+@TextField.register_lookup
+class TrigramIContains(IContains):
+    """
+    Case-insensitive substring match written as `column ILIKE '%word%'`.
+
+    The standard icontains compares UPPER(column::text), an expression the
+    trigram GIN indexes on the bare columns (gin_trgm_ops) do not cover, so
+    the search read the whole table; ILIKE on the column is served by them.
+    """
+    lookup_name = 'trgm_icontains'
+
+    def as_sql(self, compiler, connection):
+        # lookup_cast не знает этого имени и оставляет столбец как есть, без UPPER() и ::text
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs_sql} ILIKE {rhs_sql}', (*lhs_params, *rhs_params)
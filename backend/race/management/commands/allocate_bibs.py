@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from race import bibs
+from race.models import Event
+
+
+class Command(BaseCommand):
+    help = ("Give bib numbers from the race types' ranges to paid registrations that have none "
+            "(see race/bibs.py). Numbers already given are kept.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('events', nargs='*', metavar='SLUG', help="Slugs of the events.")
+        parser.add_argument('--upcoming', action='store_true', help="Allocate for every upcoming event.")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be assigned, change nothing.")
+
+    def handle(self, *args, **options):
+        if options['upcoming']:
+            events = list(Event.objects.filter(start_datetime__gte=timezone.now()).order_by('start_datetime'))
+        else:
+            events = list(Event.objects.filter(slug__in=options['events']))
+            missing = set(options['events']) - {event.slug for event in events}
+            if missing:
+                raise CommandError(f"Unknown event(s): {', '.join(sorted(missing))}.")
+        if not events:
+            raise CommandError("Name at least one event or use --upcoming.")
+
+        for event in events:
+            allocations = bibs.allocate(event, dry_run=options['dry_run'])
+            self.stdout.write(f"{event.slug}{' (dry run)' if options['dry_run'] else ''}:")
+            for allocation in allocations:
+                line = f"  {allocation}"
+                self.stdout.write(self.style.WARNING(line) if allocation.waiting else line)
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from race import audit
+from race.models import RegistrationAuditEntry
+
+
+class Command(BaseCommand):
+    help = ("Delete registration audit entries past the retention period and compact old runs of "
+            "cancellations and restorations (see race/audit.py).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=3 * 365,
+                            help="Delete entries older than this many days (default three years).")
+        parser.add_argument('--compact-after', type=int, default=180, metavar='DAYS',
+                            help="Fold each registration's toggles older than this into one entry (default 180).")
+        parser.add_argument('--dry-run', action='store_true', help="Count what would change, change nothing.")
+
+    def handle(self, *args, **options):
+        if options['compact_after'] > options['keep_days']:
+            raise CommandError("--compact-after must not exceed --keep-days.")
+        now = timezone.now()
+        keep_before = now - timedelta(days=options['keep_days'])
+        compact_before = now - timedelta(days=options['compact_after'])
+
+        if options['dry_run']:
+            expired = RegistrationAuditEntry.objects.filter(created_at__lt=keep_before).count()
+            toggles = RegistrationAuditEntry.objects.filter(action__in=audit.TOGGLES, created_at__lt=compact_before,
+                                                            created_at__gte=keep_before).count()
+            self.stdout.write(f"Would delete {expired} expired entries; {toggles} old toggle entries "
+                              f"are candidates for compaction. Dry run, nothing changed.")
+            return
+
+        # Сначала удаляем просроченное, чтобы не сжимать то, что всё равно будет удалено
+        deleted = audit.prune(keep_before)
+        compacted = audit.compact(compact_before)
+        self.stdout.write(f"Deleted {deleted} expired entries; compaction removed {compacted} more.")
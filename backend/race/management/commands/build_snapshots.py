@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from race import snapshots
+
+
+class Command(BaseCommand):
+    help = "Render stale pre-rendered snapshots of public pages for nginx (see race/snapshots.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Re-render every snapshot, not only stale ones.")
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help="Keep running and check for stale snapshots every SECONDS.")
+
+    def handle(self, *args, **options):
+        rebuild_all = options['all']
+        while True:
+            rendered, removed = snapshots.build(rebuild_all=rebuild_all)
+            if rendered or removed:
+                self.stdout.write(f"Rendered {rendered} snapshot(s), removed {removed}.")
+            if not options['watch']:
+                break
+            rebuild_all = False
+            time.sleep(options['watch'])
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from race import start_lists
+from race.models import Event
+
+
+class Command(BaseCommand):
+    help = ("Build printable start lists and bib sheets of upcoming events whose registrations changed "
+            "(see race/start_lists.py).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('events', nargs='*', metavar='SLUG', help="Slugs of the events (default: upcoming ones).")
+        parser.add_argument('--all', action='store_true', help="Rebuild even if the registrations did not change.")
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help="Keep running and check for changed registrations every SECONDS.")
+
+    def handle(self, *args, **options):
+        events = None
+        if options['events']:
+            events = list(Event.objects.filter(slug__in=options['events']))
+            missing = set(options['events']) - {event.slug for event in events}
+            if missing:
+                raise CommandError(f"Unknown event(s): {', '.join(sorted(missing))}.")
+
+        rebuild_all = options['all']
+        while True:
+            for event in start_lists.build(events, rebuild_all=rebuild_all):
+                self.stdout.write(f"Built the start list of {event.slug}.")
+            if not options['watch']:
+                break
+            rebuild_all = False
+            time.sleep(options['watch'])
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from race import names
+from race.models import CanonicalName
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the club and city dictionary from the registrations and refresh the autocomplete cache; "
+            "optionally rewrite variant spellings in the registrations (see race/names.py).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=list(names.FIELDS), action='append',
+                            help="Only this dictionary (club or city); may be repeated. Default: both.")
+        parser.add_argument('--canonicalize', action='store_true',
+                            help="Rewrite every spelling in the registrations to its dictionary name.")
+        parser.add_argument('--merge', nargs='+', metavar='SPELLING',
+                            help="Rewrite these spellings to the --into name (needs exactly one --kind).")
+        parser.add_argument('--into', metavar='NAME', help="The name the --merge spellings become.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="With --canonicalize or --merge: show what would be rewritten, leave the "
+                                 "registrations as they are.")
+
+    def handle(self, *args, **options):
+        kinds = options['kind'] or list(names.FIELDS)
+        if options['merge']:
+            if len(kinds) != 1 or not options['into']:
+                raise CommandError("--merge needs exactly one --kind and --into.")
+            self.merge(kinds[0], options['merge'], options['into'], options['dry_run'])
+            return
+
+        for kind in kinds:
+            entries, removed = names.build(kind)
+            self.stdout.write(f"{kind}: {entries} dictionary entries, {removed} removed.")
+            if not options['canonicalize']:
+                continue
+            entries = CanonicalName.objects.filter(kind=kind)
+            if options['dry_run']:
+                variants = [(spelling, entry.name) for entry in entries for spelling in entry.spellings
+                            if spelling != entry.name]
+                for spelling, name in variants:
+                    self.stdout.write(f"{kind}: {spelling!r} -> {name!r}")
+                self.stdout.write(f"{kind}: {len(variants)} spellings would be rewritten. Dry run, "
+                                  f"registrations not changed.")
+            else:
+                self.stdout.write(f"{kind}: rewrote {names.canonicalize(kind, entries)} registrations.")
+
+    def merge(self, kind, spellings, into, dry_run):
+        if dry_run:
+            self.stdout.write(f"{kind}: {', '.join(map(repr, spellings))} would become {into!r}. "
+                              f"Dry run, nothing changed.")
+            return
+        updated = names.merge(kind, spellings, into)
+        self.stdout.write(f"{kind}: rewrote {updated} registrations to {into!r}.")
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from race import images
+from race.models import ImageUpload
+
+
+class Command(BaseCommand):
+    help = ("Check the uploaded images waiting in quarantine in a pool of worker processes, strip their metadata "
+            "and publish them to their fields; delete quarantined files no upload refers to (see race/images.py).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help="Keep running and check for new uploads every SECONDS.")
+        parser.add_argument('--workers', type=int, help="Worker processes (default IMAGE_WORKERS).")
+        parser.add_argument('--limit', type=int, default=100, help="Uploads taken per round (default 100).")
+
+    def handle(self, *args, **options):
+        while True:
+            for upload in images.process_pending(workers=options['workers'], limit=options['limit']):
+                upload.refresh_from_db()
+                line = f"{upload}: {upload.get_status_display()}"
+                if upload.error:
+                    line += f" ({upload.error})"
+                self.stdout.write(self.style.ERROR(line) if upload.status == ImageUpload.FAILED else line)
+            orphans = images.sweep_quarantine()
+            if orphans:
+                self.stdout.write(f"Deleted {orphans} quarantined file(s) of rolled-back saves.")
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
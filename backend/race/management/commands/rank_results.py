@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from race import ranking
+from race.models import Event
+
+
+class Command(BaseCommand):
+    help = "Recompute places, pace and gaps of an event's results (see race/ranking.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('event', metavar='SLUG', help="Slug of the event.")
+        parser.add_argument('--distance', type=int, action='append',
+                            help="Only re-rank this distance in km (repeatable).")
+
+    def handle(self, *args, **options):
+        event = Event.objects.filter(slug=options['event']).first()
+        if event is None:
+            raise CommandError(f"Event {options['event']!r} does not exist.")
+        changed = ranking.recompute(event, options['distance'])
+        self.stdout.write(self.style.SUCCESS(f"Updated {changed} result(s)."))
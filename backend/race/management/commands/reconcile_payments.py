@@ -0,0 +1,60 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from race import reconciliation
+from race.models import Event
+
+
+class Command(BaseCommand):
+    help = ("Match a CSV bank statement with unpaid registrations by amount, phone and name, "
+            "confirm exact matches and report the rest (see race/reconciliation.py).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help="CSV export of the bank statement.")
+        parser.add_argument('--event', metavar='SLUG', help="Only match registrations for this event.")
+        parser.add_argument('--amount-column', default='Сумма')
+        parser.add_argument('--name-column', default='Плательщик')
+        parser.add_argument('--phone-column', help="Column with the payer's phone number, if the bank exports one.")
+        parser.add_argument('--purpose-column', default='Назначение платежа',
+                            help="Column searched for a phone number when there is no phone column.")
+        parser.add_argument('--delimiter', default=';')
+        parser.add_argument('--encoding', default='utf-8-sig', help="Use cp1251 for older bank exports.")
+        parser.add_argument('--report', metavar='PATH', help="Write lines needing manual review here (CSV).")
+        parser.add_argument('--dry-run', action='store_true', help="Match and report without confirming.")
+
+    def handle(self, *args, **options):
+        event = None
+        if options['event']:
+            event = Event.objects.filter(slug=options['event']).first()
+            if event is None:
+                raise CommandError(f"Event {options['event']!r} does not exist.")
+
+        try:
+            with open(options['statement'], encoding=options['encoding'], newline='') as fh:
+                lines = reconciliation.read_statement(
+                    fh, options['amount_column'], name_column=options['name_column'],
+                    phone_column=options['phone_column'], purpose_column=options['purpose_column'],
+                    delimiter=options['delimiter'],
+                )
+        except (OSError, UnicodeDecodeError) as exc:
+            raise CommandError(f"Cannot read the statement: {exc}")
+
+        amounts = {line.amount for line in lines}
+        matches = reconciliation.match_statement(lines, reconciliation.unpaid_registrations(amounts, event))
+        exact_ids = [match.registration_ids[0] for match in matches if match.status == reconciliation.EXACT]
+
+        totals = Counter(match.status for match in matches)
+        self.stdout.write(f"Statement lines: {len(lines)}; " +
+                          ", ".join(f"{status}: {count}" for status, count in sorted(totals.items())))
+        if options['dry_run']:
+            self.stdout.write(f"Dry run: {len(exact_ids)} registration(s) would be confirmed.")
+        else:
+            confirmed = reconciliation.confirm(exact_ids)
+            self.stdout.write(self.style.SUCCESS(f"Confirmed {confirmed} registration(s)."))
+
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8-sig', newline='') as fh:
+                reconciliation.write_report(matches, fh, delimiter=options['delimiter'])
+        elif len(exact_ids) < len(matches):
+            reconciliation.write_report(matches, self.stdout, delimiter=options['delimiter'])
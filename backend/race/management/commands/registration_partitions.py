@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from race import partitions
+
+
+class Command(BaseCommand):
+    help = ("List the season partitions of the registrations table, create partitions for coming seasons, "
+            "and detach and archive old ones (see race/partitions.py).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--create-ahead', type=int, metavar='SEASONS',
+                            help="Make sure partitions exist for this season and the next SEASONS ones.")
+        parser.add_argument('--archive-before', type=int, metavar='YEAR',
+                            help="Detach and archive the partitions of seasons before YEAR.")
+        parser.add_argument('--export-dir', help="Also write each archived partition to DIR/<partition>.csv.gz.")
+        parser.add_argument('--drop', action='store_true',
+                            help="Drop archived partitions instead of moving them to the archive schema.")
+        parser.add_argument('--dry-run', action='store_true', help="Show what would be archived, change nothing.")
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            raise CommandError("race_eventregistration is not partitioned; apply the race migrations first.")
+
+        if options['create_ahead'] is not None:
+            this_season = timezone.localdate().year
+            for season in range(this_season, this_season + options['create_ahead'] + 1):
+                if partitions.ensure_partition(season):
+                    self.stdout.write(f"Created the partition for season {season}.")
+
+        if options['archive_before'] is not None:
+            if options['archive_before'] > timezone.localdate().year:
+                raise CommandError("Only seasons that have already started can be archived.")
+            for partition in partitions.partitions():
+                if partition.season >= options['archive_before']:
+                    continue
+                results, timing_records = partitions.linked_rows(partition)
+                if results or timing_records:
+                    # Протоколы прошлых сезонов читают участников из регистраций — такие сезоны не архивируются
+                    self.stdout.write(self.style.WARNING(
+                        f"{partition.name}: kept, {results} result(s) and {timing_records} timing record(s) "
+                        f"refer to its registrations."))
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(f"{partition.name}: would be archived (~{max(partition.rows, 0)} rows).")
+                    continue
+                partitions.archive(partition, export_dir=options['export_dir'], drop=options['drop'])
+                where = 'dropped' if options['drop'] else f'moved to the {partitions.ARCHIVE_SCHEMA} schema'
+                self.stdout.write(f"{partition.name}: detached and {where}.")
+
+        for partition in partitions.partitions():
+            rows = f"~{partition.rows} rows" if partition.rows >= 0 else "rows not counted yet"
+            pending = ", detach pending" if partition.detach_pending else ""
+            self.stdout.write(f"{partition.name}: season {partition.season}, {rows}, "
+                              f"{partition.size // 1024} KiB{pending}")
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from race import reminders
+
+
+class Command(BaseCommand):
+    help = ("Email pre-race reminders to the active registrants of events starting in N days; "
+            "meant to run daily from cron, reruns never send twice (see race/reminders.py).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, action='append', metavar='N',
+                            help="Remind about events starting in N days; repeatable (default: 7 and 1).")
+        parser.add_argument('--connections', type=int, default=settings.REMINDER_SMTP_CONNECTIONS,
+                            help="SMTP connections used in parallel.")
+        parser.add_argument('--rate', default=settings.REMINDER_RATE,
+                            help="Sending rate shared by all connections, e.g. 50/s or 1000/m.")
+        parser.add_argument('--max-seconds', type=float, default=1800,
+                            help="Stop starting new batches after this long; the rest goes to the next run.")
+        parser.add_argument('--batch-size', type=int, default=reminders.BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="Count the recipients, send nothing.")
+
+    def handle(self, *args, **options):
+        days = sorted(set(options['days'] or [7, 1]), reverse=True)
+        if options['dry_run']:
+            for days_before in days:
+                for event in reminders.events_starting_in(days_before):
+                    count = len(reminders.recipients(event, days_before))
+                    self.stdout.write(f"{event.slug}: {count} reminder(s) {days_before} day(s) before would be sent.")
+            return
+
+        results = reminders.run(days, connections=options['connections'], rate=options['rate'],
+                                max_seconds=options['max_seconds'], batch_size=options['batch_size'])
+        if results is None:
+            raise CommandError("Another send_reminders run is in progress.")
+        for result in results:
+            line = (f"{result.event.slug}, {result.days_before} day(s) before: {result.sent} sent, "
+                    f"{result.failed} failed, {result.deferred} deferred of {result.recipients}.")
+            self.stdout.write(self.style.WARNING(line) if result.failed or result.deferred else line)
+        stale = reminders.stale_count()
+        if stale:
+            self.stdout.write(self.style.WARNING(
+                f"{stale} reminder(s) were claimed by an interrupted run and may not have been delivered; "
+                f"they are not resent automatically."))
@@ -0,0 +1,49 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from race import media_sweep
+
+
+def human_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+
+class Command(BaseCommand):
+    help = ("Delete media files no row refers to and report the storage used by each event "
+            "(see race/media_sweep.py).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report orphaned files, delete nothing.")
+        parser.add_argument('--min-age', type=float, default=24, metavar='HOURS',
+                            help="Leave files younger than this alone (default 24).")
+        parser.add_argument('--workers', type=int, default=min(32, (os.cpu_count() or 1) * 4),
+                            help="Directories listed in parallel.")
+        parser.add_argument('--list', action='store_true', help="Print the path of every orphaned file.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = media_sweep.scan(min_age=options['min_age'] * 3600, workers=options['workers'],
+                                  delete=not options['dry_run'])
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(f"{'Event':<40} {'files':>8} {'size':>11} {'orphans':>8} {'orphaned':>11}")
+        for owner, usage in sorted(result.usage.items(), key=lambda item: -item[1].bytes):
+            self.stdout.write(f"{owner or '(no event)':<40} {usage.files:>8} {human_size(usage.bytes):>11} "
+                              f"{usage.orphan_files:>8} {human_size(usage.orphan_bytes):>11}")
+        if options['list']:
+            for media_file in result.orphans:
+                self.stdout.write(media_file.name)
+
+        orphan_bytes = sum(media_file.size for media_file in result.orphans)
+        summary = (f"Scanned {result.files} file(s) in {elapsed:.1f} s: {len(result.orphans)} orphaned "
+                   f"({human_size(orphan_bytes)}), {result.skipped_recent} too recent to judge.")
+        if options['dry_run']:
+            summary += " Dry run, nothing deleted."
+        else:
+            summary += f" Deleted {result.deleted}."
+        self.stdout.write(self.style.WARNING(summary) if result.orphans else summary)
@@ -0,0 +1,167 @@
+"""
+Orphaned media files and per-event storage accounting.
+
+Files stay in MEDIA_ROOT when the row pointing at them is gone or points at a
+newer file: a replaced Event.image, a deleted GalleryPhoto, an old user photo,
+the payment document of a deleted registration. `scan` finds them by walking
+the media tree and checking every file against the set of paths stored in the
+FileField/ImageField columns of all installed models and of the archived
+registration partitions (see race/partitions.py).
+
+The tree is walked with os.scandir on a thread pool. Each directory is listed
+by one task and its subdirectories are queued as new tasks. scandir and stat
+release the GIL, so listings run in parallel, which pays off on network
+volumes. The referenced paths are read with one query per file column.
+
+Only the directories models upload to (UPLOAD_ROOTS) are swept, so files put
+into MEDIA_ROOT by hand elsewhere are left alone. Files newer than `min_age`
+are skipped as well: an upload is written to disk before the transaction
+saving its row commits.
+
+Files of an event live in a directory named after its slug with dashes turned
+into underscores (see the *_file_path functions in race/models.py), which is
+how the usage is attributed to events.
+"""
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models
+
+from . import partitions
+from .models import Event
+
+# Каталоги, в которые загружают файлы модели; остальное содержимое MEDIA_ROOT не трогается
+UPLOAD_ROOTS = ('events', 'uploads', 'users')
+# Каталоги файлов мероприятий: <корень>/<slug с подчёркиваниями>/...
+EVENT_ROOTS = (
+    os.path.join('events', 'image'),
+    os.path.join('events', 'protocol'),
+    os.path.join('events', 'photos'),
+    os.path.join('uploads', 'payment_docs'),
+)
+
+
+class MediaFile:
+    __slots__ = ('name', 'size', 'mtime')
+
+    def __init__(self, name, size, mtime):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+
+
+class Usage:
+    """Files and bytes of one event (or of everything else), and how many of them are orphans."""
+    __slots__ = ('files', 'bytes', 'orphan_files', 'orphan_bytes')
+
+    def __init__(self):
+        self.files = self.bytes = self.orphan_files = self.orphan_bytes = 0
+
+    def add(self, media_file, orphan):
+        self.files += 1
+        self.bytes += media_file.size
+        if orphan:
+            self.orphan_files += 1
+            self.orphan_bytes += media_file.size
+
+
+class Scan:
+    """Result of a sweep: the orphans found and the storage used per event slug."""
+
+    def __init__(self):
+        self.orphans = []
+        self.usage = defaultdict(Usage)
+        self.files = 0
+        self.skipped_recent = 0
+        self.deleted = 0
+
+
+def referenced_paths():
+    """Names stored in every file column of every installed model and of the archived registrations."""
+    paths = set()
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                values = model._base_manager.exclude(**{field.name: ''}).filter(**{f'{field.name}__isnull': False})
+                paths.update(values.values_list(field.name, flat=True).iterator(chunk_size=10000))
+    paths.update(partitions.archived_file_paths())
+    return paths
+
+
+def list_directory(root, relative_dir):
+    """One scandir pass: (files, subdirectories) of a directory relative to `root`."""
+    files, subdirs = [], []
+    try:
+        entries = os.scandir(os.path.join(root, relative_dir))
+    except FileNotFoundError:
+        return files, subdirs
+    with entries:
+        for entry in entries:
+            name = os.path.join(relative_dir, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(name)
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                files.append(MediaFile(name.replace(os.sep, '/'), stat.st_size, stat.st_mtime))
+    return files, subdirs
+
+
+def walk(root, top_dirs, workers):
+    """Every file under the given directories of `root`, listing directories in parallel."""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media-walk') as executor:
+        pending = {executor.submit(list_directory, root, directory) for directory in top_dirs}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                pending.update(executor.submit(list_directory, root, directory) for directory in subdirs)
+                yield from files
+
+
+def event_dir_of(name):
+    """Slug directory of the event a file belongs to, None for files of no event."""
+    for event_root in EVENT_ROOTS:
+        prefix = event_root.replace(os.sep, '/') + '/'
+        if name.startswith(prefix):
+            directory, _, rest = name[len(prefix):].partition('/')
+            return directory if rest else None
+    return None
+
+
+def scan(min_age=24 * 3600, workers=8, delete=False):
+    """Find (and optionally delete) orphaned files; returns a Scan."""
+    root = settings.MEDIA_ROOT
+    protected = {settings.DEFAULT_USER_IMAGE[len(settings.MEDIA_URL):]}
+    referenced = referenced_paths() | protected
+    slugs = {slug.replace('-', '_'): slug for slug in Event.objects.values_list('slug', flat=True)}
+    cutoff = time.time() - min_age
+
+    result = Scan()
+    for media_file in walk(root, UPLOAD_ROOTS, workers):
+        result.files += 1
+        orphan = media_file.name not in referenced
+        if orphan and media_file.mtime > cutoff:
+            result.skipped_recent += 1
+            orphan = False
+        directory = event_dir_of(media_file.name)
+        if directory is None:
+            owner = ''
+        else:
+            # Каталог удалённого мероприятия подписывается своим именем в квадратных скобках
+            owner = slugs.get(directory, f'[{directory}]')
+        result.usage[owner].add(media_file, orphan)
+        if orphan:
+            result.orphans.append(media_file)
+
+    if delete:
+        for media_file in result.orphans:
+            try:
+                os.remove(os.path.join(root, media_file.name))
+            except FileNotFoundError:
+                continue
+            result.deleted += 1
+    return result
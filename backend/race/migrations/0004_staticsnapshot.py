@@ -0,0 +1,27 @@
+# Generated by Django 4.2.6 on 2026-10-19 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race', '0003_updated_at_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaticSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=512, unique=True, verbose_name='Адрес страницы')),
+                ('is_stale', models.BooleanField(db_index=True, default=True, verbose_name='Требует обновления')),
+                ('valid_until', models.DateTimeField(blank=True, null=True, verbose_name='Актуален до')),
+                ('rendered_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата генерации')),
+            ],
+            options={
+                'verbose_name': 'Статическая копия страницы',
+                'verbose_name_plural': 'Статические копии страниц',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.6 on 2026-10-19 12:46
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_reviews(apps, schema_editor):
+    Event = apps.get_model('race', 'Event')
+    Review = apps.get_model('race', 'Review')
+    counts = Review.objects.filter(event=models.OuterRef('pk')).order_by().values('event').annotate(
+        total=models.Count('id')).values('total')
+    Event.objects.update(review_count=Coalesce(models.Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+    # Индексы на большой таблице отзывов строятся без блокировки записи
+    atomic = False
+
+    dependencies = [
+        ('race', '0004_staticsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество отзывов'),
+        ),
+        migrations.RunPython(count_reviews, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='review',
+            index=models.Index(fields=['-created_at', '-id'], name='race_review_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='review',
+            index=models.Index(fields=['event', '-created_at', '-id'], name='race_review_event_created_idx'),
+        ),
+    ]
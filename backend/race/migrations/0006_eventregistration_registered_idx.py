@@ -0,0 +1,20 @@
+# Generated by Django 4.2.6 on 2026-10-19 13:05
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индекс на большой таблице регистраций строится без блокировки записи
+    atomic = False
+
+    dependencies = [
+        ('race', '0005_review_count_and_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='eventregistration',
+            index=models.Index(fields=['registered_at'], name='race_eventreg_registered_idx'),
+        ),
+    ]
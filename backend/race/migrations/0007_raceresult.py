@@ -0,0 +1,40 @@
+# Generated by Django 4.2.6 on 2026-10-19 13:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race', '0006_eventregistration_registered_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RaceResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('finished', 'Финишировал'), ('dnf', 'Сошёл с дистанции'), ('dsq', 'Дисквалифицирован'), ('dns', 'Не стартовал')], default='finished', max_length=10, verbose_name='Статус')),
+                ('finish_time', models.DurationField(blank=True, null=True, verbose_name='Время')),
+                ('distance', models.PositiveSmallIntegerField(editable=False, verbose_name='Дистанция')),
+                ('age_group', models.CharField(blank=True, editable=False, max_length=16, verbose_name='Возрастная группа')),
+                ('place_overall', models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Место в абсолютном зачёте')),
+                ('place_gender', models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Место среди мужчин/женщин')),
+                ('place_race', models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Место в забеге')),
+                ('place_age_group', models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Место в возрастной группе')),
+                ('pace', models.DurationField(blank=True, editable=False, null=True, verbose_name='Темп на километр')),
+                ('gap_to_leader', models.DurationField(blank=True, editable=False, null=True, verbose_name='Отставание от лидера')),
+                ('gap_in_race', models.DurationField(blank=True, editable=False, null=True, verbose_name='Отставание от лидера забега')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('event', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='results', to='race.event', verbose_name='Мероприятие')),
+                ('race', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='race.racetype', verbose_name='Забег')),
+                ('registration', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='result', to='race.eventregistration', verbose_name='Регистрация')),
+            ],
+            options={
+                'verbose_name': 'Результат',
+                'verbose_name_plural': 'Результаты',
+                'indexes': [models.Index(fields=['event', 'distance', 'place_overall'], name='race_result_overall_idx'), models.Index(fields=['event', 'race', 'place_race'], name='race_result_race_idx')],
+            },
+        ),
+    ]
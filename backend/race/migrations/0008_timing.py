@@ -0,0 +1,70 @@
+# Generated by Django 4.2.6 on 2026-10-19 13:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # Уникальный индекс стартовых номеров на большой таблице регистраций строится без блокировки записи
+    atomic = False
+
+    dependencies = [
+        ('race', '0007_raceresult'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimingRecord',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('bib_number', models.PositiveIntegerField(verbose_name='Стартовый номер')),
+                ('point', models.CharField(max_length=20, verbose_name='Точка хронометража')),
+                ('elapsed', models.DurationField(verbose_name='Время от старта')),
+                ('station', models.CharField(max_length=50, verbose_name='Станция')),
+                ('sequence', models.PositiveBigIntegerField(verbose_name='Номер записи станции')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата приёма')),
+            ],
+            options={
+                'verbose_name': 'Отметка хронометража',
+                'verbose_name_plural': 'Отметки хронометража',
+            },
+        ),
+        migrations.AddField(
+            model_name='eventregistration',
+            name='bib_number',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Стартовый номер'),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "race_eventreg_event_bib_uniq" '
+                    'ON "race_eventregistration" ("event_id", "bib_number") WHERE "bib_number" IS NOT NULL',
+                    'DROP INDEX CONCURRENTLY IF EXISTS "race_eventreg_event_bib_uniq"',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='eventregistration',
+                    constraint=models.UniqueConstraint(condition=models.Q(('bib_number__isnull', False)), fields=('event', 'bib_number'), name='race_eventreg_event_bib_uniq'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='timingrecord',
+            name='event',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timing_records', to='race.event', verbose_name='Мероприятие'),
+        ),
+        migrations.AddField(
+            model_name='timingrecord',
+            name='registration',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='timing_records', to='race.eventregistration', verbose_name='Регистрация'),
+        ),
+        migrations.AddIndex(
+            model_name='timingrecord',
+            index=models.Index(fields=['event', 'id'], name='race_timing_event_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timingrecord',
+            constraint=models.UniqueConstraint(fields=('event', 'station', 'sequence'), name='race_timing_station_seq_uniq'),
+        ),
+    ]
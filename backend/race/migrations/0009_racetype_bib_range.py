@@ -0,0 +1,23 @@
+# Generated by Django 4.2.6 on 2026-10-19 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race', '0008_timing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='racetype',
+            name='bib_range_end',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Стартовые номера по'),
+        ),
+        migrations.AddField(
+            model_name='racetype',
+            name='bib_range_start',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Стартовые номера с'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.db import migrations
+
+import race.models
+
+BATCH_SIZE = 10000
+
+BACKFILL_SQL = """
+    UPDATE race_eventregistration AS registration
+    SET season = EXTRACT(YEAR FROM event.start_datetime AT TIME ZONE %(tz)s)
+    FROM race_event AS event
+    WHERE registration.event_id = event.id AND registration.id BETWEEN %(first)s AND %(last)s
+          AND registration.season IS NULL
+"""
+
+
+def backfill_season(apps, schema_editor):
+    """Fill the season of existing registrations in batches, each committed on its own."""
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT min(id), max(id) FROM race_eventregistration')
+        first, last = cursor.fetchone()
+        if first is None:
+            return
+        for start in range(first, last + 1, BATCH_SIZE):
+            cursor.execute(BACKFILL_SQL, {'tz': settings.TIME_ZONE, 'first': start, 'last': start + BATCH_SIZE - 1})
+
+
+def catch_up_season(apps, schema_editor):
+    """Rows added during the backfill; from now on the check constraint rejects new NULLs."""
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(BACKFILL_SQL, {'tz': settings.TIME_ZONE, 'first': 0, 'last': 2 ** 63 - 1})
+
+
+class Migration(migrations.Migration):
+    # Каждая порция заполнения фиксируется отдельно, таблица не блокируется на всё время миграции
+    atomic = False
+
+    dependencies = [
+        ('race', '0009_racetype_bib_range'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventregistration',
+            name='season',
+            field=race.models.SeasonField(editable=False, null=True, verbose_name='Сезон'),
+        ),
+        migrations.RunPython(backfill_season, migrations.RunPython.noop),
+        # SET NOT NULL без полного просмотра таблицы под эксклюзивной блокировкой: PostgreSQL опирается
+        # на проверенное ограничение CHECK, а проверка (VALIDATE) не мешает записи
+        migrations.RunSQL(
+            'ALTER TABLE race_eventregistration ADD CONSTRAINT race_eventreg_season_not_null '
+            'CHECK (season IS NOT NULL) NOT VALID',
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunPython(catch_up_season, migrations.RunPython.noop),
+        migrations.RunSQL(
+            'ALTER TABLE race_eventregistration VALIDATE CONSTRAINT race_eventreg_season_not_null',
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name='eventregistration',
+            name='season',
+            field=race.models.SeasonField(editable=False, verbose_name='Сезон'),
+        ),
+        migrations.RunSQL(
+            'ALTER TABLE race_eventregistration DROP CONSTRAINT race_eventreg_season_not_null',
+            'ALTER TABLE race_eventregistration DROP CONSTRAINT IF EXISTS race_eventreg_season_not_null',
+        ),
+    ]
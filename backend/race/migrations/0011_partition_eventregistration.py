@@ -0,0 +1,197 @@
+"""
+Move race_eventregistration to a table partitioned by season, without taking the
+table offline for the copy:
+
+1. Create race_eventregistration_partitioned with the same columns, foreign
+   keys and indexes, a primary key of (id, season) and a partition per season.
+2. A trigger on the old table mirrors every insert, update and delete into it.
+3. Existing rows are copied in batches of ids, each batch committed on its own.
+   The copied rows are locked FOR SHARE, so a concurrent update waits for the
+   batch and its mirrored version wins.
+4. One short transaction takes the old table's lock (with a lock timeout,
+   retried), checks that both tables have the same number of rows, drops the
+   old table and renames the new one and its indexes into its place.
+
+PostgreSQL only lets a foreign key point at a partitioned table through a
+unique key that includes the partition key, so the foreign keys of RaceResult
+and TimingRecord are dropped first and enforced by Django alone.
+"""
+import re
+import time
+
+from django.db import migrations, models, transaction
+from django.db.utils import OperationalError
+from django.utils import timezone
+
+PARENT = 'race_eventregistration'
+NEW = 'race_eventregistration_partitioned'
+COPY_BATCH_SIZE = 10000
+SWAP_ATTEMPTS = 20
+SEASONS_AHEAD = 2
+
+
+def partition_name(season):
+    return f'{PARENT}_y{season}'
+
+
+def columns_of(cursor, table):
+    cursor.execute('SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass AND attnum > 0 '
+                   'AND NOT attisdropped ORDER BY attnum', [table])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def create_table(cursor, columns):
+    cursor.execute(f'CREATE TABLE {NEW} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS) '
+                   f'PARTITION BY RANGE (season)')
+    cursor.execute(f'ALTER TABLE {NEW} ADD CONSTRAINT {NEW}_pkey PRIMARY KEY (id, season)')
+
+    cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                   "WHERE conrelid = %s::regclass AND contype = 'f'", [PARENT])
+    for name, definition in cursor.fetchall():
+        cursor.execute(f'ALTER TABLE {NEW} ADD CONSTRAINT {name} {definition}')
+
+    cursor.execute(f'SELECT DISTINCT season FROM {PARENT}')
+    this_year = timezone.localdate().year
+    seasons = {row[0] for row in cursor.fetchall()} | set(range(this_year, this_year + SEASONS_AHEAD + 1))
+    for season in sorted(seasons):
+        cursor.execute(f'CREATE TABLE {partition_name(season)} PARTITION OF {NEW} '
+                       f'FOR VALUES FROM ({season}) TO ({season + 1})')
+
+    # Индексы строятся до копирования: позже CREATE INDEX остановил бы запись в старую таблицу через триггер
+    cursor.execute('SELECT indexrelid::regclass::text, indisunique, pg_get_indexdef(indexrelid) FROM pg_index '
+                   'WHERE indrelid = %s::regclass AND NOT indisprimary', [PARENT])
+    renames = []
+    for name, unique, definition in cursor.fetchall():
+        temporary = f'{name[:58]}_part'
+        definition = definition.replace(f'INDEX {name} ON ', f'INDEX {temporary} ON ', 1)
+        definition = re.sub(r' ON \S+ ', f' ON {NEW} ', definition, count=1)
+        if unique:
+            definition = re.sub(r'USING (\w+) \(([^)]*)\)', r'USING \1 (\2, season)', definition, count=1)
+        cursor.execute(definition)
+        renames.append((temporary, name))
+    return renames
+
+
+def create_mirror(cursor, columns):
+    column_list = ', '.join(columns)
+    values = ', '.join(f'NEW.{column}' for column in columns)
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in columns if column not in ('id', 'season'))
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION {PARENT}_mirror() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND NEW.season <> OLD.season) THEN
+                DELETE FROM {NEW} WHERE id = OLD.id AND season = OLD.season;
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                INSERT INTO {NEW} ({column_list}) VALUES ({values})
+                ON CONFLICT (id, season) DO UPDATE SET {updates};
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """)
+    cursor.execute(f'CREATE TRIGGER {PARENT}_mirror AFTER INSERT OR UPDATE OR DELETE ON {PARENT} '
+                   f'FOR EACH ROW EXECUTE FUNCTION {PARENT}_mirror()')
+
+
+def copy_rows(cursor, columns):
+    column_list = ', '.join(columns)
+    cursor.execute(f'SELECT min(id), max(id) FROM {PARENT}')
+    first, last = cursor.fetchone()
+    if first is None:
+        return
+    # Строки, добавленные после этого запроса, переносит триггер
+    for start in range(first, last + 1, COPY_BATCH_SIZE):
+        cursor.execute(f'INSERT INTO {NEW} ({column_list}) SELECT {column_list} FROM {PARENT} '
+                       f'WHERE id BETWEEN %s AND %s FOR SHARE ON CONFLICT DO NOTHING',
+                       [start, start + COPY_BATCH_SIZE - 1])
+
+
+def swap(connection, renames):
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        try:
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute("SET LOCAL lock_timeout = '3s'")
+                cursor.execute(f'LOCK TABLE {PARENT} IN ACCESS EXCLUSIVE MODE')
+                cursor.execute(f'SELECT (SELECT count(*) FROM {PARENT}), (SELECT count(*) FROM {NEW})')
+                old_count, new_count = cursor.fetchone()
+                if old_count != new_count:
+                    raise RuntimeError(f'{NEW} has {new_count} rows instead of {old_count}, not switching over')
+                cursor.execute(f"SELECT pg_get_serial_sequence('{PARENT}', 'id'), "
+                               f"pg_get_serial_sequence('{NEW}', 'id')")
+                old_sequence, new_sequence = cursor.fetchone()
+                cursor.execute(f'SELECT last_value, is_called FROM {old_sequence}')
+                last_value, is_called = cursor.fetchone()
+
+                cursor.execute(f'DROP TABLE {PARENT}')
+                cursor.execute(f'DROP FUNCTION {PARENT}_mirror()')
+                cursor.execute(f'ALTER TABLE {NEW} RENAME TO {PARENT}')
+                cursor.execute(f'ALTER INDEX {NEW}_pkey RENAME TO {PARENT}_pkey')
+                for temporary, name in renames:
+                    cursor.execute(f'ALTER INDEX {temporary} RENAME TO {name}')
+                cursor.execute(f'ALTER SEQUENCE {new_sequence} RENAME TO {PARENT}_id_seq')
+                cursor.execute(f"SELECT setval('{PARENT}_id_seq', %s, %s)", [last_value, is_called])
+            return
+        except OperationalError:
+            # Не дождались блокировки за долгими запросами — пробуем снова, не задерживая остальные
+            if attempt == SWAP_ATTEMPTS:
+                raise
+            time.sleep(1)
+
+
+def partition_registrations(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [PARENT])
+        if cursor.fetchone():
+            return
+        # Остатки прерванного запуска
+        cursor.execute(f'DROP TRIGGER IF EXISTS {PARENT}_mirror ON {PARENT}')
+        cursor.execute(f'DROP TABLE IF EXISTS {NEW}')
+        columns = columns_of(cursor, PARENT)
+        renames = create_table(cursor, columns)
+        create_mirror(cursor, columns)
+        copy_rows(cursor, columns)
+    swap(connection, renames)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('race', '0010_eventregistration_season'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='raceresult',
+            name='registration',
+            field=models.OneToOneField(db_constraint=False, on_delete=models.deletion.CASCADE, related_name='result',
+                                       to='race.eventregistration', verbose_name='Регистрация'),
+        ),
+        migrations.AlterField(
+            model_name='timingrecord',
+            name='registration',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=models.deletion.SET_NULL,
+                                    related_name='timing_records', to='race.eventregistration',
+                                    verbose_name='Регистрация'),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveConstraint(
+                    model_name='eventregistration',
+                    name='race_eventreg_event_bib_uniq',
+                ),
+                migrations.AddConstraint(
+                    model_name='eventregistration',
+                    constraint=models.UniqueConstraint(condition=models.Q(('bib_number__isnull', False)),
+                                                       fields=('event', 'bib_number', 'season'),
+                                                       name='race_eventreg_event_bib_uniq'),
+                ),
+            ],
+            # Уникальный индекс получает столбец season при переносе в секционированную таблицу
+            database_operations=[
+                migrations.RunPython(partition_registrations),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.6 on 2026-10-19 13:39
+
+from django.conf import settings
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('race', '0011_partition_eventregistration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistrationAuditEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('registration_id', models.BigIntegerField(verbose_name='Регистрация')),
+                ('event_id', models.BigIntegerField(verbose_name='Мероприятие')),
+                ('action', models.CharField(choices=[('created', 'Создана'), ('deactivated', 'Отменена'), ('reactivated', 'Восстановлена'), ('payment_confirmed', 'Оплата подтверждена'), ('changed', 'Изменена'), ('deleted', 'Удалена'), ('toggles_compacted', 'Отмены и восстановления (сжато)')], max_length=20, verbose_name='Действие')),
+                ('source', models.CharField(choices=[('site', 'Сайт'), ('admin', 'Админка'), ('system', 'Система')], max_length=10, verbose_name='Источник')),
+                ('changes', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Изменения')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата изменения')),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Кто изменил')),
+            ],
+            options={
+                'verbose_name': 'Запись журнала регистраций',
+                'verbose_name_plural': 'Журнал регистраций',
+                'indexes': [models.Index(fields=['registration_id', 'created_at'], name='race_audit_registration_idx'), models.Index(fields=['event_id', 'created_at'], name='race_audit_event_idx'), models.Index(fields=['created_at'], name='race_audit_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.6 on 2026-10-19 13:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race', '0012_registrationauditentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderDelivery',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('registration_id', models.BigIntegerField(verbose_name='Регистрация')),
+                ('days_before', models.PositiveSmallIntegerField(verbose_name='За сколько дней')),
+                ('start_date', models.DateField(verbose_name='Дата старта')),
+                ('email', models.EmailField(max_length=254, verbose_name='Адрес')),
+                ('status', models.CharField(choices=[('pending', 'Отправляется'), ('sent', 'Отправлено'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата постановки')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата отправки')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='race.event', verbose_name='Мероприятие')),
+            ],
+            options={
+                'verbose_name': 'Напоминание о старте',
+                'verbose_name_plural': 'Напоминания о старте',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='reminderdelivery',
+            constraint=models.UniqueConstraint(fields=('registration_id', 'days_before', 'start_date'), name='race_reminder_once_uniq'),
+        ),
+    ]
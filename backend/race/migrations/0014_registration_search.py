@@ -0,0 +1,131 @@
+"""
+Indexes for searching registrations in the admin (race/search.py):
+
+1. phone_e164, the number in E.164, is added and filled in batches of ids,
+   each batch committed on its own.
+2. Trigram GIN indexes on city, club and phone_e164 and a btree index on
+   phone_e164 are built without blocking writes. CREATE INDEX CONCURRENTLY is
+   not available on a partitioned table, so each index is created ON ONLY the
+   parent (invalid until complete), built concurrently on every season
+   partition and attached there. Partitions created later get the indexes
+   automatically.
+"""
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+import race.models
+from race.phones import normalize_phone
+
+PARENT = 'race_eventregistration'
+BACKFILL_BATCH_SIZE = 5000
+
+INDEXES = [
+    # (имя, метод, выражение)
+    ('race_eventreg_city_trgm', 'gin', 'city gin_trgm_ops'),
+    ('race_eventreg_club_trgm', 'gin', 'club gin_trgm_ops'),
+    ('race_eventreg_phone_trgm', 'gin', 'phone_e164 gin_trgm_ops'),
+    ('race_eventreg_phone_idx', 'btree', 'phone_e164'),
+]
+
+PARTITIONS_SQL = """
+    SELECT child.relname FROM pg_inherits AS inherits JOIN pg_class AS child ON child.oid = inherits.inhrelid
+    WHERE inherits.inhparent = %s::regclass AND NOT inherits.inhdetachpending ORDER BY child.relname
+"""
+
+BACKFILL_SQL = f"""
+    UPDATE {PARENT} AS registration SET phone_e164 = batch.phone
+    FROM unnest(%s::bigint[], %s::smallint[], %s::text[]) AS batch(id, season, phone)
+    WHERE registration.id = batch.id AND registration.season = batch.season
+"""
+
+
+def fill_phone_e164(apps, schema_editor):
+    last_id = 0
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(f"SELECT id, season, phone_number FROM {PARENT} WHERE id > %s "
+                           f"AND phone_number IS NOT NULL AND phone_number <> '' ORDER BY id LIMIT %s",
+                           [last_id, BACKFILL_BATCH_SIZE])
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            rows = [(pk, season, normalize_phone(phone)) for pk, season, phone in rows]
+            rows = [row for row in rows if row[2]]
+            if rows:
+                cursor.execute(BACKFILL_SQL, [list(column) for column in zip(*rows)])
+
+
+def index_state(cursor, name):
+    """None if the index does not exist, else whether it is valid."""
+    cursor.execute('SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)', [name])
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def create_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(PARTITIONS_SQL, [PARENT])
+        partitions = [row[0] for row in cursor.fetchall()]
+        for name, method, expression in INDEXES:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON ONLY {PARENT} USING {method} ({expression})')
+            for partition in partitions:
+                child = f'{name}_{partition.rsplit("_", 1)[1]}'
+                # Прерванная CREATE INDEX CONCURRENTLY оставляет невалидный индекс — строим заново
+                if index_state(cursor, child) is False:
+                    cursor.execute(f'DROP INDEX CONCURRENTLY {child}')
+                cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} '
+                               f'USING {method} ({expression})')
+                cursor.execute('SELECT 1 FROM pg_inherits WHERE inhrelid = %s::regclass', [child])
+                if not cursor.fetchone():
+                    cursor.execute(f'ALTER INDEX {name} ATTACH PARTITION {child}')
+
+
+def drop_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for name, _, _ in INDEXES:
+            cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('race', '0013_reminderdelivery'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='eventregistration',
+            name='phone_e164',
+            field=race.models.E164Field(blank=True, default='', editable=False, max_length=16,
+                                        verbose_name='Телефон (E.164)'),
+        ),
+        migrations.RunPython(fill_phone_e164, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='eventregistration',
+                    index=GinIndex(fields=['city'], name='race_eventreg_city_trgm', opclasses=['gin_trgm_ops']),
+                ),
+                migrations.AddIndex(
+                    model_name='eventregistration',
+                    index=GinIndex(fields=['club'], name='race_eventreg_club_trgm', opclasses=['gin_trgm_ops']),
+                ),
+                migrations.AddIndex(
+                    model_name='eventregistration',
+                    index=GinIndex(fields=['phone_e164'], name='race_eventreg_phone_trgm',
+                                   opclasses=['gin_trgm_ops']),
+                ),
+                migrations.AddIndex(
+                    model_name='eventregistration',
+                    index=models.Index(fields=['phone_e164'], name='race_eventreg_phone_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+        ),
+    ]
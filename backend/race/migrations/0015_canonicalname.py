@@ -0,0 +1,35 @@
+# Generated by Django 4.2.6 on 2026-10-19 14:12
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race', '0014_registration_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CanonicalName',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('club', 'Клуб'), ('city', 'Город')], max_length=4, verbose_name='Вид')),
+                ('name', models.CharField(max_length=255, verbose_name='Название')),
+                ('key', models.CharField(max_length=255, verbose_name='Ключ')),
+                ('spellings', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), blank=True, default=list, size=None, verbose_name='Написания')),
+                ('registrations', models.PositiveIntegerField(default=0, verbose_name='Регистраций')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Клуб или город',
+                'verbose_name_plural': 'Словарь клубов и городов',
+                'indexes': [models.Index(fields=['kind', 'key'], name='race_canonical_name_prefix_idx', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops'])],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='canonicalname',
+            constraint=models.UniqueConstraint(fields=('kind', 'key'), name='race_canonical_name_key_uniq'),
+        ),
+    ]
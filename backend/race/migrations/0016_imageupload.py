@@ -0,0 +1,49 @@
+# Generated by Django 4.2.6 on 2026-10-19 14:23
+
+from django.db import migrations, models
+import django.utils.timezone
+import race.models
+import race.uploads
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('race', '0015_canonicalname'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='event',
+            name='image',
+            field=race.uploads.QuarantinedImageField(upload_to=race.models.event_image_file_path, verbose_name='Изображение для мероприятия'),
+        ),
+        migrations.AlterField(
+            model_name='galleryphoto',
+            name='photo',
+            field=race.uploads.QuarantinedImageField(upload_to=race.models.event_photos_file_path, verbose_name='Фотография'),
+        ),
+        migrations.CreateModel(
+            name='ImageUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, verbose_name='Модель')),
+                ('object_id', models.BigIntegerField(verbose_name='ID объекта')),
+                ('field', models.CharField(max_length=100, verbose_name='Поле')),
+                ('original_name', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('quarantine_name', models.CharField(max_length=255, verbose_name='Файл в карантине')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер, байт')),
+                ('status', models.CharField(choices=[('pending', 'Проверяется'), ('done', 'Опубликовано'), ('rejected', 'Отклонено'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Неудачных попыток')),
+                ('result', models.CharField(blank=True, max_length=255, verbose_name='Опубликованный файл')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата загрузки')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата обработки')),
+            ],
+            options={
+                'verbose_name': 'Загрузка изображения',
+                'verbose_name_plural': 'Загрузки изображений',
+                'indexes': [models.Index(fields=['status'], name='race_imageupload_status_idx'), models.Index(fields=['model', 'object_id', 'field'], name='race_imageupload_target_idx')],
+            },
+        ),
+    ]
@@ -3,7 +3,9 @@ Database models.
 """
 from django.urls import reverse
 from django.utils import timezone
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
 import uuid
 import os
 
@@ -16,8 +18,14 @@ import logging
 from django.utils.text import slugify
 
 from race_project import settings
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from phonenumber_field.modelfields import PhoneNumberField
 
+from .phones import normalize_phone
+from . import uploads
+from .uploads import QuarantinedImageField
+
 logger = logging.getLogger(__name__)
 
 
@@ -64,10 +72,20 @@ class RaceType(models.Model):
     min_age = models.PositiveSmallIntegerField(verbose_name="Минимальный возраст")
     distance = models.PositiveSmallIntegerField(choices=DISTANCE_CHOICES, verbose_name="Дистанция")
     registration_fee = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Стоимость регистрации")
+    # Диапазон стартовых номеров; забеги с одинаковым диапазоном получают номера из общего пула
+    bib_range_start = models.PositiveIntegerField(blank=True, null=True, verbose_name="Стартовые номера с")
+    bib_range_end = models.PositiveIntegerField(blank=True, null=True, verbose_name="Стартовые номера по")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
 
     def __str__(self):
         return f"{self.distance} км {self.get_gender_display()} {self.min_age} лет и старше (взнос {self.registration_fee} руб.)"
 
+    def clean(self):
+        if (self.bib_range_start is None) != (self.bib_range_end is None):
+            raise ValidationError("Укажите обе границы диапазона стартовых номеров или ни одной.")
+        if self.bib_range_start is not None and self.bib_range_start > self.bib_range_end:
+            raise ValidationError("Начало диапазона стартовых номеров больше его конца.")
+
     class Meta:
         verbose_name = "Тип забега"
         verbose_name_plural = "Типы забегов"
@@ -82,6 +100,7 @@ class Location(models.Model):
     country = models.CharField(max_length=100, verbose_name="Страна")
     latitude = models.FloatField(blank=True, null=True, verbose_name="Широта")
     longitude = models.FloatField(blank=True, null=True, verbose_name="Долгота")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
 
     def __str__(self):
         return f"{self.street}, {self.house_number}, {self.city}, {self.postal_code}, {self.country}"
@@ -101,7 +120,7 @@ class Location(models.Model):
             'postalcode': self.postal_code,
             'country': self.country,
         }
-        url = f"https://nominatim.openstreetmap.org/search?{urlencode(params)}"
+        url = f"{settings.GEOCODER_URL}?{urlencode(params)}"
         response = requests.get(url)
         if response.status_code == 200:
             results = response.json()
@@ -132,8 +151,12 @@ class Event(models.Model):
     location = models.ForeignKey(Location, on_delete=models.CASCADE, verbose_name="Место проведения мероприятия")
     total_slots = models.PositiveIntegerField(verbose_name="Всего мест")
     is_upcoming = models.BooleanField(default=True, verbose_name="Предстоящее мероприятие")
-    image = models.ImageField(upload_to=event_image_file_path, verbose_name="Изображение для мероприятия")
+    # Пустое, пока первая загрузка не прошла проверку (race/images.py)
+    image = QuarantinedImageField(upload_to=event_image_file_path, verbose_name="Изображение для мероприятия")
     race_types = models.ManyToManyField(RaceType, verbose_name="Участвующие группы")
+    # Поддерживается сигналами race/signals.py, чтобы не считать отзывы на каждой странице
+    review_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Количество отзывов")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
 
     def get_absolute_url(self):
         """Getting the absolute event URL."""
@@ -143,14 +166,31 @@ class Event(models.Model):
         """Получение абсолютного URL для страницы регистраций мероприятия."""
         return reverse('event_registrations', kwargs={'event_slug': self.slug})
 
+    def get_reviews_url(self):
+        """Получение абсолютного URL для страницы отзывов о мероприятии."""
+        return reverse('event_reviews', kwargs={'event_slug': self.slug})
+
+    def get_results_url(self):
+        """Получение абсолютного URL для протокола результатов мероприятия."""
+        return reverse('event_results', kwargs={'event_slug': self.slug})
+
+    def get_live_url(self):
+        """Получение URL потока отметок хронометража (Server-Sent Events)."""
+        return reverse('live_results', kwargs={'event_slug': self.slug})
+
     def days_left(self):
         """Return days left for the event."""
         delta = self.start_datetime.date() - timezone.now().date()
         return delta.days
 
+    @property
+    def season(self):
+        """Year the event starts in (local time): the partition of its registrations."""
+        return timezone.localtime(self.start_datetime).year
+
     def get_free_slots(self):
         """Returns quantity of free slots or the event."""
-        registrations_count = EventRegistration.objects.filter(event=self, is_active=True).count()
+        registrations_count = EventRegistration.objects.for_event(self).filter(is_active=True).count()
         return self.total_slots - registrations_count
 
     def __str__(self):
@@ -184,20 +224,58 @@ class Event(models.Model):
 #         verbose_name_plural = "Регистрации на забеги"
 
 
+class SeasonField(models.PositiveSmallIntegerField):
+    """Season of a registration, copied from its event on every save (bulk_create included)."""
+
+    def pre_save(self, model_instance, add):
+        season = model_instance.event.season
+        setattr(model_instance, self.attname, season)
+        return season
+
+
+class E164Field(models.CharField):
+    """The registration's phone number in E.164, recomputed from phone_number on every save."""
+
+    def pre_save(self, model_instance, add):
+        value = normalize_phone(model_instance.phone_number) or ''
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+class EventRegistrationQuerySet(models.QuerySet):
+    def for_event(self, event):
+        """Registrations of an event; the season condition lets PostgreSQL read only its partition."""
+        return self.filter(event=event, season=event.season)
+
+
 class EventRegistration(models.Model):
-    """Model representing a user's registration for a race."""
+    """
+    Model representing a user's registration for a race.
+
+    The table is partitioned by season (race/partitions.py): its primary key in
+    the database is (id, season), and the foreign keys pointing at it are not
+    enforced by PostgreSQL, only by Django.
+    """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
                              verbose_name="Пользователь", related_name="registrations")
     event = models.ForeignKey(Event, on_delete=models.CASCADE, verbose_name="Мероприятие")
     race = models.ForeignKey(RaceType, on_delete=models.CASCADE, verbose_name="Участвующие группы")
     payment_document = models.FileField(upload_to=payment_docs_file_path, verbose_name="Документ об оплате")
     phone_number = PhoneNumberField(blank=True, null=True, verbose_name="Номер телефона")
+    # Для точного поиска по номеру в любой записи (race/phones.py)
+    phone_e164 = E164Field(max_length=16, blank=True, default='', editable=False, verbose_name="Телефон (E.164)")
+    bib_number = models.PositiveIntegerField(blank=True, null=True, verbose_name="Стартовый номер")
     city = models.CharField(max_length=255, verbose_name="Город")
     club = models.CharField(max_length=255, blank=True, null=True, verbose_name="Клуб")
     tshirt_size = models.CharField(max_length=3, choices=[('S', 'Small'), ('M', 'Medium'), ('L', 'Large')], verbose_name="Размер футболки")
     payment_confirmation = models.BooleanField(default=False, verbose_name="Подтверждение оплаты")
     registered_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата регистрации")
     is_active = models.BooleanField(default=True, verbose_name="Активная регистрация")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+    # Ключ секционирования таблицы; для запросов по мероприятию — EventRegistration.objects.for_event()
+    season = SeasonField(editable=False, verbose_name="Сезон")
+
+    objects = EventRegistrationQuerySet.as_manager()
 
     def __str__(self):
         return f"Регистрация {self.user} на {self.race} в мероприятии {self.event}"
@@ -205,6 +283,23 @@ class EventRegistration(models.Model):
     class Meta:
         verbose_name = "Регистрация на забег"
         verbose_name_plural = "Регистрации на забеги"
+        indexes = [
+            # MAX(updated_at) по мероприятию для валидаторов ETag/Last-Modified
+            models.Index(fields=['event', 'updated_at'], name='race_eventreg_event_upd_idx'),
+            # Иерархия дат и фильтр по дате регистрации в админке
+            models.Index(fields=['registered_at'], name='race_eventreg_registered_idx'),
+            # Поиск в админке (race/search.py): ILIKE '%...%' и нечёткое сравнение по триграммам
+            GinIndex(fields=['city'], opclasses=['gin_trgm_ops'], name='race_eventreg_city_trgm'),
+            GinIndex(fields=['club'], opclasses=['gin_trgm_ops'], name='race_eventreg_club_trgm'),
+            GinIndex(fields=['phone_e164'], opclasses=['gin_trgm_ops'], name='race_eventreg_phone_trgm'),
+            models.Index(fields=['phone_e164'], name='race_eventreg_phone_idx'),
+        ]
+        constraints = [
+            # Стартовый номер уникален в пределах мероприятия; по нему хронометраж находит участника.
+            # Уникальный индекс секционированной таблицы обязан включать ключ секционирования (сезон)
+            models.UniqueConstraint(fields=['event', 'bib_number', 'season'],
+                                    condition=models.Q(bib_number__isnull=False), name='race_eventreg_event_bib_uniq'),
+        ]
 
 
 
@@ -214,6 +309,7 @@ class EventSchedule(models.Model):
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="schedules", verbose_name="Мероприятие")
     start_time = models.TimeField(verbose_name="Время начала")
     description = models.CharField(max_length=255, verbose_name="Описание")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
 
     def __str__(self):
         return f"{self.start_time.strftime('%H:%M')} - {self.description}"
@@ -229,6 +325,7 @@ class Organizer(models.Model):
     contact = models.CharField(max_length=255, blank=True, verbose_name="Контактные данные")
     payment_details = models.TextField(blank=True, verbose_name="Реквизиты для оплаты")
     event = models.ManyToManyField(Event, related_name="organizers", verbose_name="Событие")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
 
     def __str__(self):
         return str(self.user)
@@ -246,6 +343,7 @@ class EventSummary(models.Model):
     text = models.TextField(blank=True, null=True, verbose_name="Резюме мероприятия")
     file = models.FileField(upload_to=event_protocol_file_path, verbose_name="Протокол мероприятия")
     uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
 
     def __str__(self):
         return f"Резюме для мероприятия {self.event.title}"
@@ -262,8 +360,9 @@ class GalleryPhoto(models.Model):
     """
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='photos', verbose_name="Мероприятие")
     title = models.CharField(max_length=255, blank=True, null=True, verbose_name='Заголовок')
-    photo = models.ImageField(upload_to=event_photos_file_path, verbose_name='Фотография')
+    photo = QuarantinedImageField(upload_to=event_photos_file_path, verbose_name='Фотография')
     uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
 
     def __str__(self):
         return f"Изображение для галереи {self.event.title}"
@@ -285,3 +384,308 @@ class Review(models.Model):
     class Meta:
         verbose_name = "Отзыв"
         verbose_name_plural = "Отзывы"
+        # Лента последних отзывов и отзывы мероприятия читаются по индексу, без сортировки всей таблицы
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='race_review_created_idx'),
+            models.Index(fields=['event', '-created_at', '-id'], name='race_review_event_created_idx'),
+        ]
+
+
+class StaticSnapshot(models.Model):
+    """
+    A public page pre-rendered to a file that nginx serves directly (see race/snapshots.py).
+    """
+    path = models.CharField(max_length=512, unique=True, verbose_name="Адрес страницы")
+    is_stale = models.BooleanField(default=True, db_index=True, verbose_name="Требует обновления")
+    valid_until = models.DateTimeField(blank=True, null=True, verbose_name="Актуален до")
+    rendered_at = models.DateTimeField(blank=True, null=True, verbose_name="Дата генерации")
+
+    def __str__(self):
+        return self.path
+
+    class Meta:
+        verbose_name = "Статическая копия страницы"
+        verbose_name_plural = "Статические копии страниц"
+
+
+class RaceResult(models.Model):
+    """
+    A runner's finish time and the places computed from it by race/ranking.py.
+    Only `status` and `finish_time` are entered; the other fields are recalculated
+    for the whole distance whenever a result of that distance changes.
+    """
+    STATUS_CHOICES = [
+        ('finished', 'Финишировал'),
+        ('dnf', 'Сошёл с дистанции'),
+        ('dsq', 'Дисквалифицирован'),
+        ('dns', 'Не стартовал'),
+    ]
+    # Ссылки на секционированную таблицу регистраций PostgreSQL не проверяет, каскад выполняет Django
+    registration = models.OneToOneField(EventRegistration, on_delete=models.CASCADE, related_name='result',
+                                        db_constraint=False, verbose_name="Регистрация")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='finished', verbose_name="Статус")
+    finish_time = models.DurationField(blank=True, null=True, verbose_name="Время")
+    # Копии полей регистрации и вычисленные места — заполняются race/ranking.py
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='results', editable=False,
+                              verbose_name="Мероприятие")
+    race = models.ForeignKey(RaceType, on_delete=models.CASCADE, editable=False, verbose_name="Забег")
+    distance = models.PositiveSmallIntegerField(editable=False, verbose_name="Дистанция")
+    age_group = models.CharField(max_length=16, blank=True, editable=False, verbose_name="Возрастная группа")
+    place_overall = models.PositiveIntegerField(blank=True, null=True, editable=False,
+                                                verbose_name="Место в абсолютном зачёте")
+    place_gender = models.PositiveIntegerField(blank=True, null=True, editable=False,
+                                               verbose_name="Место среди мужчин/женщин")
+    place_race = models.PositiveIntegerField(blank=True, null=True, editable=False, verbose_name="Место в забеге")
+    place_age_group = models.PositiveIntegerField(blank=True, null=True, editable=False,
+                                                  verbose_name="Место в возрастной группе")
+    pace = models.DurationField(blank=True, null=True, editable=False, verbose_name="Темп на километр")
+    gap_to_leader = models.DurationField(blank=True, null=True, editable=False, verbose_name="Отставание от лидера")
+    gap_in_race = models.DurationField(blank=True, null=True, editable=False,
+                                       verbose_name="Отставание от лидера забега")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    def save(self, *args, **kwargs):
+        registration = self.registration
+        # Прежняя дистанция тоже пересчитывается, если регистрацию перевели на другой забег
+        self._previous_distance = self.distance
+        self.event_id, self.race_id = registration.event_id, registration.race_id
+        self.distance = registration.race.distance
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Результат {self.registration.user} в мероприятии {self.event}"
+
+    class Meta:
+        verbose_name = "Результат"
+        verbose_name_plural = "Результаты"
+        indexes = [
+            # Протоколы читаются уже упорядоченными по месту
+            models.Index(fields=['event', 'distance', 'place_overall'], name='race_result_overall_idx'),
+            models.Index(fields=['event', 'race', 'place_race'], name='race_result_race_idx'),
+        ]
+
+
+class TimingRecord(models.Model):
+    """
+    A time reading sent by a timing station (split or finish) for a bib number.
+    The log is append-only: a correction is a new record, and the latest record
+    of a point wins. Records are streamed to spectators by race/live.py.
+    """
+    FINISH = 'finish'
+
+    id = models.BigAutoField(primary_key=True)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='timing_records',
+                              verbose_name="Мероприятие")
+    # Участник по стартовому номеру на момент приёма; пусто, если номер никому не выдан
+    registration = models.ForeignKey(EventRegistration, on_delete=models.SET_NULL, blank=True, null=True,
+                                     db_constraint=False, related_name='timing_records', verbose_name="Регистрация")
+    bib_number = models.PositiveIntegerField(verbose_name="Стартовый номер")
+    point = models.CharField(max_length=20, verbose_name="Точка хронометража")
+    elapsed = models.DurationField(verbose_name="Время от старта")
+    station = models.CharField(max_length=50, verbose_name="Станция")
+    sequence = models.PositiveBigIntegerField(verbose_name="Номер записи станции")
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата приёма")
+
+    def __str__(self):
+        return f"{self.bib_number} {self.point} {self.elapsed}"
+
+    class Meta:
+        verbose_name = "Отметка хронометража"
+        verbose_name_plural = "Отметки хронометража"
+        constraints = [
+            # Повторная отправка пакета станцией не создаёт дублей
+            models.UniqueConstraint(fields=['event', 'station', 'sequence'], name='race_timing_station_seq_uniq'),
+        ]
+        indexes = [
+            # Трансляция читает новые записи мероприятия по возрастанию id
+            models.Index(fields=['event', 'id'], name='race_timing_event_id_idx'),
+        ]
+
+
+class RegistrationAuditEntry(models.Model):
+    """
+    One change of a registration: who made it, where, and the old and new values
+    of the changed fields. The log is append-only and written by race/audit.py.
+    Registrations and events are referenced by id only, so the history outlives
+    deleted and archived registrations.
+    """
+    CREATED = 'created'
+    DEACTIVATED = 'deactivated'
+    REACTIVATED = 'reactivated'
+    PAYMENT_CONFIRMED = 'payment_confirmed'
+    CHANGED = 'changed'
+    DELETED = 'deleted'
+    TOGGLES_COMPACTED = 'toggles_compacted'
+    ACTIONS = [
+        (CREATED, 'Создана'),
+        (DEACTIVATED, 'Отменена'),
+        (REACTIVATED, 'Восстановлена'),
+        (PAYMENT_CONFIRMED, 'Оплата подтверждена'),
+        (CHANGED, 'Изменена'),
+        (DELETED, 'Удалена'),
+        (TOGGLES_COMPACTED, 'Отмены и восстановления (сжато)'),
+    ]
+
+    SITE = 'site'
+    ADMIN = 'admin'
+    SYSTEM = 'system'
+    SOURCES = [(SITE, 'Сайт'), (ADMIN, 'Админка'), (SYSTEM, 'Система')]
+
+    id = models.BigAutoField(primary_key=True)
+    registration_id = models.BigIntegerField(verbose_name="Регистрация")
+    event_id = models.BigIntegerField(verbose_name="Мероприятие")
+    actor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True,
+                              related_name='+', verbose_name="Кто изменил")
+    action = models.CharField(max_length=20, choices=ACTIONS, verbose_name="Действие")
+    source = models.CharField(max_length=10, choices=SOURCES, verbose_name="Источник")
+    # {"поле": [старое значение, новое значение]}
+    changes = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder, verbose_name="Изменения")
+    # Время самого изменения, а не записи в журнал; по нему упорядочена история (сжатые записи получают новые id)
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Дата изменения")
+
+    def __str__(self):
+        return f"{self.get_action_display()}: регистрация {self.registration_id}"
+
+    class Meta:
+        verbose_name = "Запись журнала регистраций"
+        verbose_name_plural = "Журнал регистраций"
+        indexes = [
+            # История одной регистрации и одного мероприятия по времени изменений
+            models.Index(fields=['registration_id', 'created_at'], name='race_audit_registration_idx'),
+            models.Index(fields=['event_id', 'created_at'], name='race_audit_event_idx'),
+            # Общая лента в админке и удаление старых записей
+            models.Index(fields=['created_at'], name='race_audit_created_idx'),
+        ]
+
+
+class ReminderDelivery(models.Model):
+    """
+    A pre-race reminder sent (or being sent) to one registration; written by
+    race/reminders.py. The unique key makes reruns skip registrations that
+    were already reminded.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Отправляется'), (SENT, 'Отправлено'), (FAILED, 'Ошибка')]
+
+    id = models.BigAutoField(primary_key=True)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='reminders', verbose_name="Мероприятие")
+    registration_id = models.BigIntegerField(verbose_name="Регистрация")
+    days_before = models.PositiveSmallIntegerField(verbose_name="За сколько дней")
+    # Дата старта в ключе: после переноса мероприятия напоминания уходят заново
+    start_date = models.DateField(verbose_name="Дата старта")
+    email = models.EmailField(verbose_name="Адрес")
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, verbose_name="Статус")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Дата постановки")
+    sent_at = models.DateTimeField(blank=True, null=True, verbose_name="Дата отправки")
+
+    def __str__(self):
+        return f"{self.email}: {self.event_id} за {self.days_before} дн."
+
+    class Meta:
+        verbose_name = "Напоминание о старте"
+        verbose_name_plural = "Напоминания о старте"
+        constraints = [
+            # Ключ идемпотентности: одно напоминание на регистрацию, срок и дату старта
+            models.UniqueConstraint(fields=['registration_id', 'days_before', 'start_date'],
+                                    name='race_reminder_once_uniq'),
+        ]
+
+
+class CanonicalName(models.Model):
+    """
+    One club or city of the dictionary built from registrations by
+    race/names.py: the canonical spelling, the normalized key the spellings
+    share, and how they were actually typed. Serves the autocomplete of the
+    registration form and the merge of variant spellings.
+    """
+    CLUB = 'club'
+    CITY = 'city'
+    KINDS = [(CLUB, 'Клуб'), (CITY, 'Город')]
+
+    kind = models.CharField(max_length=4, choices=KINDS, verbose_name="Вид")
+    # Правится в админке; пересборка словаря имя не меняет
+    name = models.CharField(max_length=255, verbose_name="Название")
+    # Строчные буквы без знаков препинания и слов вроде "клб" и "г."; по нему ищет автодополнение
+    key = models.CharField(max_length=255, verbose_name="Ключ")
+    spellings = ArrayField(models.CharField(max_length=255), default=list, blank=True, verbose_name="Написания")
+    registrations = models.PositiveIntegerField(default=0, verbose_name="Регистраций")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.name}"
+
+    class Meta:
+        verbose_name = "Клуб или город"
+        verbose_name_plural = "Словарь клубов и городов"
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'key'], name='race_canonical_name_key_uniq'),
+        ]
+        indexes = [
+            # LIKE 'префикс%' по индексу при любой сортировке базы
+            models.Index(fields=['kind', 'key'], opclasses=['varchar_pattern_ops', 'varchar_pattern_ops'],
+                         name='race_canonical_name_prefix_idx'),
+        ]
+
+
+class ImageUploadQuerySet(models.QuerySet):
+    def for_field(self, instance, field_name):
+        """Uploads to one field of one object."""
+        return self.filter(model=instance._meta.label_lower, object_id=instance.pk, field=field_name)
+
+
+class ImageUpload(models.Model):
+    """
+    An uploaded image waiting in quarantine, and what became of it: checked,
+    cleaned and published to its field by race/images.py, or rejected with the
+    reason shown to the uploader. A newer upload to the same field replaces a
+    pending one.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    REJECTED = 'rejected'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Проверяется'), (DONE, 'Опубликовано'), (REJECTED, 'Отклонено'), (FAILED, 'Ошибка')]
+
+    # Объект и поле, куда будет опубликовано изображение: 'race.event', 'users.user', ...
+    model = models.CharField(max_length=100, verbose_name="Модель")
+    object_id = models.BigIntegerField(verbose_name="ID объекта")
+    field = models.CharField(max_length=100, verbose_name="Поле")
+    original_name = models.CharField(max_length=255, verbose_name="Имя файла")
+    quarantine_name = models.CharField(max_length=255, verbose_name="Файл в карантине")
+    size = models.PositiveBigIntegerField(verbose_name="Размер, байт")
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, verbose_name="Статус")
+    # Причина отказа показывается загрузившему; для FAILED — текст исключения
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Неудачных попыток")
+    result = models.CharField(max_length=255, blank=True, verbose_name="Опубликованный файл")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Дата загрузки")
+    processed_at = models.DateTimeField(blank=True, null=True, verbose_name="Дата обработки")
+
+    objects = ImageUploadQuerySet.as_manager()
+
+    @classmethod
+    def queue(cls, instance, field_name, quarantine_name, original_name, size):
+        """Queue a quarantined file for the field, dropping the pending uploads it replaces."""
+        replaced = cls.objects.for_field(instance, field_name).filter(status__in=[cls.PENDING, cls.FAILED])
+        names = list(replaced.values_list('quarantine_name', flat=True))
+        replaced.delete()
+        upload = cls.objects.create(model=instance._meta.label_lower, object_id=instance.pk, field=field_name,
+                                    quarantine_name=quarantine_name, original_name=original_name[:255], size=size)
+        if names:
+            storage = uploads.quarantine_storage()
+            transaction.on_commit(lambda: [storage.delete(name) for name in names])
+        return upload
+
+    def __str__(self):
+        return f"{self.model} {self.object_id}, {self.field}: {self.original_name}"
+
+    class Meta:
+        verbose_name = "Загрузка изображения"
+        verbose_name_plural = "Загрузки изображений"
+        indexes = [
+            models.Index(fields=['status'], name='race_imageupload_status_idx'),
+            models.Index(fields=['model', 'object_id', 'field'], name='race_imageupload_target_idx'),
+        ]
@@ -0,0 +1,196 @@
+"""
+Dictionary of clubs and cities (CanonicalName), built from the free-text city
+and club of registrations.
+
+Spellings are grouped by a normalized key: lower case, ё as е, no punctuation
+or quotes, and without words such as "клб" or "г.", so "КЛБ «Бегущий город»"
+and "бегущий город" are one club. The most frequent spelling of a new key
+becomes its name; names edited in the admin are kept by later builds.
+
+- build() is the batch job (`name_dictionary`, run from cron): one GROUP BY per
+  field over the registrations and one upsert of the dictionary.
+- suggest() serves the autocomplete of the registration form: a prefix match
+  on the key, read through the varchar_pattern_ops index and cached per
+  prefix. The cache key carries a dictionary version; a build writes the
+  results for all short prefixes under a new version before switching to it,
+  so the popular prefixes are always in the cache.
+- canonical() maps what a runner typed to the dictionary name on save.
+- rewrite() replaces spellings in the registrations with set-based UPDATEs,
+  one per season partition: merge() turns given spellings into one name,
+  canonicalize() turns every spelling of an entry into its name. Both then
+  rebuild the dictionary.
+"""
+import re
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count
+
+from . import partitions
+from .models import CanonicalName, EventRegistration
+
+LOCK_NAMESPACE = 4101
+
+VERSION_KEY = 'race:names:version:{}'
+SUGGEST_KEY = 'race:names:suggest:{}:{}:{}'
+
+FIELDS = {CanonicalName.CLUB: 'club', CanonicalName.CITY: 'city'}
+# Слова, которые пишут или не пишут перед названием; в ключ не входят
+NOISE_WORDS = {
+    CanonicalName.CLUB: {'клб', 'клуб', 'кб', 'club', 'rc'},
+    CanonicalName.CITY: {'г', 'гор', 'город', 'пос', 'пгт'},
+}
+WORD_RE = re.compile(r'[^\W_]+')
+
+REWRITE_SQL = """
+    UPDATE race_eventregistration AS registration SET {field} = spelling.name, updated_at = now()
+    FROM unnest(%(spellings)s::text[], %(names)s::text[]) AS spelling(value, name)
+    WHERE registration.{field} = spelling.value {season}
+"""
+
+
+def name_key(kind, value):
+    """The key that all spellings of one club or city share; '' for a value with no letters."""
+    words = WORD_RE.findall(str(value or '').casefold().replace('ё', 'е'))
+    noise = NOISE_WORDS[kind]
+    meaningful = [word for word in words if word not in noise]
+    # "Клуб" без других слов — это и есть название
+    return ' '.join(meaningful or words)
+
+
+# Кэш подсказок
+
+def version(kind):
+    key = VERSION_KEY.format(kind)
+    value = cache.get(key)
+    if value is None:
+        # Версия вытеснена из кэша: новое значение не совпадёт ни с одним прежним
+        cache.add(key, time.time_ns(), None)
+        value = cache.get(key)
+    return value
+
+
+def suggest(kind, query):
+    """Dictionary names starting with the query, most used first."""
+    prefix = name_key(kind, query)[:CanonicalName._meta.get_field('key').max_length]
+    if not prefix:
+        return []
+    key = SUGGEST_KEY.format(kind, version(kind), prefix)
+    names = cache.get(key)
+    if names is None:
+        names = list(CanonicalName.objects.filter(kind=kind, key__startswith=prefix)
+                     .order_by('-registrations', 'name').values_list('name', flat=True)[:settings.NAMES_SUGGEST_LIMIT])
+        cache.set(key, names, settings.NAMES_CACHE_TIMEOUT)
+    return names
+
+
+def warm(kind):
+    """Cache the suggestions for every short prefix under a new version, then switch to it."""
+    top = defaultdict(list)
+    entries = CanonicalName.objects.filter(kind=kind).order_by('-registrations', 'name').values_list('key', 'name')
+    for key, name in entries.iterator(chunk_size=5000):
+        for length in range(1, min(len(key), settings.NAMES_WARM_PREFIX_LENGTH) + 1):
+            names = top[key[:length]]
+            if len(names) < settings.NAMES_SUGGEST_LIMIT:
+                names.append(name)
+    new_version = time.time_ns()
+    cache.set_many({SUGGEST_KEY.format(kind, new_version, prefix): names for prefix, names in top.items()},
+                   settings.NAMES_CACHE_TIMEOUT)
+    cache.set(VERSION_KEY.format(kind), new_version, None)
+    return len(top)
+
+
+def canonical(kind, value):
+    """The dictionary name for what was typed, or the value itself (stripped) if it is not in the dictionary."""
+    value = ' '.join(str(value or '').split())
+    key = name_key(kind, value)
+    if not key:
+        return value
+    name = CanonicalName.objects.filter(kind=kind, key=key).values_list('name', flat=True).first()
+    return name or value
+
+
+# Сборка словаря
+
+def lock():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, 0)', [LOCK_NAMESPACE])
+
+
+def spelling_counts(kind):
+    """{spelling: active registrations} of the field, in one GROUP BY."""
+    field = FIELDS[kind]
+    rows = (EventRegistration.objects.filter(is_active=True, **{f'{field}__gt': ''})
+            .order_by().values_list(field).annotate(count=Count('pk')))
+    return dict(rows)
+
+
+def build(kind):
+    """Rebuild the dictionary of one kind from the registrations; returns (entries, removed)."""
+    groups = defaultdict(Counter)
+    for spelling, count in spelling_counts(kind).items():
+        key = name_key(kind, spelling)
+        if key:
+            groups[key][spelling] += count
+    entries = [
+        CanonicalName(kind=kind, key=key, name=counts.most_common(1)[0][0], spellings=sorted(counts),
+                      registrations=sum(counts.values()))
+        for key, counts in groups.items()
+    ]
+    with transaction.atomic():
+        lock()
+        # Для существующих ключей название не трогаем: его могли исправить в админке
+        CanonicalName.objects.bulk_create(entries, batch_size=1000, update_conflicts=True,
+                                          unique_fields=['kind', 'key'],
+                                          update_fields=['spellings', 'registrations', 'updated_at'])
+        removed, _ = CanonicalName.objects.filter(kind=kind).exclude(key__in=list(groups)).delete()
+    warm(kind)
+    return len(entries), removed
+
+
+# Перезапись написаний в регистрациях
+
+def rewrite(kind, mapping):
+    """
+    Replace spellings in the registrations, {spelling: name}; one UPDATE per
+    season partition, each in its own transaction. Returns the rows changed.
+    """
+    mapping = {spelling: name for spelling, name in mapping.items() if spelling != name}
+    if not mapping:
+        return 0
+    params = {'spellings': list(mapping), 'names': list(mapping.values())}
+    seasons = [partition.season for partition in partitions.partitions()] if partitions.is_partitioned() else [None]
+    updated = 0
+    for season in seasons:
+        sql = REWRITE_SQL.format(field=FIELDS[kind], season='AND registration.season = %(season)s' if season else '')
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, {**params, 'season': season})
+            updated += cursor.rowcount
+    return updated
+
+
+def merge(kind, spellings, name):
+    """
+    Make `name` the spelling of all the given spellings in the registrations
+    and rebuild the dictionary, in which they now count towards the entry of
+    `name`. Returns the registrations changed.
+    """
+    updated = rewrite(kind, {spelling: name for spelling in spellings})
+    build(kind)
+    return updated
+
+
+def canonicalize(kind, entries=None):
+    """
+    Turn every spelling of the dictionary entries (all of the kind by default)
+    into the entry's name in the registrations. Returns the registrations changed.
+    """
+    if entries is None:
+        entries = CanonicalName.objects.filter(kind=kind)
+    mapping = {spelling: entry.name for entry in entries for spelling in entry.spellings}
+    updated = rewrite(kind, mapping)
+    build(kind)
+    return updated
@@ -0,0 +1,158 @@
+"""
+Season partitions of race_eventregistration.
+
+Registrations are partitioned by season, the year their event starts in
+(migration 0011). Queries for one event go through
+EventRegistration.objects.for_event(), which adds the season condition, so
+PostgreSQL reads only that season's partition and its indexes. Registrations
+for upcoming events live in the small current partitions instead of one heap
+and index set shared with every past season.
+
+A season needs its partition before the first registration arrives. The
+migration creates partitions a few seasons ahead, `registration_partitions
+--create-ahead` extends them, and saving an event for a season without one
+creates it (race/signals.py).
+
+Old seasons are taken out of the table with `registration_partitions
+--archive-before`:
+1. The partition is detached with DETACH PARTITION CONCURRENTLY, which does not
+   block queries on the other seasons.
+2. The partition is optionally exported to a gzipped CSV.
+3. It is then moved to the `archive` schema or dropped.
+There is no default partition, because it would prevent concurrent detaching.
+
+Payment documents stay as long as the rows naming them: sweep_media counts the
+file columns of the partitions in the archive schema as references
+(archived_file_paths), so it removes the documents of a season only once its
+partition is dropped. An export keeps the file names, not the files.
+"""
+import gzip
+import logging
+import os
+import re
+
+from django.db import connection, models
+
+from .models import EventRegistration
+
+logger = logging.getLogger(__name__)
+
+PARENT = EventRegistration._meta.db_table
+ARCHIVE_SCHEMA = 'archive'
+
+ARCHIVED_COLUMNS_SQL = """
+    SELECT table_name, column_name FROM information_schema.columns
+    WHERE table_schema = %s AND table_name LIKE %s AND column_name = ANY(%s)
+    ORDER BY table_name, column_name
+"""
+
+PARTITIONS_SQL = """
+    SELECT child.relname, pg_get_expr(child.relpartbound, child.oid), child.reltuples::bigint,
+           pg_total_relation_size(child.oid), inherits.inhdetachpending
+    FROM pg_inherits AS inherits
+    JOIN pg_class AS child ON child.oid = inherits.inhrelid
+    WHERE inherits.inhparent = %s::regclass
+"""
+
+
+class Partition:
+    __slots__ = ('name', 'season', 'rows', 'size', 'detach_pending')
+
+    def __init__(self, name, season, rows, size, detach_pending):
+        self.name = name
+        self.season = season
+        self.rows = rows
+        self.size = size
+        self.detach_pending = detach_pending
+
+
+def partition_name(season):
+    return f'{PARENT}_y{season}'
+
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [PARENT])
+        return cursor.fetchone() is not None
+
+
+def partitions():
+    """Partitions of the table ordered by season; `rows` is the planner's estimate (-1 before ANALYZE)."""
+    with connection.cursor() as cursor:
+        cursor.execute(PARTITIONS_SQL, [PARENT])
+        rows = cursor.fetchall()
+    result = []
+    for name, bound, tuples, size, detach_pending in rows:
+        # FOR VALUES FROM ('2024') TO ('2025')
+        season = int(re.search(r'\d+', bound).group())
+        result.append(Partition(name, season, tuples, size, detach_pending))
+    return sorted(result, key=lambda partition: partition.season)
+
+
+def create_partition(season):
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {partition_name(season)} PARTITION OF {PARENT} '
+                       f'FOR VALUES FROM (%s) TO (%s)', [season, season + 1])
+
+
+def ensure_partition(season):
+    """Create the season's partition unless it exists (a catalog lookup when it does)."""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [partition_name(season)])
+        if cursor.fetchone()[0] or not is_partitioned():
+            return False
+    create_partition(season)
+    logger.info('Created registration partition for season %s', season)
+    return True
+
+
+def linked_rows(partition):
+    """Results and timing records that point at registrations of the partition."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT (SELECT count(*) FROM race_raceresult AS result JOIN {partition.name} AS r '
+                       f'ON r.id = result.registration_id), '
+                       f'(SELECT count(*) FROM race_timingrecord AS record JOIN {partition.name} AS r '
+                       f'ON r.id = record.registration_id)')
+        return cursor.fetchone()
+
+
+def detach(partition):
+    """Detach without blocking the other seasons; must run outside a transaction."""
+    mode = 'FINALIZE' if partition.detach_pending else 'CONCURRENTLY'
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {PARENT} DETACH PARTITION {partition.name} {mode}')
+
+
+def export(table, path):
+    """Write the rows of a detached partition to a gzipped CSV file with a header."""
+    with connection.cursor() as cursor, gzip.open(path, 'wb') as fh:
+        cursor.cursor.copy_expert(f'COPY (SELECT * FROM {table} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)', fh)
+
+
+def archive(partition, export_dir=None, drop=False):
+    """Detach a season's partition, export it if asked, then move it to the archive schema or drop it."""
+    detach(partition)
+    if export_dir:
+        os.makedirs(export_dir, exist_ok=True)
+        export(partition.name, os.path.join(export_dir, f'{partition.name}.csv.gz'))
+    with connection.cursor() as cursor:
+        if drop:
+            cursor.execute(f'DROP TABLE {partition.name}')
+        else:
+            cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}')
+            cursor.execute(f'ALTER TABLE {partition.name} SET SCHEMA {ARCHIVE_SCHEMA}')
+
+
+def archived_file_paths():
+    """File names stored in the partitions moved to the archive schema."""
+    columns = [field.column for field in EventRegistration._meta.concrete_fields
+               if isinstance(field, models.FileField)]
+    paths = set()
+    with connection.cursor() as cursor:
+        # Колонки, добавленные после архивации сезона, в его таблице отсутствуют
+        cursor.execute(ARCHIVED_COLUMNS_SQL, [ARCHIVE_SCHEMA, f'{PARENT}\\_y%', columns])
+        for table, column in cursor.fetchall():
+            table, column = connection.ops.quote_name(table), connection.ops.quote_name(column)
+            cursor.execute(f"SELECT {column} FROM {ARCHIVE_SCHEMA}.{table} WHERE {column} <> ''")
+            paths.update(value for value, in cursor.fetchall())
+    return paths
@@ -0,0 +1,36 @@
+"""
+Phone numbers in E.164 (+79161234567).
+
+Registrations store the number as entered, formatted for people
+(PHONENUMBER_DB_FORMAT). The E.164 copy in EventRegistration.phone_e164 is what
+exact lookups compare: admin search and bank statement reconciliation.
+"""
+import re
+
+import phonenumbers
+from django.conf import settings
+from phonenumber_field.phonenumber import PhoneNumber
+
+NON_DIGIT_RE = re.compile(r'\D')
+
+
+def normalize_phone(value):
+    """Phone number in E.164, or None if it cannot be parsed."""
+    if not value:
+        return None
+    if isinstance(value, PhoneNumber):
+        # Значение поля модели уже разобрано, страна известна
+        return value.as_e164 if value.is_valid() else None
+    # Быстрый путь для российских номеров; полный разбор phonenumbers в десятки раз медленнее
+    digits = NON_DIGIT_RE.sub('', str(value))
+    if len(digits) == 11 and digits[0] in '78' and digits[1] in '3489':
+        return f'+7{digits[1:]}'
+    if len(digits) == 10 and digits[0] in '3489' and not str(value).lstrip().startswith('+'):
+        return f'+7{digits}'
+    try:
+        number = phonenumbers.parse(str(value), settings.PHONENUMBER_DEFAULT_REGION)
+    except phonenumbers.NumberParseException:
+        return None
+    if not phonenumbers.is_valid_number(number):
+        return None
+    return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
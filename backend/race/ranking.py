@@ -0,0 +1,244 @@
+"""
+Ranking engine for race results.
+
+Places are computed for a whole distance of an event at once: the results are
+loaded as columns with one query, every ranking (overall, by gender, by race
+type, by age group), pace and gaps to the leaders is computed with NumPy array
+operations, and only the rows whose values changed are written back with a
+single UPDATE ... FROM (VALUES ...) per batch.
+
+Ties share the better place ("1, 2, 2, 4"). Runners without a finish time or
+with a status other than "finished" get no places. Age is taken on the day of
+the event; age groups are per gender and bounded by RESULT_AGE_GROUPS.
+
+A saved or deleted RaceResult schedules a recompute of its distance after
+commit (race/signals.py), so a corrected time re-ranks only that distance.
+Results saved one by one in a transaction share a single recompute of their
+event, as a batch from a timing station does (race/timing.py).
+"""
+import threading
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from psycopg2.extras import execute_values
+
+from race_project.metrics import registry
+
+from .models import Event, RaceResult
+
+registry.describe('ranking_recompute_seconds', 'histogram', 'Duration of recomputing the places of a distance.')
+
+NULL = -1
+# Ключ рекомендательной блокировки PostgreSQL для пересчёта мест (второй ключ — id мероприятия)
+LOCK_NAMESPACE = 3601
+MICROSECOND = timedelta(microseconds=1)
+WRITE_BATCH_SIZE = 2000
+
+# Вычисляемые поля в порядке колонок VALUES
+COMPUTED_FIELDS = ['event_id', 'race_id', 'distance', 'age_group', 'place_overall', 'place_gender', 'place_race',
+                   'place_age_group', 'pace', 'gap_to_leader', 'gap_in_race']
+DURATION_FIELDS = {'pace', 'gap_to_leader', 'gap_in_race'}
+
+# Пересчёты, отложенные до фиксации транзакции, по id мероприятия (у каждого потока свои соединения)
+_scheduled = threading.local()
+
+UPDATE_SQL = """
+    UPDATE race_raceresult AS r SET
+        event_id = v.event_id,
+        race_id = v.race_id,
+        distance = v.distance,
+        age_group = v.age_group,
+        place_overall = NULLIF(v.place_overall, -1),
+        place_gender = NULLIF(v.place_gender, -1),
+        place_race = NULLIF(v.place_race, -1),
+        place_age_group = NULLIF(v.place_age_group, -1),
+        pace = CASE WHEN v.pace < 0 THEN NULL ELSE v.pace * INTERVAL '1 microsecond' END,
+        gap_to_leader = CASE WHEN v.gap_to_leader < 0 THEN NULL ELSE v.gap_to_leader * INTERVAL '1 microsecond' END,
+        gap_in_race = CASE WHEN v.gap_in_race < 0 THEN NULL ELSE v.gap_in_race * INTERVAL '1 microsecond' END,
+        updated_at = now()
+    FROM (VALUES %s) AS v(id, event_id, race_id, distance, age_group, place_overall, place_gender, place_race,
+                          place_age_group, pace, gap_to_leader, gap_in_race)
+    WHERE r.id = v.id
+"""
+
+
+def age_group_labels():
+    bounds = settings.RESULT_AGE_GROUPS
+    labels = [f'до {bounds[0]}']
+    labels += [f'{low}–{high - 1}' for low, high in zip(bounds, bounds[1:])]
+    labels.append(f'{bounds[-1]}+')
+    return labels
+
+
+def group_places(groups, times, ids):
+    """
+    Competition ranking of `times` within each group (ties share the better place).
+    Returns (places, leader_times) aligned with the input arrays.
+    """
+    count = len(times)
+    if not count:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    order = np.lexsort((ids, times, groups))
+    sorted_groups, sorted_times = groups[order], times[order]
+    positions = np.arange(count)
+    group_start = np.ones(count, dtype=bool)
+    group_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    first_in_group = np.maximum.accumulate(np.where(group_start, positions, 0))
+    time_start = group_start.copy()
+    time_start[1:] |= sorted_times[1:] != sorted_times[:-1]
+    first_with_time = np.maximum.accumulate(np.where(time_start, positions, 0))
+
+    places = np.empty(count, dtype=np.int64)
+    places[order] = first_with_time - first_in_group + 1
+    leaders = np.empty(count, dtype=np.int64)
+    leaders[order] = sorted_times[first_in_group]
+    return places, leaders
+
+
+def ages_on(day, birth_dates):
+    """Full years on `day` for an array of datetime64[D] birth dates (NaT gives -1)."""
+    years = birth_dates.astype('datetime64[Y]')
+    months = birth_dates.astype('datetime64[M]')
+    birth_year = years.astype(np.int64) + 1970
+    birth_month_day = (months - years).astype(np.int64) * 100 + (birth_dates - months).astype(np.int64)
+    day_month_day = (day.month - 1) * 100 + day.day - 1
+    ages = day.year - birth_year - (day_month_day < birth_month_day)
+    return np.where(np.isnat(birth_dates), NULL, ages)
+
+
+def compute(columns, event_day):
+    """
+    Compute the ranking columns. `columns` holds equally long arrays: id, finished
+    (bool), time (microseconds), race_id, distance, gender ('M'/'F'), birth_date
+    (datetime64[D]). Returns a dict of int64 arrays (NULL where undefined) plus
+    the 'age_group' labels.
+    """
+    count = len(columns['id'])
+    result = {name: np.full(count, NULL, dtype=np.int64) for name in (
+        'place_overall', 'place_gender', 'place_race', 'place_age_group', 'pace', 'gap_to_leader', 'gap_in_race')}
+    labels = np.array(age_group_labels(), dtype=object)
+
+    ages = ages_on(event_day, columns['birth_date'])
+    bins = np.digitize(ages, settings.RESULT_AGE_GROUPS)
+    has_age = ages >= 0
+    result['age_group'] = np.where(has_age, labels[bins], '')
+
+    finished = columns['finished']
+    ids, times = columns['id'][finished], columns['time'][finished]
+    distance = columns['distance'][finished]
+    gender = (columns['gender'][finished] == 'F').astype(np.int64)
+    gender_group = distance * 2 + gender
+
+    places, leaders = group_places(distance, times, ids)
+    result['place_overall'][finished] = places
+    result['gap_to_leader'][finished] = times - leaders
+    result['place_gender'][finished] = group_places(gender_group, times, ids)[0]
+    places, leaders = group_places(columns['race_id'][finished], times, ids)
+    result['place_race'][finished] = places
+    result['gap_in_race'][finished] = times - leaders
+    result['pace'][finished] = times // np.maximum(distance, 1)
+
+    ranked_by_age = finished & has_age
+    age_group = columns['distance'][ranked_by_age] * 2 * 100 + \
+        (columns['gender'][ranked_by_age] == 'F') * 100 + bins[ranked_by_age]
+    result['place_age_group'][ranked_by_age] = group_places(
+        age_group, columns['time'][ranked_by_age], columns['id'][ranked_by_age])[0]
+    return result
+
+
+def _micros(value):
+    return NULL if value is None else value // MICROSECOND
+
+
+def load(event, distances=None):
+    """The event's results (of the given distances) as columns, with the currently stored values."""
+    queryset = RaceResult.objects.filter(registration__event=event)
+    if distances is not None:
+        # Включаем и результаты, чья регистрация перешла на другую дистанцию
+        queryset = queryset.filter(Q(distance__in=distances) | Q(registration__race__distance__in=distances))
+    rows = list(queryset.values_list(
+        'id', 'status', 'finish_time', 'registration__race_id', 'registration__race__distance',
+        'registration__race__gender', 'registration__user__date_birth', *COMPUTED_FIELDS,
+    ))
+    fields = ['id', 'status', 'finish_time', 'new_race_id', 'new_distance', 'gender', 'birth_date',
+              *COMPUTED_FIELDS]
+    raw = dict(zip(fields, zip(*rows))) if rows else {name: () for name in fields}
+
+    columns = {
+        'id': np.array(raw['id'], dtype=np.int64),
+        'finished': np.array([status == 'finished' and time is not None
+                              for status, time in zip(raw['status'], raw['finish_time'])], dtype=bool),
+        'time': np.array([_micros(time) for time in raw['finish_time']], dtype=np.int64),
+        'race_id': np.array(raw['new_race_id'], dtype=np.int64),
+        'distance': np.array(raw['new_distance'], dtype=np.int64),
+        'gender': np.array(raw['gender'], dtype=object),
+        'birth_date': np.array(raw['birth_date'], dtype='datetime64[D]'),
+    }
+    stored = {
+        name: np.array([_micros(value) if name in DURATION_FIELDS else (NULL if value is None else value)
+                        for value in raw[name]], dtype=object if name == 'age_group' else np.int64)
+        for name in COMPUTED_FIELDS
+    }
+    return columns, stored
+
+
+def recompute(event, distances=None):
+    """Re-rank the event's results (only the given distances if set); returns the number of rows changed."""
+    if not isinstance(event, Event):
+        event = Event.objects.filter(pk=event).first()
+        if event is None:
+            return 0
+    started = timezone.now()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # Параллельные пересчёты одного мероприятия выполняются по очереди
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [LOCK_NAMESPACE, event.pk])
+        columns, stored = load(event, distances)
+        computed = compute(columns, timezone.localtime(event.start_datetime).date())
+        computed.update(event_id=np.full(len(columns['id']), event.pk, dtype=np.int64),
+                        race_id=columns['race_id'], distance=columns['distance'])
+
+        changed = np.zeros(len(columns['id']), dtype=bool)
+        for name in COMPUTED_FIELDS:
+            changed |= computed[name] != stored[name]
+        rows = list(zip(columns['id'][changed].tolist(), *(computed[name][changed].tolist()
+                                                            for name in COMPUTED_FIELDS)))
+        if rows:
+            with connection.cursor() as cursor:
+                execute_values(cursor.cursor, UPDATE_SQL, rows, page_size=WRITE_BATCH_SIZE)
+    registry.observe('ranking_recompute_seconds', (timezone.now() - started).total_seconds())
+    return len(rows)
+
+
+class ScheduledRecompute:
+    """A recompute of an event waiting for the commit, collecting the distances to re-rank."""
+
+    def __init__(self, event_id):
+        self.event_id = event_id
+        self.distances = set()
+
+    def __call__(self):
+        pending = _scheduled.__dict__.get('events', {})
+        if pending.get(self.event_id) is self:
+            del pending[self.event_id]
+        recompute(self.event_id, self.distances)
+
+
+def schedule_recompute(event_id, distances):
+    """
+    Re-rank the distances of the event once the current transaction commits.
+    Repeated calls in one transaction add their distances to the same recompute.
+    """
+    pending = _scheduled.__dict__.setdefault('events', {})
+    scheduled = pending.get(event_id)
+    # Колбэк пропадает при откате, в том числе точки сохранения: тогда регистрируется новый
+    if scheduled is not None and any(func is scheduled for _, func, *_ in connection.run_on_commit):
+        scheduled.distances.update(distances)
+        return
+    scheduled = pending[event_id] = ScheduledRecompute(event_id)
+    scheduled.distances.update(distances)
+    transaction.on_commit(scheduled)
@@ -0,0 +1,190 @@
+"""
+Reconciliation of bank statements with unpaid registrations.
+
+A statement line is matched by amount (the race's registration fee) together
+with the payer's phone number and/or name. Registrations are loaded with one
+query and indexed in hash tables keyed by (fee, phone) and (fee, name), so
+every statement line is matched with a few dictionary lookups and the whole
+statement is reconciled in a single pass. The keys are strings and sets of
+name words, which NumPy arrays (used by race/ranking.py) cannot look up any
+faster than a dict.
+
+Lines that point at exactly one registration, which no other line claims, are
+exact matches and are confirmed with a single UPDATE per chunk; everything else
+is reported for manual review.
+"""
+import csv
+import re
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from itertools import combinations
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import audit
+from .models import EventRegistration, RegistrationAuditEntry
+from .phones import normalize_phone
+
+EXACT = 'exact'
+AMBIGUOUS = 'ambiguous'
+CONFLICT = 'conflict'
+DUPLICATE = 'duplicate'
+UNMATCHED = 'unmatched'
+
+REASONS = {
+    AMBIGUOUS: 'Подходит несколько регистраций',
+    CONFLICT: 'Телефон и имя указывают на разные регистрации',
+    DUPLICATE: 'Регистрацию оплачивают несколько строк выписки',
+    UNMATCHED: 'Подходящая регистрация не найдена',
+}
+
+CONFIRM_CHUNK_SIZE = 5000
+
+PHONE_RE = re.compile(r'(?:\+7|\b8|\b7)[\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}\b')
+WORD_RE = re.compile(r'[^\W\d_]+')
+
+
+class StatementLine:
+    """One payment from the bank statement."""
+    __slots__ = ('number', 'amount', 'phone', 'name_keys', 'raw')
+
+    def __init__(self, number, amount, phone, name_keys, raw):
+        self.number = number
+        self.amount = amount
+        self.phone = phone
+        self.name_keys = name_keys
+        self.raw = raw
+
+
+class Match:
+    """Outcome for one statement line."""
+    __slots__ = ('line', 'status', 'registration_ids')
+
+    def __init__(self, line, status, registration_ids=()):
+        self.line = line
+        self.status = status
+        self.registration_ids = sorted(registration_ids)
+
+
+def normalize_amount(value):
+    """'1 500,00' -> Decimal('1500.00'); None if the value is not an amount."""
+    value = re.sub(r'[\s ]', '', str(value or '')).replace(',', '.')
+    try:
+        return Decimal(value).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        return None
+
+
+def name_words(value):
+    return [word.replace('ё', 'е') for word in WORD_RE.findall(str(value or '').casefold())]
+
+
+def name_key(last_name, first_name):
+    """Order-independent key of a person's last and first name."""
+    words = name_words(f'{last_name} {first_name}')
+    return frozenset(words) if len(words) >= 2 else None
+
+
+def payer_name_keys(value):
+    """
+    Keys for every combination of two or more words of the payer's name, so that
+    "Иванов Иван Петрович" matches "Иванов Иван" and "Петров-Водкин Кузьма" matches too.
+    """
+    words = list(dict.fromkeys(name_words(value)))[:4]
+    return {frozenset(combo) for size in range(2, len(words) + 1) for combo in combinations(words, size)}
+
+
+def read_statement(fh, amount_column, name_column=None, phone_column=None, purpose_column=None, delimiter=';'):
+    """Parse a CSV bank statement export into StatementLine objects."""
+    lines = []
+    for number, row in enumerate(csv.DictReader(fh, delimiter=delimiter), start=2):
+        amount = normalize_amount(row.get(amount_column))
+        if amount is None:
+            continue
+        phone = normalize_phone(row.get(phone_column)) if phone_column else None
+        if phone is None and purpose_column:
+            # Телефон часто указывают в назначении платежа
+            found = PHONE_RE.search(row.get(purpose_column) or '')
+            phone = normalize_phone(found.group()) if found else None
+        name_keys = payer_name_keys(row.get(name_column)) if name_column else set()
+        lines.append(StatementLine(number, amount, phone, name_keys, row))
+    return lines
+
+
+def unpaid_registrations(amounts, event=None):
+    """(id, fee, phone, last name, first name) of active unpaid registrations with one of the fees."""
+    queryset = EventRegistration.objects.filter(
+        is_active=True, payment_confirmation=False, race__registration_fee__in=amounts,
+    )
+    if event is not None:
+        queryset = queryset.for_event(event)
+    return queryset.values_list('id', 'race__registration_fee', 'phone_e164', 'user__last_name',
+                                'user__first_name').iterator(chunk_size=10000)
+
+
+def match_statement(lines, registrations):
+    """Match statement lines against (id, fee, phone, last name, first name) rows; returns a Match per line."""
+    by_phone = defaultdict(set)
+    by_name = defaultdict(set)
+    for registration_id, fee, phone, last_name, first_name in registrations:
+        fee = Decimal(fee).quantize(Decimal('0.01'))
+        phone = normalize_phone(phone)
+        if phone:
+            by_phone[fee, phone].add(registration_id)
+        key = name_key(last_name, first_name)
+        if key:
+            by_name[fee, key].add(registration_id)
+
+    matches = []
+    for line in lines:
+        phone_ids = by_phone.get((line.amount, line.phone), set()) if line.phone else None
+        name_ids = set().union(*(by_name.get((line.amount, key), ()) for key in line.name_keys)) \
+            if line.name_keys else None
+        if phone_ids and name_ids:
+            candidates = phone_ids & name_ids
+            status = CONFLICT if not candidates else None
+        else:
+            candidates = phone_ids or name_ids or set()
+            status = UNMATCHED if not candidates else None
+        if status is None:
+            status = EXACT if len(candidates) == 1 else AMBIGUOUS
+        matches.append(Match(line, status, candidates if status != CONFLICT else phone_ids | name_ids))
+
+    # Одна регистрация не может быть подтверждена двумя платежами
+    claims = defaultdict(list)
+    for match in matches:
+        if match.status == EXACT:
+            claims[match.registration_ids[0]].append(match)
+    for claimants in claims.values():
+        if len(claimants) > 1:
+            for match in claimants:
+                match.status = DUPLICATE
+    return matches
+
+
+def confirm(registration_ids):
+    """Confirm payment of the registrations; returns the number of rows updated."""
+    registration_ids = list(registration_ids)
+    updated = 0
+    now = timezone.now()
+    with audit.buffered(), transaction.atomic():
+        for start in range(0, len(registration_ids), CONFIRM_CHUNK_SIZE):
+            rows = list(EventRegistration.objects.filter(
+                pk__in=registration_ids[start:start + CONFIRM_CHUNK_SIZE], payment_confirmation=False,
+            ).select_for_update().values_list('pk', 'event_id'))
+            updated += EventRegistration.objects.filter(pk__in=[pk for pk, _ in rows]).update(
+                payment_confirmation=True, updated_at=now)
+            audit.record_many(rows, RegistrationAuditEntry.PAYMENT_CONFIRMED, source=RegistrationAuditEntry.SYSTEM,
+                              changes={'payment_confirmation': [False, True]})
+    return updated
+
+
+def write_report(matches, fh, delimiter=';'):
+    """Write the lines that need manual review as CSV."""
+    writer = csv.writer(fh, delimiter=delimiter)
+    writer.writerow(['Строка выписки', 'Сумма', 'Телефон', 'Причина', 'Регистрации'])
+    for match in matches:
+        if match.status != EXACT:
+            writer.writerow([match.line.number, match.line.amount, match.line.phone or '', REASONS[match.status],
+                             ' '.join(map(str, match.registration_ids))])
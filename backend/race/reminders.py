@@ -0,0 +1,302 @@
+"""
+Pre-race reminder emails.
+
+`send_reminders` runs daily from cron. It finds the events starting in N days
+and emails every active registrant:
+
+1. Recipients come from one joined query over registration, user and race
+   type. It skips registrations whose reminder was already sent or is being
+   sent.
+2. Recipients are processed in batches. Each batch is first claimed by
+   inserting its idempotency keys: a ReminderDelivery row, unique per
+   registration, number of days and start date. Only the rows this run
+   inserted are emailed, so a rerun or an overlapping run never sends twice.
+3. The claimed batch is rendered and handed to a small pool of SMTP
+   connections. The connections stay open across batches and share a rate
+   limit (REMINDER_RATE). The next batch is rendered while the previous one
+   is being sent.
+4. Delivered rows are marked sent. Rows the server refused are marked failed,
+   and the next run retries them.
+
+If a run crashes mid-batch, some rows stay pending. Those emails may or may
+not have gone out, so they are never resent automatically; the command
+reports them instead.
+"""
+import logging
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.template.loader import get_template
+from django.utils import timezone
+
+from race_project.throttling import LocalBucketStore, parse_rate
+
+from .models import Event, EventRegistration, ReminderDelivery
+
+logger = logging.getLogger(__name__)
+
+# Ключ рекомендательной блокировки PostgreSQL: одновременно работает один запуск рассылки
+LOCK_NAMESPACE = 4001
+BATCH_SIZE = 500
+# Многие SMTP-серверы ограничивают число писем за одну сессию
+MESSAGES_PER_CONNECTION = 200
+# Столько ждём подтверждения отправки, прежде чем считать запись зависшей
+STALE_AFTER = timedelta(hours=1)
+
+RECIPIENT_FIELDS = ('pk', 'user__email', 'user__first_name', 'user__last_name', 'user__username',
+                    'race__distance', 'bib_number')
+
+CLAIM_SQL = """
+    INSERT INTO race_reminderdelivery
+        (event_id, registration_id, days_before, start_date, email, status, error, created_at)
+    SELECT %(event)s, batch.registration_id, %(days)s, %(date)s, batch.email, %(pending)s, '', %(now)s
+    FROM unnest(%(ids)s::bigint[], %(emails)s::text[]) AS batch(registration_id, email)
+    ON CONFLICT (registration_id, days_before, start_date) DO UPDATE
+    SET status = EXCLUDED.status, email = EXCLUDED.email, error = '', created_at = EXCLUDED.created_at
+    WHERE race_reminderdelivery.status = %(failed)s
+    RETURNING registration_id
+"""
+
+MARK_SQL = """
+    UPDATE race_reminderdelivery SET status = %s, sent_at = %s, error = %s
+    WHERE registration_id = ANY(%s) AND days_before = %s AND start_date = %s
+"""
+
+
+class Recipient:
+    __slots__ = ('registration_id', 'email', 'first_name', 'last_name', 'username', 'distance', 'bib_number')
+
+    def __init__(self, registration_id, email, first_name, last_name, username, distance, bib_number):
+        self.registration_id = registration_id
+        self.email = email
+        self.first_name = first_name
+        self.last_name = last_name
+        self.username = username
+        self.distance = distance
+        self.bib_number = bib_number
+
+    @property
+    def name(self):
+        return self.first_name or self.username
+
+
+class Result:
+    __slots__ = ('event', 'days_before', 'recipients', 'sent', 'failed', 'deferred')
+
+    def __init__(self, event, days_before):
+        self.event = event
+        self.days_before = days_before
+        self.recipients = 0
+        self.sent = 0
+        self.failed = 0
+        # Не успели до конца отведённого времени; достанутся следующему запуску
+        self.deferred = 0
+
+
+class SmtpPool:
+    """
+    Sends messages over up to `size` SMTP connections, one per worker thread,
+    each reused for MESSAGES_PER_CONNECTION messages. All workers share one
+    token bucket of `rate` (e.g. '50/s').
+    """
+
+    def __init__(self, size, rate):
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='smtp')
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.capacity, self.rate = parse_rate(rate)
+        self.bucket = LocalBucketStore()
+
+    def wait_for_slot(self):
+        while True:
+            wait = self.bucket.take('reminders', self.capacity, self.rate)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def connection(self):
+        smtp = getattr(self.local, 'connection', None)
+        if smtp is None or self.local.sent >= MESSAGES_PER_CONNECTION:
+            if smtp is not None:
+                smtp.close()
+            smtp = get_connection(fail_silently=False)
+            smtp.open()
+            self.local.connection, self.local.sent = smtp, 0
+            with self.lock:
+                self.connections.append(smtp)
+        return smtp
+
+    def send_one(self, message):
+        """Send one message; returns None or the error."""
+        self.wait_for_slot()
+        for attempt in (1, 2):
+            try:
+                self.connection().send_messages([message])
+                self.local.sent += 1
+                return None
+            except smtplib.SMTPServerDisconnected as exc:
+                # Сервер закрыл простаивавшее соединение — открываем новое и пробуем ещё раз
+                self.local.connection = None
+                if attempt == 2:
+                    return repr(exc)
+            except (smtplib.SMTPException, OSError) as exc:
+                self.local.connection = None
+                return repr(exc)
+
+    def submit(self, messages):
+        return [self.executor.submit(self.send_one, message) for message in messages]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for smtp in self.connections:
+            smtp.close()
+
+
+def events_starting_in(days, today=None):
+    """Events whose start falls on the local day `days` days from today."""
+    day = (today or timezone.localdate()) + timedelta(days=days)
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+    return Event.objects.filter(start_datetime__gte=start, start_datetime__lt=end).select_related('location')
+
+
+def start_date_of(event):
+    return timezone.localtime(event.start_datetime).date()
+
+
+def recipients(event, days_before):
+    """Active registrants with an email who have not been reminded yet: one query."""
+    reminded = ReminderDelivery.objects.filter(
+        registration_id=OuterRef('pk'), days_before=days_before, start_date=start_date_of(event),
+        status__in=[ReminderDelivery.PENDING, ReminderDelivery.SENT],
+    )
+    rows = (EventRegistration.objects.for_event(event)
+            .filter(is_active=True, user__is_active=True).exclude(user__email='')
+            .filter(~Exists(reminded)).order_by('pk').values_list(*RECIPIENT_FIELDS))
+    return [Recipient(*row) for row in rows]
+
+
+def claim(event, days_before, batch):
+    """Insert the idempotency keys of a batch; returns the registration ids this run may email."""
+    with connection.cursor() as cursor:
+        cursor.execute(CLAIM_SQL, {
+            'event': event.pk, 'days': days_before, 'date': start_date_of(event), 'now': timezone.now(),
+            'ids': [recipient.registration_id for recipient in batch],
+            'emails': [recipient.email for recipient in batch],
+            'pending': ReminderDelivery.PENDING, 'failed': ReminderDelivery.FAILED,
+        })
+        return {row[0] for row in cursor.fetchall()}
+
+
+def mark(event, days_before, registration_ids, status, error=''):
+    if not registration_ids:
+        return
+    sent_at = timezone.now() if status == ReminderDelivery.SENT else None
+    with connection.cursor() as cursor:
+        cursor.execute(MARK_SQL, [status, sent_at, error, list(registration_ids), days_before, start_date_of(event)])
+
+
+class Renderer:
+    """Renders the reminders of one event; templates and the shared context are prepared once."""
+
+    def __init__(self, event, days_before):
+        self.event = event
+        self.days_before = days_before
+        self.text = get_template('race/email/reminder.txt')
+        self.html = get_template('race/email/reminder.html')
+        self.context = {
+            'event': event,
+            'days_before': days_before,
+            'start': timezone.localtime(event.start_datetime),
+            'event_url': settings.EMAIL_PAGE_DOMAIN.rstrip('/') + event.get_absolute_url(),
+        }
+        self.subject = get_template('race/email/reminder_subject.txt').render(self.context).strip()
+        self.domain = settings.EMAIL_FROM_ADDRESS.rpartition('@')[2] or 'localhost'
+        self.start_key = start_date_of(event).strftime('%Y%m%d')
+
+    def message(self, recipient):
+        context = dict(self.context, recipient=recipient)
+        message = EmailMultiAlternatives(
+            self.subject, self.text.render(context), settings.EMAIL_FROM_ADDRESS, [recipient.email],
+            # Постоянный Message-ID: почтовые серверы отбросят дубль, даже если письмо всё же уйдёт дважды
+            headers={'Message-ID': f'<reminder.{recipient.registration_id}.{self.days_before}.{self.start_key}'
+                                   f'@{self.domain}>'},
+        )
+        message.attach_alternative(self.html.render(context), 'text/html')
+        return message
+
+
+def finish(event, days_before, sending, result):
+    """Wait for a batch and record the outcome of each message."""
+    sent, failed = [], {}
+    for registration_id, future in sending:
+        error = future.result()
+        if error is None:
+            sent.append(registration_id)
+        else:
+            failed.setdefault(error, []).append(registration_id)
+    mark(event, days_before, sent, ReminderDelivery.SENT)
+    for error, registration_ids in failed.items():
+        logger.warning('Reminder for %d registration(s) of %s failed: %s', len(registration_ids), event.slug, error)
+        mark(event, days_before, registration_ids, ReminderDelivery.FAILED, error)
+    result.sent += len(sent)
+    result.failed += sum(len(registration_ids) for registration_ids in failed.values())
+
+
+def send(event, days_before, pool, deadline, batch_size=BATCH_SIZE):
+    """Remind the registrants of one event; stops claiming new batches at `deadline` (monotonic time)."""
+    result = Result(event, days_before)
+    pending = recipients(event, days_before)
+    result.recipients = len(pending)
+    renderer = Renderer(event, days_before)
+    sending = None
+    for start in range(0, len(pending), batch_size):
+        if time.monotonic() >= deadline:
+            result.deferred = len(pending) - start
+            break
+        batch = pending[start:start + batch_size]
+        claimed = claim(event, days_before, batch)
+        messages = [(recipient.registration_id, renderer.message(recipient))
+                    for recipient in batch if recipient.registration_id in claimed]
+        futures = pool.submit([message for _, message in messages])
+        # Пока уходит эта порция, записываем итог предыдущей
+        if sending:
+            finish(event, days_before, sending, result)
+        sending = [(registration_id, future) for (registration_id, _), future in zip(messages, futures)]
+    if sending:
+        finish(event, days_before, sending, result)
+    return result
+
+
+def stale_count():
+    """Claimed reminders never confirmed as sent, most likely after a crash."""
+    return ReminderDelivery.objects.filter(status=ReminderDelivery.PENDING,
+                                           created_at__lt=timezone.now() - STALE_AFTER).count()
+
+
+def run(days, connections=None, rate=None, max_seconds=None, batch_size=BATCH_SIZE):
+    """
+    Send the reminders of every event starting in each of `days` days.
+    Returns the results, or None if another run holds the lock.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s, 0)', [LOCK_NAMESPACE])
+        if not cursor.fetchone()[0]:
+            return None
+    pool = SmtpPool(connections or settings.REMINDER_SMTP_CONNECTIONS, rate or settings.REMINDER_RATE)
+    deadline = time.monotonic() + max_seconds if max_seconds else float('inf')
+    try:
+        return [send(event, days_before, pool, deadline, batch_size)
+                for days_before in days for event in events_starting_in(days_before)]
+    finally:
+        pool.close()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s, 0)', [LOCK_NAMESPACE])
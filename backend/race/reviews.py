@@ -0,0 +1,31 @@
+"""
+Cached feed of the latest reviews shown on the main page.
+
+The feed is read with an index scan over race_review_created_idx and kept in the
+cache until a review is saved or deleted (race/signals.py) or the timeout runs out.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Review
+
+LATEST_REVIEWS_CACHE_KEY = 'race:latest_reviews'
+LATEST_REVIEWS_COUNT = 5
+
+
+def latest_reviews():
+    """The newest reviews with their event and author, from the cache when possible."""
+    reviews = cache.get(LATEST_REVIEWS_CACHE_KEY)
+    if reviews is None:
+        # В кэш попадают только поля, нужные шаблону (без пароля и e-mail автора)
+        reviews = list(
+            Review.objects.select_related('event', 'author').only(
+                'text', 'created_at', 'event__title', 'event__slug', 'author__first_name', 'author__last_name',
+            ).order_by('-created_at', '-id')[:LATEST_REVIEWS_COUNT]
+        )
+        cache.set(LATEST_REVIEWS_CACHE_KEY, reviews, settings.LATEST_REVIEWS_CACHE_TIMEOUT)
+    return reviews
+
+
+def invalidate_latest_reviews():
+    cache.delete(LATEST_REVIEWS_CACHE_KEY)
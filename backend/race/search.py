@@ -0,0 +1,100 @@
+"""
+Search of registrations in the admin: by the runner's last name, first name
+and email, by phone number, club and city.
+
+Every word of the query has to match one of the fields, as in the standard
+admin search, but each field is looked up through its own index, and the
+matches are combined with UNION instead of one WHERE with OR across two
+tables, which PostgreSQL can only answer by reading the whole table:
+
+- names and email: the users matching the word (trigram GIN indexes on
+  users_user), then their registrations by user_id;
+- city and club: trigram GIN indexes, which serve ILIKE '%word%' (the
+  trgm_icontains lookup of race/lookups.py: icontains would compare
+  UPPER(column), which the indexes do not cover);
+- phone: a word that is a phone number in any format is looked up by its
+  E.164 form (btree on phone_e164); four or more digits, a fragment of a
+  number, by the trigram index on phone_e164.
+
+A whole query that is one phone number, "+7 (916) 123-45-67" say, is a single
+exact lookup. When a word matches nothing, it is looked up once more by
+trigram word similarity (pg_trgm `%>`), so "Иванва" still finds Ivanova.
+"""
+import re
+
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.utils.text import smart_split, unescape_string_literal
+
+from .phones import NON_DIGIT_RE, normalize_phone
+
+# Меньше трёх символов — нет ни одной триграммы, индекс не помогает
+MIN_FUZZY_LENGTH = 3
+MIN_PHONE_DIGITS = 4
+# Номер или его часть: цифры и то, чем их разделяют при записи
+PHONE_RE = re.compile(r'^\+?[\d\s()-]+$')
+
+
+def split_words(term):
+    """Words of the query, quoted phrases kept whole, as the standard admin search splits them."""
+    words = []
+    for word in smart_split(term):
+        if word[0] in '"\'' and word[0] == word[-1]:
+            word = unescape_string_literal(word)
+        if word:
+            words.append(word)
+    return words
+
+
+def phone_queries(queryset, word):
+    if not PHONE_RE.match(word):
+        return []
+    e164 = normalize_phone(word)
+    if e164:
+        return [queryset.filter(phone_e164=e164)]
+    digits = NON_DIGIT_RE.sub('', word)
+    if len(digits) >= MIN_PHONE_DIGITS:
+        return [queryset.filter(phone_e164__contains=digits)]
+    return []
+
+
+def word_queries(queryset, word):
+    """Querysets of the registrations one word matches, one per index."""
+    users = get_user_model().objects.filter(
+        Q(last_name__trgm_icontains=word) | Q(first_name__trgm_icontains=word) | Q(email__trgm_icontains=word))
+    return [
+        queryset.filter(user__in=users.values('pk')),
+        queryset.filter(city__trgm_icontains=word),
+        queryset.filter(club__trgm_icontains=word),
+        *phone_queries(queryset, word),
+    ]
+
+
+def fuzzy_queries(queryset, word):
+    """Querysets of the registrations where some word of a field is similar to `word`."""
+    users = get_user_model().objects.filter(
+        Q(last_name__trigram_word_similar=word) | Q(first_name__trigram_word_similar=word))
+    return [
+        queryset.filter(user__in=users.values('pk')),
+        queryset.filter(city__trigram_word_similar=word),
+        queryset.filter(club__trigram_word_similar=word),
+    ]
+
+
+def union_pks(queries):
+    first, *rest = [query.order_by().values('pk') for query in queries]
+    return first.union(*rest) if rest else first
+
+
+def search_registrations(queryset, term):
+    """`queryset` narrowed to the registrations matching the search query."""
+    base = queryset.model._default_manager.all()
+    e164 = normalize_phone(term) if PHONE_RE.match(term) else None
+    if e164:
+        return queryset.filter(phone_e164=e164)
+    for word in split_words(term):
+        matches = queryset.filter(pk__in=union_pks(word_queries(base, word)))
+        if len(word) >= MIN_FUZZY_LENGTH and not PHONE_RE.match(word) and not matches.exists():
+            matches = queryset.filter(pk__in=union_pks(fuzzy_queries(base, word)))
+        queryset = matches
+    return queryset
@@ -0,0 +1,182 @@
+"""
+Signal handlers of the race app.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import api, partitions, ranking, reviews, snapshots
+from .models import (Event, EventRegistration, EventSchedule, EventSummary, GalleryPhoto, Location, Organizer,
+                     RaceResult, RaceType, Review)
+
+
+def touch_events(**filters):
+    """Bump Event.updated_at so HTTP validators of the affected pages change."""
+    Event.objects.filter(**filters).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=EventSchedule)
+@receiver(post_delete, sender=EventSummary)
+@receiver(post_delete, sender=GalleryPhoto)
+@receiver(post_delete, sender=Review)
+@receiver(post_delete, sender=EventRegistration)
+def event_dependent_deleted(sender, instance, **kwargs):
+    # Удаление не оставляет метки времени, поэтому обновляем само мероприятие
+    touch_events(pk=instance.event_id)
+
+
+@receiver(pre_delete, sender=RaceType)
+def race_type_deleted(sender, instance, **kwargs):
+    touch_events(race_types=instance)
+
+
+@receiver(pre_delete, sender=Organizer)
+def organizer_deleted(sender, instance, **kwargs):
+    touch_events(organizers=instance)
+
+
+@receiver(m2m_changed, sender=Event.race_types.through)
+@receiver(m2m_changed, sender=Organizer.event.through)
+def event_links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Race types or organizers were attached to or detached from events."""
+    if isinstance(instance, Event):
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            touch_events(pk=instance.pk)
+    elif action in ('post_add', 'post_remove'):
+        touch_events(pk__in=pk_set)
+    elif action == 'pre_clear':
+        touch_events(**{'race_types' if isinstance(instance, RaceType) else 'organizers': instance})
+
+
+def refresh_snapshots(**filters):
+    """Mark the snapshots showing the matching events as stale once the transaction commits."""
+    event_ids = list(Event.objects.filter(**filters).values_list('pk', flat=True))
+
+    def mark():
+        events = Event.objects.filter(pk__in=event_ids).only('slug', 'start_datetime')
+        snapshots.mark_stale(snapshots.paths_for_events(events))
+
+    transaction.on_commit(mark)
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def event_changed(sender, instance, **kwargs):
+    paths = snapshots.paths_for_events([instance])
+    transaction.on_commit(lambda: snapshots.mark_stale(paths))
+
+
+@receiver(post_save, sender=EventSchedule)
+@receiver(post_delete, sender=EventSchedule)
+@receiver(post_save, sender=EventSummary)
+@receiver(post_delete, sender=EventSummary)
+@receiver(post_save, sender=GalleryPhoto)
+@receiver(post_delete, sender=GalleryPhoto)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def event_content_changed(sender, instance, **kwargs):
+    refresh_snapshots(pk=instance.event_id)
+
+
+@receiver(post_save, sender=RaceType)
+@receiver(pre_delete, sender=RaceType)
+def race_type_changed(sender, instance, **kwargs):
+    refresh_snapshots(race_types=instance)
+
+
+@receiver(post_save, sender=Organizer)
+@receiver(pre_delete, sender=Organizer)
+def organizer_changed(sender, instance, **kwargs):
+    refresh_snapshots(organizers=instance)
+
+
+@receiver(post_save, sender=Location)
+def location_changed(sender, instance, created, **kwargs):
+    # Адрес показывают страницы прошедших мероприятий и ленты предстоящих
+    if not created:
+        refresh_snapshots(location=instance)
+
+
+@receiver(m2m_changed, sender=Event.race_types.through)
+@receiver(m2m_changed, sender=Organizer.event.through)
+def event_links_changed_snapshots(sender, instance, action, pk_set, **kwargs):
+    if isinstance(instance, Event):
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_snapshots(pk=instance.pk)
+    elif action in ('post_add', 'post_remove'):
+        refresh_snapshots(pk__in=pk_set)
+    elif action == 'pre_clear':
+        refresh_snapshots(**{'race_types' if isinstance(instance, RaceType) else 'organizers': instance})
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    if created:
+        Event.objects.filter(pk=instance.event_id).update(review_count=F('review_count') + 1)
+    transaction.on_commit(reviews.invalidate_latest_reviews)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    Event.objects.filter(pk=instance.event_id, review_count__gt=0).update(review_count=F('review_count') - 1)
+    transaction.on_commit(reviews.invalidate_latest_reviews)
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def event_changed_reviews(sender, instance, **kwargs):
+    # Лента отзывов показывает название мероприятия
+    transaction.on_commit(reviews.invalidate_latest_reviews)
+
+
+@receiver(post_save, sender=RaceResult)
+@receiver(post_delete, sender=RaceResult)
+def result_changed(sender, instance, **kwargs):
+    """A time was entered or corrected: re-rank its distance (and the one it left)."""
+    distances = {instance.distance, getattr(instance, '_previous_distance', None)} - {None}
+    ranking.schedule_recompute(instance.event_id, distances)
+
+
+@receiver(post_save, sender=Event)
+def event_season_changed(sender, instance, **kwargs):
+    """Registrations follow their event into the partition of its (possibly new) season."""
+    season = instance.season
+    partitions.ensure_partition(season)
+    EventRegistration.objects.filter(event=instance).exclude(season=season).update(season=season)
+
+
+# Версии кэшированных ответов JSON API (race/api.py)
+
+API_TOPICS = {
+    Event: api.EVENTS,
+    Location: api.LOCATIONS,
+    RaceType: api.RACE_TYPES,
+    EventSchedule: api.SCHEDULES,
+    EventRegistration: api.REGISTRATIONS,
+    # Отзывы меняют Event.review_count через update(), без сигнала мероприятия
+    Review: api.EVENTS,
+}
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+@receiver(post_save, sender=RaceType)
+@receiver(post_delete, sender=RaceType)
+@receiver(post_save, sender=EventSchedule)
+@receiver(post_delete, sender=EventSchedule)
+@receiver(post_save, sender=EventRegistration)
+@receiver(post_delete, sender=EventRegistration)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def api_topic_changed(sender, instance, **kwargs):
+    api.bump(API_TOPICS[sender])
+
+
+@receiver(m2m_changed, sender=Event.race_types.through)
+def api_race_types_linked(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        api.bump(api.RACE_TYPES)
@@ -0,0 +1,179 @@
+"""
+Pre-rendered snapshots of public pages.
+
+Anonymous versions of pages that do not depend on live registration counts are
+rendered to files under SNAPSHOT_ROOT, which nginx serves directly to anonymous
+visitors (falling through to Django when a file is missing):
+
+    /contact/                         -> contact/index.html
+    /pricing/                         -> pricing/index.html
+    /event-detail/<slug>/             -> event-detail/<slug>/index.html  (past events only)
+    /events/?filter=past[&page=N]     -> events/past/page-N.html
+    /events/feed.{ics,rss,atom}       -> events/feed.{ics,rss,atom}       (upcoming events, race/feeds.py)
+
+Every snapshot has a StaticSnapshot row. Signal handlers mark the rows affected
+by a changed Event, RaceType, GalleryPhoto, EventSummary or Review as stale, and
+the build_snapshots command re-renders only stale or expired rows.
+"""
+import logging
+import math
+import os
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Q
+from django.http import Http404
+from django.test import RequestFactory
+from django.urls import Resolver404, resolve, reverse
+from django.utils import timezone
+
+from .models import Event, StaticSnapshot
+from .views import EventsView
+
+logger = logging.getLogger(__name__)
+
+PAST_ARCHIVE_URL = '/events/?filter=past'
+FEED_URLS = ['/events/feed.ics', '/events/feed.rss', '/events/feed.atom']
+
+
+def archive_url(page):
+    return PAST_ARCHIVE_URL if page == 1 else f'/events/?page={page}&filter=past'
+
+
+def snapshot_file(path):
+    """Location of a page's snapshot relative to SNAPSHOT_ROOT (mirrors conf/nginx.conf)."""
+    parts = urlsplit(path)
+    if os.path.splitext(parts.path)[1]:
+        # Ленты отдаются файлами под своими именами
+        return parts.path.lstrip('/')
+    if parts.path == '/events/':
+        page = parse_qs(parts.query).get('page', ['1'])[0]
+        return os.path.join('events', 'past', f'page-{page}.html')
+    return os.path.join(parts.path.strip('/'), 'index.html')
+
+
+def archive_urls():
+    past_count = Event.objects.filter(start_datetime__lt=timezone.now()).count()
+    pages = max(1, math.ceil(past_count / EventsView.paginate_by))
+    return [archive_url(page) for page in range(1, pages + 1)]
+
+
+def expected_paths():
+    """All pages that should currently have a snapshot."""
+    paths = [reverse('contact'), reverse('pricing')] + FEED_URLS
+    paths += archive_urls()
+    past_events = Event.objects.filter(start_datetime__lt=timezone.now()).only('slug')
+    paths += [event.get_absolute_url() for event in past_events]
+    return paths
+
+
+def paths_for_events(events):
+    """Snapshots showing any of the given events."""
+    paths = set()
+    now = timezone.now()
+    any_past = False
+    for event in events:
+        if event.start_datetime < now:
+            paths.add(event.get_absolute_url())
+            any_past = True
+        else:
+            paths.add(reverse('pricing'))
+            paths.update(FEED_URLS)
+    if any_past:
+        # Страницы архива одни на все прошедшие мероприятия: один COUNT на вызов
+        paths.update(archive_urls())
+    return paths
+
+
+def mark_stale(paths):
+    """Flag snapshots for re-rendering, creating rows for pages that have none yet."""
+    paths = set(paths)
+    if not paths:
+        return
+    StaticSnapshot.objects.bulk_create([StaticSnapshot(path=path) for path in paths], ignore_conflicts=True)
+    StaticSnapshot.objects.filter(path__in=paths, is_stale=False).update(is_stale=True)
+
+
+def next_event_start():
+    """The moment the pricing page and the archive change on their own: the next event starts."""
+    return Event.objects.filter(start_datetime__gte=timezone.now()).order_by('start_datetime') \
+        .values_list('start_datetime', flat=True).first()
+
+
+def render_page(path):
+    """Render a page as an anonymous visitor would get it; returns (status, html)."""
+    parts = urlsplit(path)
+    match = resolve(parts.path)
+    host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+    request = RequestFactory().get(path, SERVER_NAME=host)
+    request.user = AnonymousUser()
+    request.resolver_match = match
+    response = match.func(request, *match.args, **match.kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response.status_code, response.content
+
+
+def write_file(relative_path, content):
+    path = os.path.join(settings.SNAPSHOT_ROOT, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fh:
+        fh.write(content)
+    os.replace(tmp_path, path)
+
+
+def remove_file(relative_path):
+    try:
+        os.remove(os.path.join(settings.SNAPSHOT_ROOT, relative_path))
+    except FileNotFoundError:
+        pass
+
+
+def build(rebuild_all=False):
+    """Render stale, expired and missing snapshots (or all of them); returns (rendered, removed)."""
+    now = timezone.now()
+    expected = set(expected_paths())
+    known = set(StaticSnapshot.objects.values_list('path', flat=True))
+    mark_stale(expected - known)
+    # Страницы, которые больше не должны существовать (архив стал короче, мероприятие перенесли)
+    mark_stale(known - expected)
+
+    snapshots = StaticSnapshot.objects.all()
+    if not rebuild_all:
+        snapshots = snapshots.filter(Q(is_stale=True) | Q(valid_until__lte=now))
+
+    expires = next_event_start()
+    rendered = removed = 0
+    for snapshot in snapshots:
+        relative_path = snapshot_file(snapshot.path)
+        if snapshot.path not in expected:
+            remove_file(relative_path)
+            snapshot.delete()
+            removed += 1
+            continue
+        # Снимаем флаг до рендеринга: изменения во время рендеринга снова пометят страницу
+        StaticSnapshot.objects.filter(pk=snapshot.pk).update(is_stale=False)
+        try:
+            status, content = render_page(snapshot.path)
+        except (Resolver404, Http404):
+            status, content = 404, b''
+        except Exception:
+            # Страницу отдаёт Django, пока очередное изменение снова не пометит её
+            logger.exception('Snapshot of %s failed to render', snapshot.path)
+            remove_file(relative_path)
+            continue
+        if status != 200:
+            logger.warning('Snapshot of %s not rendered: status %s', snapshot.path, status)
+            remove_file(relative_path)
+            snapshot.delete()
+            removed += 1
+            continue
+        write_file(relative_path, content)
+        # Цены, архив и ленты меняются сами, когда начинается очередное мероприятие
+        is_time_dependent = snapshot.path == reverse('pricing') or snapshot.path.startswith('/events/')
+        StaticSnapshot.objects.filter(pk=snapshot.pk).update(
+            rendered_at=now, valid_until=expires if is_time_dependent else None)
+        rendered += 1
+    return rendered, removed
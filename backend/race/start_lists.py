@@ -0,0 +1,180 @@
+"""
+Printable start lists and bib sheets, generated off-request.
+
+For every event that has not started yet (or started less than a day ago) the
+build_start_lists command writes two print-ready HTML documents under
+START_LIST_ROOT:
+
+    <slug>/start-list.html  - paid, active runners grouped by race type, by bib number
+    <slug>/bibs.html        - one sheet per allocated bib number, in number order
+    <slug>/VERSION          - registration version the documents were built from
+
+The documents carry the runners' birth years, which the public pages do not
+show, so only staff get them: the start_list_document view checks the user
+and has nginx send the file from its internal location START_LIST_URL
+(X-Accel-Redirect).
+
+The registration version is a hash of the event's row, the number and newest
+updated_at of its registrations and the newest updated_at of its race types,
+read together with the events in one query over race_eventreg_event_upd_idx.
+Deletions of registrations and race types bump Event.updated_at
+(race/signals.py), so any change to what the documents show gives a new
+version. The documents of an event are rebuilt only when the version differs
+from the one in its VERSION file; each build is a single joined query over the
+registrations and their users. Renaming a user does not touch the
+registration, so the next change or `build_start_lists --all` picks it up.
+"""
+import logging
+import os
+from datetime import timedelta
+from hashlib import md5
+from itertools import groupby
+
+from django.conf import settings
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Event, EventRegistration, RaceType
+
+logger = logging.getLogger(__name__)
+
+START_LIST_FILE = 'start-list.html'
+BIB_SHEETS_FILE = 'bibs.html'
+VERSION_FILE = 'VERSION'
+DOCUMENTS = (START_LIST_FILE, BIB_SHEETS_FILE)
+
+# Протоколы нужны и в день старта, поэтому начавшиеся мероприятия обновляются ещё сутки
+KEEP_AFTER_START = timedelta(days=1)
+
+RUNNER_FIELDS = ('race__distance', 'race__gender', 'race__min_age', 'race_id', 'bib_number', 'user__last_name',
+                 'user__first_name', 'user__username', 'user__date_birth', 'city', 'club')
+GENDERS = dict(RaceType.GENDER_CHOICES)
+
+
+class Runner:
+    """One line of a start list."""
+    __slots__ = ('bib_number', 'name', 'birth_year', 'city', 'club')
+
+    def __init__(self, bib_number, name, birth_year, city, club):
+        self.bib_number = bib_number
+        self.name = name
+        self.birth_year = birth_year
+        self.city = city
+        self.club = club
+
+
+def race_label(distance, gender, min_age):
+    return f"{distance} км, {GENDERS.get(gender, gender)} {min_age}+"
+
+
+def with_versions(events):
+    """The events of a queryset, each with its `registration_version`, read in one query."""
+    registrations = EventRegistration.objects.filter(event=OuterRef('pk')).order_by().values('event')
+    events = events.annotate(
+        registration_count=Subquery(registrations.annotate(total=Count('id')).values('total')[:1]),
+        registration_latest=Subquery(registrations.annotate(latest=Max('updated_at')).values('latest')[:1]),
+        races_latest=Max('race_types__updated_at'),
+    )
+    for event in events:
+        source = (event.updated_at, event.registration_count, event.registration_latest, event.races_latest)
+        event.registration_version = md5(repr(source).encode()).hexdigest()[:16]
+        yield event
+
+
+def runners_by_race(event):
+    """[(race label, [Runner, ...]), ...] of the event's paid, active registrations."""
+    rows = EventRegistration.objects.for_event(event).filter(is_active=True, payment_confirmation=True).order_by(
+        'race__distance', 'race__gender', 'race__min_age', 'race_id', F('bib_number').asc(nulls_last=True),
+        'user__last_name', 'user__first_name', 'id',
+    ).values_list(*RUNNER_FIELDS)
+
+    groups = []
+    for (distance, gender, min_age, _), race_rows in groupby(rows.iterator(chunk_size=2000), key=lambda row: row[:4]):
+        runners = [
+            Runner(bib_number, f"{last_name} {first_name}".strip() or username,
+                   date_birth.year if date_birth else None, city, club or '')
+            for _, _, _, _, bib_number, last_name, first_name, username, date_birth, city, club in race_rows
+        ]
+        groups.append((race_label(distance, gender, min_age), runners))
+    return groups
+
+
+def event_dir(event):
+    return os.path.join(settings.START_LIST_ROOT, event.slug)
+
+
+def document_path(event, name):
+    return os.path.join(event_dir(event), name)
+
+
+def document_url(event, name=START_LIST_FILE):
+    return reverse('start_list_document', kwargs={'event_slug': event.slug, 'name': name})
+
+
+def internal_url(event, name):
+    """The nginx-internal location of a document, for X-Accel-Redirect."""
+    return f'{settings.START_LIST_URL}{event.slug}/{name}'
+
+
+def built_version(event):
+    """Version of the documents on disk, None if they were never built."""
+    try:
+        with open(os.path.join(event_dir(event), VERSION_FILE)) as fh:
+            return fh.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_file(path, content):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        fh.write(content)
+    os.replace(tmp_path, path)
+
+
+def render(event, version):
+    """Render and write the documents of one event; returns the number of runners."""
+    groups = runners_by_race(event)
+    bib_sheets = sorted(
+        ((runner.bib_number, runner, label) for label, runners in groups for runner in runners
+         if runner.bib_number is not None),
+        key=lambda item: item[0],
+    )
+    context = {
+        'event': event,
+        'groups': groups,
+        'total': sum(len(runners) for _, runners in groups),
+        'generated_at': timezone.now(),
+        'version': version,
+    }
+    directory = event_dir(event)
+    os.makedirs(directory, exist_ok=True)
+    write_file(os.path.join(directory, START_LIST_FILE), render_to_string('race/start_list.html', context))
+    write_file(os.path.join(directory, BIB_SHEETS_FILE),
+               render_to_string('race/bib_sheets.html', dict(context, sheets=bib_sheets)))
+    # Версия записывается последней: при сбое на середине документы соберутся заново
+    write_file(os.path.join(directory, VERSION_FILE), version)
+    return context['total']
+
+
+def pending_events():
+    return Event.objects.filter(start_datetime__gte=timezone.now() - KEEP_AFTER_START).order_by('start_datetime')
+
+
+def build(events=None, rebuild_all=False):
+    """Rebuild the documents whose registration version changed (or all of them); returns the rebuilt events."""
+    queryset = pending_events() if events is None else Event.objects.filter(pk__in=[event.pk for event in events])
+    rebuilt = []
+    for event in with_versions(queryset):
+        if not rebuild_all and built_version(event) == event.registration_version:
+            continue
+        try:
+            render(event, event.registration_version)
+        except Exception:
+            # Остальные мероприятия собираются; это повторится при следующем запуске
+            logger.exception('Start list of %s failed to build', event.slug)
+            continue
+        rebuilt.append(event)
+    return rebuilt
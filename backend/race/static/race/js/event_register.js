@@ -18,3 +18,36 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 });
 
+
+// Подсказки клубов и городов: поля с data-autocomplete получают список вариантов по мере ввода
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('input[data-autocomplete]').forEach(function(input) {
+        const list = document.createElement('datalist');
+        list.id = `${input.id}_suggestions`;
+        input.setAttribute('list', list.id);
+        input.after(list);
+
+        let timer = null;
+        let lastQuery = '';
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            timer = setTimeout(function() {
+                const query = input.value.trim();
+                if (!query || query === lastQuery) {
+                    return;
+                }
+                lastQuery = query;
+                fetch(`${input.dataset.autocomplete}?q=${encodeURIComponent(query)}`)
+                .then(response => response.ok ? response.json() : {results: []})
+                .then(data => {
+                    list.innerHTML = '';
+                    data.results.forEach(name => {
+                        const option = document.createElement('option');
+                        option.value = name;
+                        list.appendChild(option);
+                    });
+                });
+            }, 200);
+        });
+    });
+});
@@ -0,0 +1,38 @@
+// Пока загруженное изображение проверяется, страница сама узнаёт, чем закончилась проверка:
+// заново запрашивает себя и подменяет изображения с data-image-preview и сообщение под полем
+document.addEventListener('DOMContentLoaded', function() {
+    if (!document.querySelector('[data-image-pending]')) {
+        return;
+    }
+    let polls = 0;
+    const timer = setInterval(function() {
+        if (++polls > 20) {
+            clearInterval(timer);
+            return;
+        }
+        fetch(window.location.href, {credentials: 'same-origin'})
+        .then(response => response.text())
+        .then(html => {
+            const page = new DOMParser().parseFromString(html, 'text/html');
+            if (page.querySelector('[data-image-pending]')) {
+                return;
+            }
+            clearInterval(timer);
+            document.querySelectorAll('[data-image-preview]').forEach(function(image) {
+                const fresh = page.querySelector(`[data-image-preview="${image.dataset.imagePreview}"]`);
+                if (fresh) {
+                    image.src = fresh.src;
+                }
+            });
+            document.querySelectorAll('[data-image-pending]').forEach(function(notice) {
+                const field = notice.closest('[data-image-field]');
+                const fresh = field && page.querySelector(`[data-image-field="${field.dataset.imageField}"]`);
+                if (fresh) {
+                    field.replaceWith(document.importNode(fresh, true));
+                } else {
+                    notice.remove();
+                }
+            });
+        });
+    }, 3000);
+});
@@ -0,0 +1,34 @@
+document.addEventListener('DOMContentLoaded', function() {
+    var list = document.getElementById('live-results');
+    if (!list || !window.EventSource) {
+        return;
+    }
+    var maxItems = 20;
+
+    // EventSource сам переподключается и передаёт Last-Event-ID, пропущенные отметки приходят повтором
+    var source = new EventSource(list.getAttribute('data-url'));
+    source.addEventListener('timing', function(event) {
+        var record = JSON.parse(event.data);
+        var placeholder = list.querySelector('[data-placeholder]');
+        if (placeholder) {
+            placeholder.remove();
+        }
+
+        var item = document.createElement('li');
+        item.className = 'list-group-item d-flex justify-content-between';
+        var runner = document.createElement('span');
+        runner.textContent = '№' + record.bib + (record.name ? ' — ' + record.name : '');
+        var mark = document.createElement('span');
+        mark.textContent = (record.point === 'finish' ? 'финиш' : record.point) + ' ' + record.time;
+        if (record.point === 'finish') {
+            mark.className = 'fw-bold';
+        }
+        item.appendChild(runner);
+        item.appendChild(mark);
+        list.insertBefore(item, list.firstChild);
+
+        while (list.children.length > maxItems) {
+            list.removeChild(list.lastChild);
+        }
+    });
+});
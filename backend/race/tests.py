@@ -1,3 +1,1100 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time as day_time, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.forms import modelform_factory
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageFile
+
+from . import (audit, bibs, feeds, images, imaging, media_sweep, names, partitions, ranking, reconciliation, reminders,
+               search, snapshots, start_lists)
+from .models import (CanonicalName, Event, EventRegistration, GalleryPhoto, ImageUpload, Location, RaceResult, RaceType,
+                     RegistrationAuditEntry, ReminderDelivery, TimingRecord)
+
+
+class EventRegistrationAdminTests(TestCase):
+    """The registrations changelist must not issue queries per row."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        cls.races = [RaceType.objects.create(distance=distance, gender='M', min_age=18, registration_fee=1000)
+                     for distance in (5, 10)]
+        cls.events = [
+            Event.objects.create(title=f'Забег {n}', slug=f'zabeg-{n}', description='-', event_rules='-',
+                                 event_type='road', start_datetime=timezone.now() + timedelta(days=30),
+                                 location=location, total_slots=100, image='events/zabeg.jpg')
+            for n in range(2)
+        ]
+        cls.user_count = 0
+
+    def add_registrations(self, count):
+        User = get_user_model()
+        users = User.objects.bulk_create([
+            User(username=f'runner{n}', email=f'runner{n}@example.com', first_name='Иван', last_name=f'Иванов{n}',
+                 date_birth=date(1990, 1, 1))
+            for n in range(self.user_count, self.user_count + count)
+        ])
+        EventRegistration.objects.bulk_create([
+            EventRegistration(user=user, event=self.events[n % 2], race=self.races[n % 2],
+                              payment_document='docs/payment.pdf', city='Москва', tshirt_size='M')
+            for n, user in enumerate(users)
+        ])
+        self.user_count += count
+
+    def changelist_queries(self, **params):
+        url = reverse('admin:race_eventregistration_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.client.force_login(self.admin)
+        self.add_registrations(3)
+        few = self.changelist_queries()
+        self.add_registrations(30)
+        many = self.changelist_queries()
+        self.assertEqual(few, many)
+
+    def test_filtered_query_count_does_not_grow_with_rows(self):
+        self.client.force_login(self.admin)
+        self.add_registrations(3)
+        few = self.changelist_queries(event__id__exact=self.events[0].pk)
+        self.add_registrations(30)
+        many = self.changelist_queries(event__id__exact=self.events[0].pk)
+        self.assertEqual(few, many)
+
+
+class RegistrationSearchTests(TestCase):
+    """Admin search by name, email, phone, club and city."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        race = RaceType.objects.create(distance=10, gender='M', min_age=18, registration_fee=1000)
+        event = Event.objects.create(title='Забег', slug='zabeg', description='-', event_rules='-',
+                                     event_type='road', start_datetime=timezone.now() + timedelta(days=30),
+                                     location=location, total_slots=100, image='events/zabeg.jpg')
+        runners = [
+            ('ivanova', 'Мария', 'Иванова', 'maria@example.com', '+7 916 123-45-67', 'Казань', 'Бегущий город'),
+            ('petrov', 'Пётр', 'Петров', 'petya@mail.example', '8 (903) 765-43-21', 'Тверь', ''),
+        ]
+        cls.registrations = {}
+        for username, first_name, last_name, email, phone, city, club in runners:
+            user = User.objects.create_user(username, email, 'password', first_name=first_name,
+                                            last_name=last_name)
+            cls.registrations[username] = EventRegistration.objects.create(
+                user=user, event=event, race=race, phone_number=phone, city=city, club=club,
+                payment_document='docs/payment.pdf', tshirt_size='M')
+
+    def found(self, term):
+        return set(search.search_registrations(EventRegistration.objects.all(), term)
+                   .values_list('user__username', flat=True))
+
+    def test_phone_e164_is_stored_on_save(self):
+        self.assertEqual(self.registrations['ivanova'].phone_e164, '+79161234567')
+        self.assertEqual(self.registrations['petrov'].phone_e164, '+79037654321')
+
+    def test_finds_by_user_fields_club_and_city(self):
+        self.assertEqual(self.found('Иванов'), {'ivanova'})
+        self.assertEqual(self.found('Пётр'), {'petrov'})
+        self.assertEqual(self.found('PETYA@MAIL'), {'petrov'})
+        self.assertEqual(self.found('Бегущий'), {'ivanova'})
+        self.assertEqual(self.found('Тверь'), {'petrov'})
+        self.assertEqual(self.found('example'), {'ivanova', 'petrov'})
+        self.assertEqual(self.found('Мария Казань'), {'ivanova'})
+        self.assertEqual(self.found('Мария Тверь'), set())
+
+    def test_finds_by_phone_in_any_format(self):
+        for term in ('+79161234567', '8 916 123 45 67', '(916) 123-45-67', '89161234567'):
+            self.assertEqual(self.found(term), {'ivanova'}, term)
+        self.assertEqual(self.found('7654321'), {'petrov'})
+
+    def test_finds_misspelled_words(self):
+        self.assertEqual(self.found('Петрв'), {'petrov'})
+
+    def test_word_lookups_compare_the_bare_columns(self):
+        sql = str(search.union_pks(search.word_queries(EventRegistration.objects.all(), 'Иванов')).query)
+        self.assertIn('"city" ILIKE', sql)
+        self.assertIn('"last_name" ILIKE', sql)
+        self.assertNotIn('UPPER(', sql)
+
+    def test_trigram_indexes_serve_the_search(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('race_eventreg_city_trgm'), to_regclass('users_user_last_name_trgm')")
+            if None in cursor.fetchone():
+                self.skipTest('pg_trgm indexes are not available')
+            # На двух строках планировщик всегда выбрал бы полный просмотр
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = search.union_pks(search.word_queries(EventRegistration.objects.all(), 'Иванов')).explain()
+        self.assertIn('race_eventreg_city_trgm', plan)
+        self.assertIn('race_eventreg_club_trgm', plan)
+        self.assertIn('users_user_last_name_trgm', plan)
+
+    def test_changelist_search(self):
+        User = get_user_model()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(reverse('admin:race_eventregistration_changelist'), {'q': '+7 903 765 43 21'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['cl'].result_list), [self.registrations['petrov']])
+
+
+class ReconciliationTests(SimpleTestCase):
+    """Statement lines are matched to unpaid registrations by fee plus phone and/or name."""
+
+    REGISTRATIONS = [
+        (1, '1500', '+79161234567', 'Иванов', 'Иван'),
+        (2, '1500', '+79031112233', 'Петров', 'Пётр'),
+        (3, '1500', None, 'Сидорова', 'Анна'),
+        (4, '1500', None, 'Сидорова', 'Анна'),
+        (5, '2000', '+79161234567', 'Иванов', 'Иван'),
+    ]
+
+    def match(self, csv_text):
+        lines = reconciliation.read_statement(io.StringIO(csv_text), 'Сумма', name_column='Плательщик',
+                                              purpose_column='Назначение')
+        return {match.line.number: (match.status, match.registration_ids)
+                for match in reconciliation.match_statement(lines, self.REGISTRATIONS)}
+
+    def test_statement_lines_are_matched(self):
+        matches = self.match(
+            'Сумма;Плательщик;Назначение\n'
+            '"1 500,00";Иван Петрович Иванов;Взнос 8 (916) 123-45-67\n'
+            '1500;ПЕТРОВ ПЕТР;Взнос\n'
+            '2000;Иванов Иван;Взнос\n'
+            '1500;Сидорова Анна;Взнос\n'
+            '1500;Петров Пётр;Взнос +7 916 123 45 67\n'
+            '1500;Смирнов Олег;Взнос\n'
+            'сумма;Кто-то;Не платёж\n'
+        )
+        self.assertEqual(matches, {
+            # Телефон из назначения платежа, отчество и порядок слов не мешают
+            2: (reconciliation.EXACT, [1]),
+            # Регистр и "ё" не различаются
+            3: (reconciliation.EXACT, [2]),
+            # Сумма отличает регистрации одного человека на разные дистанции
+            4: (reconciliation.EXACT, [5]),
+            5: (reconciliation.AMBIGUOUS, [3, 4]),
+            6: (reconciliation.CONFLICT, [1, 2]),
+            7: (reconciliation.UNMATCHED, []),
+        })
+
+    def test_registration_paid_twice_is_left_for_review(self):
+        matches = self.match(
+            'Сумма;Плательщик;Назначение\n'
+            '1500;Иванов Иван;Взнос\n'
+            '1500;;Взнос 89161234567\n'
+        )
+        self.assertEqual(matches, {2: (reconciliation.DUPLICATE, [1]), 3: (reconciliation.DUPLICATE, [1])})
+
+
+@override_settings(TIMING_API_TOKENS=['station-token'])
+class TimingIngestTests(TestCase):
+    """Timing stations append readings to the log; finish readings become results."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        race = RaceType.objects.create(distance=10, gender='M', min_age=18, registration_fee=1000)
+        cls.event = Event.objects.create(title='Забег', slug='zabeg', description='-', event_rules='-',
+                                         event_type='road', start_datetime=timezone.now(), location=location,
+                                         total_slots=100, image='events/zabeg.jpg')
+        cls.registrations = [
+            EventRegistration.objects.create(
+                user=User.objects.create(username=f'runner{n}', email=f'runner{n}@example.com',
+                                         date_birth=date(1990, 1, 1)),
+                event=cls.event, race=race, bib_number=101 + n, payment_document='docs/payment.pdf', city='Москва',
+                tshirt_size='M')
+            for n in range(2)
+        ]
+        cls.url = reverse('timing_ingest', kwargs={'event_slug': cls.event.slug})
+
+    def post(self, records, token='station-token'):
+        return self.client.post(self.url, {'station': 'finish-1', 'records': records}, content_type='application/json',
+                                HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_requires_station_token(self):
+        response = self.post([{'seq': 1, 'bib': 101, 'point': 'finish', 'time': 2500}], token='wrong')
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(TimingRecord.objects.exists())
+
+    def test_malformed_batch_is_rejected_whole(self):
+        response = self.post([{'seq': 1, 'bib': 101, 'point': 'finish', 'time': 2500},
+                              {'seq': 2, 'bib': 102, 'point': 'finish', 'time': 'скоро'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TimingRecord.objects.exists())
+
+    def test_resent_batch_is_stored_once(self):
+        records = [{'seq': 1, 'bib': 101, 'point': '5km', 'time': '20:00.5'},
+                   {'seq': 2, 'bib': 999, 'point': '5km', 'time': 1250}]
+        self.assertEqual(self.post(records).json()['stored'], 2)
+        summary = self.post(records).json()
+        self.assertEqual((summary['stored'], summary['duplicates'], summary['unknown_bibs']), (0, 2, [999]))
+        self.assertEqual(TimingRecord.objects.count(), 2)
+        self.assertEqual(TimingRecord.objects.get(bib_number=101).registration, self.registrations[0])
+
+    def test_finish_readings_become_ranked_results(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post([{'seq': 1, 'bib': 101, 'point': 'finish', 'time': '41:00'},
+                       {'seq': 2, 'bib': 102, 'point': 'finish', 'time': '40:00'}])
+        self.assertEqual(
+            list(RaceResult.objects.order_by('place_overall').values_list('registration', 'place_overall')),
+            [(self.registrations[1].pk, 1), (self.registrations[0].pk, 2)],
+        )
+        # Исправление — новая отметка, а не изменение старой
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post([{'seq': 3, 'bib': 101, 'point': 'finish', 'time': '39:30'}])
+        self.assertEqual(RaceResult.objects.get(registration=self.registrations[0]).place_overall, 1)
+        self.assertEqual(TimingRecord.objects.filter(bib_number=101).count(), 2)
+
+    def test_results_saved_in_one_transaction_share_one_recompute(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                RaceResult(registration=self.registrations[0], finish_time=timedelta(minutes=39)).save()
+                raise RuntimeError
+            # Колбэк из отменённой точки сохранения пропал, регистрируется новый
+            for registration, minutes in zip(self.registrations, (41, 40)):
+                RaceResult(registration=registration, finish_time=timedelta(minutes=minutes)).save()
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(
+            list(RaceResult.objects.order_by('place_overall').values_list('registration', 'place_overall')),
+            [(self.registrations[1].pk, 1), (self.registrations[0].pk, 2)],
+        )
+
+
+@override_settings(RESULT_AGE_GROUPS=[18, 30, 40, 50, 60, 70])
+class RankingTests(SimpleTestCase):
+    """Places, gaps and age groups computed from result columns."""
+
+    def test_ties_share_the_better_place_and_unfinished_get_none(self):
+        minute = 60_000_000
+        columns = {
+            'id': np.array([1, 2, 3, 4, 5, 6]),
+            # Сошедший без времени и дисквалифицированный с лучшим временем мест не получают
+            'finished': np.array([True, True, True, True, False, False]),
+            'time': np.array([40, 41, 41, 43, ranking.NULL, 39]) * minute,
+            'race_id': np.array([7, 8, 7, 8, 7, 7]),
+            'distance': np.array([10] * 6),
+            'gender': np.array(list('MFMFMM'), dtype=object),
+            'birth_date': np.array(['1990-06-02', '1986-06-01', '1986-06-02', None, '1990-01-01', '1990-01-01'],
+                                   dtype='datetime64[D]'),
+        }
+        result = ranking.compute(columns, date(2026, 6, 1))
+        self.assertEqual(result['place_overall'].tolist(), [1, 2, 2, 4, -1, -1])
+        self.assertEqual(result['place_gender'].tolist(), [1, 1, 2, 2, -1, -1])
+        self.assertEqual(result['place_race'].tolist(), [1, 1, 2, 2, -1, -1])
+        self.assertEqual(result['gap_to_leader'].tolist(), [0, minute, minute, 3 * minute, -1, -1])
+        self.assertEqual(result['gap_in_race'].tolist(), [0, 0, minute, 2 * minute, -1, -1])
+        self.assertEqual(result['pace'].tolist(), [time * minute // 10 for time in (40, 41, 41, 43)] + [-1, -1])
+        # Возраст считается на день старта: 40 лет исполняется ровно в этот день
+        self.assertEqual(result['age_group'].tolist(), ['30–39', '40–49', '30–39', '', '30–39', '30–39'])
+        self.assertEqual(result['place_age_group'].tolist(), [1, 1, 2, -1, -1, -1])
+
+    def test_no_results(self):
+        columns = {name: np.array([], dtype=dtype) for name, dtype in (
+            ('id', np.int64), ('finished', bool), ('time', np.int64), ('race_id', np.int64),
+            ('distance', np.int64), ('gender', object), ('birth_date', 'datetime64[D]'))}
+        self.assertEqual(ranking.compute(columns, date(2026, 6, 1))['place_overall'].tolist(), [])
+
+
+class BibAllocationTests(TestCase):
+    """Bib numbers come from the race types' ranges and never change once given."""
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        # 5 км мужчины и женщины делят диапазон 1–3, у 10 км свой диапазон, у 20 км диапазона нет
+        cls.men_5 = RaceType.objects.create(distance=5, gender='M', min_age=18, registration_fee=1000,
+                                            bib_range_start=1, bib_range_end=3)
+        cls.women_5 = RaceType.objects.create(distance=5, gender='F', min_age=18, registration_fee=1000,
+                                              bib_range_start=1, bib_range_end=3)
+        cls.men_10 = RaceType.objects.create(distance=10, gender='M', min_age=18, registration_fee=1000,
+                                             bib_range_start=1000, bib_range_end=1999)
+        cls.men_20 = RaceType.objects.create(distance=20, gender='M', min_age=18, registration_fee=1000)
+        cls.event = Event.objects.create(title='Забег', slug='zabeg', description='-', event_rules='-',
+                                         event_type='road', start_datetime=timezone.now() + timedelta(days=30),
+                                         location=location, total_slots=100, image='events/zabeg.jpg')
+        cls.event.race_types.set([cls.men_5, cls.women_5, cls.men_10, cls.men_20])
+        cls.user_count = 0
+
+    def register(self, race, paid=True, active=True, bib_number=None):
+        self.user_count += 1
+        user = get_user_model().objects.create(username=f'runner{self.user_count}',
+                                               email=f'runner{self.user_count}@example.com')
+        return EventRegistration.objects.create(user=user, event=self.event, race=race, bib_number=bib_number,
+                                                payment_confirmation=paid, is_active=active,
+                                                payment_document='docs/payment.pdf', city='Москва', tshirt_size='M')
+
+    def bib_numbers(self, *registrations):
+        return [EventRegistration.objects.get(pk=registration.pk).bib_number for registration in registrations]
+
+    def test_shared_range_is_filled_in_registration_order(self):
+        first, second = self.register(self.men_5), self.register(self.women_5)
+        ten = self.register(self.men_10)
+        bibs.allocate(self.event)
+        self.assertEqual(self.bib_numbers(first, second, ten), [1, 2, 1000])
+
+    def test_existing_numbers_are_kept_and_skipped(self):
+        kept = self.register(self.men_5, bib_number=2)
+        first = self.register(self.men_5)
+        bibs.allocate(self.event)
+        late = self.register(self.women_5)
+        bibs.allocate(self.event)
+        self.assertEqual(self.bib_numbers(kept, first, late), [2, 1, 3])
+
+    def test_unpaid_inactive_and_unranged_registrations_get_no_number(self):
+        unpaid = self.register(self.men_5, paid=False)
+        cancelled = self.register(self.men_5, active=False)
+        unranged = self.register(self.men_20)
+        allocations = bibs.allocate(self.event)
+        self.assertEqual(self.bib_numbers(unpaid, cancelled, unranged), [None, None, None])
+        self.assertEqual([a.waiting for a in allocations if a.start is None], [1])
+
+    def test_exhausted_range_reports_waiting_runners(self):
+        runners = [self.register(self.men_5) for _ in range(4)]
+        allocations = bibs.allocate(self.event)
+        self.assertEqual(self.bib_numbers(*runners), [1, 2, 3, None])
+        shared = next(a for a in allocations if a.start == 1)
+        self.assertEqual((shared.assigned, shared.waiting), (3, 1))
+
+    def test_dry_run_changes_nothing(self):
+        runner = self.register(self.men_10)
+        allocations = bibs.allocate(self.event, dry_run=True)
+        self.assertEqual(sum(a.assigned for a in allocations), 1)
+        self.assertEqual(self.bib_numbers(runner), [None])
+
+
+class StartListTests(TestCase):
+    """Start lists are rebuilt only when the event's registrations change."""
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        cls.race = RaceType.objects.create(distance=10, gender='F', min_age=18, registration_fee=1000)
+        cls.event = Event.objects.create(title='Забег', slug='zabeg', description='-', event_rules='-',
+                                         event_type='road', start_datetime=timezone.now() + timedelta(days=30),
+                                         location=location, total_slots=100, image='events/zabeg.jpg')
+        cls.event.race_types.set([cls.race])
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings_override = override_settings(START_LIST_ROOT=root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.root = root
+
+    def register(self, last_name, bib_number=None, paid=True):
+        user = get_user_model().objects.create(username=last_name, email=f'{last_name}@example.com',
+                                               first_name='Анна', last_name=last_name)
+        return EventRegistration.objects.create(user=user, event=self.event, race=self.race, bib_number=bib_number,
+                                                payment_confirmation=paid, payment_document='docs/payment.pdf',
+                                                city='Москва', tshirt_size='M')
+
+    def document(self, name=start_lists.START_LIST_FILE):
+        with open(os.path.join(self.root, self.event.slug, name), encoding='utf-8') as fh:
+            return fh.read()
+
+    def test_paid_runners_are_listed_by_bib_number(self):
+        self.register('Смирнова', bib_number=2)
+        self.register('Иванова', bib_number=1)
+        self.register('Должница', paid=False)
+        self.assertEqual(start_lists.build(), [self.event])
+        document = self.document()
+        self.assertLess(document.index('Иванова'), document.index('Смирнова'))
+        self.assertNotIn('Должница', document)
+        self.assertIn('Смирнова', self.document(start_lists.BIB_SHEETS_FILE))
+
+    def test_unchanged_registrations_are_not_rebuilt(self):
+        self.register('Иванова')
+        start_lists.build()
+        with self.assertNumQueries(1):
+            self.assertEqual(start_lists.build(), [])
+
+    def test_registration_change_rebuilds(self):
+        registration = self.register('Иванова')
+        start_lists.build()
+        registration.bib_number = 7
+        registration.save()
+        self.assertEqual(start_lists.build(), [self.event])
+        self.assertIn('>7<', self.document())
+
+    def test_documents_are_served_to_staff_only(self):
+        self.register('Иванова')
+        start_lists.build()
+        url = start_lists.document_url(self.event)
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(get_user_model().objects.get(username='Иванова'))
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(get_user_model().objects.create(username='staff', is_staff=True))
+        with override_settings(START_LIST_ACCEL_REDIRECT=True):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Accel-Redirect'], '/start-lists/zabeg/start-list.html')
+        with override_settings(START_LIST_ACCEL_REDIRECT=False):
+            response = self.client.get(url)
+        self.assertIn('Иванова', b''.join(response.streaming_content).decode())
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(self.client.get(url.replace('start-list.html', 'VERSION')).status_code, 404)
+
+
+class SnapshotPathTests(TestCase):
+    """Snapshots to re-render when events change."""
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        cls.events = [
+            Event.objects.create(title=f'Забег {n}', slug=f'past-{n}', description='-', event_rules='-',
+                                 event_type='road', start_datetime=timezone.now() - timedelta(days=n + 1),
+                                 location=location, total_slots=100, image='events/zabeg.jpg')
+            for n in range(5)
+        ]
+
+    def test_archive_pages_are_counted_once(self):
+        with self.assertNumQueries(1):
+            paths = snapshots.paths_for_events(self.events)
+        self.assertIn(snapshots.PAST_ARCHIVE_URL, paths)
+        self.assertIn(self.events[0].get_absolute_url(), paths)
+
+
+class ConditionalGetTests(TestCase):
+    """Event pages answer 304 while nothing they show has changed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        cls.event = Event.objects.create(title='Забег', slug='zabeg', description='-', event_rules='-',
+                                         event_type='road', start_datetime=timezone.now() + timedelta(days=10),
+                                         location=location, total_slots=100, image='events/zabeg.jpg')
+        cls.user = get_user_model().objects.create(username='runner', email='runner@example.com')
+
+    def test_unchanged_page_is_not_modified(self):
+        url = reverse('event_detail', args=[self.event.slug])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        self.event.title = 'Новый забег'
+        self.event.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_profile_edit_changes_the_etag(self):
+        url = reverse('event_detail', args=[self.event.slug])
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        self.user.first_name, self.user.last_name = 'Анна', 'Иванова'
+        self.user.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertContains(changed, 'Анна Иванова')
+
+
+class MediaSweepTests(TestCase):
+    """Files no row refers to are found by walking the media tree; recent and shared files are kept."""
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        cls.event = Event.objects.create(title='Забег', slug='zimnii-zabeg', description='-', event_rules='-',
+                                         event_type='road', start_datetime=timezone.now() + timedelta(days=30),
+                                         location=location, total_slots=100,
+                                         image='events/image/zimnii_zabeg/new.jpg')
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings_override = override_settings(MEDIA_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create(self, name, size=10, age=48 * 3600):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fh:
+            fh.write(b'x' * size)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+    def test_orphans_are_reported_and_deleted(self):
+        self.create('events/image/zimnii_zabeg/new.jpg', size=100)
+        self.create('events/image/zimnii_zabeg/old.jpg', size=40)
+        self.create('events/photos/zimnii_zabeg/2023/removed.jpg', size=5)
+        self.create('uploads/payment_docs/zimnii_zabeg/fresh.pdf', age=60)
+        self.create('users/default.png')
+        self.create('robots.txt')
+
+        dry_run = media_sweep.scan(workers=4)
+        self.assertEqual(sorted(f.name for f in dry_run.orphans),
+                         ['events/image/zimnii_zabeg/old.jpg', 'events/photos/zimnii_zabeg/2023/removed.jpg'])
+        self.assertEqual(dry_run.skipped_recent, 1)
+        usage = dry_run.usage['zimnii-zabeg']
+        self.assertEqual((usage.files, usage.bytes, usage.orphan_bytes), (4, 155, 45))
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'events/image/zimnii_zabeg/old.jpg')))
+
+        media_sweep.scan(workers=4, delete=True)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'events/image/zimnii_zabeg/old.jpg')))
+        for kept in ('events/image/zimnii_zabeg/new.jpg', 'uploads/payment_docs/zimnii_zabeg/fresh.pdf',
+                     'users/default.png', 'robots.txt'):
+            self.assertTrue(os.path.exists(os.path.join(self.root, kept)), kept)
+
+    def test_documents_of_archived_registrations_are_kept(self):
+        self.create('uploads/payment_docs/zabeg_2001/receipt.pdf')
+        self.create('uploads/payment_docs/zabeg_2001/replaced.pdf')
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {partitions.ARCHIVE_SCHEMA}')
+            cursor.execute(f'CREATE TABLE {partitions.ARCHIVE_SCHEMA}.{partitions.partition_name(2001)} '
+                           f'(id bigint, payment_document varchar(100))')
+            cursor.execute(f"INSERT INTO {partitions.ARCHIVE_SCHEMA}.{partitions.partition_name(2001)} "
+                           f"VALUES (1, 'uploads/payment_docs/zabeg_2001/receipt.pdf'), (2, '')")
+        self.assertEqual([f.name for f in media_sweep.scan(workers=2).orphans],
+                         ['uploads/payment_docs/zabeg_2001/replaced.pdf'])
+
+
+class RegistrationPartitionTests(TestCase):
+    """Registrations live in the partition of their event's season and queries for an event read only it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        cls.race = RaceType.objects.create(distance=10, gender='F', min_age=18, registration_fee=1000)
+        cls.event = Event.objects.create(title='Забег', slug='zabeg', description='-', event_rules='-',
+                                         event_type='road', start_datetime=timezone.now() + timedelta(days=30),
+                                         location=location, total_slots=100, image='events/zabeg.jpg')
+        user = get_user_model().objects.create(username='runner', email='runner@example.com')
+        cls.registration = EventRegistration.objects.create(user=user, event=cls.event, race=cls.race,
+                                                            payment_document='docs/payment.pdf', city='Москва',
+                                                            tshirt_size='M')
+
+    def test_queries_for_an_event_read_one_partition(self):
+        self.assertEqual(self.registration.season, self.event.season)
+        plan = EventRegistration.objects.for_event(self.event).explain()
+        scanned = set(re.findall(r'race_eventregistration_y\d+', plan))
+        self.assertEqual(scanned, {partitions.partition_name(self.event.season)})
+
+    def test_rescheduled_event_moves_its_registrations(self):
+        self.event.start_datetime = self.event.start_datetime.replace(year=self.event.season + 5)
+        self.event.save()
+        self.assertIn(self.event.season, {partition.season for partition in partitions.partitions()})
+        self.registration.refresh_from_db()
+        self.assertEqual(self.registration.season, self.event.season)
+        self.assertEqual(self.event.get_free_slots(), 99)
+
+
+class RegistrationAuditTests(TestCase):
+    """Registration changes are appended to the audit log after commit; old toggles are compacted."""
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        race = RaceType.objects.create(distance=10, gender='F', min_age=18, registration_fee=1000)
+        event = Event.objects.create(title='Забег', slug='zabeg', description='-', event_rules='-',
+                                     event_type='road', start_datetime=timezone.now() + timedelta(days=30),
+                                     location=location, total_slots=100, image='events/zabeg.jpg')
+        User = get_user_model()
+        cls.runner = User.objects.create_user(username='runner', email='runner@example.com', password='secret')
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.registration = EventRegistration.objects.create(user=cls.runner, event=event, race=race,
+                                                            payment_document='docs/payment.pdf', city='Москва',
+                                                            tshirt_size='M')
+
+    def timeline(self):
+        return list(RegistrationAuditEntry.objects.filter(registration_id=self.registration.pk)
+                    .order_by('created_at', 'id').values_list('action', 'source', 'actor', 'changes'))
+
+    def test_toggles_and_payment_confirmation_are_logged(self):
+        self.client.force_login(self.runner)
+        url = reverse('users:registration_toggle_status', args=[self.registration.pk])
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(url)
+        self.client.force_login(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:race_eventregistration_changelist'),
+                             {'action': 'confirm_payment', '_selected_action': [self.registration.pk]})
+        self.assertEqual(self.timeline(), [
+            ('deactivated', 'site', self.runner.pk, {'is_active': [True, False]}),
+            ('reactivated', 'site', self.runner.pk, {'is_active': [False, True]}),
+            ('payment_confirmed', 'admin', self.admin.pk, {'payment_confirmation': [False, True]}),
+        ])
+
+    def test_rolled_back_change_is_not_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                audit.record(self.registration, RegistrationAuditEntry.DEACTIVATED)
+                raise ValueError
+        self.assertEqual(self.timeline(), [])
+
+    def test_buffered_entries_are_written_with_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            with audit.buffered(), self.captureOnCommitCallbacks(execute=True):
+                for _ in range(3):
+                    audit.record(self.registration, RegistrationAuditEntry.CHANGED)
+        self.assertEqual(len(self.timeline()), 3)
+        self.assertEqual(len(queries), 1)
+
+    def test_old_toggles_are_compacted_and_expired_entries_deleted(self):
+        now = timezone.now()
+        entries = [
+            RegistrationAuditEntry(registration_id=self.registration.pk, event_id=self.registration.event_id,
+                                   actor=self.runner, source='site', action=action,
+                                   changes={'is_active': [action == 'deactivated', action == 'reactivated']},
+                                   created_at=now - timedelta(days=days))
+            for days, action in [(400, 'deactivated'), (300, 'reactivated'), (250, 'deactivated'),
+                                 (200, 'reactivated'), (190, 'deactivated'), (1, 'reactivated')]
+        ]
+        RegistrationAuditEntry.objects.bulk_create(entries)
+        self.assertEqual(audit.prune(now - timedelta(days=365)), 1)
+        self.assertEqual(audit.compact(now - timedelta(days=180)), 3)
+        timeline = self.timeline()
+        self.assertEqual([action for action, *_ in timeline], ['toggles_compacted', 'reactivated'])
+        _, source, actor, changes = timeline[0]
+        self.assertEqual((source, actor, changes['is_active'], changes['toggles']), ('site', self.runner.pk,
+                                                                                     [False, False], 4))
+
+
+class ReminderTests(TestCase):
+    """Reminders reach every active registrant of events starting in N days, once."""
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        race = RaceType.objects.create(distance=10, gender='F', min_age=18, registration_fee=1000)
+        start = timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=7), day_time(10)))
+        cls.event = Event.objects.create(title='Забег', slug='zabeg', description='-', event_rules='-',
+                                         event_type='road', start_datetime=start, location=location,
+                                         total_slots=100, image='events/zabeg.jpg')
+        Event.objects.create(title='Другой забег', slug='drugoi', description='-', event_rules='-',
+                             event_type='road', start_datetime=start + timedelta(days=1), location=location,
+                             total_slots=100, image='events/zabeg.jpg')
+        User = get_user_model()
+        for n, (is_active, user_active) in enumerate([(True, True), (True, True), (False, True), (True, False)]):
+            user = User.objects.create(username=f'runner{n}', email=f'runner{n}@example.com', first_name='Анна',
+                                       is_active=user_active)
+            EventRegistration.objects.create(user=user, event=cls.event, race=race, bib_number=n + 1,
+                                             payment_document='docs/payment.pdf', city='Москва', tshirt_size='M',
+                                             is_active=is_active)
+
+    def test_recipients_are_read_with_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(len(reminders.recipients(self.event, 7)), 2)
+
+    def test_active_registrants_are_reminded_once(self):
+        [result] = reminders.run([7])
+        self.assertEqual((result.event, result.sent, result.failed), (self.event, 2, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['runner0@example.com', 'runner1@example.com'])
+        self.assertIn('Стартовый номер: 1', mail.outbox[0].body)
+
+        [rerun] = reminders.run([7])
+        self.assertEqual((rerun.recipients, rerun.sent), (0, 0))
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_failed_reminders_are_retried_by_the_next_run(self):
+        with mock.patch.object(reminders.SmtpPool, 'send_one', return_value='SMTPDataError(451)'):
+            [result] = reminders.run([7])
+        self.assertEqual((result.sent, result.failed), (0, 2))
+        self.assertEqual(ReminderDelivery.objects.filter(status=ReminderDelivery.FAILED).count(), 2)
+
+        [retry] = reminders.run([7])
+        self.assertEqual(retry.sent, 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertFalse(ReminderDelivery.objects.exclude(status=ReminderDelivery.SENT).exists())
+
+
+class FeedTests(TestCase):
+    """Feeds of upcoming events are snapshot files with ETags; the personal calendar needs only its token."""
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        race = RaceType.objects.create(distance=10, gender='F', min_age=18, registration_fee=1000)
+        cls.events = [
+            Event.objects.create(title=title, slug=slug, description='Длинное описание, с запятыми; и точкой',
+                                 event_rules='-', event_type='road', start_datetime=timezone.now() + timedelta(days=days),
+                                 location=location, total_slots=100, image='events/zabeg.jpg')
+            for title, slug, days in [('Весенний забег', 'spring', 30), ('Прошедший забег', 'past', -30)]
+        ]
+        cls.events[0].race_types.add(race)
+        cls.user = get_user_model().objects.create_user('runner', 'runner@example.com', 'secret')
+        EventRegistration.objects.create(user=cls.user, event=cls.events[0], race=race, bib_number=7,
+                                         payment_document='docs/payment.pdf', city='Москва', tshirt_size='M')
+
+    def test_public_calendar_lists_upcoming_events_and_honours_etag(self):
+        response = self.client.get(reverse('events_calendar'))
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('SUMMARY:Весенний забег', body)
+        self.assertNotIn('Прошедший', body)
+        self.assertIn('с запятыми\\; и точкой', body)
+        self.assertTrue(all(len(line.encode()) <= 75 for line in body.split('\r\n')))
+
+        response = self.client.get(reverse('events_calendar'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        for name in ('events_rss', 'events_atom'):
+            self.assertContains(self.client.get(reverse(name)), 'Весенний забег')
+
+    def test_personal_calendar_is_served_by_token_without_a_session(self):
+        self.assertEqual(self.client.get(reverse('user_calendar', args=[f'{self.user.pk}:forged'])).status_code, 404)
+        self.client.force_login(self.user)
+        url = reverse('user_calendar', args=[feeds.calendar_token(self.user)])
+        response = self.client.get(url)
+        self.assertContains(response, 'Стартовый номер: 7')
+        # Повторный опрос календаря — один агрегатный запрос, без сессии и пользователя
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).content, response.content)
+
+    def test_feeds_are_built_as_snapshot_files(self):
+        snapshot_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshot_root)
+        with self.settings(SNAPSHOT_ROOT=snapshot_root):
+            snapshots.build()
+            for url in snapshots.FEED_URLS:
+                with open(os.path.join(snapshot_root, snapshots.snapshot_file(url)), 'rb') as fh:
+                    self.assertIn('Весенний забег'.encode(), fh.read())
+
+
+class ApiTests(TestCase):
+    """The JSON API reads only what the requested fields need and answers repeated requests from the cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.location = Location.objects.create(street='Ленина', house_number='1', city='Казань', postal_code='420000',
+                                               country='Россия', latitude=55.79, longitude=49.11)
+        cls.race = RaceType.objects.create(distance=10, gender='M', min_age=18, registration_fee=1500)
+        cls.events = []
+        for days in (10, 20, 30, 40, 50, -5):
+            event = Event.objects.create(title=f'Забег {days}', slug=f'api-{days}', description='-', event_rules='-',
+                                         event_type='road', start_datetime=timezone.now() + timedelta(days=days),
+                                         location=cls.location, total_slots=50, image='events/zabeg.jpg')
+            event.race_types.add(cls.race)
+            event.schedules.create(start_time=day_time(9, 30), description='Старт')
+            cls.events.append(event)
+        cls.user = get_user_model().objects.create_user('api-runner', 'api@example.com', 'secret')
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url, **params):
+        response = self.client.get(url, params, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        return response, json.loads(gzip.decompress(response.content))
+
+    def test_prefetches_follow_the_requested_fields(self):
+        url = reverse('api_events')
+        # Мероприятия и ближайший старт; без расписания и дистанций нет и предвыборок
+        with self.assertNumQueries(2):
+            _, data = self.get(url, fields='slug,title')
+        self.assertEqual(data['results'][0], {'slug': 'api-10', 'title': 'Забег 10'})
+        with self.assertNumQueries(3):
+            _, data = self.get(url, fields='slug,location,race_types,schedules,free_slots', limit=2)
+        first = data['results'][0]
+        self.assertEqual(first['location']['city'], 'Казань')
+        self.assertEqual(first['race_types'], [{'id': self.race.pk, 'distance': 10, 'gender': 'M', 'min_age': 18,
+                                                'registration_fee': '1500.00'}])
+        self.assertEqual(first['schedules'], [{'start_time': '09:30', 'description': 'Старт'}])
+        self.assertEqual(first['free_slots'], 50)
+
+        self.assertEqual(self.client.get(url, {'fields': 'title,password'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 1000}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': 'bm9wZQ'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_event_detail', args=['missing'])).status_code, 404)
+
+    def test_cursor_walks_every_upcoming_event_once(self):
+        url, slugs = f"{reverse('api_events')}?fields=slug&limit=2", []
+        while url:
+            _, data = self.get(url)
+            slugs += [event['slug'] for event in data['results']]
+            url = data['next']
+        self.assertEqual(slugs, ['api-10', 'api-20', 'api-30', 'api-40', 'api-50'])
+        _, data = self.get(reverse('api_events'), fields='slug', filter='past')
+        self.assertEqual(data, {'results': [{'slug': 'api--5'}], 'next': None})
+
+    def test_responses_are_cached_until_a_field_they_show_changes(self):
+        url = reverse('api_events')
+        response, _ = self.get(url, fields='slug,free_slots')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={settings.API_MAX_AGE}')
+        self.get(url, fields='slug')
+        with self.assertNumQueries(0):
+            again, _ = self.get(url, fields='slug,free_slots')
+            self.assertEqual(again.content, response.content)
+            not_modified = self.client.get(url, {'fields': 'slug,free_slots'}, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+            plain = self.client.get(url, {'fields': 'slug,free_slots'})
+            self.assertFalse(plain.has_header('Content-Encoding'))
+            self.assertEqual(json.loads(plain.content)['results'][0]['free_slots'], 50)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            EventRegistration.objects.create(user=self.user, event=self.events[0], race=self.race,
+                                             payment_document='docs/payment.pdf', city='Казань', tshirt_size='M')
+        # Регистрация меняет только ответы со свободными местами
+        with self.assertNumQueries(0):
+            self.get(url, fields='slug')
+        _, data = self.get(url, fields='slug,free_slots')
+        self.assertEqual(data['results'][0]['free_slots'], 49)
+
+
+class NameDictionaryTests(TestCase):
+    """Club and city dictionary: grouping of spellings, cached suggestions and set-based rewrites."""
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        race = RaceType.objects.create(distance=10, gender='M', min_age=18, registration_fee=1000)
+        event = Event.objects.create(title='Забег', slug='names', description='-', event_rules='-',
+                                     event_type='road', start_datetime=timezone.now() + timedelta(days=30),
+                                     location=location, total_slots=100, image='events/zabeg.jpg')
+        clubs = ['Бегущий город'] * 3 + ['КЛБ «Бегущий город»', 'бегущий город', 'Бегун', 'Марафонец']
+        cities = ['Москва', 'г. Москва', 'москва', 'Мытищи', 'Москва', 'Казань', 'Мурманск']
+        User = get_user_model()
+        for n, (club, city) in enumerate(zip(clubs, cities)):
+            user = User.objects.create_user(f'names{n}', f'names{n}@example.com', 'password')
+            EventRegistration.objects.create(user=user, event=event, race=race, phone_number='+79161234567',
+                                             city=city, club=club, payment_document='docs/payment.pdf',
+                                             tshirt_size='M')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_spellings_share_a_key(self):
+        self.assertEqual(names.name_key(CanonicalName.CLUB, 'КЛБ «Бегущий город»'), 'бегущий город')
+        self.assertEqual(names.name_key(CanonicalName.CITY, 'г. Санкт-Петербург'), 'санкт петербург')
+        self.assertEqual(names.name_key(CanonicalName.CLUB, 'Клуб'), 'клуб')
+
+    def test_build_groups_spellings_under_the_most_frequent(self):
+        self.assertEqual(names.build(CanonicalName.CLUB), (3, 0))
+        entry = CanonicalName.objects.get(kind=CanonicalName.CLUB, key='бегущий город')
+        self.assertEqual(entry.name, 'Бегущий город')
+        self.assertEqual(entry.registrations, 5)
+        self.assertEqual(set(entry.spellings), {'Бегущий город', 'КЛБ «Бегущий город»', 'бегущий город'})
+
+        # Исправленное в админке название переживает пересборку
+        CanonicalName.objects.filter(pk=entry.pk).update(name='КЛБ Бегущий Город')
+        names.build(CanonicalName.CLUB)
+        self.assertEqual(CanonicalName.objects.get(pk=entry.pk).name, 'КЛБ Бегущий Город')
+
+    def test_suggestions_come_from_the_cache_after_a_build(self):
+        names.build(CanonicalName.CITY)
+        with self.assertNumQueries(0):
+            self.assertEqual(names.suggest(CanonicalName.CITY, 'М'), ['Москва', 'Мурманск', 'Мытищи'])
+            self.assertEqual(names.suggest(CanonicalName.CITY, 'г. му'), ['Мурманск'])
+        with self.assertNumQueries(1):
+            self.assertEqual(names.suggest(CanonicalName.CITY, 'Каза'), ['Казань'])
+        with self.assertNumQueries(0):
+            names.suggest(CanonicalName.CITY, 'Каза')
+
+        response = self.client.get(reverse('autocomplete', args=['city']), {'q': 'мо'})
+        self.assertEqual(response.json(), {'results': ['Москва']})
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertEqual(self.client.get(reverse('autocomplete', args=['street'])).status_code, 404)
+
+    def test_canonicalize_and_merge_rewrite_registrations(self):
+        names.build(CanonicalName.CITY)
+        self.assertEqual(names.canonicalize(CanonicalName.CITY), 2)
+        self.assertEqual(EventRegistration.objects.filter(city='Москва').count(), 4)
+        self.assertEqual(CanonicalName.objects.get(kind=CanonicalName.CITY, key='москва').spellings, ['Москва'])
+
+        names.build(CanonicalName.CLUB)
+        self.assertEqual(names.merge(CanonicalName.CLUB, ['Бегун', 'бегущий город'], 'Бегущий город'), 2)
+        self.assertEqual(EventRegistration.objects.filter(club='Бегущий город').count(), 5)
+        self.assertFalse(CanonicalName.objects.filter(kind=CanonicalName.CLUB, key='бегун').exists())
+        self.assertEqual(names.canonical(CanonicalName.CLUB, 'клб бегущий  ГОРОД'), 'Бегущий город')
+        self.assertEqual(names.canonical(CanonicalName.CLUB, 'Новый клуб'), 'Новый клуб')
+
+
+real_sanitize = imaging.sanitize
+
+
+def sanitize_or_die(source, target, **limits):
+    """imaging.sanitize in which a PNG kills the worker process, as a decoder crash would."""
+    if source.endswith('.png'):
+        os._exit(1)
+    return real_sanitize(source, target, **limits)
+
+
+def forked_pool(workers):
+    # fork: процесс пула получает подменённую sanitize вместе с памятью теста
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+
+
+class ImageUploadTests(TestCase):
+    """Uploads wait in quarantine and are published by the worker pool without metadata; bombs are rejected."""
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        cls.event = Event.objects.create(title='Забег', slug='foto-zabeg', description='-', event_rules='-',
+                                         event_type='road', start_datetime=timezone.now() + timedelta(days=30),
+                                         location=location, total_slots=100, image='events/zabeg.jpg')
+
+    def setUp(self):
+        roots = {}
+        for setting in ('MEDIA_ROOT', 'IMAGE_QUARANTINE_ROOT'):
+            roots[setting] = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, roots[setting])
+        settings_override = override_settings(**roots)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.quarantine = roots['IMAGE_QUARANTINE_ROOT']
+        self.Form = modelform_factory(GalleryPhoto, fields=['event', 'photo'])
+
+    def camera_jpeg(self):
+        """A 400x200 JPEG shot with the camera turned: EXIF orientation 6 and GPS coordinates."""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Camera'
+        exif.get_ifd(0x8825).update({1: 'N', 2: (55.0, 45.0, 0.0), 3: 'E', 4: (37.0, 37.0, 0.0)})
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 200), 'red').save(buffer, 'JPEG', exif=exif)
+        return buffer.getvalue()
+
+    def upload(self, content, name='IMG_0001.JPG'):
+        form = self.Form({'event': self.event.pk}, {'photo': SimpleUploadedFile(name, content)})
+        self.assertTrue(form.is_valid(), form.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            return form.save()
+
+    def test_upload_is_quarantined_then_published_without_metadata(self):
+        photo = self.upload(self.camera_jpeg())
+        photo.refresh_from_db()
+        self.assertFalse(photo.photo)
+        upload = ImageUpload.objects.get()
+        self.assertEqual((upload.status, upload.original_name), (ImageUpload.PENDING, 'IMG_0001.JPG'))
+        self.assertEqual(os.listdir(self.quarantine), [upload.quarantine_name])
+        self.assertIn('data-image-pending', str(self.Form(instance=photo)['photo']))
+
+        images.process_pending(workers=1)
+        upload.refresh_from_db()
+        photo.refresh_from_db()
+        self.assertEqual(upload.status, ImageUpload.DONE, upload.error)
+        self.assertEqual(photo.photo.name, 'events/photos/foto_zabeg/IMG_0001.jpg')
+        with Image.open(photo.photo.path) as published:
+            # Повёрнуто по ориентации, а EXIF вместе с GPS не сохранён
+            self.assertEqual(published.size, (200, 400))
+            self.assertEqual(dict(published.getexif()), {})
+            self.assertNotIn('exif', published.info)
+        self.assertEqual(os.listdir(self.quarantine), [])
+        self.assertNotIn('data-image-pending', str(self.Form(instance=photo)['photo']))
+
+    def test_newer_upload_replaces_a_pending_one(self):
+        photo = self.upload(self.camera_jpeg())
+        form = self.Form({'event': self.event.pk}, {'photo': SimpleUploadedFile('second.jpg', self.camera_jpeg())},
+                         instance=photo)
+        self.assertTrue(form.is_valid(), form.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            form.save()
+        upload = ImageUpload.objects.get()
+        self.assertEqual(upload.original_name, 'second.jpg')
+        self.assertEqual(os.listdir(self.quarantine), [upload.quarantine_name])
+
+    def test_pixel_bomb_is_rejected_from_its_header(self):
+        # PNG на сотню байт, который объявляет 100 млн точек
+        buffer = io.BytesIO()
+        Image.new('1', (1, 1)).save(buffer, 'PNG')
+        bomb = bytearray(buffer.getvalue())
+        bomb[16:24] = (10000).to_bytes(4, 'big') * 2
+        bomb[29:33] = zlib.crc32(bomb[12:29]).to_bytes(4, 'big')
+        photo = self.upload(bytes(bomb), name='bomb.png')
+
+        with mock.patch.object(ImageFile.ImageFile, 'load', side_effect=AssertionError('decoded')):
+            with self.assertRaisesMessage(imaging.Rejected, 'Слишком большое изображение'):
+                imaging.sanitize(os.path.join(self.quarantine, ImageUpload.objects.get().quarantine_name),
+                                 os.path.join(self.quarantine, 'out'), max_pixels=40_000_000, max_side=2560)
+
+        images.process_pending(workers=1)
+        upload = ImageUpload.objects.get()
+        self.assertEqual(upload.status, ImageUpload.REJECTED)
+        photo.refresh_from_db()
+        self.assertFalse(photo.photo)
+        self.assertIn('не принято', str(self.Form(instance=photo)['photo']))
+
+    @override_settings(IMAGE_MAX_UPLOAD_SIZE=1000)
+    def test_form_checks_size_and_signature_without_decoding(self):
+        for name, content in [('script.jpg', b'<?php echo 1; ?>'), ('large.jpg', self.camera_jpeg())]:
+            form = self.Form({'event': self.event.pk}, {'photo': SimpleUploadedFile(name, content)})
+            self.assertFalse(form.is_valid())
+            self.assertIn('photo', form.errors)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_dead_worker_costs_only_its_own_upload_an_attempt(self):
+        # Упавшая первой загрузка роняет пул, пока соседние ещё ждут своей очереди
+        buffer = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(buffer, 'PNG')
+        self.upload(buffer.getvalue(), name='crash.png')
+        neighbours = [self.upload(self.camera_jpeg(), name=f'photo{n}.jpg') for n in range(3)]
+
+        with mock.patch.object(images, 'pool', forked_pool), mock.patch.object(imaging, 'sanitize', sanitize_or_die):
+            images.process_pending(workers=2)
+            crash = ImageUpload.objects.get(original_name='crash.png')
+            self.assertEqual((crash.status, crash.attempts), (ImageUpload.PENDING, 1))
+            for photo in neighbours:
+                photo.refresh_from_db()
+                self.assertTrue(photo.photo, photo.pk)
+            self.assertEqual(ImageUpload.objects.filter(status=ImageUpload.DONE, attempts=0).count(), 3)
+
+            for _ in range(images.MAX_ATTEMPTS - 1):
+                images.process_pending(workers=2)
+        crash.refresh_from_db()
+        self.assertEqual(crash.status, ImageUpload.REJECTED)
+        self.assertEqual(os.listdir(self.quarantine), [])
+
+    def test_files_of_rolled_back_saves_are_swept(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.upload(self.camera_jpeg())
+            raise RuntimeError
+        kept = self.upload(self.camera_jpeg())
+        self.assertEqual(len(os.listdir(self.quarantine)), 2)
+        self.assertEqual(images.sweep_quarantine(), 0)
+
+        past = time.time() - 2 * images.ORPHAN_MIN_AGE
+        for name in os.listdir(self.quarantine):
+            os.utime(os.path.join(self.quarantine, name), (past, past))
+        self.assertEqual(images.sweep_quarantine(), 1)
+        self.assertEqual(os.listdir(self.quarantine), [ImageUpload.objects.get(object_id=kept.pk).quarantine_name])
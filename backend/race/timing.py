@@ -0,0 +1,170 @@
+"""
+Ingestion of timing-station readings.
+
+A station posts its readings in batches:
+
+    POST /api/timing/<event slug>/
+    Authorization: Bearer <one of TIMING_API_TOKENS>
+
+    {"station": "finish-1",
+     "records": [{"seq": 41, "bib": 117, "point": "finish", "time": "41:12.3"}, ...]}
+
+`seq` is the station's own record counter: a batch sent again after a timeout
+is stored only once (ON CONFLICT DO NOTHING on event, station and seq). `time`
+is the time since the gun, in seconds or as [HH:]MM:SS[.f]; `point` is "finish"
+or the name of a split.
+
+The log is append-only. A batch is written with one INSERT under a per-event
+advisory lock, so the record ids of an event are committed in increasing order
+and race/live.py can follow the log with an id cursor. Newly stored finish
+readings update the runners' results with one upsert, and their distances are
+re-ranked after commit.
+"""
+import hmac
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.dateparse import parse_duration
+from psycopg2.extras import execute_values
+
+from race_project.metrics import registry
+
+from . import ranking
+from .models import EventRegistration, RaceResult, TimingRecord
+
+registry.describe('timing_records_total', 'counter', 'Timing readings received, by outcome.')
+
+# Ключ рекомендательной блокировки PostgreSQL для записи в журнал (второй ключ — id мероприятия)
+LOCK_NAMESPACE = 3701
+
+INSERT_SQL = """
+    INSERT INTO race_timingrecord (event_id, registration_id, bib_number, point, elapsed, station, sequence,
+                                   received_at)
+    VALUES %s
+    ON CONFLICT (event_id, station, sequence) DO NOTHING
+    RETURNING sequence
+"""
+INSERT_TEMPLATE = '(%s, %s, %s, %s, %s, %s, %s, now())'
+
+
+class BatchError(ValueError):
+    """The posted batch is malformed; nothing of it was stored."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+class Reading:
+    """One record of a batch."""
+    __slots__ = ('sequence', 'bib_number', 'point', 'elapsed')
+
+    def __init__(self, sequence, bib_number, point, elapsed):
+        self.sequence = sequence
+        self.bib_number = bib_number
+        self.point = point
+        self.elapsed = elapsed
+
+
+def authorized(request):
+    """Whether the request carries one of the station tokens."""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return False
+    return any(hmac.compare_digest(token.encode(), allowed.encode()) for allowed in settings.TIMING_API_TOKENS)
+
+
+def parse_elapsed(value):
+    """Seconds or '[HH:]MM:SS[.f]' -> timedelta; None if the value is not a time."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return timedelta(seconds=value) if value >= 0 else None
+    if isinstance(value, str):
+        elapsed = parse_duration(value.strip())
+        return elapsed if elapsed is not None and elapsed >= timedelta(0) else None
+    return None
+
+
+def _positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def parse_batch(payload):
+    """Validate a posted batch; returns (station, readings) or raises BatchError."""
+    if not isinstance(payload, dict):
+        raise BatchError(['The body must be a JSON object.'])
+    station = payload.get('station')
+    records = payload.get('records')
+    errors = []
+    if not isinstance(station, str) or not 0 < len(station) <= 50:
+        errors.append('"station" must be a string of 1 to 50 characters.')
+    if not isinstance(records, list) or not 0 < len(records) <= settings.TIMING_MAX_BATCH:
+        errors.append(f'"records" must be a list of 1 to {settings.TIMING_MAX_BATCH} readings.')
+        raise BatchError(errors)
+
+    readings = []
+    for number, record in enumerate(records):
+        record = record if isinstance(record, dict) else {}
+        point = record.get('point')
+        elapsed = parse_elapsed(record.get('time'))
+        if not _positive_int(record.get('seq')) or not _positive_int(record.get('bib')) \
+                or not isinstance(point, str) or not 0 < len(point) <= 20 or elapsed is None:
+            errors.append(f'records[{number}]: expected {{"seq": int, "bib": int, "point": str, "time": time}}.')
+            continue
+        readings.append(Reading(record['seq'], record['bib'], point, elapsed))
+    if errors:
+        raise BatchError(errors)
+    return station, readings
+
+
+def ingest(event, station, readings):
+    """Append the readings to the event's log; returns a summary of what was stored."""
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # Записи мероприятия фиксируются строго по возрастанию id — на этом держится курсор трансляции
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [LOCK_NAMESPACE, event.pk])
+        registrations = {
+            bib_number: (registration_id, race_id, distance)
+            for bib_number, registration_id, race_id, distance in EventRegistration.objects.for_event(event).filter(
+                is_active=True, bib_number__in={reading.bib_number for reading in readings},
+            ).values_list('bib_number', 'id', 'race_id', 'race__distance')
+        }
+        rows = [
+            (event.pk, registrations.get(reading.bib_number, (None,))[0], reading.bib_number, reading.point,
+             reading.elapsed, station, reading.sequence)
+            for reading in readings
+        ]
+        with connection.cursor() as cursor:
+            stored = {row[0] for row in execute_values(cursor.cursor, INSERT_SQL, rows, template=INSERT_TEMPLATE,
+                                                       page_size=len(rows), fetch=True)}
+
+        # Последняя новая отметка финиша участника становится его результатом
+        finishes = {}
+        for reading in readings:
+            if reading.sequence in stored and reading.point == TimingRecord.FINISH \
+                    and reading.bib_number in registrations:
+                finishes[reading.bib_number] = reading
+        if finishes:
+            RaceResult.objects.bulk_create(
+                [RaceResult(registration_id=registrations[bib_number][0], event=event,
+                            race_id=registrations[bib_number][1], distance=registrations[bib_number][2],
+                            finish_time=reading.elapsed)
+                 for bib_number, reading in finishes.items()],
+                update_conflicts=True, unique_fields=['registration'], update_fields=['finish_time', 'updated_at'],
+            )
+            distances = {registrations[bib_number][2] for bib_number in finishes}
+            transaction.on_commit(lambda: ranking.recompute(event.pk, distances))
+
+    duplicates = len(readings) - len(stored)
+    registry.inc('timing_records_total', {'outcome': 'stored'}, len(stored))
+    if duplicates:
+        registry.inc('timing_records_total', {'outcome': 'duplicate'}, duplicates)
+    return {
+        'received': len(readings),
+        'stored': len(stored),
+        'duplicates': duplicates,
+        'finishes': len(finishes),
+        'unknown_bibs': sorted({reading.bib_number for reading in readings} - registrations.keys()),
+    }
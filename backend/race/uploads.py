@@ -0,0 +1,135 @@
+"""
+The request side of image uploads (see race/images.py for the rest).
+
+QuarantinedImageField gives its form fields QuarantinedImageFormField: the
+upload is checked by its size and first bytes only, never decoded in the
+request. On save the file goes to the quarantine storage
+(IMAGE_QUARANTINE_ROOT, not served), the field keeps its published value, and
+an ImageUpload row queues the file for process_images.
+
+The widgets show the state of the latest upload of the field: "being checked"
+while it is queued, the reason if it was rejected.
+"""
+import os
+import uuid
+
+from django import forms
+from django.apps import apps
+from django.conf import settings
+from django.contrib.admin.widgets import AdminFileWidget
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.template.defaultfilters import filesizeformat
+from django.utils.html import format_html
+
+from .imaging import sniff
+
+
+def quarantine_storage():
+    return FileSystemStorage(location=settings.IMAGE_QUARANTINE_ROOT)
+
+
+def latest_upload(instance, field_name):
+    """The newest ImageUpload of the field of a saved object, or None."""
+    if instance is None or instance.pk is None:
+        return None
+    ImageUpload = apps.get_model('race', 'ImageUpload')
+    return ImageUpload.objects.for_field(instance, field_name).order_by('-id').first()
+
+
+class UploadStateMixin:
+    """Adds the state of the latest upload of the field under the file input."""
+
+    def render(self, name, value, attrs=None, renderer=None):
+        html = super().render(name, value, attrs, renderer)
+        field = getattr(value, 'field', None)
+        upload = latest_upload(getattr(value, 'instance', None), field.name) if field else None
+        if upload is None or upload.status == upload.DONE:
+            return html
+        if upload.status == upload.PENDING:
+            notice = format_html('<div class="form-text text-info" data-image-pending="1">{}</div>',
+                                 "Новое изображение проверяется и появится через несколько секунд.")
+        else:
+            notice = format_html('<div class="form-text text-danger">{} {}</div>',
+                                 "Загруженное изображение не принято:", upload.error)
+        return html + notice
+
+
+class QuarantinedImageInput(UploadStateMixin, forms.ClearableFileInput):
+    pass
+
+
+class AdminQuarantinedImageInput(UploadStateMixin, AdminFileWidget):
+    pass
+
+
+class QuarantinedImageFormField(forms.FileField):
+    """An image upload checked by size and signature in the request; decoding is left to process_images."""
+    widget = QuarantinedImageInput
+    default_error_messages = {
+        'too_large': "Файл больше %(limit)s.",
+        'invalid_image': "Загрузите изображение в формате JPEG, PNG или WebP.",
+    }
+
+    def __init__(self, *args, **kwargs):
+        if kwargs.get('widget') is AdminFileWidget:
+            kwargs['widget'] = AdminQuarantinedImageInput
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, data):
+        upload = super().to_python(data)
+        if upload is None:
+            return None
+        if upload.size > settings.IMAGE_MAX_UPLOAD_SIZE:
+            raise forms.ValidationError(self.error_messages['too_large'], code='too_large',
+                                        params={'limit': filesizeformat(settings.IMAGE_MAX_UPLOAD_SIZE)})
+        upload.seek(0)
+        head = upload.read(16)
+        upload.seek(0)
+        if sniff(head) is None:
+            raise forms.ValidationError(self.error_messages['invalid_image'], code='invalid_image')
+        return upload
+
+    def widget_attrs(self, widget):
+        attrs = super().widget_attrs(widget)
+        if isinstance(widget, forms.FileInput) and 'accept' not in widget.attrs:
+            attrs.setdefault('accept', 'image/jpeg,image/png,image/webp')
+        return attrs
+
+
+class QuarantinedImageField(models.ImageField):
+    """
+    An image field whose uploads are published by process_images. Saving an
+    object with a new upload puts the file in quarantine, keeps the published
+    value of the field in the row and queues an ImageUpload.
+    """
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{'form_class': QuarantinedImageFormField, **kwargs})
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super().contribute_to_class(cls, name, **kwargs)
+        if not cls._meta.abstract:
+            models.signals.post_save.connect(self.queue_upload, sender=cls, weak=False)
+
+    def pre_save(self, model_instance, add):
+        file = getattr(model_instance, self.attname)
+        if not file or file._committed:
+            return file
+        ext = os.path.splitext(file.name)[1].lower()
+        quarantined = quarantine_storage().save(f'{uuid.uuid4().hex}{ext}', file.file)
+        model_instance.__dict__.setdefault('_quarantined_images', {})[self.name] = (
+            quarantined, os.path.basename(file.name), file.size)
+        # В строке остаётся опубликованное изображение (у нового объекта — пустое значение)
+        published = None
+        if not add:
+            published = (type(model_instance)._base_manager.filter(pk=model_instance.pk)
+                         .values_list(self.attname, flat=True).first())
+        setattr(model_instance, self.attname, published or (None if self.null else ''))
+        return getattr(model_instance, self.attname)
+
+    def queue_upload(self, sender, instance, **kwargs):
+        quarantined = instance.__dict__.get('_quarantined_images', {}).pop(self.name, None)
+        if quarantined:
+            name, original_name, size = quarantined
+            apps.get_model('race', 'ImageUpload').queue(instance, self.name, name, original_name, size)
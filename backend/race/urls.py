@@ -3,14 +3,31 @@ from . import views
 
 urlpatterns = [
     path('get-races-for-event/<int:event_id>/', views.get_races_for_event, name='get-races-for-event'),
+    path('autocomplete/<str:kind>/', views.autocomplete, name='autocomplete'),
     path('', views.MainPageView.as_view(), name='main_page'),
     path('events/', views.EventsView.as_view(), name='events'),
+    path('events/feed.ics', views.events_calendar, name='events_calendar'),
+    path('events/feed.rss', views.events_rss, name='events_rss'),
+    path('events/feed.atom', views.events_atom, name='events_atom'),
+    path('calendar/<str:token>.ics', views.user_calendar, name='user_calendar'),
     path('pricing/', views.PricingView.as_view(), name='pricing'),
     path('contact/', views.ContactView.as_view(), name='contact'),
     path('event-detail/<slug:event_slug>/',
          views.EventDetailView.as_view(), name='event_detail'),
     path('event-detail/<slug:event_slug>/registrations/',
          views.EventRegistrationsView.as_view(), name='event_registrations'),
+    path('event-detail/<slug:event_slug>/reviews/',
+         views.EventReviewsView.as_view(), name='event_reviews'),
+    path('event-detail/<slug:event_slug>/results/',
+         views.EventResultsView.as_view(), name='event_results'),
+    path('event-detail/<slug:event_slug>/documents/<str:name>',
+         views.start_list_document, name='start_list_document'),
+    path('live/<slug:event_slug>/', views.live_results, name='live_results'),
+    path('api/v1/events/', views.api_events, name='api_events'),
+    path('api/v1/events/<slug:event_slug>/', views.api_event_detail, name='api_event_detail'),
+    path('api/v1/race-types/', views.api_race_types, name='api_race_types'),
+    path('api/v1/locations/', views.api_locations, name='api_locations'),
+    path('api/timing/<slug:event_slug>/', views.TimingIngestView.as_view(), name='timing_ingest'),
 
     path('events/<int:pk>/add_review/', views.add_review, name='add_review'),
 
@@ -1,22 +1,38 @@
-from django.http import HttpResponseNotFound
+import json
+
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotFound, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse_lazy
 from django.views.generic import ListView, TemplateView, CreateView, DetailView
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views import View
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_safe
+from django.utils.decorators import method_decorator
 from django.utils import timezone
-from .models import Event, Location, RaceType, Organizer, GalleryPhoto, Review, EventRegistration
-from django.db.models import Prefetch
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from .models import Event, Location, RaceType, Organizer, GalleryPhoto, Review, EventRegistration, RaceResult
+from django.db.models import F, Prefetch
+from django.conf import settings
 from .forms import ReviewForm, EventRegistrationForm
+from .paginators import CountedPaginator
+from .reviews import latest_reviews
+from . import api, audit, feeds, live, names, start_lists, timing
+from .conditional import ConditionalGetMixin, event_detail_validator, events_list_validator, pricing_validator
 from django.core.paginator import Paginator
 from django.http import JsonResponse
+from race_project.db_router import ReplicaReadMixin, replica_reads
+from race_project.throttling import ThrottleMixin, throttle
 
 
 def page_not_found(request, exception):
     return HttpResponseNotFound("<h1>Страница не найдена</h1>")
 
 
-class MainPageView(TemplateView):
+class MainPageView(ReplicaReadMixin, TemplateView):
     """
     The MainPageView class represents the view for the main page of the site. This view handles the display
     of upcoming and past events, as well as the latest reviews.
@@ -35,18 +51,17 @@ class MainPageView(TemplateView):
         context['past_events'] = Event.objects.filter(
             start_datetime__lt=current_datetime
         ).prefetch_related(
-            'photos', 'summary'
+            # Фотографии, ещё не прошедшие проверку (race/images.py), пока без файла
+            Prefetch('photos', queryset=GalleryPhoto.objects.exclude(photo='')), 'summary'
         ).order_by('-start_datetime')[:3]
 
-        # Получение последних 5 отзывов с выборкой связанных данных
-        context['latest_reviews'] = Review.objects.order_by('-created_at')[:5].select_related(
-            'event', 'author'
-        )
+        # Последние отзывы из кэша (сбрасывается при изменении отзывов)
+        context['latest_reviews'] = latest_reviews()
 
         return context
 
 
-class EventsView(ListView):
+class EventsView(ReplicaReadMixin, ConditionalGetMixin, ListView):
     """
     The EventsView class is responsible for displaying a list of events on the 'race/events.html' page.
     This class extends Django's ListView. It provides a list of events based on the filter
@@ -74,25 +89,34 @@ class EventsView(ListView):
         context['filter'] = self.request.GET.get('filter', 'all')
         return context
 
+    def get_validator(self):
+        return events_list_validator()
+
 
-class PricingView(View):
+class PricingView(ReplicaReadMixin, ConditionalGetMixin, TemplateView):
     """
-    The PricingView class extends Django's View class and is used to render the 'race/pricing.html' page.
+    The PricingView class extends Django's TemplateView class and is used to render the 'race/pricing.html' page.
     This view gathers data about upcoming events, including their associated race types and organizers,
     and passes this information to the template for rendering.
     """
-    def get(self, request, *args, **kwargs):
-        upcoming_events = Event.objects.filter(start_datetime__gte=timezone.now()).prefetch_related(
+    template_name = 'race/pricing.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['upcoming_events'] = Event.objects.filter(start_datetime__gte=timezone.now()).prefetch_related(
             'race_types', 'organizers'
         )
-        return render(request, 'race/pricing.html', {'upcoming_events': upcoming_events})
+        return context
+
+    def get_validator(self):
+        return pricing_validator()
 
 
 class ContactView(TemplateView):
     template_name = 'race/contact.html'
 
 
-class EventDetailView(DetailView):
+class EventDetailView(ReplicaReadMixin, ConditionalGetMixin, DetailView):
     """
     The EventDetailView class provides a detailed view of an individual event.
     It extends Django's DetailView class to render a specific event's details.
@@ -115,10 +139,74 @@ class EventDetailView(DetailView):
         else:
             context['latitude'], context['longitude'] = None, None
 
+        context['latest_event_reviews'] = event.reviews.select_related('author').order_by('-created_at', '-id')[:3] \
+            if event.review_count else []
         return context
 
+    def get_validator(self):
+        return event_detail_validator(self.kwargs[self.slug_url_kwarg])
 
-class EventRegistrationsView(DetailView):
+
+class EventReviewsView(ReplicaReadMixin, ListView):
+    """
+    Paginated reviews of one event, newest first. Pages are read through the
+    (event, created_at) index and counted with Event.review_count instead of COUNT(*).
+    """
+    template_name = 'race/event_reviews.html'
+    context_object_name = 'reviews'
+    paginate_by = settings.REVIEWS_PER_PAGE
+
+    def get(self, request, *args, **kwargs):
+        self.event = get_object_or_404(Event.objects.only('title', 'slug', 'review_count'),
+                                       slug=self.kwargs['event_slug'])
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return Review.objects.filter(event=self.event).select_related('author').only(
+            'text', 'created_at', 'author__first_name', 'author__last_name'
+        ).order_by('-created_at', '-id')
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return CountedPaginator(queryset, per_page, count=self.event.review_count, orphans=orphans,
+                                allow_empty_first_page=allow_empty_first_page, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['event'] = self.event
+        context['page_range'] = context['paginator'].get_elided_page_range(context['page_obj'].number)
+        return context
+
+
+class EventResultsView(ReplicaReadMixin, ListView):
+    """
+    Results of an event ordered by place, for one distance or race type at a time.
+    Places are precomputed by race/ranking.py, so the page is a plain index read.
+    """
+    template_name = 'race/event_results.html'
+    context_object_name = 'results'
+    paginate_by = 50
+
+    def get(self, request, *args, **kwargs):
+        self.event = get_object_or_404(Event, slug=self.kwargs['event_slug'])
+        self.races = list(self.event.race_types.order_by('distance', 'gender', 'min_age'))
+        self.race = next((race for race in self.races if str(race.pk) == request.GET.get('race')), None)
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        results = RaceResult.objects.filter(event=self.event).select_related('registration__user', 'race')
+        if self.race is not None:
+            return results.filter(race=self.race).order_by(F('place_race').asc(nulls_last=True), 'id')
+        return results.order_by('distance', F('place_overall').asc(nulls_last=True), 'id')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(event=self.event, races=self.races, race=self.race)
+        # В день старта протокол дополняется отметками хронометража в реальном времени
+        context['is_live'] = self.event.days_left() == 0
+        return context
+
+
+class EventRegistrationsView(ReplicaReadMixin, DetailView):
     """
     A view for display details of registrations.
     """
@@ -130,7 +218,7 @@ class EventRegistrationsView(DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         event = self.object
-        registrations = EventRegistration.objects.filter(event=event, is_active=True).select_related('user', 'race').order_by('race')
+        registrations = EventRegistration.objects.for_event(event).filter(is_active=True).select_related('user', 'race').order_by('race')
 
         grouped_registrations = {}
         for registration in registrations:
@@ -143,6 +231,7 @@ class EventRegistrationsView(DetailView):
         return context
 
 
+@throttle('races_for_event', methods=None)
 def get_races_for_event(request, event_id):
     """
     A Django view function that retrieves and returns all race types
@@ -163,10 +252,145 @@ def get_races_for_event(request, event_id):
     return JsonResponse(data)
 
 
-class EventRegistrationCreateView(LoginRequiredMixin, CreateView):
+@require_safe
+@throttle('autocomplete', methods=None)
+@replica_reads
+def autocomplete(request, kind):
+    """Suggestions for the club or city field of the registration form (see race/names.py)."""
+    if kind not in names.FIELDS:
+        raise Http404("Нет такого словаря")
+    response = JsonResponse({'results': names.suggest(kind, request.GET.get('q', '')[:100])})
+    patch_cache_control(response, public=True, max_age=settings.NAMES_MAX_AGE)
+    return response
+
+
+async def live_results(request, event_slug):
+    """
+    Server-Sent Events stream of an event's timing records (`?race=<id>` narrows it
+    to one race type). Served by the ASGI workers; see race/live.py.
+    """
+    event_id = await live.in_database_thread(live.event_id_for)(event_slug)
+    if event_id is None:
+        raise Http404("Мероприятие не найдено")
+    race_id = request.GET.get('race')
+    last_event_id = request.headers.get('Last-Event-ID')
+    response = StreamingHttpResponse(
+        live.stream(event_id, int(race_id) if race_id and race_id.isdigit() else None,
+                    int(last_event_id) if last_event_id and last_event_id.isdigit() else None),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # nginx не должен буферизовать поток
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def public_feed(view):
+    """A feed of upcoming events: 304 while feeds_validator() is unchanged, revalidated on every poll."""
+    view = condition(etag_func=lambda request, *args, **kwargs: feeds.feeds_validator())(view)
+    return cache_control(no_cache=True)(view)
+
+
+@public_feed
+def events_calendar(request):
+    """Upcoming events as iCalendar; nginx serves the snapshot of it (see race/feeds.py)."""
+    return HttpResponse(feeds.events_calendar(request), content_type='text/calendar; charset=utf-8')
+
+
+events_rss = public_feed(feeds.UpcomingEventsFeed())
+events_atom = public_feed(feeds.UpcomingEventsAtomFeed())
+
+
+def user_calendar(request, token):
+    """
+    A runner's own starts as iCalendar. The signed token identifies the user,
+    so calendar apps fetch it without a session.
+    """
+    user_id = feeds.user_id_from_token(token)
+    if user_id is None:
+        raise Http404("Календарь не найден")
+    etag = feeds.user_calendar_etag(user_id)
+    response = get_conditional_response(request, etag=quote_etag(etag))
+    if response is None:
+        response = HttpResponse(feeds.user_calendar(request, user_id, etag),
+                                content_type='text/calendar; charset=utf-8')
+    response['ETag'] = quote_etag(etag)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@staff_member_required
+@require_safe
+def start_list_document(request, event_slug, name):
+    """
+    A start list or bib sheet of an event, for staff only: they carry the
+    runners' birth years. nginx sends the file from its internal location.
+    """
+    event = get_object_or_404(Event, slug=event_slug)
+    if name not in start_lists.DOCUMENTS or start_lists.built_version(event) is None:
+        raise Http404("Документ не найден")
+    if settings.START_LIST_ACCEL_REDIRECT:
+        response = HttpResponse(content_type='text/html; charset=utf-8')
+        response['X-Accel-Redirect'] = start_lists.internal_url(event, name)
+    else:
+        response = FileResponse(open(start_lists.document_path(event, name), 'rb'),
+                                content_type='text/html; charset=utf-8')
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+# Read-only JSON API v1 (see race/api.py)
+
+@require_safe
+@replica_reads
+def api_events(request):
+    return api.respond(request, api.EVENT_RESOURCE, api.event_list, request, clock=True)
+
+
+@require_safe
+@replica_reads
+def api_event_detail(request, event_slug):
+    return api.respond(request, api.EVENT_RESOURCE, api.event_detail, event_slug, detail=True)
+
+
+@require_safe
+@replica_reads
+def api_race_types(request):
+    return api.respond(request, api.RACE_TYPE_RESOURCE, api.simple_list(api.RACE_TYPE_RESOURCE), request)
+
+
+@require_safe
+@replica_reads
+def api_locations(request):
+    return api.respond(request, api.LOCATION_RESOURCE, api.simple_list(api.LOCATION_RESOURCE), request)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class TimingIngestView(View):
+    """
+    Accepts batches of split and finish readings from timing stations and appends
+    them to the event's timing log (see race/timing.py for the format).
+    """
+    http_method_names = ['post']
+
+    def post(self, request, event_slug):
+        if not timing.authorized(request):
+            return JsonResponse({'errors': ['Invalid or missing station token.']}, status=401)
+        event = get_object_or_404(Event, slug=event_slug)
+        try:
+            station, readings = timing.parse_batch(json.loads(request.body))
+        except timing.BatchError as exc:
+            return JsonResponse({'errors': exc.errors}, status=400)
+        except ValueError:
+            return JsonResponse({'errors': ['The body is not valid JSON.']}, status=400)
+        return JsonResponse(timing.ingest(event, station, readings))
+
+
+class EventRegistrationCreateView(ThrottleMixin, LoginRequiredMixin, CreateView):
     """
     A view for creating new event registrations.
     """
+    throttle_scope = 'event_registration'
     model = EventRegistration
     form_class = EventRegistrationForm
     template_name = 'race/register_for_event.html'
@@ -176,6 +400,7 @@ class EventRegistrationCreateView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         form.instance.user = self.request.user  # Assign the current user to the registration
         response = super().form_valid(form)
+        audit.record_created(self.object, actor=self.request.user)
         self.request.session['registration_successful'] = True  # Установка флага в сессии
         return response
 
@@ -200,6 +425,7 @@ class RaceRegistrationSuccessView(TemplateView):
         return super().dispatch(request, *args, **kwargs)
 
 
+@throttle('review')
 def add_review(request, pk):
     event = Event.objects.get(id=pk)
     if request.method == 'POST':
@@ -0,0 +1,6 @@
+"""
+PostgreSQL backend with a bounded per-process connection pool.
+
+Use ``'ENGINE': 'race_project.db_pool'`` and configure the pool with a ``POOL``
+dict in the database settings (see ``pool.ConnectionPool`` for the keys).
+"""
@@ -0,0 +1,31 @@
+"""
+PostgreSQL database wrapper that checks connections out of a per-process pool
+instead of opening one per request, and returns them to the pool on close().
+"""
+from django.db.backends.postgresql import base as postgresql_base
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from .creation import DatabaseCreation
+from .pool import get_pool
+
+
+class DatabaseWrapper(postgresql_base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+    _pool = None
+
+    def get_new_connection(self, conn_params):
+        self._pool = get_pool(self.alias, conn_params, self.settings_dict.get('POOL'))
+        connection = self._pool.acquire(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        # Для соединения из пула уровень изоляции уже выставлен, восстанавливаем только атрибут
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        self.isolation_level = IsolationLevel(isolation_level) if isolation_level is not None \
+            else IsolationLevel.READ_COMMITTED
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                if self._pool is None:
+                    return self.connection.close()
+                # Соединение, закрываемое внутри транзакции или после ошибки, в пул не возвращаем
+                self._pool.release(self.connection, discard=self.errors_occurred or self.in_atomic_block)
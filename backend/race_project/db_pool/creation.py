@@ -0,0 +1,11 @@
+from django.db.backends.postgresql import creation as postgresql_creation
+
+from .pool import close_idle_connections
+
+
+class DatabaseCreation(postgresql_creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Соединения, вернувшиеся в пул, иначе не дадут удалить тестовую базу
+        close_idle_connections(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
@@ -0,0 +1,220 @@
+"""
+Thread-safe bounded pool of psycopg2 connections.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+from race_project.metrics import registry
+
+registry.describe('db_pool_wait_seconds', 'histogram', 'Time spent waiting for a pooled DB connection.')
+registry.describe('db_pool_timeouts_total', 'counter', 'Checkouts that gave up waiting for a connection.')
+registry.describe('db_pool_connections_created_total', 'counter', 'New DB connections opened by the pool.')
+registry.describe('db_pool_connections_discarded_total', 'counter', 'Pooled connections closed, by reason.')
+registry.describe('db_pool_size', 'gauge', 'Open connections (idle and in use) per worker.')
+registry.describe('db_pool_in_use', 'gauge', 'Connections checked out per worker.')
+
+WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+DEFAULTS = {
+    'MAX_SIZE': 8,                # Максимум соединений на процесс
+    'TIMEOUT': 10.0,              # Сколько ждать свободное соединение, сек
+    'MAX_IDLE': 300.0,            # Закрывать соединения, простаивающие дольше, сек
+    'MAX_LIFETIME': 1800.0,       # Пересоздавать соединения старше, сек
+    'HEALTH_CHECK_INTERVAL': 30.0,  # Проверять SELECT 1 соединения, простаивавшие дольше, сек
+}
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No connection became available within POOL['TIMEOUT'] seconds."""
+
+
+class PooledConnection:
+    __slots__ = ('connection', 'created_at', 'released_at')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = self.released_at = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    Keeps up to MAX_SIZE open connections per process. Checkout reuses the most
+    recently released connection, health-checks connections that sat idle for
+    longer than HEALTH_CHECK_INTERVAL, and blocks up to TIMEOUT seconds when
+    every connection is in use. The lock only guards the bookkeeping: health
+    checks, rollbacks and closes talk to the server without holding it.
+    """
+
+    def __init__(self, alias, options=None):
+        options = {**DEFAULTS, **(options or {})}
+        self.alias = alias
+        self.max_size = options['MAX_SIZE']
+        self.timeout = options['TIMEOUT']
+        self.max_idle = options['MAX_IDLE']
+        self.max_lifetime = options['MAX_LIFETIME']
+        self.health_check_interval = options['HEALTH_CHECK_INTERVAL']
+        self.pid = os.getpid()
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, connect):
+        """Check out a connection, opening one with `connect()` if the pool has room."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            pooled = self._reserve(deadline)
+            if pooled is None:
+                break
+            # Проверка (в том числе SELECT 1) идёт вне блокировки: другие потоки не ждут сети
+            reason = self._unhealthy(pooled)
+            if reason is None:
+                with self._cond:
+                    return self._checkout(pooled, started)
+            self._discard(pooled, reason)
+        # Новое соединение открываем вне блокировки, чтобы не задерживать остальные потоки
+        try:
+            connection = connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        registry.inc('db_pool_connections_created_total', {'alias': self.alias})
+        with self._cond:
+            return self._checkout(PooledConnection(connection), started)
+
+    def release(self, connection, discard=False):
+        with self._cond:
+            pooled = self._in_use.pop(id(connection), None)
+        if pooled is None:
+            connection.close()
+            return
+        # Соединение уже ничьё, кроме этого потока: откат транзакции и закрытие — без блокировки
+        if discard or not self._reset(connection):
+            self._discard(pooled, 'error')
+            return
+        with self._cond:
+            pooled.released_at = time.monotonic()
+            self._idle.append(pooled)
+            self._report()
+            self._cond.notify()
+
+    def close_idle(self):
+        """Close every idle connection, e.g. before the database they point at is dropped."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for pooled in idle:
+            self._discard(pooled, 'closed')
+
+    def _reserve(self, deadline):
+        """
+        Take the most recently released idle connection, or room for a new one
+        (None); wait for either until the deadline.
+        """
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    registry.inc('db_pool_timeouts_total', {'alias': self.alias})
+                    raise PoolTimeout(f'No free connection in pool "{self.alias}" after {self.timeout}s')
+                self._cond.wait(remaining)
+
+    def _checkout(self, pooled, started):
+        self._in_use[id(pooled.connection)] = pooled
+        registry.observe('db_pool_wait_seconds', time.monotonic() - started, {'alias': self.alias},
+                         buckets=WAIT_BUCKETS)
+        self._report()
+        return pooled.connection
+
+    def _unhealthy(self, pooled):
+        """Why the idle connection must not be reused, or None."""
+        now = time.monotonic()
+        if pooled.connection.closed:
+            return 'closed'
+        if now - pooled.created_at > self.max_lifetime:
+            return 'lifetime'
+        if now - pooled.released_at > self.max_idle:
+            return 'idle'
+        if now - pooled.released_at > self.health_check_interval and not self._ping(pooled.connection):
+            return 'health_check'
+        return None
+
+    @staticmethod
+    def _ping(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _reset(connection):
+        """Return the connection to a clean, idle state; False if it cannot be reused."""
+        if connection.closed:
+            return False
+        status = connection.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _discard(self, pooled, reason):
+        """Forget a connection that is neither idle nor checked out, and close it outside the lock."""
+        with self._cond:
+            self._size -= 1
+            registry.inc('db_pool_connections_discarded_total', {'alias': self.alias, 'reason': reason})
+            self._report()
+            self._cond.notify()
+        try:
+            pooled.connection.close()
+        except psycopg2.Error:
+            pass
+
+    def _report(self):
+        registry.set_gauge('db_pool_size', self._size, {'alias': self.alias})
+        registry.set_gauge('db_pool_in_use', len(self._in_use), {'alias': self.alias})
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, conn_params, options=None):
+    """
+    Return the process-wide pool for these connection parameters, creating it on
+    first use. Pools inherited through fork() are abandoned, never shared.
+    """
+    key = (alias, tuple(sorted((name, str(value)) for name, value in conn_params.items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[key] = ConnectionPool(alias, options)
+        return pool
+
+
+def close_idle_connections(alias=None):
+    """Close idle pooled connections of this process, for one alias or all of them."""
+    with _pools_lock:
+        pools = [pool for (pool_alias, _), pool in _pools.items() if alias in (None, pool_alias)]
+    for pool in pools:
+        pool.close_idle()
@@ -0,0 +1,163 @@
+"""
+Primary/replica database routing.
+
+Reads go to a replica only inside views that opt in with ``ReplicaReadMixin``
+(or the ``replica_reads`` decorator), only for GET/HEAD requests, and only if
+the client has not written anything in the last ``REPLICA_PIN_SECONDS``:
+every write marks the response with a short-lived cookie that pins the
+client's subsequent reads to the primary (read-your-writes). Replicas whose
+replication lag exceeds ``REPLICA_MAX_LAG`` seconds, or that cannot be reached,
+are skipped until the next lag check.
+"""
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+registry.describe('db_replica_lag_seconds', 'gauge', 'Last measured replication lag per replica.')
+registry.describe('db_replica_reads_total', 'counter', 'Replica-eligible requests by chosen database.')
+
+PRIMARY = 'default'
+
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class RoutingState:
+    """Routing decisions for the request being handled in this context."""
+    __slots__ = ('read_alias', 'wrote')
+
+    def __init__(self):
+        self.read_alias = PRIMARY
+        self.wrote = False
+
+
+routing_state = ContextVar('routing_state', default=None)
+
+
+class ReplicaHealth:
+    """Per-process cache of replica lag, refreshed at most every REPLICA_LAG_CHECK_INTERVAL."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._healthy = []
+
+    def healthy_replicas(self):
+        if time.monotonic() - self._checked_at > settings.REPLICA_LAG_CHECK_INTERVAL \
+                and self._lock.acquire(blocking=False):
+            # Проверяет один поток, остальные пока пользуются прежним списком
+            try:
+                self._healthy = [alias for alias in settings.DATABASE_REPLICAS if self._lag_ok(alias)]
+                self._checked_at = time.monotonic()
+            finally:
+                self._lock.release()
+        return self._healthy
+
+    @staticmethod
+    def _lag_ok(alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+        except DatabaseError:
+            logger.warning('Replica %s is unreachable, reading from the primary', alias)
+            connections[alias].close()
+            return False
+        registry.set_gauge('db_replica_lag_seconds', lag, {'alias': alias})
+        if lag > settings.REPLICA_MAX_LAG:
+            logger.warning('Replica %s lags %.1fs behind, bypassing it', alias, lag)
+            return False
+        return True
+
+
+replica_health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+    """Send writes to the primary and reads wherever the current request allows."""
+
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        return state.read_alias if state is not None else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.wrote = True
+            # После записи в этом же запросе читаем только с основной БД
+            state.read_alias = PRIMARY
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная БД
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+class ReplicaReadMixin:
+    """Let the read-only view serve GET/HEAD requests from a replica."""
+    use_replica = True
+
+
+def replica_reads(view_func):
+    """Function-view counterpart of ReplicaReadMixin."""
+    view_func.use_replica = True
+    return view_func
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Sets up the routing state for each request and maintains the
+    read-your-writes cookie. Must sit above SessionMiddleware so session
+    writes are seen as writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RoutingState()
+        token = routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        if state.wrote:
+            pin_seconds = settings.REPLICA_PIN_SECONDS
+            response.set_cookie(settings.REPLICA_PIN_COOKIE, str(int(time.time() + pin_seconds)),
+                                max_age=pin_seconds, httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.DATABASE_REPLICAS or request.method not in ('GET', 'HEAD'):
+            return None
+        view = getattr(view_func, 'view_class', view_func)
+        if not getattr(view, 'use_replica', False) or self._pinned(request):
+            return None
+        replicas = replica_health.healthy_replicas()
+        alias = random.choice(replicas) if replicas else PRIMARY
+        registry.inc('db_replica_reads_total', {'alias': alias})
+        routing_state.get().read_alias = alias
+        return None
+
+    @staticmethod
+    def _pinned(request):
+        try:
+            return int(request.COOKIES.get(settings.REPLICA_PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
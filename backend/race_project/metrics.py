@@ -0,0 +1,216 @@
+"""
+Lightweight Prometheus-style metrics shared across gunicorn workers.
+
+Each process keeps its counters, histograms and gauges in memory and periodically
+dumps them to ``METRICS_DIR/metrics_<pid>.json``. The ``/metrics`` view merges the
+files of all workers; when gunicorn reaps a worker, ``mark_process_dead`` folds its
+counters into an archive file so totals survive worker recycling. Without
+``METRICS_DIR`` (runserver, tests) only the current process is reported.
+"""
+import ipaddress
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ARCHIVE_FILE = 'metrics_archive.json'
+
+
+def _labels(labels):
+    """Render a label dict in Prometheus text syntax (sorted for stable keys)."""
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsStore:
+    """In-process metrics registry with an optional per-process file dump."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._help = {}
+        self._last_flush = 0.0
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, labels=None, amount=1):
+        key = f'{name}{_labels(labels)}'
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, labels=None):
+        key = f'{name}{_labels(labels)}'
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, labels=None, buckets=LATENCY_BUCKETS):
+        key = f'{name}|{_labels(labels)}'
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = {'buckets': list(buckets), 'counts': [0] * (len(buckets) + 1),
+                                                  'sum': 0.0}
+            series['counts'][bisect_left(series['buckets'], value)] += 1
+            series['sum'] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': {key: {'buckets': series['buckets'], 'counts': list(series['counts']),
+                                     'sum': series['sum']}
+                               for key, series in self._histograms.items()},
+                'gauges': dict(self._gauges),
+            }
+
+    def maybe_flush(self, force=False):
+        """Dump this process' metrics to METRICS_DIR at most once per flush interval."""
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        _write_json(os.path.join(directory, f'metrics_{os.getpid()}.json'), self.snapshot())
+
+    def render(self):
+        """Return the merged metrics of all live and dead workers as Prometheus text."""
+        self.maybe_flush(force=True)
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if directory:
+            snapshots = []
+            for filename in sorted(os.listdir(directory)):
+                if filename.startswith('metrics_') and filename.endswith('.json'):
+                    data = _read_json(os.path.join(directory, filename))
+                    if data:
+                        pid = filename[len('metrics_'):-len('.json')]
+                        snapshots.append((pid, data))
+        else:
+            snapshots = [(str(os.getpid()), self.snapshot())]
+        return _render(merge(snapshots), self._help)
+
+
+def merge(snapshots):
+    """Sum counters and histograms across processes; gauges keep a pid label."""
+    merged = {'counters': {}, 'histograms': {}, 'gauges': {}}
+    for pid, data in snapshots:
+        for key, value in data.get('counters', {}).items():
+            merged['counters'][key] = merged['counters'].get(key, 0) + value
+        for key, series in data.get('histograms', {}).items():
+            target = merged['histograms'].get(key)
+            if target is None:
+                merged['histograms'][key] = {'buckets': series['buckets'], 'counts': list(series['counts']),
+                                             'sum': series['sum']}
+            else:
+                target['counts'] = [a + b for a, b in zip(target['counts'], series['counts'])]
+                target['sum'] += series['sum']
+        for key, value in data.get('gauges', {}).items():
+            name, _, labels = key.partition('{')
+            labels = labels.rstrip('}')
+            pid_label = f'pid="{pid}"'
+            merged['gauges'][f'{name}{{{labels + "," if labels else ""}{pid_label}}}'] = value
+    return merged
+
+
+def _render(merged, help_texts):
+    lines = []
+    described = set()
+
+    def header(name, kind):
+        if name in described:
+            return
+        described.add(name)
+        kind, text = help_texts.get(name, (kind, name))
+        lines.append(f'# HELP {name} {text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    for key in sorted(merged['counters']):
+        header(key.partition('{')[0], 'counter')
+        lines.append(f'{key} {merged["counters"][key]}')
+    for key in sorted(merged['gauges']):
+        header(key.partition('{')[0], 'gauge')
+        lines.append(f'{key} {merged["gauges"][key]}')
+    for key in sorted(merged['histograms']):
+        name, _, labels = key.partition('|')
+        series = merged['histograms'][key]
+        header(name, 'histogram')
+        inner = labels[1:-1] + ',' if labels else ''
+        cumulative = 0
+        for bound, count in zip(list(series['buckets']) + ['+Inf'], series['counts']):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{inner}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{labels} {series["sum"]}')
+        lines.append(f'{name}_count{labels} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as fh:
+        json.dump(data, fh)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def mark_process_dead(pid, directory=None):
+    """
+    Fold a dead worker's counters and histograms into the archive file.
+    Called from the gunicorn master (``child_exit``), so there is a single writer.
+    """
+    directory = directory or getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        return
+    path = os.path.join(directory, f'metrics_{pid}.json')
+    data = _read_json(path)
+    if data is None:
+        return
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    archive = _read_json(archive_path) or {}
+    data['gauges'] = {}
+    merged = merge([('archive', archive), (str(pid), data)])
+    _write_json(archive_path, merged)
+    os.remove(path)
+
+
+registry = MetricsStore()
+
+
+def scraper_allowed(address):
+    """Whether the address belongs to one of the METRICS_ALLOWED_IPS networks."""
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    # gunicorn, слушающий [::], видит IPv4-клиентов как ::ffff:a.b.c.d
+    address = getattr(address, 'ipv4_mapped', None) or address
+    return any(address in ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_IPS)
+
+
+def metrics_view(request):
+    """Expose the aggregated metrics in the Prometheus text format."""
+    if not scraper_allowed(request.META.get('REMOTE_ADDR', '')):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,88 @@
+"""
+Project-wide middleware.
+"""
+import random
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import registry
+
+# Per-request timing collector; set only while a sampled request is being handled.
+current_sample = ContextVar('current_sample', default=None)
+
+registry.describe('django_http_requests_total', 'counter', 'Requests by view, method and status.')
+registry.describe('django_http_request_latency_seconds', 'histogram', 'Request latency by view.')
+registry.describe('django_http_sampled_requests_total', 'counter', 'Requests sampled for DB and template timing.')
+registry.describe('django_db_queries_total', 'counter', 'Database queries issued by sampled requests.')
+registry.describe('django_db_query_seconds', 'histogram', 'Database time per sampled request.')
+registry.describe('django_template_render_seconds', 'histogram', 'Template render time per sampled request.')
+
+
+class RequestSample:
+    """Accumulates DB and template timings of one sampled request."""
+    __slots__ = ('queries', 'db_time', 'template_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Используется как execute_wrapper для всех подключений к БД
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+class RequestMetricsMiddleware:
+    """
+    Records per-view request counts and latency for every request, and DB query
+    count/time and template render time for a random sample of requests
+    (METRICS_SAMPLE_RATE), so the hot path only pays for two clock reads.
+    With METRICS_QUERY_HEADER every request is sampled and its query count is
+    returned in the X-DB-Queries header for the load tests.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.query_header = settings.METRICS_QUERY_HEADER
+        self.sample_rate = 1.0 if self.query_header else settings.METRICS_SAMPLE_RATE
+
+    def __call__(self, request):
+        sample = RequestSample() if self.sample_rate and random.random() < self.sample_rate else None
+        started = time.perf_counter()
+        if sample is None:
+            response = self.get_response(request)
+        else:
+            token = current_sample.set(sample)
+            try:
+                with ExitStack() as stack:
+                    for alias in connections:
+                        stack.enter_context(connections[alias].execute_wrapper(sample))
+                    response = self.get_response(request)
+            finally:
+                current_sample.reset(token)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        registry.inc('django_http_requests_total',
+                     {'view': view, 'method': request.method, 'status': response.status_code})
+        registry.observe('django_http_request_latency_seconds', elapsed, {'view': view})
+        if sample is not None:
+            labels = {'view': view}
+            registry.inc('django_http_sampled_requests_total', labels)
+            registry.inc('django_db_queries_total', labels, sample.queries)
+            registry.observe('django_db_query_seconds', sample.db_time, labels)
+            registry.observe('django_template_render_seconds', sample.template_time, labels)
+            if self.query_header:
+                response['X-DB-Queries'] = str(sample.queries)
+        registry.maybe_flush()
+        return response
@@ -43,8 +43,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'widget_tweaks',
-    'debug_toolbar',
     'django_email_verification',
     'phonenumber_field',
     'race',
@@ -52,21 +52,29 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'race_project.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'race_project.db_router.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    # Журнал изменений регистраций пишется одним INSERT после ответа представления
+    'race.audit.AuditMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+# Панель отладки подключается только в режиме разработки
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'race_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'race_project.template_backends.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -87,17 +95,71 @@ WSGI_APPLICATION = 'race_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# With DB_POOL each worker process keeps a bounded pool of connections
+# (race_project.db_pool); otherwise Django keeps one persistent connection per thread.
+DB_POOL = env.bool('DB_POOL', default=True)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'race_project.db_pool' if DB_POOL else 'django.db.backends.postgresql_psycopg2',
         'NAME': env("DB_NAME"),
         'USER': env("DB_USER"),
         'PASSWORD': env("DB_PASSWORD"),
         'HOST': env("DB_HOST"),
         'PORT': env("DB_PORT"),
+        # Пул сам держит соединения открытыми, Django возвращает их в пул в конце запроса
+        'CONN_MAX_AGE': 0 if DB_POOL else env.int('DB_CONN_MAX_AGE', default=60),
+        'CONN_HEALTH_CHECKS': True,
+        'POOL': {
+            'MAX_SIZE': env.int('DB_POOL_MAX_SIZE', default=8),
+            'TIMEOUT': env.float('DB_POOL_TIMEOUT', default=10.0),
+            'MAX_IDLE': env.float('DB_POOL_MAX_IDLE', default=300.0),
+            'MAX_LIFETIME': env.float('DB_POOL_MAX_LIFETIME', default=1800.0),
+            'HEALTH_CHECK_INTERVAL': env.float('DB_POOL_HEALTH_CHECK_INTERVAL', default=30.0),
+        },
     }
 }
 
+# Read replicas for the public read-only pages: "host" or "host:port", comma-separated.
+# For local testing DB_REPLICA_HOSTS may simply point at the primary (e.g. postgres-db).
+DATABASE_REPLICAS = []
+for number, replica_host in enumerate(filter(None, env.list('DB_REPLICA_HOSTS', default=[])), start=1):
+    host, _, port = replica_host.partition(':')
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['race_project.db_router.PrimaryReplicaRouter']
+
+# Seconds a client's reads stay on the primary after it wrote something
+REPLICA_PIN_SECONDS = env.int('REPLICA_PIN_SECONDS', default=10)
+REPLICA_PIN_COOKIE = 'db_primary_pin'
+# Replicas lagging more than this many seconds are bypassed
+REPLICA_MAX_LAG = env.float('REPLICA_MAX_LAG', default=5.0)
+REPLICA_LAG_CHECK_INTERVAL = env.float('REPLICA_LAG_CHECK_INTERVAL', default=5.0)
+
+# Redis is shared by all gunicorn workers (cache, throttling); without it everything is per process
+REDIS_URL = env('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -144,6 +206,16 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Готовые HTML-копии публичных страниц (race/snapshots.py), которые nginx отдаёт анонимным посетителям
+SNAPSHOT_ROOT = env('SNAPSHOT_ROOT', default=os.path.join(BASE_DIR, 'snapshots'))
+
+# Стартовые протоколы и листы номеров (race/start_lists.py) — только для сотрудников: после проверки
+# прав Django отвечает X-Accel-Redirect, и файл отдаёт nginx из внутреннего location START_LIST_URL
+START_LIST_ROOT = env('START_LIST_ROOT', default=os.path.join(BASE_DIR, 'start_lists'))
+START_LIST_URL = '/start-lists/'
+# Без nginx (runserver) файл отдаёт сам Django
+START_LIST_ACCEL_REDIRECT = env.bool('START_LIST_ACCEL_REDIRECT', default=not DEBUG)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -191,4 +263,105 @@ EMAIL_HOST = env('EMAIL_HOST')
 EMAIL_PORT = env('EMAIL_PORT')
 EMAIL_HOST_USER = env('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD')
-EMAIL_USE_TLS = True
+# Без TLS работает только локальный приёмник писем нагрузочного стенда (docker-compose.loadtest.yml)
+EMAIL_USE_TLS = env.bool('EMAIL_USE_TLS', default=True)
+
+# Pre-race reminders (race/reminders.py): SMTP connections used in parallel and the shared sending rate
+REMINDER_SMTP_CONNECTIONS = env.int('REMINDER_SMTP_CONNECTIONS', default=4)
+REMINDER_RATE = env('REMINDER_RATE', default='50/s')
+
+
+# Request metrics (/metrics)
+# Share of requests for which DB and template timings are collected
+METRICS_SAMPLE_RATE = env.float('METRICS_SAMPLE_RATE', default=0.1)
+# Directory for per-worker metric dumps; empty means single-process (runserver)
+METRICS_DIR = env('METRICS_DIR', default='')
+METRICS_FLUSH_INTERVAL = env.float('METRICS_FLUSH_INTERVAL', default=5.0)
+# Addresses or networks allowed to scrape /metrics (nginx also denies it publicly); by default loopback and
+# private networks, where Prometheus reaches backend:8000 inside the docker network
+METRICS_ALLOWED_IPS = env.list('METRICS_ALLOWED_IPS', default=[
+    '127.0.0.0/8', '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16', '::1/128', 'fc00::/7',
+])
+# Count the queries of every request and return them in X-DB-Queries (load-test stand only)
+METRICS_QUERY_HEADER = env.bool('METRICS_QUERY_HEADER', default=False)
+
+
+# Request throttling: token buckets per client IP and per user, "<tokens>/<s|m|h|d>"
+THROTTLE_RATES = {
+    'login': env('THROTTLE_RATE_LOGIN', default='10/m'),
+    'signup': env('THROTTLE_RATE_SIGNUP', default='5/h'),
+    'event_registration': env('THROTTLE_RATE_EVENT_REGISTRATION', default='10/m'),
+    'review': env('THROTTLE_RATE_REVIEW', default='5/m'),
+    'races_for_event': env('THROTTLE_RATE_RACES_FOR_EVENT', default='60/m'),
+    'autocomplete': env('THROTTLE_RATE_AUTOCOMPLETE', default='120/m'),
+}
+# Only behind nginx, which appends the client address as the last X-Forwarded-For entry; a server reachable
+# directly would let clients pick their own address and bucket
+THROTTLE_TRUST_X_FORWARDED_FOR = env.bool('THROTTLE_TRUST_X_FORWARDED_FOR', default=False)
+THROTTLE_LOCAL_CACHE_SIZE = 10000
+
+
+# Reviews
+# Seconds the main-page feed of latest reviews stays cached (it is also dropped on every review change)
+LATEST_REVIEWS_CACHE_TIMEOUT = env.int('LATEST_REVIEWS_CACHE_TIMEOUT', default=600)
+REVIEWS_PER_PAGE = 20
+
+
+# Results
+# Lower bounds of the age groups used for places in race/ranking.py
+RESULT_AGE_GROUPS = [18, 30, 40, 50, 60, 70]
+
+
+# Live results (race/timing.py, race/live.py)
+# Bearer tokens of the timing stations allowed to post readings
+TIMING_API_TOKENS = env.list('TIMING_API_TOKENS', default=[])
+TIMING_MAX_BATCH = 500
+# Seconds between reads of the timing log by each ASGI worker
+LIVE_POLL_INTERVAL = env.float('LIVE_POLL_INTERVAL', default=0.5)
+LIVE_POLL_BATCH = 5000
+# Polls a slow client may fall behind before its stream is closed
+LIVE_QUEUE_SIZE = 100
+# Records replayed to a reconnecting client (Last-Event-ID)
+LIVE_REPLAY_LIMIT = 1000
+LIVE_HEARTBEAT_SECONDS = 15
+LIVE_STREAM_MAX_SECONDS = env.int('LIVE_STREAM_MAX_SECONDS', default=300)
+LIVE_RETRY_MS = 3000
+
+
+# Read-only JSON API (race/api.py)
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+# Seconds a built response stays in the cache; changes seen by signals replace it sooner
+API_CACHE_TIMEOUT = env.int('API_CACHE_TIMEOUT', default=300)
+# Cache-Control max-age for clients and proxies
+API_MAX_AGE = env.int('API_MAX_AGE', default=10)
+
+
+# Club and city dictionary (race/names.py)
+NAMES_SUGGEST_LIMIT = 10
+# Prefixes up to this length are put in the cache by every dictionary build
+NAMES_WARM_PREFIX_LENGTH = 2
+# Seconds the suggestions for a prefix stay cached; a build replaces them all sooner
+NAMES_CACHE_TIMEOUT = env.int('NAMES_CACHE_TIMEOUT', default=86400)
+# Cache-Control max-age of the autocomplete responses
+NAMES_MAX_AGE = env.int('NAMES_MAX_AGE', default=300)
+
+
+# Geocoding of locations
+# Nominatim-compatible search endpoint used by Location.geocode_address
+GEOCODER_URL = env('GEOCODER_URL', default='https://nominatim.openstreetmap.org/search')
+
+
+# Uploaded images (race/uploads.py, race/images.py)
+# Uploads wait here, outside MEDIA_ROOT and never served, until process_images has checked them
+IMAGE_QUARANTINE_ROOT = env('IMAGE_QUARANTINE_ROOT', default=os.path.join(BASE_DIR, 'quarantine'))
+IMAGE_MAX_UPLOAD_SIZE = env.int('IMAGE_MAX_UPLOAD_SIZE', default=10 * 1024 * 1024)
+# Width x height of an accepted image, checked from the header before decoding
+IMAGE_MAX_PIXELS = env.int('IMAGE_MAX_PIXELS', default=40_000_000)
+# Published images are scaled down to fit this many pixels on the longer side
+IMAGE_MAX_SIDE = env.int('IMAGE_MAX_SIDE', default=2560)
+IMAGE_JPEG_QUALITY = 85
+# Worker processes of process_images; each checks one image at a time within these limits
+IMAGE_WORKERS = env.int('IMAGE_WORKERS', default=2)
+IMAGE_TASK_TIMEOUT = env.int('IMAGE_TASK_TIMEOUT', default=30)
+IMAGE_WORKER_MEMORY_MB = env.int('IMAGE_WORKER_MEMORY_MB', default=1024)
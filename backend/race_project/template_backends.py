@@ -0,0 +1,33 @@
+"""
+Django template backend that reports render time to the metrics middleware.
+"""
+import time
+
+from django.template.backends.django import DjangoTemplates, Template
+
+from .middleware import current_sample
+
+
+class TimedTemplate(Template):
+    """Template wrapper adding its render time to the current request sample."""
+
+    def render(self, context=None, request=None):
+        sample = current_sample.get()
+        if sample is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            sample.template_time += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """The stock Django backend, returning TimedTemplate instances."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
@@ -0,0 +1,235 @@
+import threading
+import time
+from unittest import mock
+
+import psycopg2
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from psycopg2 import extensions
+
+from . import db_router, throttling
+from .db_pool.pool import ConnectionPool, PoolTimeout
+
+
+class MetricsAccessTests(SimpleTestCase):
+    """/metrics answers scrapers from loopback and private networks only."""
+
+    def scrape(self, address):
+        return self.client.get(reverse('metrics'), REMOTE_ADDR=address).status_code
+
+    def test_private_networks_are_allowed_by_default(self):
+        for address in ('127.0.0.1', '172.18.0.7', '10.1.2.3', '::1', '::ffff:192.168.1.5'):
+            self.assertEqual(self.scrape(address), 200, address)
+        for address in ('8.8.8.8', '172.32.0.1', '2001:db8::1', 'unknown'):
+            self.assertEqual(self.scrape(address), 403, address)
+
+    @override_settings(METRICS_ALLOWED_IPS=['203.0.113.10', '198.51.100.0/24'])
+    def test_allowed_addresses_and_networks_are_configurable(self):
+        self.assertEqual(self.scrape('203.0.113.10'), 200)
+        self.assertEqual(self.scrape('198.51.100.77'), 200)
+        self.assertEqual(self.scrape('127.0.0.1'), 403)
+
+
+@override_settings(REDIS_URL='', THROTTLE_RATES={'test': '1/h'})
+class ThrottleTests(TestCase):
+    """Token buckets per client IP and user, kept per process without Redis."""
+
+    def setUp(self):
+        self.throttle = throttling.Throttle()
+        self.factory = RequestFactory()
+        self.user = get_user_model().objects.create(username='runner')
+
+    def request(self, ip, user=None):
+        request = self.factory.post('/', REMOTE_ADDR=ip)
+        if user is not None:
+            request.user = user
+        return request
+
+    def test_denied_request_leaves_the_user_bucket_alone(self):
+        self.assertEqual(self.throttle.check('test', self.request('10.0.0.1')), 0)
+        self.assertGreater(self.throttle.check('test', self.request('10.0.0.1', self.user)), 0)
+        # Отклонённый по адресу запрос не потратил токен пользователя
+        self.assertEqual(self.throttle.check('test', self.request('10.0.0.2', self.user)), 0)
+        self.assertGreater(self.throttle.check('test', self.request('10.0.0.3', self.user)), 0)
+
+    def test_forwarded_for_is_ignored_unless_trusted(self):
+        request = self.factory.get('/', REMOTE_ADDR='172.18.0.5', HTTP_X_FORWARDED_FOR='1.2.3.4, 5.6.7.8')
+        self.assertEqual(throttling.client_ip(request), '172.18.0.5')
+        with override_settings(THROTTLE_TRUST_X_FORWARDED_FOR=True):
+            self.assertEqual(throttling.client_ip(request), '5.6.7.8')
+
+
+@override_settings(THROTTLE_LOCAL_CACHE_SIZE=2)
+class LocalBucketStoreTests(SimpleTestCase):
+
+    def test_full_buckets_are_pruned(self):
+        store = throttling.LocalBucketStore()
+        # Миллион токенов в секунду: бакет снова полон к следующему вызову
+        for n in range(5):
+            store.take(f'fast:{n}', 1, 1_000_000)
+        store.take('slow', 1, 1 / 3600)
+        self.assertLessEqual(len(store._buckets), 2)
+        self.assertIn('slow', store._buckets)
+        self.assertGreater(store.take('slow', 1, 1 / 3600), 0)
+
+    def test_store_never_outgrows_its_limit(self):
+        store = throttling.LocalBucketStore()
+        for n in range(10):
+            store.take(f'slow:{n}', 1, 1 / 3600)
+            self.assertLessEqual(len(store._buckets), 2)
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """Checkout, reuse, exhaustion and discards of the per-process connection pool."""
+
+    def setUp(self):
+        params = connection.get_connection_params()
+        self.connect = lambda: psycopg2.connect(**params)
+        self.pool = ConnectionPool('test', {'MAX_SIZE': 1, 'TIMEOUT': 0.2})
+        self.addCleanup(self.pool.close_idle)
+
+    def test_released_connection_is_reused(self):
+        first = self.pool.acquire(self.connect)
+        self.pool.release(first)
+        self.assertIs(self.pool.acquire(self.connect), first)
+        self.pool.release(first)
+
+    def test_checkout_waits_for_a_release_then_times_out(self):
+        held = self.pool.acquire(self.connect)
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire(self.connect)
+
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(self.pool.acquire(self.connect)))
+        waiter.start()
+        time.sleep(0.05)
+        self.pool.release(held)
+        waiter.join()
+        self.assertEqual(got, [held])
+        self.pool.release(held)
+
+    def test_broken_connections_are_discarded(self):
+        first = self.pool.acquire(self.connect)
+        self.pool.release(first, discard=True)
+        self.assertTrue(first.closed)
+        second = self.pool.acquire(self.connect)
+        self.assertIsNot(second, first)
+
+        # Ошибка внутри транзакции: откат возвращает соединение в пул
+        with self.assertRaises(psycopg2.Error), second.cursor() as cursor:
+            cursor.execute('SELECT 1/0')
+        self.pool.release(second)
+        self.assertIs(self.pool.acquire(self.connect), second)
+        self.assertEqual(second.get_transaction_status(), extensions.TRANSACTION_STATUS_IDLE)
+
+        second.close()
+        self.pool.release(second)
+        third = self.pool.acquire(self.connect)
+        self.assertIsNot(third, second)
+        self.pool.release(third)
+
+    def test_slow_rollback_does_not_block_other_checkouts(self):
+        pool = ConnectionPool('test', {'MAX_SIZE': 2, 'TIMEOUT': 1})
+        rollback_started, finish_rollback = threading.Event(), threading.Event()
+
+        class SlowConnection:
+            closed = False
+
+            def get_transaction_status(self):
+                return extensions.TRANSACTION_STATUS_INTRANS
+
+            def rollback(self):
+                rollback_started.set()
+                finish_rollback.wait(5)
+
+            def close(self):
+                self.closed = True
+
+        slow = pool.acquire(SlowConnection)
+        releasing = threading.Thread(target=pool.release, args=(slow,))
+        releasing.start()
+        rollback_started.wait(5)
+        started = time.monotonic()
+        pool.acquire(SlowConnection)
+        self.assertLess(time.monotonic() - started, 0.5)
+        finish_rollback.set()
+        releasing.join()
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTests(SimpleTestCase):
+    """Replica reads for opted-in GET views, and the primary after the client's writes."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = db_router.PrimaryReplicaRouter()
+        patcher = mock.patch.object(db_router.replica_health, 'healthy_replicas', return_value=['replica1'])
+        self.healthy_replicas = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def serve(self, request, write=False, use_replica=True):
+        """Run the request through the middleware; returns the response and the databases the view read from."""
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(get_user_model()))
+            if write:
+                self.router.db_for_write(get_user_model())
+                reads.append(self.router.db_for_read(get_user_model()))
+            return HttpResponse()
+
+        if use_replica:
+            view = db_router.replica_reads(view)
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = db_router.ReplicaRoutingMiddleware(get_response)
+        return middleware(request), reads
+
+    def test_opted_in_get_reads_from_a_replica(self):
+        self.assertEqual(self.serve(self.factory.get('/'))[1], ['replica1'])
+        self.assertEqual(self.serve(self.factory.get('/'), use_replica=False)[1], ['default'])
+        self.assertEqual(self.serve(self.factory.post('/'))[1], ['default'])
+        # Вне запроса всё читается с основной БД
+        self.assertEqual(self.router.db_for_read(get_user_model()), 'default')
+
+    def test_write_pins_the_client_to_the_primary(self):
+        response, reads = self.serve(self.factory.get('/'), write=True)
+        self.assertEqual(reads, ['replica1', 'default'])
+        cookie = response.cookies[settings.REPLICA_PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_PIN_SECONDS)
+
+        request = self.factory.get('/')
+        request.COOKIES[settings.REPLICA_PIN_COOKIE] = cookie.value
+        response, reads = self.serve(request)
+        self.assertEqual(reads, ['default'])
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+        # Просроченная метка больше не привязывает клиента
+        request.COOKIES[settings.REPLICA_PIN_COOKIE] = str(int(time.time()) - 1)
+        self.assertEqual(self.serve(request)[1], ['replica1'])
+
+    def test_falls_back_to_the_primary_without_healthy_replicas(self):
+        self.healthy_replicas.return_value = []
+        self.assertEqual(self.serve(self.factory.get('/'))[1], ['default'])
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.serve(self.factory.get('/'))[1], ['default'])
+
+
+class ReplicaHealthTests(TestCase):
+    """Lag checks against a live server (the primary stands in for a replica)."""
+
+    def test_lagging_or_unreachable_replicas_are_skipped(self):
+        with override_settings(DATABASE_REPLICAS=['default'], REPLICA_LAG_CHECK_INTERVAL=0):
+            self.assertEqual(db_router.ReplicaHealth().healthy_replicas(), ['default'])
+            with override_settings(REPLICA_MAX_LAG=-1), self.assertLogs(db_router.logger, 'WARNING'):
+                self.assertEqual(db_router.ReplicaHealth().healthy_replicas(), [])
+            with mock.patch.object(connection, 'cursor', side_effect=db_router.DatabaseError), \
+                    mock.patch.object(connection, 'close'), self.assertLogs(db_router.logger, 'WARNING'):
+                self.assertEqual(db_router.ReplicaHealth().healthy_replicas(), [])
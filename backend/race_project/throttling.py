@@ -0,0 +1,219 @@
+"""
+Token-bucket request throttling.
+
+Each throttled view has a scope with a rate from ``THROTTLE_RATES`` such as
+``'10/m'``: a bucket holds up to 10 tokens and refills at 10 per minute.
+Every request takes one token from the client IP's bucket and, for logged-in
+users, from the user's bucket; an empty bucket answers 429 with Retry-After
+without touching the buckets after it.
+
+Buckets live in Redis (``REDIS_URL``) so all gunicorn workers share them, and
+are updated atomically by a Lua script. Without Redis they are kept per
+process, up to THROTTLE_LOCAL_CACHE_SIZE buckets that are not full. Once a
+bucket is known to be empty, the worker remembers it until the Retry-After
+moment and rejects further requests without asking Redis.
+"""
+import logging
+import math
+import threading
+import time
+from functools import lru_cache, wraps
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+registry.describe('throttle_requests_total', 'counter', 'Throttled-view requests by scope and decision.')
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(retry_after)
+"""
+
+
+class HttpResponseTooManyRequests(HttpResponse):
+    status_code = 429
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """Turn '10/m' into (capacity, tokens per second)."""
+    count, _, period = rate.partition('/')
+    count = int(count)
+    return count, count / PERIODS[period[0]]
+
+
+class LocalBucketStore:
+    """Per-process buckets; used when Redis is not configured (runserver, tests)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (tokens, time of the update, time the bucket is full again)
+        self._buckets = {}
+
+    def take(self, key, capacity, rate):
+        """Take a token; return 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - ts) * rate)
+            retry_after = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if len(self._buckets) > settings.THROTTLE_LOCAL_CACHE_SIZE:
+                self._prune(now)
+            return retry_after
+
+    def _prune(self, now):
+        # Полный бакет ничем не отличается от отсутствующего
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+        if len(self._buckets) > settings.THROTTLE_LOCAL_CACHE_SIZE:
+            self._buckets.clear()
+
+
+class RedisBucketStore:
+    """Buckets shared by all workers, updated atomically in Redis."""
+
+    def __init__(self, url):
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._script = self._client.register_script(TOKEN_BUCKET_LUA)
+
+    def take(self, key, capacity, rate):
+        import redis
+
+        try:
+            return float(self._script(keys=[key], args=[rate, capacity]))
+        except redis.RedisError:
+            # Недоступность Redis не должна блокировать регистрацию — пропускаем запрос
+            logger.warning('Throttle store unavailable, letting %s through', key, exc_info=True)
+            return 0.0
+
+
+class Throttle:
+    """Checks requests of one process against the configured buckets."""
+
+    def __init__(self):
+        self._store = None
+        self._store_lock = threading.Lock()
+        # key -> monotonic time until which the bucket is known to be empty
+        self._denied_until = {}
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    url = settings.REDIS_URL
+                    self._store = RedisBucketStore(url) if url else LocalBucketStore()
+        return self._store
+
+    def check(self, scope, request):
+        """Return the Retry-After seconds for a request that must be rejected, or 0."""
+        capacity, rate = parse_rate(settings.THROTTLE_RATES[scope])
+        for key in self.bucket_keys(scope, request):
+            # Отклонённый запрос не тратит токены следующих бакетов
+            retry_after = self._take(key, capacity, rate)
+            if retry_after:
+                return retry_after
+        return 0.0
+
+    def bucket_keys(self, scope, request):
+        keys = [f'throttle:{scope}:ip:{client_ip(request)}']
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            keys.append(f'throttle:{scope}:user:{user.pk}')
+        return keys
+
+    def _take(self, key, capacity, rate):
+        now = time.monotonic()
+        denied_until = self._denied_until.get(key)
+        if denied_until is not None:
+            if denied_until > now:
+                return denied_until - now
+            self._denied_until.pop(key, None)
+        retry_after = self.store.take(key, capacity, rate)
+        if retry_after:
+            if len(self._denied_until) > settings.THROTTLE_LOCAL_CACHE_SIZE:
+                self._denied_until.clear()
+            self._denied_until[key] = now + retry_after
+        return retry_after
+
+
+throttle_checker = Throttle()
+
+
+def client_ip(request):
+    """Client address; behind nginx it is the last X-Forwarded-For entry nginx appended."""
+    if settings.THROTTLE_TRUST_X_FORWARDED_FOR:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+        if forwarded:
+            return forwarded.rsplit(',', 1)[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def throttled_response(scope, methods, request):
+    """Return a 429 response if the request exceeds the scope's buckets, else None."""
+    if methods is not None and request.method not in methods:
+        return None
+    retry_after = throttle_checker.check(scope, request)
+    if not retry_after:
+        registry.inc('throttle_requests_total', {'scope': scope, 'decision': 'allowed'})
+        return None
+    registry.inc('throttle_requests_total', {'scope': scope, 'decision': 'denied'})
+    response = HttpResponseTooManyRequests('Слишком много запросов. Попробуйте позже.',
+                                           content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+
+def throttle(scope, methods=('POST',)):
+    """Throttle a view function with the buckets of `scope`; methods=None throttles every method."""
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            response = throttled_response(scope, methods, request)
+            if response is not None:
+                return response
+            return view_func(request, *args, **kwargs)
+
+        return wrapped
+
+    return decorator
+
+
+class ThrottleMixin:
+    """Throttle a class-based view; set `throttle_scope` and optionally `throttle_methods`."""
+    throttle_scope = None
+    throttle_methods = ('POST',)
+
+    def dispatch(self, request, *args, **kwargs):
+        response = throttled_response(self.throttle_scope, self.throttle_methods, request)
+        if response is not None:
+            return response
+        return super().dispatch(request, *args, **kwargs)
@@ -22,8 +22,10 @@ from django_email_verification import urls as email_urls
 
 from django.conf import settings
 from race.views import page_not_found
+from race_project.metrics import metrics_view
 
 urlpatterns = [
+    path('metrics', metrics_view, name='metrics'),
     path('admin/', admin.site.urls),
     path('users/', include('users.urls', namespace='users')),
     path('email/', include(email_urls), name='email_verification'),
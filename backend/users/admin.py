@@ -1,6 +1,6 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
-from .models import User
+from .models import AccountDeletion, User
 
 
 class CustomUserAdmin(UserAdmin):
@@ -18,5 +18,26 @@ class CustomUserAdmin(UserAdmin):
     )
 
 
+class AccountDeletionAdmin(admin.ModelAdmin):
+    """Progress of account deletions; the work is done by process_account_deletions."""
+    list_display = ('account_id', 'user', 'status', 'requested_at', 'finished_at', 'registrations_deleted',
+                    'reviews_deleted', 'files_deleted', 'attempts')
+    list_filter = ('status',)
+    search_fields = ('=account_id',)
+    readonly_fields = [field.name for field in AccountDeletion._meta.fields]
+    ordering = ('-requested_at',)
+    actions = ['retry']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Повторить удаление", permissions=['change'])
+    def retry(self, request, queryset):
+        # Следующий запуск process_account_deletions продолжит с того места, где удаление остановилось
+        updated = queryset.filter(status=AccountDeletion.FAILED).update(status=AccountDeletion.PENDING, attempts=0)
+        self.message_user(request, f"Поставлено в очередь повторно: {updated}.", messages.SUCCESS)
+
+
 admin.site.register(User, CustomUserAdmin)
+admin.site.register(AccountDeletion, AccountDeletionAdmin)
 
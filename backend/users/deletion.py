@@ -0,0 +1,137 @@
+"""
+Account deletion in the background.
+
+Deleting a profile used to call user.delete() in the request, cascading through
+all of the user's registrations, reviews and organizer rows while the worker
+waited, and leaving the uploaded photo and payment documents on disk.
+
+`request_deletion` now only deactivates the account and its registrations (two
+UPDATEs) and records an AccountDeletion. The process_account_deletions command
+then removes the user's rows in batches of BATCH_SIZE, each batch in its own
+transaction, so locks are short and the signals keeping counters, snapshots
+and rankings in sync run as usual. The files of the rows deleted in a batch are
+written to AccountDeletion.pending_files in the same transaction and removed
+from storage after it commits. A run that fails or is interrupted leaves the
+remaining rows and the pending files in place, and the next run continues from
+there. Each step only looks at what is left, so retries are idempotent. A
+session-level advisory lock keeps two runs from working on the same account.
+"""
+import logging
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from race import api, audit
+from race.models import EventRegistration, Organizer, RegistrationAuditEntry, Review
+
+from .models import AccountDeletion
+
+logger = logging.getLogger(__name__)
+
+# Ключ рекомендательной блокировки PostgreSQL для удаления аккаунтов (второй ключ — id запроса)
+LOCK_NAMESPACE = 3901
+BATCH_SIZE = 200
+# После стольких неудачных попыток запрос ждёт разбора в админке
+MAX_ATTEMPTS = 5
+
+
+def request_deletion(user):
+    """Deactivate the account at once and queue the removal of its data."""
+    with transaction.atomic():
+        get_user_model().objects.filter(pk=user.pk).update(is_active=False)
+        # Регистрации сразу пропадают из списков участников и освобождают места
+        registrations = EventRegistration.objects.filter(user=user, is_active=True)
+        rows = list(registrations.select_for_update().values_list('pk', 'event_id'))
+        EventRegistration.objects.filter(pk__in=[pk for pk, _ in rows]).update(is_active=False,
+                                                                              updated_at=timezone.now())
+        audit.record_many(rows, RegistrationAuditEntry.DEACTIVATED, actor=user,
+                          changes={'is_active': [True, False]})
+        if rows:
+            # UPDATE не отправляет сигналов: свободные места в ответах API меняем сами
+            api.bump(api.REGISTRATIONS)
+        deletion, _ = AccountDeletion.objects.get_or_create(user=user, defaults={'account_id': user.pk})
+    return deletion
+
+
+def remove_files(deletion):
+    """Delete the pending files from storage, keeping those that another row still uses."""
+    names = set(deletion.pending_files)
+    if names:
+        names -= set(EventRegistration.objects.filter(payment_document__in=names)
+                     .values_list('payment_document', flat=True))
+        names -= set(get_user_model().objects.filter(photo__in=names).values_list('photo', flat=True))
+        for name in names:
+            # FileSystemStorage не считает ошибкой отсутствие файла — повторное удаление безопасно
+            default_storage.delete(name)
+    AccountDeletion.objects.filter(pk=deletion.pk).update(
+        pending_files=[], files_deleted=F('files_deleted') + len(names))
+    deletion.pending_files = []
+
+
+def delete_in_batches(deletion, queryset, file_field=None, counter=None):
+    """Delete the rows of the queryset BATCH_SIZE at a time, queueing and then removing their files."""
+    fields = ['pk', file_field] if file_field else ['pk']
+    while True:
+        with transaction.atomic():
+            batch = list(queryset.order_by('pk').values_list(*fields)[:BATCH_SIZE])
+            if not batch:
+                return
+            queryset.model.objects.filter(pk__in=[row[0] for row in batch]).delete()
+            updates = {'pending_files': [row[1] for row in batch if file_field and row[1]]}
+            if counter:
+                updates[counter] = F(counter) + len(batch)
+            AccountDeletion.objects.filter(pk=deletion.pk).update(**updates)
+            deletion.pending_files = updates['pending_files']
+        remove_files(deletion)
+
+
+def delete_account(deletion):
+    user_id = deletion.account_id
+    # Файлы прерванного прошлого запуска
+    remove_files(deletion)
+    delete_in_batches(deletion, EventRegistration.objects.filter(user_id=user_id), 'payment_document',
+                      'registrations_deleted')
+    delete_in_batches(deletion, Review.objects.filter(author_id=user_id), counter='reviews_deleted')
+    delete_in_batches(deletion, Organizer.objects.filter(user_id=user_id))
+    with transaction.atomic():
+        photo = get_user_model().objects.filter(pk=user_id).values_list('photo', flat=True).first()
+        # Оставшиеся связи пользователя (группы, права, журнал админки) невелики и удаляются каскадом
+        get_user_model().objects.filter(pk=user_id).delete()
+        deletion.pending_files = [photo] if photo else []
+        AccountDeletion.objects.filter(pk=deletion.pk).update(
+            status=AccountDeletion.DONE, finished_at=timezone.now(), last_error='',
+            pending_files=deletion.pending_files)
+    remove_files(deletion)
+
+
+def process(deletion):
+    """Run or resume one deletion; returns False if another run is working on it."""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [LOCK_NAMESPACE, deletion.pk])
+        if not cursor.fetchone()[0]:
+            return False
+    try:
+        deletion.refresh_from_db()
+        if deletion.status == AccountDeletion.DONE and not deletion.pending_files:
+            return True
+        try:
+            delete_account(deletion)
+        except Exception as exc:
+            logger.exception('Deletion of account %s failed', deletion.account_id)
+            AccountDeletion.objects.filter(pk=deletion.pk).update(
+                status=AccountDeletion.FAILED, attempts=F('attempts') + 1, last_error=repr(exc))
+        return True
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [LOCK_NAMESPACE, deletion.pk])
+
+
+def process_pending():
+    """Run every unfinished deletion that has attempts left; returns the processed ones."""
+    # Выполненное удаление с непустым списком файлов прервалось после удаления пользователя
+    deletions = AccountDeletion.objects.exclude(status=AccountDeletion.DONE, pending_files=[]).filter(
+        attempts__lt=MAX_ATTEMPTS).order_by('requested_at')
+    return [deletion for deletion in deletions if process(deletion)]
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users import deletion
+from users.models import AccountDeletion
+
+
+class Command(BaseCommand):
+    help = ("Delete the data and files of accounts whose owners asked for deletion, in batches "
+            "(see users/deletion.py). Interrupted and failed deletions are resumed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', type=float, metavar='SECONDS',
+                            help="Keep running and check for new requests every SECONDS.")
+
+    def handle(self, *args, **options):
+        while True:
+            for item in deletion.process_pending():
+                item.refresh_from_db()
+                line = (f"Account {item.account_id}: {item.get_status_display()}, registrations "
+                        f"{item.registrations_deleted}, reviews {item.reviews_deleted}, files {item.files_deleted}")
+                self.stdout.write(self.style.ERROR(line) if item.status == AccountDeletion.FAILED else line)
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
@@ -0,0 +1,28 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся без блокировки записи в таблицу пользователей
+    atomic = False
+
+    dependencies = [
+        ('users', '0002_accountdeletion'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='user',
+            index=GinIndex(fields=['last_name'], name='users_user_last_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=GinIndex(fields=['first_name'], name='users_user_first_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=GinIndex(fields=['email'], name='users_user_email_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.6 on 2026-10-19 14:23
+
+from django.db import migrations
+import race.uploads
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='photo',
+            field=race.uploads.QuarantinedImageField(blank=True, null=True, upload_to='users/%Y/%m/%d/', verbose_name='Фотография'),
+        ),
+    ]
@@ -1,8 +1,57 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 
+from race.uploads import QuarantinedImageField
+
 
 class User(AbstractUser):
-    photo = models.ImageField(upload_to="users/%Y/%m/%d/", blank=True, null=True, verbose_name="Фотография")
+    photo = QuarantinedImageField(upload_to="users/%Y/%m/%d/", blank=True, null=True, verbose_name="Фотография")
     date_birth = models.DateField(blank=True, null=True, verbose_name="Дата рождения")
     email = models.EmailField(unique=True, blank=False)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Поиск участников в админке (race/search.py): ILIKE '%...%' и нечёткое сравнение по триграммам
+            GinIndex(fields=['last_name'], opclasses=['gin_trgm_ops'], name='users_user_last_name_trgm'),
+            GinIndex(fields=['first_name'], opclasses=['gin_trgm_ops'], name='users_user_first_name_trgm'),
+            GinIndex(fields=['email'], opclasses=['gin_trgm_ops'], name='users_user_email_trgm'),
+        ]
+
+
+class AccountDeletion(models.Model):
+    """
+    A request to delete an account and the progress of its removal (see users/deletion.py).
+    The row outlives the account: `user` becomes empty once the user itself is deleted.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Ожидает'),
+        (DONE, 'Выполнено'),
+        (FAILED, 'Ошибка'),
+    ]
+    user = models.OneToOneField(User, on_delete=models.SET_NULL, blank=True, null=True,
+                                related_name='deletion', verbose_name="Пользователь")
+    account_id = models.BigIntegerField(verbose_name="ID аккаунта")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name="Статус")
+    requested_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата запроса")
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name="Дата завершения")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Неудачных попыток")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    registrations_deleted = models.PositiveIntegerField(default=0, verbose_name="Удалено регистраций")
+    reviews_deleted = models.PositiveIntegerField(default=0, verbose_name="Удалено отзывов")
+    files_deleted = models.PositiveIntegerField(default=0, verbose_name="Удалено файлов")
+    # Файлы из уже удалённых строк; удаляются после фиксации транзакции и при повторной попытке
+    pending_files = models.JSONField(default=list, blank=True, verbose_name="Файлы к удалению")
+
+    def __str__(self):
+        return f"Удаление аккаунта {self.account_id}"
+
+    class Meta:
+        verbose_name = "Удаление аккаунта"
+        verbose_name_plural = "Удаления аккаунтов"
+        indexes = [
+            models.Index(fields=['status'], name='users_deletion_status_idx'),
+        ]
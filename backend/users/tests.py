@@ -1,3 +1,86 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from race.models import Event, EventRegistration, Location, RaceType, Review
+
+from . import deletion
+from .models import AccountDeletion, User
+
+
+class AccountDeletionTests(TestCase):
+    """Deleting a profile deactivates it at once; its rows and files are removed in the background."""
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Location.objects.create(street='Ленина', house_number='1', city='Москва', postal_code='101000',
+                                           country='Россия', latitude=55.75, longitude=37.62)
+        cls.race = RaceType.objects.create(distance=10, gender='F', min_age=18, registration_fee=1000)
+        cls.events = [
+            Event.objects.create(title=f'Забег {n}', slug=f'zabeg-{n}', description='-', event_rules='-',
+                                 event_type='road', start_datetime=timezone.now() + timedelta(days=30),
+                                 location=location, total_slots=100, image='events/zabeg.jpg')
+            for n in range(3)
+        ]
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username='anna', email='anna@example.com', password='secret')
+        self.user.photo = default_storage.save('users/anna.jpg', ContentFile(b'photo'))
+        self.user.save()
+        self.documents = []
+        for event in self.events:
+            document = default_storage.save('docs/payment.pdf', ContentFile(b'pdf'))
+            self.documents.append(document)
+            EventRegistration.objects.create(user=self.user, event=event, race=self.race, payment_document=document,
+                                             city='Москва', tshirt_size='M')
+        Review.objects.create(event=self.events[0], author=self.user, text='Отлично')
+
+    def test_profile_deletion_only_deactivates_the_account(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('users:delete_profile'))
+        self.assertRedirects(response, reverse('main_page'), fetch_redirect_response=False)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(EventRegistration.objects.filter(user=self.user, is_active=True).exists())
+        self.assertEqual(AccountDeletion.objects.get(user=self.user).status, AccountDeletion.PENDING)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_rows_and_files_are_removed_in_batches(self):
+        request = deletion.request_deletion(self.user)
+        with mock.patch.object(deletion, 'BATCH_SIZE', 2):
+            deletion.process_pending()
+        request.refresh_from_db()
+        self.assertEqual(request.status, AccountDeletion.DONE)
+        self.assertIsNone(request.user)
+        self.assertEqual((request.registrations_deleted, request.reviews_deleted, request.files_deleted), (3, 1, 4))
+        self.assertFalse(User.objects.filter(pk=request.account_id).exists())
+        self.assertFalse(any(default_storage.exists(name) for name in self.documents + ['users/anna.jpg']))
+        self.assertEqual(Event.objects.get(pk=self.events[0].pk).review_count, 0)
+
+    def test_failed_deletion_resumes_where_it_stopped(self):
+        request = deletion.request_deletion(self.user)
+        with mock.patch.object(default_storage, 'delete', side_effect=OSError('disk unavailable')), \
+                self.assertLogs('users.deletion', 'ERROR'):
+            deletion.process_pending()
+        request.refresh_from_db()
+        self.assertEqual((request.status, request.attempts), (AccountDeletion.FAILED, 1))
+        self.assertEqual(request.pending_files, self.documents)
+
+        deletion.process_pending()
+        request.refresh_from_db()
+        self.assertEqual(request.status, AccountDeletion.DONE)
+        self.assertEqual(request.registrations_deleted, 3)
+        self.assertFalse(any(default_storage.exists(name) for name in self.documents))
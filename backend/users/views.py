@@ -11,13 +11,17 @@ from django.views import View
 from django.views.generic import CreateView, UpdateView, ListView, DetailView
 
 from race_project import settings
+from .deletion import request_deletion
 from .forms import LoginUserForm, RegisterUserForm, ProfileUserForm, UserPasswordChangeForm
-from race.models import EventRegistration
+from race import audit, feeds
+from race.models import EventRegistration, RegistrationAuditEntry
+from race_project.throttling import ThrottleMixin
 
 from django_email_verification import send_email
 
 
-class LoginUser(LoginView):
+class LoginUser(ThrottleMixin, LoginView):
+    throttle_scope = 'login'
     form_class = LoginUserForm
     template_name = 'users/login.html'
     extra_context = {'title': 'Авторизация'}
@@ -29,7 +33,8 @@ class LoginUser(LoginView):
 #     extra_context = {'title': "Регистрация"}
 #     success_url = reverse_lazy('users:login')
 
-class RegisterUser(CreateView):
+class RegisterUser(ThrottleMixin, CreateView):
+    throttle_scope = 'signup'
     form_class = RegisterUserForm
     template_name = 'users/register.html'
     extra_context = {'title': "Регистрация"}
@@ -82,6 +87,13 @@ class RegistrationsListView(LoginRequiredMixin, ListView):
         # Получение регистраций
         return self.request.user.registrations.order_by('-registered_at')
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Адрес для подписки в календаре; открывается без входа на сайт
+        context['calendar_url'] = self.request.build_absolute_uri(
+            reverse('user_calendar', kwargs={'token': feeds.calendar_token(self.request.user)}))
+        return context
+
 
 class RegistrationDetailView(LoginRequiredMixin, DetailView):
     """A view for displaying the details of an individual event registration."""
@@ -106,6 +118,9 @@ class ToggleRegistrationStatusView(LoginRequiredMixin, View):
         if registration:
             registration.is_active = not registration.is_active
             registration.save()
+            audit.record(registration, RegistrationAuditEntry.REACTIVATED if registration.is_active
+                         else RegistrationAuditEntry.DEACTIVATED, actor=request.user,
+                         changes={'is_active': [not registration.is_active, registration.is_active]})
             message = "Регистрация успешно отменена." if not registration.is_active else "Регистрация восстановлена."
             messages.success(request, message)
         else:
@@ -122,7 +137,8 @@ class DeleteProfileView(LoginRequiredMixin, View):
         return render(request, self.template_name)
 
     def post(self, request, *args, **kwargs):
-        user = request.user
-        user.delete()
-        messages.success(request, 'Ваш аккаунт успешно удален.')
+        # Аккаунт отключается сразу, данные и файлы удаляет process_account_deletions (users/deletion.py)
+        request_deletion(request.user)
+        logout(request)
+        messages.success(request, 'Ваш аккаунт отключён, его данные будут удалены в ближайшее время.')
         return redirect(self.success_url)